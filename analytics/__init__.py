@@ -0,0 +1 @@
+# Analytics Engines Module
\ No newline at end of file
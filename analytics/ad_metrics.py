@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+広告メトリクスのストリーミング集計ストア
+プラットフォーム別のインプレッション・クリック・コンバージョン・コストのイベントを取り込み、
+固定メモリのリングバッファ（1分/5分/1時間/24時間/7日/90日）で集計してCTR・CPC・CPA・ROASを提供
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 集計する指標
+METRIC_FIELDS = ('impressions', 'clicks', 'conversions', 'cost', 'revenue')
+
+# ウィンドウごとのリングバッファ構成（バケット幅の秒数, バケット数）
+RING_SPECS = {
+    '1m': (1, 60),
+    '5m': (5, 60),
+    '1h': (60, 60),
+    '24h': (3600, 24),
+    '7d': (3600, 168),
+    '90d': (86400, 90)
+}
+
+# 受信したイベントをまとめて取り込む間隔（秒）
+FLUSH_INTERVAL_SECONDS = 1.0
+
+# ソケット受信のデフォルト設定（ローカルのUDPでイベントを受け付ける）
+DEFAULT_SOCKET_HOST = "127.0.0.1"
+DEFAULT_SOCKET_PORT = int(os.getenv("AD_METRICS_PORT", "9876"))
+
+# 取り込むイベントファイル（JSON Lines/CSV）。未設定でソケット受信も無効の場合はデモ用フィードを使用
+EVENT_FILE_PATH = os.getenv("AD_METRICS_EVENT_FILE")
+SOCKET_ENABLED = os.getenv("AD_METRICS_SOCKET", "false").lower() == "true"
+
+# 保持するスナップショットキャッシュの上限件数
+MAX_CACHED_SNAPSHOTS = 64
+
+# デモ用フィードが起動時に時間単位で遡って生成する日数（予測モデルの学習用）
+SIMULATED_HISTORY_DAYS = 90
+
+# デモ用フィードの曜日別の需要係数（月曜〜日曜）
+SIMULATED_WEEKDAY_FACTORS = (1.0, 1.05, 1.05, 1.0, 0.95, 0.8, 0.75)
+
+# デモ用フィードのプラットフォーム別の想定値（インプレッション/分, CTR, CVR, CPC, 平均注文額）
+SIMULATED_PLATFORMS = {
+    'Google Ads': (420, 0.032, 0.045, 180.0, 9000.0),
+    'Facebook Ads': (380, 0.018, 0.030, 120.0, 7500.0),
+    'Instagram Ads': (300, 0.021, 0.025, 110.0, 7000.0),
+    'LinkedIn Ads': (90, 0.012, 0.060, 520.0, 30000.0),
+    'Twitter Ads': (150, 0.011, 0.020, 90.0, 6000.0)
+}
+
+
+def derive_metrics(totals: np.ndarray) -> Dict[str, np.ndarray]:
+    """集計値（[..., METRIC_FIELDS]）からCTR・CPC・CPA・ROASを算出"""
+    impressions, clicks, conversions, cost, revenue = (totals[..., i] for i in range(len(METRIC_FIELDS)))
+
+    def ratio(a, b):
+        return np.divide(a, b, out=np.zeros_like(a, dtype=np.float64), where=b > 0)
+
+    return {
+        'ctr': ratio(clicks, impressions) * 100,
+        'cpc': ratio(cost, clicks),
+        'cpa': ratio(cost, conversions),
+        'roas': ratio(revenue, cost)
+    }
+
+
+class RingWindow:
+    """プラットフォーム×バケット×指標の固定長リングバッファ"""
+
+    def __init__(self, width: int, n_buckets: int, n_platforms: int = 0):
+        self.width = width
+        self.n_buckets = n_buckets
+        self.values = np.zeros((n_platforms, n_buckets, len(METRIC_FIELDS)))
+        self.epochs = np.full(n_buckets, -1, dtype=np.int64)
+        self.head = -1
+
+    def grow(self, n_platforms: int) -> None:
+        """プラットフォーム数に合わせて拡張"""
+        extra = n_platforms - self.values.shape[0]
+        if extra > 0:
+            self.values = np.concatenate([self.values, np.zeros((extra,) + self.values.shape[1:])])
+
+    def add(self, platform: np.ndarray, seconds: np.ndarray, values: np.ndarray) -> None:
+        """イベントを該当バケットに加算（ウィンドウより古いイベントは無視）"""
+        buckets = np.floor(seconds / self.width).astype(np.int64)
+        self.head = max(self.head, int(buckets.max()))
+        valid = buckets > self.head - self.n_buckets
+        platform, buckets, values = platform[valid], buckets[valid], values[valid]
+        if not len(buckets):
+            return
+
+        # 新しいバケットが入るスロットは古い値を消去
+        slots = buckets % self.n_buckets
+        fresh = np.unique(slots[self.epochs[slots] != buckets])
+        if len(fresh):
+            self.values[:, fresh, :] = 0.0
+        self.epochs[slots] = buckets
+
+        n_fields = len(METRIC_FIELDS)
+        cells = (platform * self.n_buckets + slots)[:, None] * n_fields + np.arange(n_fields)
+        self.values += np.bincount(
+            cells.ravel(), weights=values.ravel(), minlength=self.values.size
+        ).reshape(self.values.shape)
+
+    def series(self, now_seconds: float) -> Tuple[np.ndarray, np.ndarray]:
+        """古い順のバケット開始時刻（秒）と、プラットフォーム×バケット×指標の値"""
+        now_bucket = int(now_seconds // self.width)
+        buckets = np.arange(now_bucket - self.n_buckets + 1, now_bucket + 1)
+        slots = buckets % self.n_buckets
+        values = np.where((self.epochs[slots] == buckets)[None, :, None], self.values[:, slots, :], 0.0)
+        return buckets * self.width, values
+
+
+class AdMetricsStore:
+    """プロセス全体で共有する広告メトリクスストア"""
+
+    def __init__(self, ring_specs: Dict[str, Tuple[int, int]] = RING_SPECS):
+        self.platforms: List[str] = []
+        self._platform_index: Dict[str, int] = {}
+        self.rings = {name: RingWindow(width, n) for name, (width, n) in ring_specs.items()}
+        self.version = 0
+        self.last_event_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple, Any] = {}
+
+    def _platform_codes(self, platforms: np.ndarray) -> np.ndarray:
+        """プラットフォーム名を番号に変換（ロック取得済みで呼ぶ）"""
+        uniques, inverse = np.unique(platforms.astype(str), return_inverse=True)
+        codes = np.empty(len(uniques), dtype=np.int64)
+        for i, name in enumerate(uniques):
+            code = self._platform_index.get(name)
+            if code is None:
+                code = len(self.platforms)
+                self._platform_index[name] = code
+                self.platforms.append(name)
+            codes[i] = code
+        for ring in self.rings.values():
+            ring.grow(len(self.platforms))
+        return codes[inverse]
+
+    def ingest(self, events: pd.DataFrame) -> int:
+        """イベント（platform, timestamp, 各指標の列）を取り込み、件数を返す"""
+        if events is None or len(events) == 0:
+            return 0
+        timestamps = events['timestamp']
+        if np.issubdtype(timestamps.dtype, np.number):
+            seconds = timestamps.to_numpy(dtype=np.float64)
+        else:
+            parsed = pd.to_datetime(timestamps, utc=True)
+            seconds = (parsed - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(dtype=np.float64)
+        values = np.column_stack([
+            pd.to_numeric(events[field], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+            if field in events else np.zeros(len(events))
+            for field in METRIC_FIELDS
+        ])
+
+        with self._lock:
+            platform = self._platform_codes(events['platform'].to_numpy())
+            for ring in self.rings.values():
+                ring.add(platform, seconds, values)
+            self.last_event_at = max(self.last_event_at or 0.0, float(seconds.max()))
+            self.version += 1
+            self._cache.clear()
+        return len(events)
+
+    def ingest_records(self, records: Sequence[Dict[str, Any]]) -> int:
+        """辞書のリストで受け取ったイベントを取り込む"""
+        return self.ingest(pd.DataFrame.from_records(records)) if records else 0
+
+    def _cached(self, key: Tuple, compute):
+        """スナップショットをバージョンと時刻バケットごとにキャッシュ"""
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            if len(self._cache) >= MAX_CACHED_SNAPSHOTS:
+                self._cache.clear()
+            result = compute()
+            self._cache[key] = result
+            return result
+
+    def snapshot(self, window: str = '1h', now: Optional[float] = None) -> Dict[str, Any]:
+        """ウィンドウ内の合計と派生指標（全体・プラットフォーム別）を取得"""
+        now = time.time() if now is None else now
+        ring = self.rings[window]
+        key = ('snapshot', window, int(now // ring.width))
+
+        def compute():
+            _, values = ring.series(now)
+            per_platform = values.sum(axis=1)
+            total = per_platform.sum(axis=0)
+            derived = derive_metrics(per_platform)
+            derived_total = derive_metrics(total)
+            return {
+                'window': window,
+                'total': {**dict(zip(METRIC_FIELDS, total.tolist())), **{k: float(v) for k, v in derived_total.items()}},
+                'platforms': {
+                    name: {
+                        **dict(zip(METRIC_FIELDS, per_platform[i].tolist())),
+                        **{k: float(v[i]) for k, v in derived.items()}
+                    }
+                    for i, name in enumerate(self.platforms)
+                }
+            }
+
+        return self._cached(key, compute)
+
+    def series(self, window: str = '24h', now: Optional[float] = None) -> pd.DataFrame:
+        """ウィンドウ内のバケット別推移（全プラットフォーム合計）を取得"""
+        now = time.time() if now is None else now
+        ring = self.rings[window]
+        key = ('series', window, int(now // ring.width))
+
+        def compute():
+            starts, values = ring.series(now)
+            total = values.sum(axis=0)
+            df = pd.DataFrame(total, columns=list(METRIC_FIELDS))
+            df.insert(0, 'time', [datetime.fromtimestamp(s) for s in starts])
+            for name, values_ in derive_metrics(total).items():
+                df[name] = values_
+            return df
+
+        return self._cached(key, compute)
+
+    def platform_series(self, window: str = '7d', now: Optional[float] = None,
+                        include_current: bool = False, include_total: bool = True) -> pd.DataFrame:
+        """ウィンドウ内のプラットフォーム別・バケット別推移を縦持ちで取得（platform='total'は全体合計、seconds はバケット開始のエポック秒）"""
+        now = time.time() if now is None else now
+        ring = self.rings[window]
+        key = ('platform_series', window, int(now // ring.width), include_current, include_total)
+
+        def compute():
+            starts, values = ring.series(now)
+            names = list(self.platforms)
+            if not include_current:
+                starts, values = starts[:-1], values[:, :-1]
+            if include_total:
+                values = np.concatenate([values, values.sum(axis=0, keepdims=True)])
+                names.append('total')
+            n_buckets = len(starts)
+            flat = values.reshape(-1, len(METRIC_FIELDS))
+            df = pd.DataFrame(flat, columns=list(METRIC_FIELDS))
+            df.insert(0, 'platform', np.repeat(names, n_buckets))
+            # time は表示用の現地時刻、seconds は集計・検知用のUTCエポック秒
+            df.insert(0, 'seconds', np.tile(starts.astype(np.int64), len(names)))
+            df.insert(0, 'time', np.tile([datetime.fromtimestamp(s) for s in starts], len(names)))
+            for name, values_ in derive_metrics(flat).items():
+                df[name] = values_
+            return df
+
+        return self._cached(key, compute)
+
+    def hourly_heatmap(self, metric: str = 'ctr', now: Optional[float] = None) -> pd.DataFrame:
+        """直近24時間の時刻（時）×プラットフォームの指標テーブルを取得"""
+        now = time.time() if now is None else now
+        ring = self.rings['24h']
+        key = ('heatmap', metric, int(now // ring.width))
+
+        def compute():
+            starts, values = ring.series(now)
+            hours = [datetime.fromtimestamp(s).hour for s in starts]
+            table = derive_metrics(values)[metric] if metric in ('ctr', 'cpc', 'cpa', 'roas') \
+                else values[..., METRIC_FIELDS.index(metric)]
+            df = pd.DataFrame(table, index=self.platforms, columns=[f"{h:02d}:00" for h in hours])
+            return df[[f"{h:02d}:00" for h in range(24)]]
+
+        return self._cached(key, compute)
+
+
+class FileEventSource:
+    """JSON Lines/CSVファイルに追記されるイベントを差分で読み込むソース"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offset = 0
+        self._header: Optional[List[str]] = None
+
+    def poll(self, store: AdMetricsStore) -> int:
+        """前回以降に追記された完全な行を取り込む"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind('\n') + 1
+        if end == 0:
+            return 0
+        self._offset += len(chunk[:end].encode('utf-8'))
+        lines = [line for line in chunk[:end].splitlines() if line.strip()]
+
+        if self.path.endswith('.csv'):
+            if self._header is None and lines:
+                self._header = lines.pop(0).split(',')
+            rows = [line.split(',') for line in lines]
+            events = pd.DataFrame(rows, columns=self._header) if rows else None
+        else:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"不正なイベント行をスキップしました: {line[:80]}")
+            events = pd.DataFrame.from_records(records) if records else None
+        return store.ingest(events)
+
+
+class SocketEventSource:
+    """ローカルのUDPソケットでJSONイベントを受信し、一定間隔でまとめて取り込むソース"""
+
+    def __init__(self, store: AdMetricsStore, host: str = DEFAULT_SOCKET_HOST, port: int = DEFAULT_SOCKET_PORT,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """受信スレッドを開始（開始済みなら何もしない）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ad-metrics-socket", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.host, self.port))
+        except OSError as e:
+            logger.error(f"メトリクス受信ソケットの起動エラー: {e}")
+            return
+        sock.settimeout(self.flush_interval)
+        last_flush = time.monotonic()
+        with sock:
+            while not self._stop.is_set():
+                try:
+                    payload, _ = sock.recvfrom(65536)
+                    for line in payload.decode('utf-8').splitlines():
+                        if line.strip():
+                            with self._buffer_lock:
+                                self._buffer.append(json.loads(line))
+                except socket.timeout:
+                    pass
+                except ValueError as e:
+                    logger.warning(f"不正なイベントを受信しました: {e}")
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.monotonic()
+        self.flush()
+
+    def flush(self) -> int:
+        """受信済みのイベントをストアに取り込む"""
+        with self._buffer_lock:
+            records, self._buffer = self._buffer, []
+        return self.store.ingest_records(records)
+
+
+class SimulatedEventSource:
+    """デモ用に、前回呼び出し以降の経過時間ぶんのイベントを分単位で生成するソース（初回は過去分を時間単位で遡って生成）"""
+
+    def __init__(self, platforms: Dict[str, Tuple[float, float, float, float, float]] = SIMULATED_PLATFORMS,
+                 backfill_hours: int = 24, history_days: int = SIMULATED_HISTORY_DAYS, seed: Optional[int] = None):
+        self.platforms = platforms
+        self.backfill_hours = backfill_hours
+        self.history_days = history_days
+        self._rng = np.random.default_rng(seed)
+        self._generated_until: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def poll(self, store: AdMetricsStore, now: Optional[float] = None) -> int:
+        """未生成の期間のイベントを生成して取り込む（複数セッションから呼ばれても重複しない）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            history = None
+            if self._generated_until is None:
+                backfill_start = np.floor((now - self.backfill_hours * 3600) / 3600) * 3600
+                history = np.arange(backfill_start - self.history_days * 86400, backfill_start, 3600)
+            start = self._generated_until or backfill_start
+            minutes = np.arange(np.floor(start / 60) + 1, np.floor(now / 60) + 1) * 60
+            if not len(minutes) and history is None:
+                return 0
+            if len(minutes):
+                self._generated_until = float(minutes[-1])
+
+        count = 0
+        if history is not None and len(history):
+            count += store.ingest(self._generate(history, 60))
+        if len(minutes):
+            count += store.ingest(self._generate(minutes, 1))
+        return count
+
+    def _generate(self, timestamps: np.ndarray, minutes_per_event: int) -> pd.DataFrame:
+        """各時刻からminutes_per_event分間ぶんのイベントをプラットフォームごとに生成"""
+        names = list(self.platforms)
+        params = np.array([self.platforms[name] for name in names])
+        # 時間帯・曜日による需要の変動（日中と平日に多く、深夜と週末に少ない）
+        moments = [datetime.fromtimestamp(t) for t in timestamps]
+        hours = np.array([m.hour for m in moments])
+        weekdays = np.array([m.weekday() for m in moments])
+        demand = (0.6 + 0.4 * np.sin((hours - 6) / 24 * 2 * np.pi) + 0.2) \
+            * np.asarray(SIMULATED_WEEKDAY_FACTORS)[weekdays] * minutes_per_event
+        impressions = self._rng.poisson(params[None, :, 0] * demand[:, None])
+        clicks = self._rng.binomial(impressions, params[None, :, 1])
+        conversions = self._rng.binomial(clicks, params[None, :, 2])
+        cost = clicks * params[None, :, 3] * self._rng.uniform(0.8, 1.2, clicks.shape)
+        revenue = conversions * params[None, :, 4] * self._rng.uniform(0.7, 1.3, conversions.shape)
+
+        return pd.DataFrame({
+            'platform': np.tile(names, len(timestamps)),
+            'timestamp': np.repeat(timestamps, len(names)),
+            'impressions': impressions.ravel(),
+            'clicks': clicks.ravel(),
+            'conversions': conversions.ravel(),
+            'cost': cost.ravel(),
+            'revenue': revenue.ravel()
+        })
+
+
+# プロセス全体で共有するストアとイベントソース
+ad_metrics_store = AdMetricsStore()
+_file_source = FileEventSource(EVENT_FILE_PATH) if EVENT_FILE_PATH else None
+_socket_source = SocketEventSource(ad_metrics_store) if SOCKET_ENABLED else None
+_simulated_source = SimulatedEventSource()
+
+
+_refresh_lock = threading.Lock()
+
+
+def refresh_sources(now: Optional[float] = None) -> int:
+    """設定されたイベントソースから未取り込みのイベントを読み込む（取り込んだ件数を返す）"""
+    with _refresh_lock:
+        if _socket_source is not None:
+            _socket_source.start()
+        if _file_source is not None:
+            return _file_source.poll(ad_metrics_store)
+        if _socket_source is None:
+            return _simulated_source.poll(ad_metrics_store, now)
+        return 0
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+広告KPIストリームの異常検知
+プラットフォーム×指標の系列ごとにロバストなEWMA管理図（季節成分付き）を定数サイズの状態で逐次更新し、
+検知したアラートを重複排除・クールダウンしたうえで購読者（スケジューラーなど）へ配信
+"""
+
+import time
+import threading
+import logging
+import uuid
+from collections import deque
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Callable, Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .ad_metrics import METRIC_FIELDS, AdMetricsStore, ad_metrics_store, derive_metrics, refresh_sources
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 警告・重大と判定するロバストzスコアの閾値
+WARNING_Z = 4.0
+CRITICAL_Z = 6.0
+
+# 外れ値が状態を汚さないよう、更新に使う残差をスケールの何倍で打ち切るか（Huber型）
+HUBER_K = 2.5
+
+# 平均絶対偏差から標準偏差への換算係数（正規分布で sqrt(π/2)）
+ABS_DEV_TO_SIGMA = 1.2533
+
+# 期待値に対するスケールの下限（ほぼ一定の系列で僅かな揺れを異常扱いしないため）
+MIN_RELATIVE_SCALE = 0.02
+
+# 指標ごとの悪化方向（1: 上昇が悪化、-1: 低下が悪化、0: 両方向）
+METRIC_DIRECTIONS = {
+    'impressions': 0,
+    'clicks': -1,
+    'conversions': -1,
+    'cost': 1,
+    'revenue': -1,
+    'ctr': -1,
+    'cpc': 1,
+    'cpa': 1,
+    'roas': -1
+}
+
+# アラート表示用の指標名
+METRIC_LABELS = {
+    'impressions': 'インプレッション',
+    'clicks': 'クリック数',
+    'conversions': 'コンバージョン',
+    'cost': '広告費',
+    'revenue': '売上',
+    'ctr': 'CTR',
+    'cpc': 'CPC',
+    'cpa': 'CPA',
+    'roas': 'ROAS'
+}
+
+# 比率指標のばらつきを決める件数の列（件数が少ない期間の比率は判定に使わない）
+RATIO_SUPPORT = {'ctr': 'clicks', 'cpc': 'clicks', 'cpa': 'conversions', 'roas': 'conversions'}
+MIN_RATIO_EVENTS = 20
+
+# 位相別のスケールを使い始めるのに必要な観測数
+MIN_PHASE_OBSERVATIONS = 3
+
+# 同じ系列・方向のアラートを再通知しない期間（秒）
+ALERT_COOLDOWN_SECONDS = 900
+
+# プラットフォームの状態判定に使うアラートの有効期間（秒）
+ACTIVE_ALERT_SECONDS = 1800
+
+# 保持する直近アラートの件数
+MAX_RECENT_ALERTS = 200
+
+# アラート対象とする直近の期間数（起動時の履歴取り込みで過去の異常を通知しないため）
+ALERT_LOOKBACK_PERIODS = 3
+
+# バックグラウンド監視の実行間隔（秒）
+MONITOR_INTERVAL_SECONDS = 15.0
+
+
+@dataclass
+class Alert:
+    """KPI異常アラート"""
+    alert_id: str
+    detector: str
+    metric: str
+    platform: str
+    severity: str
+    direction: str
+    value: float
+    expected: float
+    z_score: float
+    period_start: str
+    created_at: float = field(default_factory=time.time)
+    last_seen: float = field(default_factory=time.time)
+    occurrences: int = 1
+
+    @property
+    def dedup_key(self) -> Tuple[str, str, str, str]:
+        return (self.detector, self.metric, self.platform, self.direction)
+
+    @property
+    def message(self) -> str:
+        label = METRIC_LABELS.get(self.metric, self.metric)
+        trend = "急上昇" if self.direction == 'up' else "急低下"
+        return f"{self.platform} {label}が{trend}中（実績 {self.value:,.2f} / 想定 {self.expected:,.2f}）"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), 'message': self.message}
+
+
+class RobustEwmaDetector:
+    """系列ごとに水準・季節成分・スケールのEWMAを保持するロバスト管理図（系列数に比例する計算量で一括更新）"""
+
+    def __init__(self, name: str, period_seconds: int, season_length: int = 1, alpha: float = 0.1,
+                 gamma: float = 0.1, scale_alpha: float = 0.05, warmup: int = 30,
+                 warning_z: float = WARNING_Z, critical_z: float = CRITICAL_Z):
+        self.name = name
+        self.period_seconds = period_seconds
+        self.season_length = season_length
+        self.alpha = alpha
+        self.gamma = gamma
+        self.scale_alpha = scale_alpha
+        self.warmup = warmup
+        self.warning_z = warning_z
+        self.critical_z = critical_z
+        self.keys: List[Tuple[str, str]] = []
+        self._index: Dict[Tuple[str, str], int] = {}
+        self.last_period: Optional[int] = None
+        self.level = np.empty(0)
+        self.season = np.empty((0, season_length))
+        self.scale = np.empty(0)
+        self.phase_scale = np.empty((0, season_length))
+        self.n_obs = np.empty(0, dtype=np.int64)
+        self.phase_obs = np.empty((0, season_length), dtype=np.int64)
+        self.last_z = np.empty(0)
+        self._directions = np.empty(0)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _add_keys(self, keys: List[Tuple[str, str]]) -> None:
+        """新しい系列を初期状態で追加（ロック取得済みで呼ぶ）"""
+        n = len(keys)
+        for j, key in enumerate(keys):
+            self._index[key] = len(self.keys) + j
+        self.keys.extend(keys)
+        self.level = np.concatenate([self.level, np.zeros(n)])
+        self.season = np.concatenate([self.season, np.zeros((n, self.season_length))])
+        self.scale = np.concatenate([self.scale, np.zeros(n)])
+        self.phase_scale = np.concatenate([self.phase_scale, np.zeros((n, self.season_length))])
+        self.n_obs = np.concatenate([self.n_obs, np.zeros(n, dtype=np.int64)])
+        self.phase_obs = np.concatenate([self.phase_obs, np.zeros((n, self.season_length), dtype=np.int64)])
+        self.last_z = np.concatenate([self.last_z, np.zeros(n)])
+        self._directions = np.concatenate([self._directions, [METRIC_DIRECTIONS.get(k[0], 0) for k in keys]])
+
+    def observe(self, keys: Sequence[Tuple[str, str]], periods: np.ndarray, values: np.ndarray) -> List[Alert]:
+        """系列（指標, プラットフォーム）×期間の観測値のうち未処理の期間で状態を更新し、直近期間の異常をアラートとして返す"""
+        keys = [tuple(k) for k in keys]
+        periods = np.asarray(periods, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        alerts: List[Alert] = []
+        with self._lock:
+            new_keys = [k for k in dict.fromkeys(keys) if k not in self._index]
+            if new_keys:
+                self._add_keys(new_keys)
+            rows = np.array([self._index[k] for k in keys], dtype=np.int64)
+
+            fresh = periods > self.last_period if self.last_period is not None else np.ones(len(periods), dtype=bool)
+            order = np.argsort(periods[fresh])
+            fresh_periods, fresh_values = periods[fresh][order], values[:, fresh][:, order]
+            last_alert_period = fresh_periods[-1] - ALERT_LOOKBACK_PERIODS if len(fresh_periods) else None
+
+            for t, period in enumerate(fresh_periods):
+                y = np.full(len(self.keys), np.nan)
+                y[rows] = fresh_values[:, t]
+                z, expected = self._step(y, int(period))
+                if period > last_alert_period:
+                    alerts.extend(self._alerts(z, y, expected, int(period)))
+            if len(fresh_periods):
+                self.last_period = int(fresh_periods[-1])
+        return alerts
+
+    def _step(self, y: np.ndarray, period: int) -> Tuple[np.ndarray, np.ndarray]:
+        """1期間ぶんの更新（ロック取得済みで呼ぶ）。ロバストzスコアと期待値を返す"""
+        phase = period % self.season_length
+        observed = ~np.isnan(y)
+        first = observed & (self.n_obs == 0)
+        self.level[first] = y[first]
+
+        # 時間帯で件数が変わりばらつきも変わるため、全体と位相別のスケールの大きい方を使う
+        expected = self.level + self.season[:, phase]
+        phase_scale = self.phase_scale[:, phase]
+        phase_obs = self.phase_obs[:, phase]
+        residual = np.where(observed, y - expected, 0.0)
+        scale = np.maximum(self.scale, np.where(phase_obs >= MIN_PHASE_OBSERVATIONS, phase_scale, 0.0))
+        sigma = np.maximum(ABS_DEV_TO_SIGMA * scale, MIN_RELATIVE_SCALE * np.abs(expected))
+        sigma = np.where(sigma > 0, sigma, 1e-9)
+        ready = self.n_obs >= self.warmup
+        z = np.where(observed & ready, residual / sigma, 0.0)
+
+        # ウォームアップ中は累積平均で素早く学習し、以降は打ち切った残差で更新（異常値に引きずられない）
+        warming = ~ready
+        limit = np.where(warming, np.inf, HUBER_K * sigma)
+        clipped = np.clip(residual, -limit, limit)
+        update = observed & ~first
+        weight = np.maximum(self.alpha, 1.0 / (self.n_obs + 1))
+        scale_weight = np.maximum(self.scale_alpha, 1.0 / np.maximum(self.n_obs, 1))
+        phase_weight = np.maximum(self.scale_alpha, 1.0 / (phase_obs + 1))
+        self.level += np.where(update, weight * clipped, 0.0)
+        if self.season_length > 1:
+            self.season[:, phase] += np.where(update, self.gamma * (1 - weight) * clipped, 0.0)
+        self.scale = np.where(update, (1 - scale_weight) * self.scale + scale_weight * np.abs(clipped), self.scale)
+        self.phase_scale[:, phase] = np.where(
+            update, (1 - phase_weight) * phase_scale + phase_weight * np.abs(clipped), phase_scale
+        )
+        self.phase_obs[:, phase] += update
+        self.n_obs += observed
+        self.last_z = np.where(observed, z, self.last_z)
+        return z, expected
+
+    def _alerts(self, z: np.ndarray, y: np.ndarray, expected: np.ndarray, period: int) -> List[Alert]:
+        """悪化方向に閾値を超えた系列のアラートを作成（ロック取得済みで呼ぶ）"""
+        worse = np.where(self._directions == 0, np.abs(z), z * self._directions)
+        flagged = np.flatnonzero(worse >= self.warning_z)
+        period_start = datetime.fromtimestamp(period * self.period_seconds).isoformat()
+        return [
+            Alert(
+                alert_id=str(uuid.uuid4()),
+                detector=self.name,
+                metric=self.keys[i][0],
+                platform=self.keys[i][1],
+                severity='critical' if worse[i] >= self.critical_z else 'warning',
+                direction='up' if z[i] > 0 else 'down',
+                value=float(y[i]),
+                expected=float(expected[i]),
+                z_score=float(z[i]),
+                period_start=period_start
+            )
+            for i in flagged
+        ]
+
+    def scores(self) -> Dict[Tuple[str, str], float]:
+        """系列ごとの直近のロバストzスコア"""
+        with self._lock:
+            return dict(zip(self.keys, self.last_z.tolist()))
+
+
+class AlertBus:
+    """アラートを重複排除・クールダウンして購読者に配信するイベントバス"""
+
+    def __init__(self, cooldown_seconds: float = ALERT_COOLDOWN_SECONDS, max_recent: int = MAX_RECENT_ALERTS):
+        self.cooldown_seconds = cooldown_seconds
+        self._recent: deque = deque(maxlen=max_recent)
+        self._last_sent: Dict[Tuple, Alert] = {}
+        self._subscribers: List[Callable[[Alert], None]] = []
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def subscribe(self, callback: Callable[[Alert], None]) -> None:
+        """アラートの購読者を登録"""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def publish(self, alerts: Sequence[Alert], now: Optional[float] = None) -> List[Alert]:
+        """アラートを配信（クールダウン中の同じ系列・方向のアラートは、重大度が上がった場合を除き集約）し、配信したものを返す"""
+        now = time.time() if now is None else now
+        delivered = []
+        with self._lock:
+            for alert in alerts:
+                previous = self._last_sent.get(alert.dedup_key)
+                if previous is not None and now - previous.created_at < self.cooldown_seconds \
+                        and not (previous.severity == 'warning' and alert.severity == 'critical'):
+                    previous.occurrences += 1
+                    previous.last_seen = now
+                    self.suppressed += 1
+                    continue
+                alert.created_at = alert.last_seen = now
+                self._last_sent[alert.dedup_key] = alert
+                self._recent.append(alert)
+                delivered.append(alert)
+            subscribers = list(self._subscribers)
+
+        for alert in delivered:
+            for callback in subscribers:
+                try:
+                    callback(alert)
+                except Exception as e:
+                    logger.error(f"アラート配信エラー: {e}")
+        return delivered
+
+    def recent(self, limit: int = 20, min_severity: str = 'warning') -> List[Alert]:
+        """新しい順の直近アラート"""
+        with self._lock:
+            alerts = [a for a in reversed(self._recent) if min_severity == 'warning' or a.severity == 'critical']
+        return alerts[:limit]
+
+    def active(self, now: Optional[float] = None, within_seconds: float = ACTIVE_ALERT_SECONDS) -> List[Alert]:
+        """最後の検知から一定時間内のアラート"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [a for a in self._last_sent.values() if now - a.last_seen < within_seconds]
+
+
+def forward_to_scheduler(alert: Alert) -> None:
+    """スケジューラーが稼働中であれば、アラート通知をイベントタスクとして渡す（登録・実行・破棄はスケジューラースレッド側）"""
+    try:
+        from automation.scheduler import marketing_scheduler, TaskPriority
+    except ImportError:
+        return
+    if not marketing_scheduler.is_running:
+        return
+    marketing_scheduler.submit_event(
+        name=f"KPIアラート: {alert.message}",
+        description="KPI異常検知によるアラート通知",
+        function_name="notify_kpi_alert",
+        kwargs={"alert": alert.to_dict()},
+        priority=TaskPriority.CRITICAL if alert.severity == 'critical' else TaskPriority.HIGH,
+        max_retries=1
+    )
+
+
+def frame_seconds(frame: pd.DataFrame) -> np.ndarray:
+    """推移表の各行のエポック秒（seconds 列を優先し、無ければ time 列をタイムゾーン付きはUTC、なしは現地時刻として変換）"""
+    if 'seconds' in frame:
+        return frame['seconds'].to_numpy(dtype=np.int64)
+    times = pd.to_datetime(frame['time'])
+    if times.dt.tz is not None:
+        return (times - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy().astype(np.int64)
+    return np.array([int(time.mktime(t.timetuple())) for t in times], dtype=np.int64)
+
+
+def frame_to_matrix(frame: pd.DataFrame, metrics: Sequence[str], period_seconds: int,
+                    now: Optional[float] = None):
+    """プラットフォーム別の縦持ち推移を検知器の周期に集計し、（系列キー, 期間, 系列×期間の値）に変換
+
+    周期がバケットより長い場合は件数を合算して比率を計算し直し、nowを含む未確定の周期は除く
+    """
+    seconds = frame_seconds(frame)
+    raw_periods = seconds // period_seconds
+    keep = raw_periods < (time.time() if now is None else now) // period_seconds
+    periods, period_index = np.unique(raw_periods[keep], return_inverse=True)
+    platforms, platform_index = np.unique(frame['platform'].astype(str).to_numpy()[keep], return_inverse=True)
+
+    cells = platform_index * len(periods) + period_index
+    size = len(platforms) * len(periods)
+    totals = np.column_stack([
+        np.bincount(cells, weights=frame[name].to_numpy(dtype=np.float64)[keep], minlength=size)
+        for name in METRIC_FIELDS
+    ])
+    columns = {**dict(zip(METRIC_FIELDS, totals.T)), **derive_metrics(totals)}
+
+    keys, blocks = [], []
+    for metric in metrics:
+        values = columns[metric].copy()
+        # 件数が少ない周期の比率指標は判定に使わない
+        support = RATIO_SUPPORT.get(metric)
+        if support is not None:
+            values[columns[support] < MIN_RATIO_EVENTS] = np.nan
+        keys.extend((metric, platform) for platform in platforms)
+        blocks.append(values.reshape(len(platforms), len(periods)))
+    return keys, periods, np.vstack(blocks) if blocks else np.empty((0, len(periods)))
+
+
+class AnomalyMonitor:
+    """メトリクスストアを定期的に読み、5分単位・時間単位の検知器を更新するバックグラウンドワーカー"""
+
+    FAST_METRICS = ('impressions', 'clicks', 'cost')
+    HOURLY_METRICS = ('impressions', 'clicks', 'conversions', 'cost', 'ctr', 'cpc', 'cpa', 'roas')
+
+    def __init__(self, store: AdMetricsStore, bus: AlertBus, interval: float = MONITOR_INTERVAL_SECONDS):
+        self.store = store
+        self.bus = bus
+        self.interval = interval
+        # (検知器, 集計ウィンドウ, 対象指標)。5分単位は配信量・支出の急変を、時間単位は日内の季節成分を考慮して効率指標の悪化を検知
+        # （5分単位は件数が少なく裾の重いばらつきになるため閾値を上げ、比率指標は対象外）
+        self.detectors = [
+            (RobustEwmaDetector('5min', 300, warmup=8, warning_z=5.0, critical_z=8.0), '1h', self.FAST_METRICS),
+            (RobustEwmaDetector('hourly', 3600, season_length=24, warmup=48), '7d', self.HOURLY_METRICS)
+        ]
+        self.last_run: Optional[float] = None
+        self.last_duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        """監視スレッドを開始（開始済みなら何もしない）"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="kpi-anomaly-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"異常検知の実行エラー: {e}")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now: Optional[float] = None) -> List[Alert]:
+        """未処理の確定済みバケットで全検知器を更新し、配信したアラートを返す"""
+        started = time.perf_counter()
+        refresh_sources(now)
+        alerts = []
+        for detector, window, metrics in self.detectors:
+            frame = self.store.platform_series(window, now, include_total=False)
+            if len(frame):
+                alerts.extend(detector.observe(*frame_to_matrix(frame, metrics, detector.period_seconds, now)))
+        delivered = self.bus.publish(alerts, now)
+        self.last_run = time.time() if now is None else now
+        self.last_duration = time.perf_counter() - started
+        return delivered
+
+    def platform_status(self, platforms: Sequence[str], now: Optional[float] = None) -> Dict[str, str]:
+        """有効なアラートからプラットフォームの状態（active/warning/error）を判定"""
+        status = {platform: 'active' for platform in platforms}
+        for alert in self.bus.active(now):
+            if alert.platform not in status:
+                continue
+            if alert.severity == 'critical':
+                status[alert.platform] = 'error'
+            elif status[alert.platform] == 'active':
+                status[alert.platform] = 'warning'
+        return status
+
+
+# プロセス全体で共有するアラートバスと監視ワーカー
+alert_bus = AlertBus()
+alert_bus.subscribe(forward_to_scheduler)
+anomaly_monitor = AnomalyMonitor(ad_metrics_store, alert_bus)
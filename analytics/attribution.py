@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+アトリビューションエンジン
+タッチポイントを列指向配列で保持し、各ヒューリスティックモデルをNumPyのgroup-byで一括計算
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+# エンジンで計算するヒューリスティックモデル
+HEURISTIC_MODELS = ['First-Touch', 'Last-Touch', 'Linear', 'Time-Decay', 'U-Shaped', 'W-Shaped']
+
+@dataclass
+class TouchpointArrays:
+    """列指向のタッチポイントデータ（journey_id, position 順にソート済み）
+
+    value は所属ジャーニーのコンバージョン価値（未コンバージョンは0）。
+    converted を省略した場合は value > 0 をコンバージョンとみなす。
+    """
+    journey_id: np.ndarray
+    position: np.ndarray
+    channel: np.ndarray
+    timestamp: np.ndarray
+    value: np.ndarray
+    channels: List[str]
+    converted: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.journey_id)
+
+    def is_converted(self) -> np.ndarray:
+        """行ごとのコンバージョンフラグ"""
+        return self.converted if self.converted is not None else self.value > 0
+
+    @classmethod
+    def from_columns(cls,
+                     journey_id: Sequence,
+                     position: Sequence,
+                     channel: Sequence,
+                     timestamp: Sequence,
+                     value: Sequence,
+                     channels: List[str],
+                     converted: Optional[Sequence] = None,
+                     assume_sorted: bool = False) -> "TouchpointArrays":
+        """列データから生成（未ソートなら journey_id, position でソート）"""
+        journey_id = np.asarray(journey_id, dtype=np.int64)
+        position = np.asarray(position, dtype=np.int32)
+        channel = np.asarray(channel, dtype=np.int32)
+        timestamp = np.asarray(timestamp, dtype=np.float64)
+        value = np.asarray(value, dtype=np.float64)
+        converted = np.asarray(converted, dtype=bool) if converted is not None else None
+
+        if not assume_sorted and len(journey_id) > 1:
+            order = np.lexsort((position, journey_id))
+            journey_id, position, channel, timestamp, value = (
+                journey_id[order], position[order], channel[order], timestamp[order], value[order]
+            )
+            if converted is not None:
+                converted = converted[order]
+
+        return cls(journey_id, position, channel, timestamp, value, list(channels), converted)
+
+    def journey_layout(self):
+        """各行のジャーニー内順位・ジャーニー長・ジャーニー番号を返す"""
+        n = len(self.journey_id)
+        if n == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+
+        is_start = np.empty(n, dtype=bool)
+        is_start[0] = True
+        np.not_equal(self.journey_id[1:], self.journey_id[:-1], out=is_start[1:])
+
+        starts = np.flatnonzero(is_start)
+        lengths = np.diff(np.append(starts, n))
+        journey_index = np.repeat(np.arange(len(starts)), lengths)
+        rank = np.arange(n) - starts[journey_index]
+        return rank, lengths[journey_index], journey_index, starts
+
+def journeys_to_arrays(journeys: List[Dict[str, Any]],
+                       channels: Optional[List[str]] = None,
+                       converted_only: bool = True) -> TouchpointArrays:
+    """ページ形式のジャーニー（dictのリスト）を列指向配列へ変換"""
+    vocabulary = {name: i for i, name in enumerate(channels or [])}
+    channel_names = list(channels or [])
+
+    journey_ids, positions, codes, timestamps, values, flags = [], [], [], [], [], []
+    for journey_index, journey in enumerate(journeys):
+        converted = journey.get('converted', True)
+        if converted_only and not converted:
+            continue
+
+        value = float(journey.get('conversion_value', 0.0)) if converted else 0.0
+        for position, tp in enumerate(journey.get('touchpoints', [])):
+            name = tp['name']
+            code = vocabulary.get(name)
+            if code is None:
+                code = vocabulary[name] = len(channel_names)
+                channel_names.append(name)
+
+            ts = tp.get('timestamp')
+            journey_ids.append(journey_index)
+            positions.append(position)
+            codes.append(code)
+            timestamps.append(ts.timestamp() if isinstance(ts, datetime) else float(ts or 0.0))
+            values.append(value)
+            flags.append(bool(converted))
+
+    return TouchpointArrays.from_columns(
+        journey_ids, positions, codes, timestamps, values, channel_names, converted=flags, assume_sorted=True
+    )
+
+def _position_weights(model: str,
+                      rank: np.ndarray,
+                      length: np.ndarray,
+                      arrays: TouchpointArrays,
+                      journey_index: np.ndarray,
+                      time_decay_base: float,
+                      half_life_days: Optional[float]) -> np.ndarray:
+    """モデル別の行ごとの配分比率（各ジャーニー内で合計1）"""
+    lengthf = length.astype(np.float64)
+    first = rank == 0
+    last = rank == length - 1
+
+    if model == 'First-Touch':
+        return first.astype(np.float64)
+
+    if model == 'Last-Touch':
+        return last.astype(np.float64)
+
+    if model == 'Linear':
+        return 1.0 / lengthf
+
+    if model == 'Time-Decay':
+        if half_life_days:
+            # コンバージョン直前のタッチからの経過時間で半減
+            last_ts = arrays.timestamp[last]
+            age_days = (last_ts[journey_index] - arrays.timestamp) / 86400.0
+            raw = np.power(0.5, age_days / half_life_days)
+            totals = np.bincount(journey_index, weights=raw)
+            return raw / totals[journey_index]
+        # 後ろのタッチほど base 倍重い: base^i / Σ base^k（オーバーフローしない形で計算）
+        base = time_decay_base
+        if base == 1.0:
+            return 1.0 / lengthf
+        return np.power(base, rank - (length - 1)) * (base - 1.0) / (base - np.power(base, 1.0 - lengthf))
+
+    if model == 'U-Shaped':
+        # 40% first, 40% last, 20% middle（1件は100%、2件は50%ずつ）
+        middle = np.where(length > 2, 0.2 / np.maximum(lengthf - 2, 1.0), 0.0)
+        edge = np.where(length == 1, 1.0, np.where(length == 2, 0.5, 0.4))
+        return np.where(first | last, edge, middle)
+
+    if model == 'W-Shaped':
+        # 30% first, 30% 中間の主要タッチ, 30% last, 残り10%を均等（3件以下は均等）
+        key_touch = rank == length // 2
+        rest = np.where(length > 3, 0.1 / np.maximum(lengthf - 3, 1.0), 0.0)
+        major = np.where(length > 3, 0.3, 1.0 / lengthf)
+        return np.where(first | last | key_touch, major, np.where(length > 3, rest, 1.0 / lengthf))
+
+    raise ValueError(f"Unknown attribution model: {model}")
+
+def compute_attribution(arrays: TouchpointArrays,
+                        models: Optional[List[str]] = None,
+                        time_decay_base: float = 2.0,
+                        half_life_days: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """各モデルのチャネル別貢献値（長さ = チャネル数の配列）を計算"""
+    models = models or HEURISTIC_MODELS
+    n_channels = len(arrays.channels)
+
+    if len(arrays) == 0:
+        return {model: np.zeros(n_channels) for model in models}
+
+    rank, length, journey_index, _ = arrays.journey_layout()
+
+    return {
+        model: np.bincount(
+            arrays.channel,
+            weights=arrays.value * _position_weights(
+                model, rank, length, arrays, journey_index, time_decay_base, half_life_days
+            ),
+            minlength=n_channels
+        )
+        for model in models
+    }
+
+def attribution_to_dict(credits: Dict[str, np.ndarray], channels: List[str]) -> Dict[str, Dict[str, float]]:
+    """{モデル: {チャネル: 貢献値}} 形式へ変換（貢献の無いチャネルは除外）"""
+    return {
+        model: {channels[i]: float(values[i]) for i in np.flatnonzero(values)}
+        for model, values in credits.items()
+    }
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+インクリメンタルアトリビューション集計
+日次バケットにモデル別・チャネル別の貢献値、遷移回数、コアリション集計を積み上げ、更新した日のバケットだけをディスクへ保存
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Any, Iterable, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from .attribution import HEURISTIC_MODELS, TouchpointArrays, journeys_to_arrays, compute_attribution
+from .markov_attribution import MarkovStates, transition_counts, markov_attribution
+from .shapley_attribution import CoalitionTable, build_coalition_table, shapley_attribution
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 保存先ディレクトリ（環境変数で上書き可能）
+DEFAULT_STATE_DIR = os.getenv(
+    "ATTRIBUTION_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "attribution_state")
+)
+
+# チャネル一覧などのメタデータファイル名
+META_FILE = "meta.json"
+
+# 日次バケットファイルを置くサブディレクトリ
+BUCKET_DIR = "buckets"
+
+# 日次バケットを保持する日数
+DEFAULT_RETENTION_DAYS = 90
+
+# 遷移の始点・終点をチャネル数に依存しない形で保存するための番号
+START_CODE = -1
+CONVERSION_CODE = -2
+NULL_CODE = -3
+
+# インクリメンタル集計で提供するモデル
+STATE_MODELS = HEURISTIC_MODELS + ['Markov Chain', 'Shapley']
+
+def journey_date(journey: Dict[str, Any]) -> date:
+    """ジャーニーの集計日（コンバージョン日、未コンバージョンは最後のタッチ日）"""
+    stamp = journey.get('conversion_date') if journey.get('converted', True) else None
+    if stamp is None and journey.get('touchpoints'):
+        stamp = journey['touchpoints'][-1].get('timestamp')
+    if isinstance(stamp, datetime):
+        return stamp.date()
+    if isinstance(stamp, date):
+        return stamp
+    return datetime.now().date()
+
+def journey_key(journey: Dict[str, Any]) -> int:
+    """重複排除用の64bitハッシュ（IDが無いジャーニーは内容から算出）"""
+    journey_id = journey.get('id')
+    identity = str(journey_id) if journey_id is not None else json.dumps(journey, sort_keys=True, default=str)
+    return int.from_bytes(hashlib.blake2b(identity.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def _pad(values: np.ndarray, size: int) -> np.ndarray:
+    """チャネル追加に合わせて末尾を0埋め"""
+    return values if len(values) >= size else np.concatenate([values, np.zeros(size - len(values))])
+
+@dataclass
+class AttributionBucket:
+    """1日分の集計"""
+    credits: Dict[str, np.ndarray] = field(default_factory=dict)
+    # (from_code, to_code) -> 回数（開始/コンバージョン/離脱は負の番号）
+    transitions: Dict[Tuple[int, int], float] = field(default_factory=dict)
+    # チャネル番号のタプル -> [パス数, コンバージョン数, 価値]
+    coalitions: Dict[Tuple[int, ...], List[float]] = field(default_factory=dict)
+    journeys: int = 0
+    conversions: int = 0
+    value: float = 0.0
+    # 重複排除用のジャーニーIDハッシュ
+    journey_keys: Set[int] = field(default_factory=set)
+
+    def add(self, arrays: TouchpointArrays, journey_keys: List[int]) -> Dict[str, np.ndarray]:
+        """新しいジャーニー群を加算し、加算したヒューリスティックモデルの貢献値を返す"""
+        n_channels = len(arrays.channels)
+        credits = compute_attribution(arrays, HEURISTIC_MODELS)
+        for model, values in credits.items():
+            self.credits[model] = _pad(self.credits.get(model, np.zeros(0)), n_channels) + values
+
+        # 遷移回数を状態番号からチャネル番号へ変換して加算
+        states = MarkovStates(n_channels)
+        codes = np.arange(states.size) - 1
+        codes[states.conversion] = CONVERSION_CODE
+        codes[states.null] = NULL_CODE
+        counts = transition_counts(arrays).tocoo()
+        for row, col, count in zip(codes[counts.row], codes[counts.col], counts.data):
+            key = (int(row), int(col))
+            self.transitions[key] = self.transitions.get(key, 0.0) + float(count)
+
+        table = build_coalition_table(arrays)
+        members = table.channel_codes[table.members]
+        for k in range(len(table)):
+            key = tuple(int(c) for c in members[table.indptr[k]:table.indptr[k + 1]])
+            entry = self.coalitions.setdefault(key, [0.0, 0.0, 0.0])
+            entry[0] += table.paths[k]
+            entry[1] += table.conversions[k]
+            entry[2] += table.value[k]
+
+        self.journeys += len(journey_keys)
+        self.conversions += int(table.conversions.sum())
+        self.value += float(table.value.sum())
+        self.journey_keys.update(journey_keys)
+        return credits
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "credits": {model: values.tolist() for model, values in self.credits.items()},
+            "transitions": [[row, col, count] for (row, col), count in self.transitions.items()],
+            "coalitions": [[list(members), *counts] for members, counts in self.coalitions.items()],
+            "journeys": self.journeys,
+            "conversions": self.conversions,
+            "value": self.value,
+            "journey_keys": sorted(self.journey_keys)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AttributionBucket":
+        return cls(
+            credits={model: np.asarray(values, dtype=np.float64) for model, values in data["credits"].items()},
+            transitions={(int(row), int(col)): count for row, col, count in data["transitions"]},
+            coalitions={tuple(members): [paths, conversions, value]
+                        for members, paths, conversions, value in data["coalitions"]},
+            journeys=data["journeys"],
+            conversions=data["conversions"],
+            value=data["value"],
+            journey_keys=set(data["journey_keys"])
+        )
+
+class AttributionState:
+    """日次ウィンドウ付きのインクリメンタルアトリビューション集計"""
+
+    def __init__(self,
+                 state_dir: Optional[str] = DEFAULT_STATE_DIR,
+                 retention_days: int = DEFAULT_RETENTION_DAYS):
+        self.state_dir = state_dir
+        self.retention_days = retention_days
+        self.channels: List[str] = []
+        self.buckets: Dict[date, AttributionBucket] = {}
+
+        self._seen_keys: Dict[int, date] = {}
+        self._totals: Dict[str, np.ndarray] = {}
+        self._results_cache: Dict[Tuple[Optional[date], Optional[date]], Dict[str, Dict[str, float]]] = {}
+        # model_results が集計メソッドを呼ぶため再入可能にする
+        self._lock = threading.RLock()
+
+        self.load()
+
+    def update(self, journeys: List[Dict[str, Any]], today: Optional[date] = None) -> int:
+        """新しいジャーニーを集計に反映（処理済みのジャーニーはIDまたは内容のハッシュでスキップ）し、追加件数を返す"""
+        today = today or datetime.now().date()
+        cutoff = today - timedelta(days=self.retention_days - 1)
+
+        with self._lock:
+            groups: Dict[date, List[Dict[str, Any]]] = {}
+            batch_keys: Set[int] = set()
+            keys: Dict[date, List[int]] = {}
+            for journey in journeys:
+                key = journey_key(journey)
+                if key in self._seen_keys or key in batch_keys:
+                    continue
+                day = journey_date(journey)
+                if day < cutoff:
+                    continue
+                batch_keys.add(key)
+                groups.setdefault(day, []).append(journey)
+                keys.setdefault(day, []).append(key)
+
+            n_channels = len(self.channels)
+            added = 0
+            for day, group in groups.items():
+                arrays = journeys_to_arrays(group, channels=self.channels, converted_only=False)
+                self.channels = list(arrays.channels)
+
+                credits = self.buckets.setdefault(day, AttributionBucket()).add(arrays, keys[day])
+                for key in keys[day]:
+                    self._seen_keys[key] = day
+
+                # 累計は差分だけ加算
+                for model, values in credits.items():
+                    self._totals[model] = _pad(self._totals.get(model, np.zeros(0)), len(self.channels)) + values
+                added += len(group)
+
+            expired = self._evict(cutoff)
+            if added or expired:
+                self._results_cache.clear()
+                self._save(groups.keys(), expired, channels_changed=len(self.channels) != n_channels)
+
+        return added
+
+    def _evict(self, cutoff: date) -> List[date]:
+        """保持期間外のバケットを削除して累計を再構築し、削除した日を返す"""
+        expired = [day for day in self.buckets if day < cutoff]
+        for day in expired:
+            for key in self.buckets.pop(day).journey_keys:
+                self._seen_keys.pop(key, None)
+        if expired:
+            self._totals = self._sum_credits(self.buckets.values())
+        return expired
+
+    def _sum_credits(self, buckets) -> Dict[str, np.ndarray]:
+        n_channels = len(self.channels)
+        totals = {model: np.zeros(n_channels) for model in HEURISTIC_MODELS}
+        for bucket in buckets:
+            for model, values in bucket.credits.items():
+                totals[model][:len(values)] += values
+        return totals
+
+    def _select(self, start: Optional[date], end: Optional[date]) -> List[AttributionBucket]:
+        return [
+            bucket for day, bucket in self.buckets.items()
+            if (start is None or day >= start) and (end is None or day <= end)
+        ]
+
+    def heuristic_credits(self, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, np.ndarray]:
+        """ヒューリスティックモデルの貢献値（期間指定なしは累計をそのまま返す）"""
+        with self._lock:
+            n_channels = len(self.channels)
+            if start is None and end is None:
+                return {model: _pad(self._totals.get(model, np.zeros(0)), n_channels) for model in HEURISTIC_MODELS}
+            return self._sum_credits(self._select(start, end))
+
+    def transition_matrix(self, start: Optional[date] = None, end: Optional[date] = None) -> sparse.csr_matrix:
+        """期間内の遷移回数（markov_attribution の状態番号）"""
+        with self._lock:
+            states = MarkovStates(len(self.channels))
+            special = {START_CODE: states.start, CONVERSION_CODE: states.conversion, NULL_CODE: states.null}
+            rows, cols, data = [], [], []
+            for bucket in self._select(start, end):
+                for (row, col), count in bucket.transitions.items():
+                    rows.append(special.get(row, row + 1))
+                    cols.append(special.get(col, col + 1))
+                    data.append(count)
+            return sparse.coo_matrix((data, (rows, cols)), shape=(states.size, states.size)).tocsr()
+
+    def coalition_table(self, start: Optional[date] = None, end: Optional[date] = None) -> CoalitionTable:
+        """期間内のコアリション集計"""
+        with self._lock:
+            merged: Dict[Tuple[int, ...], np.ndarray] = {}
+            for bucket in self._select(start, end):
+                for members, counts in bucket.coalitions.items():
+                    merged[members] = merged.get(members, 0.0) + np.asarray(counts)
+        return CoalitionTable.from_counts(merged)
+
+    def summary(self, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+        """期間内のジャーニー数・コンバージョン数・価値"""
+        with self._lock:
+            buckets = self._select(start, end)
+            return {
+                "journeys": sum(b.journeys for b in buckets),
+                "conversions": sum(b.conversions for b in buckets),
+                "value": sum(b.value for b in buckets),
+                "days": len(buckets)
+            }
+
+    def model_results(self, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Dict[str, float]]:
+        """{モデル: {チャネル: 貢献値}}（更新があるまで結果をキャッシュ）"""
+        key = (start, end)
+        with self._lock:
+            cached = self._results_cache.get(key)
+            if cached is not None:
+                return cached
+
+            channels = list(self.channels)
+            results = {
+                model: {channels[i]: float(values[i]) for i in np.flatnonzero(values)}
+                for model, values in self.heuristic_credits(start, end).items()
+            }
+
+            # 集計済みの遷移・コアリションから再計算（生ジャーニーは不要）
+            total_value = self.summary(start, end)["value"]
+            empty = TouchpointArrays.from_columns([], [], [], [], [], channels)
+            results['Markov Chain'] = markov_attribution(
+                empty, total_value=total_value, counts=self.transition_matrix(start, end)
+            ).to_dict()
+            results['Shapley'] = shapley_attribution(
+                empty, total_value=total_value, table=self.coalition_table(start, end)
+            ).to_dict()
+
+            self._results_cache[key] = results
+            return results
+
+    def _bucket_path(self, day: date) -> str:
+        return os.path.join(self.state_dir, BUCKET_DIR, f"{day.isoformat()}.json")
+
+    @staticmethod
+    def _write_json(path: str, data: Dict[str, Any]):
+        """一時ファイル経由でアトミックに書き込む"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _save(self, days: Iterable[date], expired: Iterable[date], channels_changed: bool):
+        """更新した日のバケットだけを書き換え、期限切れの日のファイルを削除（ロック取得済みで呼ぶ）"""
+        if not self.state_dir:
+            return
+        try:
+            os.makedirs(os.path.join(self.state_dir, BUCKET_DIR), exist_ok=True)
+            # チャネル番号はバケットより先に確定させる
+            if channels_changed or not os.path.exists(os.path.join(self.state_dir, META_FILE)):
+                self._write_json(os.path.join(self.state_dir, META_FILE), {
+                    "channels": self.channels,
+                    "retention_days": self.retention_days
+                })
+            for day in days:
+                self._write_json(self._bucket_path(day), self.buckets[day].to_dict())
+            for day in expired:
+                if os.path.exists(self._bucket_path(day)):
+                    os.remove(self._bucket_path(day))
+        except OSError as e:
+            logger.error(f"アトリビューション集計の保存エラー: {e}")
+
+    def load(self):
+        """メタデータと日次バケットファイルから復元"""
+        meta_path = os.path.join(self.state_dir, META_FILE) if self.state_dir else None
+        if not meta_path or not os.path.exists(meta_path):
+            return
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.channels = json.load(f).get("channels", [])
+            bucket_dir = os.path.join(self.state_dir, BUCKET_DIR)
+            buckets = {}
+            for name in sorted(os.listdir(bucket_dir)) if os.path.isdir(bucket_dir) else []:
+                if not name.endswith('.json'):
+                    continue
+                with open(os.path.join(bucket_dir, name), 'r', encoding='utf-8') as f:
+                    buckets[date.fromisoformat(name[:-len('.json')])] = AttributionBucket.from_dict(json.load(f))
+            self.buckets = buckets
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"アトリビューション集計の読み込みエラー: {e}")
+            return
+
+        self._seen_keys = {key: day for day, bucket in self.buckets.items() for key in bucket.journey_keys}
+        self._totals = self._sum_credits(self.buckets.values())
+        logger.info(f"アトリビューション集計を復元: {len(self.buckets)}日分")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+バックグラウンドジョブ実行
+プロセスで1つの常駐イベントループスレッド上でAI分析などのコルーチンを実行し、
+ページはジョブIDで進捗・結果をリラン時に参照する（同じ入力のジョブは結果を共有）
+"""
+
+import time
+import json
+import uuid
+import asyncio
+import hashlib
+import threading
+import contextvars
+import logging
+from concurrent.futures import Future, CancelledError
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Any, Optional, Coroutine
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 完了したジョブの結果を再利用する期間（秒）
+RESULT_TTL_SECONDS = 600
+
+# 保持するジョブ数の上限（超えたら参照済みの完了ジョブから古い順に破棄）
+MAX_RETAINED_JOBS = 500
+
+# 一度も参照されていない完了ジョブの結果を保持する期間（秒）
+UNCOLLECTED_TTL_SECONDS = 3600
+
+# ジョブ毎に保持する進捗イベント数の上限
+MAX_PROGRESS_EVENTS = 50
+
+# キャンセル時にジョブの終了を待つ最長時間（秒）
+CANCEL_WAIT_SECONDS = 1.0
+
+
+class JobStatus(Enum):
+    """ジョブの状態"""
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class Job:
+    """実行中または完了したジョブ"""
+    job_id: str
+    name: str
+    key: Optional[str]
+    ttl_seconds: float
+    status: JobStatus = JobStatus.PENDING
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: float = 0.0
+    message: str = ""
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+    # 完了後にページ（get）から参照されたか
+    collected: bool = False
+    _future: Optional[Future] = field(default=None, repr=False)
+    # 状態が完了・失敗・キャンセルのいずれかに確定したら立つ
+    _finished: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.finished_at is not None and (now or time.time()) - self.finished_at > self.ttl_seconds
+
+    def evictable(self, now: float, uncollected_ttl: float) -> bool:
+        """破棄してよいか（未参照の結果は保持期間内なら残す）"""
+        return self.done and (self.collected or now - self.finished_at >= uncollected_ttl)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """完了まで待機（タイムアウトした場合は False）"""
+        if self._future is None:
+            return self.done
+        self._finished.wait(timeout)
+        return self.done
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'status': self.status.value,
+            'progress': self.progress,
+            'message': self.message,
+            'elapsed': self.elapsed,
+            'error': self.error
+        }
+
+
+# 実行中のコルーチンから自身のジョブを参照するためのコンテキスト
+_current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar('current_job', default=None)
+
+
+def report_progress(progress: float, message: str = "") -> None:
+    """実行中のジョブの進捗（0〜1）を記録（ジョブ外から呼ばれた場合は何もしない）"""
+    job = _current_job.get()
+    if job is None:
+        return
+    job.progress = min(max(float(progress), 0.0), 1.0)
+    job.message = message or job.message
+    job.events.append({'time': time.time(), 'progress': job.progress, 'message': job.message})
+    del job.events[:-MAX_PROGRESS_EVENTS]
+
+
+def job_key(name: str, *args, **kwargs) -> str:
+    """ジョブ名と入力からキャッシュキーを生成"""
+    payload = json.dumps([name, args, kwargs], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class JobRunner:
+    """常駐イベントループスレッドでコルーチンを実行するジョブランナー"""
+
+    def __init__(self, result_ttl: float = RESULT_TTL_SECONDS, max_jobs: int = MAX_RETAINED_JOBS,
+                 uncollected_ttl: float = UNCOLLECTED_TTL_SECONDS):
+        self.result_ttl = result_ttl
+        self.max_jobs = max_jobs
+        self.uncollected_ttl = uncollected_ttl
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="background-jobs", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro: Coroutine, name: str = "", key: Optional[str] = None,
+               ttl_seconds: Optional[float] = None) -> str:
+        """コルーチンをバックグラウンドで実行し、ジョブIDを返す（同じキーの有効なジョブがあれば再利用）"""
+        loop = self._ensure_loop()
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key)) if key else None
+            if existing is not None and existing.status not in (JobStatus.FAILED, JobStatus.CANCELLED) \
+                    and not existing.expired():
+                coro.close()
+                return existing.job_id
+
+            job = Job(
+                job_id=str(uuid.uuid4()),
+                name=name or getattr(coro, '__name__', 'job'),
+                key=key,
+                ttl_seconds=self.result_ttl if ttl_seconds is None else ttl_seconds
+            )
+            self._jobs[job.job_id] = job
+            if key:
+                self._by_key[key] = job.job_id
+            self._prune()
+
+        job._future = asyncio.run_coroutine_threadsafe(self._run(job, coro), loop)
+        return job.job_id
+
+    async def _run(self, job: Job, coro: Coroutine) -> Any:
+        _current_job.set(job)
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = await coro
+            job.progress = 1.0
+            job.status = JobStatus.COMPLETED
+            return job.result
+        except asyncio.CancelledError:
+            job.status = JobStatus.CANCELLED
+            raise
+        except Exception as e:
+            logger.error(f"バックグラウンドジョブ '{job.name}' でエラー: {e}")
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+            raise
+        finally:
+            job.finished_at = time.time()
+            job._finished.set()
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        """ジョブを取得（未知・破棄済みのIDは None、完了済みなら参照済みにする）"""
+        with self._lock:
+            job = self._jobs.get(job_id) if job_id else None
+            if job is not None and job.done:
+                job.collected = True
+            return job
+
+    def result(self, job_id: str, timeout: Optional[float] = None) -> Any:
+        """ジョブの結果を待って返す（失敗時は例外、タイムアウト時は TimeoutError）"""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(f"ジョブが見つかりません: {job_id}")
+        try:
+            return job._future.result(timeout)
+        except CancelledError:
+            raise RuntimeError(f"ジョブはキャンセルされました: {job.name}")
+
+    def cancel(self, job_id: str) -> bool:
+        """実行中のジョブをキャンセル（実行中なら終了を短時間待ち、リラン時に状態が反映されるようにする）"""
+        job = self.get(job_id)
+        if job is None or job.done or job._future is None:
+            return False
+        cancelled = job._future.cancel()
+        if cancelled and job.status == JobStatus.PENDING:
+            # 開始前のコルーチンは _run に入らないためここで確定する
+            job.status = JobStatus.CANCELLED
+            job.finished_at = time.time()
+            job._finished.set()
+        elif cancelled:
+            job._finished.wait(CANCEL_WAIT_SECONDS)
+        return cancelled
+
+    def jobs(self, name: Optional[str] = None) -> List[Job]:
+        """保持中のジョブ（新しい順）"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if name is None or job.name == name]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def _prune(self) -> None:
+        """期限切れのジョブと上限を超えた古い完了済みジョブを破棄（ロック保持中に呼ぶ）
+
+        未参照の結果はセッションが取りに来るまで uncollected_ttl の間は上限を超えても残す。
+        """
+        now = time.time()
+        finished = sorted(
+            (job for job in self._jobs.values() if job.evictable(now, self.uncollected_ttl)),
+            key=lambda job: job.created_at
+        )
+        excess = len(self._jobs) - self.max_jobs
+        for job in finished:
+            if job.expired(now) or excess > 0:
+                del self._jobs[job.job_id]
+                if job.key and self._by_key.get(job.key) == job.job_id:
+                    del self._by_key[job.key]
+                excess -= 1
+
+
+# プロセス共通のジョブランナー（ページのリランやセッションをまたいでジョブを共有）
+job_runner = JobRunner()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+多腕バンディットによるトラフィック配分
+Thompson SamplingとUCBで配分先を決定し、アーム状態を定期的にディスクへ保存
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# アーム状態の保存ディレクトリ（環境変数で上書き可能）
+DEFAULT_BANDIT_DIR = os.getenv(
+    "BANDIT_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "bandits")
+)
+
+# 配分ポリシー
+BANDIT_POLICIES = ('thompson', 'ucb')
+
+# ベータ事前分布のパラメータ（一様分布）
+PRIOR_ALPHA = 1.0
+PRIOR_BETA = 1.0
+
+# 一度にまとめて決定しておく配分数（事後分布のサンプリングをまとめて行う）
+DECISION_BATCH_SIZE = 256
+
+# スナップショットを保存する最短間隔（秒）
+SNAPSHOT_INTERVAL_SECONDS = 10.0
+
+# 最良確率の推定に使うサンプル数
+ALLOCATION_DRAWS = 10000
+
+
+class BanditAllocator:
+    """アームごとの試行数・報酬を保持し、choose_variant/record_outcomeを定数時間で処理する配分器"""
+
+    def __init__(self, arm_ids: Sequence[str], policy: str = 'thompson', snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = SNAPSHOT_INTERVAL_SECONDS, batch_size: int = DECISION_BATCH_SIZE,
+                 seed: Optional[int] = None):
+        if policy not in BANDIT_POLICIES:
+            raise ValueError(f"未対応の配分ポリシーです: {policy}")
+        if not arm_ids:
+            raise ValueError("アームが指定されていません")
+        self.policy = policy
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.batch_size = batch_size
+        self.arm_ids: List[str] = [str(a) for a in arm_ids]
+        self._index = {arm_id: i for i, arm_id in enumerate(self.arm_ids)}
+        self.pulls = np.zeros(len(self.arm_ids))
+        self.rewards = np.zeros(len(self.arm_ids))
+        self._rng = np.random.default_rng(seed)
+        self._queue: deque = deque()
+        self._since_refill = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_snapshot = time.monotonic()
+
+        if snapshot_path:
+            self.load()
+
+    def _decide(self, n: int) -> np.ndarray:
+        """n件分の配分先をまとめて決定（ロック取得済みで呼ぶ）"""
+        k = len(self.arm_ids)
+        if self.policy == 'thompson':
+            a = PRIOR_ALPHA + self.rewards
+            b = PRIOR_BETA + np.maximum(self.pulls - self.rewards, 0.0)
+            return self._rng.beta(a, b, size=(n, k)).argmax(axis=1)
+
+        # UCB1: 決定済みの配分を試行数に仮算入しながら指標が最大のアームを順に選ぶ
+        pending = np.zeros(k)
+        means = np.divide(self.rewards, self.pulls, out=np.zeros(k), where=self.pulls > 0)
+        total = self.pulls.sum()
+        choices = np.empty(n, dtype=np.int64)
+        for i in range(n):
+            pulls = self.pulls + pending
+            bonus = np.sqrt(2 * np.log(max(total + i, 1.0)) / np.maximum(pulls, 1e-12))
+            index = np.where(pulls > 0, means + bonus, np.inf)
+            choices[i] = int(np.argmax(index))
+            pending[choices[i]] += 1
+        return choices
+
+    def choose_variant(self) -> str:
+        """配分先のアームを1件選択（事前に決定したバッチから取り出すため定数時間）"""
+        with self._lock:
+            if not self._queue or self._since_refill >= self.batch_size:
+                self._queue = deque(self._decide(self.batch_size).tolist())
+                self._since_refill = 0
+            return self.arm_ids[self._queue.popleft()]
+
+    def choose_batch(self, n: int) -> np.ndarray:
+        """n件分の配分先アームIDを一括で選択"""
+        with self._lock:
+            return np.asarray(self.arm_ids, dtype=object)[self._decide(n)]
+
+    def record_outcome(self, arm_id: str, reward: float = 1.0) -> None:
+        """配分結果（報酬は0〜1）を記録"""
+        with self._lock:
+            i = self._index.get(str(arm_id))
+            if i is None:
+                raise KeyError(f"未知のアームです: {arm_id}")
+            self.pulls[i] += 1
+            self.rewards[i] += reward
+            self._since_refill += 1
+        self._maybe_save()
+
+    def record_outcomes(self, arm_ids, rewards) -> None:
+        """配分結果を一括で記録"""
+        arm_ids = np.asarray(arm_ids, dtype=object)
+        with self._lock:
+            codes = np.fromiter((self._index.get(str(a), -1) for a in arm_ids), dtype=np.int64, count=len(arm_ids))
+            if (codes < 0).any():
+                raise KeyError("未知のアームが含まれています")
+            k = len(self.arm_ids)
+            rewards = np.broadcast_to(np.asarray(rewards, dtype=np.float64), codes.shape)
+            self.pulls += np.bincount(codes, minlength=k)
+            self.rewards += np.bincount(codes, weights=rewards, minlength=k)
+            self._since_refill += len(codes)
+        self._maybe_save()
+
+    def add_arm(self, arm_id: str) -> None:
+        """アームを追加（既存の場合は何もしない）"""
+        arm_id = str(arm_id)
+        with self._lock:
+            if arm_id in self._index:
+                return
+            self._index[arm_id] = len(self.arm_ids)
+            self.arm_ids.append(arm_id)
+            self.pulls = np.append(self.pulls, 0.0)
+            self.rewards = np.append(self.rewards, 0.0)
+            self._queue.clear()
+
+    def remove_arm(self, arm_id: str) -> None:
+        """アームを削除"""
+        with self._lock:
+            i = self._index.get(str(arm_id))
+            if i is None or len(self.arm_ids) == 1:
+                return
+            self.arm_ids.pop(i)
+            self.pulls = np.delete(self.pulls, i)
+            self.rewards = np.delete(self.rewards, i)
+            self._index = {a: j for j, a in enumerate(self.arm_ids)}
+            self._queue.clear()
+
+    def allocation(self) -> Dict[str, float]:
+        """現在の配分比率（Thompson Samplingは最良確率、UCBは次バッチの配分割合）"""
+        with self._lock:
+            n = ALLOCATION_DRAWS if self.policy == 'thompson' else self.batch_size
+            choices = self._decide(n)
+        shares = np.bincount(choices, minlength=len(self.arm_ids)) / len(choices)
+        return dict(zip(self.arm_ids, shares.tolist()))
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """アーム別の試行数・報酬・平均報酬・配分比率"""
+        allocation = self.allocation()
+        with self._lock:
+            return [
+                {
+                    "arm_id": arm_id,
+                    "pulls": int(self.pulls[i]),
+                    "rewards": float(self.rewards[i]),
+                    "mean_reward": float(self.rewards[i] / self.pulls[i]) if self.pulls[i] > 0 else 0.0,
+                    "allocation": allocation[arm_id]
+                }
+                for i, arm_id in enumerate(self.arm_ids)
+            ]
+
+    def _maybe_save(self) -> None:
+        """前回保存から一定時間経過していればスナップショットを保存"""
+        if self.snapshot_path and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.save()
+
+    def save(self) -> None:
+        """アーム状態をアトミックに保存"""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            self._last_snapshot = time.monotonic()
+            data = {
+                "policy": self.policy,
+                "arm_ids": list(self.arm_ids),
+                "pulls": self.pulls.tolist(),
+                "rewards": self.rewards.tolist(),
+                "saved_at": time.time()
+            }
+        try:
+            with self._save_lock:
+                os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+                tmp_path = f"{self.snapshot_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.error(f"バンディット状態の保存エラー: {e}")
+
+    def load(self) -> None:
+        """保存済みのアーム状態を読み込む（現在のアームに存在するものだけ復元）"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for arm_id, pulls, rewards in zip(data["arm_ids"], data["pulls"], data["rewards"]):
+                i = self._index.get(arm_id)
+                if i is not None:
+                    self.pulls[i] = pulls
+                    self.rewards[i] = rewards
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"バンディット状態の読み込みエラー: {e}")
+
+
+# プロセス内で共有する配分器
+_allocators: Dict[str, BanditAllocator] = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(name: str, arm_ids: Sequence[str], policy: str = 'thompson', persist: bool = True) -> BanditAllocator:
+    """名前ごとに共有される配分器を取得（新しいアームは追加、ポリシー変更時は状態を引き継いで作り直す）"""
+    with _allocators_lock:
+        allocator = _allocators.get(name)
+        if allocator is None or allocator.policy != policy:
+            snapshot_path = os.path.join(DEFAULT_BANDIT_DIR, f"{name}.json") if persist else None
+            previous = allocator
+            allocator = BanditAllocator(previous.arm_ids if previous else arm_ids, policy=policy, snapshot_path=snapshot_path)
+            if previous is not None:
+                allocator.pulls = previous.pulls.copy()
+                allocator.rewards = previous.rewards.copy()
+            _allocators[name] = allocator
+        for arm_id in arm_ids:
+            allocator.add_arm(arm_id)
+        return allocator
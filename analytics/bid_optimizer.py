@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+入札・予算配分最適化
+広告グループごとの反応曲線（支出→コンバージョン）を履歴から推定し、
+予算・目標CPAの制約下で限界ROASが等しくなる支出配分をベクトル演算で求める
+"""
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 反応曲線の弾力性（支出が1%増えたときのコンバージョン増加率）の範囲
+MIN_ELASTICITY = 0.05
+MAX_ELASTICITY = 0.95
+
+# 現在の支出に対する推奨支出の下限・上限の倍率
+MIN_SPEND_RATIO = 0.2
+MAX_SPEND_RATIO = 3.0
+
+# 入札単価の変化に対する支出の弾力性（支出比の平方根を入札比とみなす）
+BID_SPEND_ELASTICITY = 2.0
+
+# 限界ROASを求める二分探索の反復回数と探索範囲（log λ）
+SOLVER_ITERATIONS = 64
+LOG_LAMBDA_RANGE = (-20.0, 20.0)
+
+# 最適化はUIスレッド外の専用スレッドで実行
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bid-optimizer")
+
+
+@dataclass
+class ResponseCurves:
+    """広告グループ別のべき乗型反応曲線（conversions = scale * spend ** elasticity）"""
+    group_ids: np.ndarray
+    platforms: np.ndarray
+    scale: np.ndarray
+    elasticity: np.ndarray
+    value_per_conversion: np.ndarray
+    current_spend: np.ndarray
+    min_spend: np.ndarray
+    max_spend: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.group_ids)
+
+    def conversions(self, spend: np.ndarray) -> np.ndarray:
+        return self.scale * np.power(np.maximum(spend, 0.0), self.elasticity)
+
+    def marginal_roas(self, spend: np.ndarray) -> np.ndarray:
+        """支出1円あたりの限界収益"""
+        safe = np.maximum(spend, 1e-9)
+        return self.value_per_conversion * self.scale * self.elasticity * np.power(safe, self.elasticity - 1)
+
+
+def fit_response_curves(history: pd.DataFrame, group_col: str = 'group_id', platform_col: str = 'platform',
+                        spend_col: str = 'spend', conversions_col: str = 'conversions',
+                        revenue_col: str = 'revenue', recent_days: int = 7) -> ResponseCurves:
+    """日別の支出・コンバージョン履歴から広告グループごとの反応曲線を一括で推定（対数回帰）"""
+    df = history[history[spend_col] > 0]
+    x = np.log(df[spend_col].to_numpy(dtype=np.float64))
+    y = np.log(df[conversions_col].to_numpy(dtype=np.float64) + 0.5)
+    groups, inverse = np.unique(df[group_col].to_numpy().astype(str), return_inverse=True)
+    k = len(groups)
+
+    def total(values):
+        return np.bincount(inverse, weights=values, minlength=k)
+
+    n = np.bincount(inverse, minlength=k).astype(np.float64)
+    sx, sy = total(x), total(y)
+    sxx, sxy = total(x * x), total(x * y)
+    var_x = sxx - sx * sx / n
+    cov_xy = sxy - sx * sy / n
+    elasticity = np.clip(
+        np.divide(cov_xy, var_x, out=np.full(k, 0.5), where=var_x > 1e-9), MIN_ELASTICITY, MAX_ELASTICITY
+    )
+    scale = np.exp((sy - elasticity * sx) / n)
+
+    conversions = total(df[conversions_col].to_numpy(dtype=np.float64))
+    revenue = total(df[revenue_col].to_numpy(dtype=np.float64)) if revenue_col in df else np.zeros(k)
+    value = np.divide(revenue, conversions, out=np.zeros(k), where=conversions > 0)
+    value = np.where(value > 0, value, np.median(value[value > 0]) if (value > 0).any() else 1.0)
+
+    # 現在の支出は直近の平均
+    days = pd.to_datetime(df['date']) if 'date' in df else None
+    if days is not None:
+        recent = (days >= days.max() - pd.Timedelta(days=recent_days - 1)).to_numpy()
+        current = np.divide(
+            np.bincount(inverse[recent], weights=df[spend_col].to_numpy()[recent], minlength=k),
+            np.bincount(inverse[recent], minlength=k),
+            out=np.exp(sx / n), where=np.bincount(inverse[recent], minlength=k) > 0
+        )
+    else:
+        current = np.exp(sx / n)
+
+    first_rows = np.unique(inverse, return_index=True)[1]
+    return ResponseCurves(
+        group_ids=groups,
+        platforms=df[platform_col].to_numpy().astype(str)[first_rows] if platform_col in df else np.full(k, ''),
+        scale=scale,
+        elasticity=elasticity,
+        value_per_conversion=value,
+        current_spend=current,
+        min_spend=current * MIN_SPEND_RATIO,
+        max_spend=current * MAX_SPEND_RATIO
+    )
+
+
+@dataclass
+class AllocationPlan:
+    """最適化された支出配分"""
+    curves: ResponseCurves
+    recommended_spend: np.ndarray
+    bid_multiplier: np.ndarray
+    marginal_roas: float
+    budget: float
+    target_cpa: Optional[float]
+    binding: str
+
+    @property
+    def current_conversions(self) -> np.ndarray:
+        return self.curves.conversions(self.curves.current_spend)
+
+    @property
+    def expected_conversions(self) -> np.ndarray:
+        return self.curves.conversions(self.recommended_spend)
+
+    def totals(self) -> Dict[str, float]:
+        """現状と推奨配分の合計指標"""
+        value = self.curves.value_per_conversion
+        current_spend = float(self.curves.current_spend.sum())
+        spend = float(self.recommended_spend.sum())
+        current_conv = float(self.current_conversions.sum())
+        conv = float(self.expected_conversions.sum())
+        current_revenue = float((self.current_conversions * value).sum())
+        revenue = float((self.expected_conversions * value).sum())
+        return {
+            'current_spend': current_spend,
+            'recommended_spend': spend,
+            'current_conversions': current_conv,
+            'expected_conversions': conv,
+            'current_cpa': current_spend / current_conv if current_conv > 0 else 0.0,
+            'expected_cpa': spend / conv if conv > 0 else 0.0,
+            'current_roas': current_revenue / current_spend if current_spend > 0 else 0.0,
+            'expected_roas': revenue / spend if spend > 0 else 0.0,
+            'marginal_roas': self.marginal_roas
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        """広告グループ別の配分表"""
+        current = self.curves.current_spend
+        return pd.DataFrame({
+            'group_id': self.curves.group_ids,
+            'platform': self.curves.platforms,
+            'current_spend': current,
+            'recommended_spend': self.recommended_spend,
+            'spend_change': np.divide(self.recommended_spend - current, current, out=np.zeros(len(current)), where=current > 0),
+            'bid_multiplier': self.bid_multiplier,
+            'expected_conversions': self.expected_conversions,
+            'marginal_roas': self.curves.marginal_roas(self.recommended_spend)
+        })
+
+    def platform_summary(self) -> pd.DataFrame:
+        """プラットフォーム別の現状・推奨支出"""
+        return self.to_frame().groupby('platform')[['current_spend', 'recommended_spend', 'expected_conversions']].sum()
+
+
+def solve_allocation(curves: ResponseCurves, budget: float, target_cpa: Optional[float] = None,
+                     min_marginal_roas: float = 0.0, max_bid_adjustment: Optional[float] = 0.5,
+                     objective: str = 'revenue') -> AllocationPlan:
+    """予算・目標CPAの制約下で限界ROASを均等化する支出配分を求める
+
+    max_bid_adjustment を指定すると、入札単価の変更幅（±）で到達できる支出の範囲に配分を限定する
+    （None の場合は反応曲線の支出上下限のみ）
+    """
+    weights = curves.value_per_conversion if objective == 'revenue' else np.ones(len(curves))
+    min_spend, max_spend = curves.min_spend, curves.max_spend
+    if max_bid_adjustment is not None:
+        min_spend = np.maximum(min_spend, curves.current_spend * (1 - max_bid_adjustment) ** BID_SPEND_ELASTICITY)
+        max_spend = np.minimum(max_spend, curves.current_spend * (1 + max_bid_adjustment) ** BID_SPEND_ELASTICITY)
+        max_spend = np.maximum(max_spend, min_spend)
+    beta = curves.elasticity
+    log_coef = np.log(np.maximum(weights * curves.scale * beta, 1e-300))
+
+    def spend_at(log_lambda: float) -> np.ndarray:
+        # 限界価値 w*a*β*s^(β-1) = λ を満たす支出を上下限で切り詰める
+        spend = np.exp((log_lambda - log_coef) / (beta - 1))
+        return np.clip(spend, min_spend, max_spend)
+
+    def cpa_at(log_lambda: float) -> float:
+        spend = spend_at(log_lambda)
+        conv = curves.conversions(spend).sum()
+        return spend.sum() / conv if conv > 0 else np.inf
+
+    def bisect(predicate) -> float:
+        """predicateを満たす最小のlog λを二分探索（predicateはλについて単調）"""
+        lo, hi = LOG_LAMBDA_RANGE
+        for _ in range(SOLVER_ITERATIONS):
+            mid = (lo + hi) / 2
+            if predicate(mid):
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    if min_spend.sum() > budget:
+        logger.warning("最低支出の合計が予算を超えています。最低支出で配分します")
+        log_lambda, binding = LOG_LAMBDA_RANGE[1], 'min_spend'
+    else:
+        log_lambda, binding = bisect(lambda l: spend_at(l).sum() <= budget), 'budget'
+        if min_marginal_roas > 0 and np.log(min_marginal_roas) > log_lambda:
+            log_lambda, binding = np.log(min_marginal_roas), 'marginal_roas'
+        if target_cpa and cpa_at(log_lambda) > target_cpa:
+            # 支出を増やすほどCPAは悪化するため、目標CPAを満たす範囲で最大の支出に絞る
+            log_lambda, binding = max(log_lambda, bisect(lambda l: cpa_at(l) <= target_cpa)), 'target_cpa'
+
+    spend = spend_at(log_lambda)
+    ratio = np.divide(spend, curves.current_spend, out=np.ones(len(spend)), where=curves.current_spend > 0)
+    # 支出は入札の変更幅で到達できる範囲に収めているため、入札倍率は支出比から一意に決まる
+    bid_multiplier = np.power(ratio, 1 / BID_SPEND_ELASTICITY)
+    return AllocationPlan(
+        curves=curves,
+        recommended_spend=spend,
+        bid_multiplier=bid_multiplier,
+        marginal_roas=float(np.exp(log_lambda)) if objective == 'revenue' else float('nan'),
+        budget=budget,
+        target_cpa=target_cpa,
+        binding=binding
+    )
+
+
+def submit_optimization(curves: ResponseCurves, budget: float, **kwargs) -> Future:
+    """最適化をバックグラウンドスレッドで実行し、Futureを返す"""
+    return _executor.submit(solve_allocation, curves, budget, **kwargs)
+
+
+def simulate_ad_group_history(n_groups: int = 2000, days: int = 28, platforms: Sequence[str] = (),
+                              seed: Optional[int] = 42) -> pd.DataFrame:
+    """デモ用の広告グループ別・日別の支出とコンバージョンの履歴を生成"""
+    rng = np.random.default_rng(seed)
+    platforms = list(platforms) or ['Google Ads', 'Facebook Ads', 'Instagram Ads', 'LinkedIn Ads', 'Twitter Ads']
+    elasticity = rng.uniform(0.3, 0.8, n_groups)
+    base_spend = rng.lognormal(np.log(3000), 0.8, n_groups)
+    base_cpa = rng.lognormal(np.log(4500), 0.5, n_groups)
+    scale = base_spend / base_cpa / np.power(base_spend, elasticity)
+    value = rng.lognormal(np.log(12000), 0.4, n_groups)
+
+    spend = base_spend[None, :] * rng.lognormal(0, 0.35, (days, n_groups))
+    conversions = rng.poisson(scale * np.power(spend, elasticity))
+    revenue = conversions * value * rng.uniform(0.8, 1.2, (days, n_groups))
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq='D')
+    return pd.DataFrame({
+        'date': np.repeat(dates, n_groups),
+        'group_id': np.tile([f"ag_{i:05d}" for i in range(n_groups)], days),
+        'platform': np.tile(rng.choice(platforms, n_groups), days),
+        'spend': spend.ravel(),
+        'conversions': conversions.ravel(),
+        'revenue': revenue.ravel()
+    })
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+クロスプラットフォーム予算配分
+プラットフォーム別の支出→コンバージョンの履歴から逓減型の反応曲線を推定し、
+上下限・ペーシング制約の下で目的（売上/コンバージョン）を最大化する日予算の配分を求める
+"""
+
+import logging
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bid_optimizer import ResponseCurves, fit_response_curves, solve_allocation
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 配分の目的
+BUDGET_OBJECTIVES = ('revenue', 'conversions')
+
+# 評価する候補配分の数（最適解の検証と、配分ごとの成果分布の可視化に使用）
+DEFAULT_CANDIDATES = 5000
+
+# 候補配分を予算合計・上下限に射影する二分探索の反復回数
+PROJECTION_ITERATIONS = 50
+
+# 1日あたりの支出変更率の上限（ペーシング）のデフォルト
+DEFAULT_MAX_DAILY_CHANGE = 0.3
+
+# デモ用の履歴を生成するプラットフォーム別の想定値（日予算, 日予算時のCPA, 弾力性, 平均注文額, CPC, CTR）
+SIMULATED_PLATFORM_PROFILES = {
+    'Google Ads': (32000.0, 2200.0, 0.55, 8500.0, 450.0, 0.042),
+    'Facebook Ads': (21000.0, 1800.0, 0.65, 7000.0, 330.0, 0.034),
+    'Instagram Ads': (15000.0, 2000.0, 0.60, 6500.0, 380.0, 0.039),
+    'LinkedIn Ads': (10000.0, 6000.0, 0.45, 24000.0, 1500.0, 0.019),
+    'Twitter Ads': (7000.0, 2800.0, 0.40, 6000.0, 700.0, 0.025),
+    'TikTok Ads': (12000.0, 1500.0, 0.70, 5500.0, 260.0, 0.058)
+}
+
+
+@dataclass
+class BudgetConstraints:
+    """配分の制約（プラットフォーム別の上下限と、現在の支出からの1日あたりの変更率の上限）"""
+    min_spend: Optional[Dict[str, float]] = None
+    max_spend: Optional[Dict[str, float]] = None
+    min_share: float = 0.0
+    max_share: float = 1.0
+    max_daily_change: Optional[float] = DEFAULT_MAX_DAILY_CHANGE
+
+    def bounds(self, curves: ResponseCurves, budget: float) -> Tuple[np.ndarray, np.ndarray]:
+        """プラットフォーム別の支出の下限・上限"""
+        platforms = curves.group_ids
+        lower = np.full(len(platforms), budget * self.min_share)
+        upper = np.full(len(platforms), budget * self.max_share)
+        if self.max_daily_change is not None:
+            lower = np.maximum(lower, curves.current_spend * (1 - self.max_daily_change))
+            upper = np.minimum(upper, curves.current_spend * (1 + self.max_daily_change))
+        if self.min_spend:
+            lower = np.maximum(lower, [self.min_spend.get(p, 0.0) for p in platforms])
+        if self.max_spend:
+            upper = np.minimum(upper, [self.max_spend.get(p, np.inf) for p in platforms])
+        return lower, np.maximum(upper, lower)
+
+
+@dataclass
+class BudgetAllocation:
+    """最適化された日予算の配分と、評価した候補配分の成果"""
+    platforms: np.ndarray
+    current_spend: np.ndarray
+    recommended_spend: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    expected_conversions: np.ndarray
+    expected_revenue: np.ndarray
+    current_conversions: np.ndarray
+    current_revenue: np.ndarray
+    marginal_roas: np.ndarray
+    budget: float
+    objective: str
+    binding: str
+    candidate_spend: np.ndarray
+    candidate_conversions: np.ndarray
+    candidate_revenue: np.ndarray
+
+    def to_frame(self) -> pd.DataFrame:
+        """プラットフォーム別の配分表"""
+        return pd.DataFrame({
+            'platform': self.platforms,
+            'current_spend': self.current_spend,
+            'recommended_spend': self.recommended_spend,
+            'change': np.divide(self.recommended_spend - self.current_spend, self.current_spend,
+                                out=np.zeros(len(self.platforms)), where=self.current_spend > 0),
+            'share': self.recommended_spend / self.recommended_spend.sum() if self.recommended_spend.sum() > 0 else 0.0,
+            'expected_conversions': self.expected_conversions,
+            'expected_revenue': self.expected_revenue,
+            'marginal_roas': self.marginal_roas
+        })
+
+    def totals(self) -> Dict[str, float]:
+        """現状と推奨配分の合計指標"""
+        current_spend = float(self.current_spend.sum())
+        spend = float(self.recommended_spend.sum())
+        conversions = float(self.expected_conversions.sum())
+        revenue = float(self.expected_revenue.sum())
+        current_conversions = float(self.current_conversions.sum())
+        current_revenue = float(self.current_revenue.sum())
+        return {
+            'current_spend': current_spend,
+            'recommended_spend': spend,
+            'current_conversions': current_conversions,
+            'expected_conversions': conversions,
+            'current_revenue': current_revenue,
+            'expected_revenue': revenue,
+            'current_roas': current_revenue / current_spend if current_spend > 0 else 0.0,
+            'expected_roas': revenue / spend if spend > 0 else 0.0,
+            'expected_cpa': spend / conversions if conversions > 0 else 0.0,
+            'candidates': len(self.candidate_spend),
+            'candidate_percentile': float((self._candidate_scores() <= self._score(conversions, revenue)).mean() * 100)
+            if len(self.candidate_spend) else 100.0
+        }
+
+    def _score(self, conversions, revenue):
+        return revenue if self.objective == 'revenue' else conversions
+
+    def _candidate_scores(self) -> np.ndarray:
+        return self._score(self.candidate_conversions, self.candidate_revenue)
+
+
+def fit_platform_curves(history: pd.DataFrame, recent_days: int = 7) -> ResponseCurves:
+    """日別・プラットフォーム別の支出とコンバージョンの履歴から反応曲線を推定"""
+    return fit_response_curves(history, group_col='platform', platform_col='platform', spend_col='spend',
+                               conversions_col='conversions', revenue_col='revenue', recent_days=recent_days)
+
+
+def evaluate_allocations(curves: ResponseCurves, spend: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """候補配分（候補×プラットフォーム）ごとの期待コンバージョンと期待売上をまとめて計算"""
+    spend = np.atleast_2d(spend)
+    conversions = curves.scale * np.power(np.maximum(spend, 0.0), curves.elasticity)
+    return conversions.sum(axis=1), (conversions * curves.value_per_conversion).sum(axis=1)
+
+
+def project_to_budget(spend: np.ndarray, budget: float, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """候補配分を上下限内で合計が予算に等しくなるよう、候補ごとに一律の加減額を二分探索して射影"""
+    spend = np.atleast_2d(spend)
+    lo = np.full(len(spend), -budget - spend.max(initial=0.0))
+    hi = np.full(len(spend), budget + upper[np.isfinite(upper)].sum(initial=0.0))
+    for _ in range(PROJECTION_ITERATIONS):
+        mid = (lo + hi) / 2
+        over = np.clip(spend + mid[:, None], lower, upper).sum(axis=1) > budget
+        hi = np.where(over, mid, hi)
+        lo = np.where(over, lo, mid)
+    return np.clip(spend + lo[:, None], lower, upper)
+
+
+def optimize_budget(curves: ResponseCurves, budget: float, constraints: Optional[BudgetConstraints] = None,
+                    objective: str = 'revenue', n_candidates: int = DEFAULT_CANDIDATES,
+                    seed: Optional[int] = 0) -> BudgetAllocation:
+    """制約下で目的を最大化する日予算の配分を求め、候補配分の一括評価で検証"""
+    if objective not in BUDGET_OBJECTIVES:
+        raise ValueError(f"未対応の目的です: {objective}")
+    constraints = constraints or BudgetConstraints()
+    lower, upper = constraints.bounds(curves, budget)
+    if lower.sum() > budget:
+        logger.warning("下限の合計が予算を超えています。下限を予算に合わせて縮小します")
+        lower = lower * budget / lower.sum()
+    if upper.sum() < budget:
+        logger.warning("上限の合計が予算に届きません。上限まで配分します")
+
+    # 限界価値を均等化する解析解（反応曲線は凹なので上下限付きでも最適）
+    bounded = replace(curves, min_spend=lower, max_spend=upper)
+    # プラットフォーム単位の配分のため入札変更幅による制限は掛けず、制約の上下限のみを使う
+    plan = solve_allocation(bounded, budget, max_bid_adjustment=None, objective=objective)
+    best = plan.recommended_spend
+    binding = plan.binding
+
+    # 解の近傍と実行可能領域全体から候補を生成して一括評価（最適性の確認と成果分布の可視化）
+    rng = np.random.default_rng(seed)
+    n_local = n_candidates // 2
+    local = best[None, :] * rng.lognormal(0, 0.15, (n_local, len(best)))
+    shares = rng.dirichlet(np.ones(len(best)), n_candidates - n_local)
+    candidates = project_to_budget(np.vstack([local, shares * budget]), budget, lower, upper)
+    conversions, revenue = evaluate_allocations(curves, candidates)
+    scores = revenue if objective == 'revenue' else conversions
+
+    best_conversions, best_revenue = evaluate_allocations(curves, best)
+    best_score = best_revenue[0] if objective == 'revenue' else best_conversions[0]
+    if len(scores) and scores.max() > best_score * (1 + 1e-9):
+        logger.info("候補配分の方が解析解より良い成果でした。候補配分を採用します")
+        best = candidates[int(scores.argmax())]
+        binding = 'candidate_search'
+
+    current = curves.current_spend
+    expected_conversions = curves.conversions(best)
+    current_conversions = curves.conversions(current)
+    return BudgetAllocation(
+        platforms=curves.group_ids,
+        current_spend=current,
+        recommended_spend=best,
+        lower=lower,
+        upper=upper,
+        expected_conversions=expected_conversions,
+        expected_revenue=expected_conversions * curves.value_per_conversion,
+        current_conversions=current_conversions,
+        current_revenue=current_conversions * curves.value_per_conversion,
+        marginal_roas=curves.marginal_roas(best),
+        budget=budget,
+        objective=objective,
+        binding=binding,
+        candidate_spend=candidates,
+        candidate_conversions=conversions,
+        candidate_revenue=revenue
+    )
+
+
+def simulate_platform_history(profiles: Optional[Dict[str, Tuple[float, ...]]] = None, days: int = 90,
+                              seed: Optional[int] = 42) -> pd.DataFrame:
+    """デモ用のプラットフォーム別・日別の支出と成果の履歴を生成（予算テストによる支出の変動を含む）"""
+    profiles = profiles or SIMULATED_PLATFORM_PROFILES
+    rng = np.random.default_rng(seed)
+    names = list(profiles)
+    base_spend, base_cpa, elasticity, order_value, cpc, ctr = (np.array(v) for v in zip(*profiles.values()))
+    scale = base_spend / base_cpa / np.power(base_spend, elasticity)
+
+    spend = base_spend[None, :] * rng.lognormal(0, 0.3, (days, len(names)))
+    conversions = rng.poisson(scale * np.power(spend, elasticity))
+    clicks = rng.poisson(spend / cpc)
+    impressions = rng.poisson(clicks / ctr)
+    revenue = conversions * order_value * rng.uniform(0.8, 1.2, conversions.shape)
+    dates = pd.date_range(end=pd.Timestamp.now().normalize() - pd.Timedelta(days=1), periods=days, freq='D')
+    return pd.DataFrame({
+        'date': np.repeat(dates, len(names)),
+        'platform': np.tile(names, days),
+        'spend': spend.ravel(),
+        'impressions': impressions.ravel(),
+        'clicks': clicks.ravel(),
+        'conversions': conversions.ravel(),
+        'revenue': revenue.ravel()
+    })
+
+
+def platform_summary(history: pd.DataFrame, recent_days: int = 7) -> Dict[str, Dict[str, float]]:
+    """直近の日平均の指標（支出・件数・CTR・CPC・CPA・ROAS）をプラットフォーム別に集計"""
+    dates = pd.to_datetime(history['date'])
+    recent = history[dates >= dates.max() - pd.Timedelta(days=recent_days - 1)]
+    totals = recent.groupby('platform')[['spend', 'impressions', 'clicks', 'conversions', 'revenue']].sum()
+    days = recent.groupby('platform')['date'].nunique()
+    summary = {}
+    for platform, row in totals.iterrows():
+        summary[platform] = {
+            'daily_spend': row['spend'] / days[platform],
+            'impressions': int(row['impressions'] / days[platform]),
+            'clicks': int(row['clicks'] / days[platform]),
+            'conversions': int(row['conversions'] / days[platform]),
+            'ctr': row['clicks'] / row['impressions'] * 100 if row['impressions'] > 0 else 0.0,
+            'cpc': row['spend'] / row['clicks'] if row['clicks'] > 0 else 0.0,
+            'cpa': row['spend'] / row['conversions'] if row['conversions'] > 0 else 0.0,
+            'roas': row['revenue'] / row['spend'] if row['spend'] > 0 else 0.0
+        }
+    return summary
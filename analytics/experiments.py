@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+実験（A/B・多変量テスト）エンジン
+バリアント別の十分統計量をインクリメンタルに積み上げ、常時有効な逐次検定（mSPRT）と
+ベータ二項モデルのベイズ事後分布で継続モニタリング
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 実験状態のスナップショットファイル（環境変数で上書き可能）
+DEFAULT_EXPERIMENT_STATE_PATH = os.getenv(
+    "EXPERIMENT_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "experiments.json")
+)
+
+# mSPRTの混合分布（効果量の事前分布）の標準偏差（コンバージョン率の差の絶対値）
+DEFAULT_MIXING_SD = 0.01
+
+# ベータ事前分布のパラメータ（一様分布）
+PRIOR_ALPHA = 1.0
+PRIOR_BETA = 1.0
+
+# 常時有効p値の更新を始める各バリアントの最小訪問者数
+MIN_MONITOR_VISITORS = 100
+
+# 事後分布のモンテカルロサンプル数
+POSTERIOR_DRAWS = 20000
+
+# スナップショットを保存する最短間隔（秒）
+SNAPSHOT_INTERVAL_SECONDS = 30.0
+
+
+def msprt_statistics(rate_diff: np.ndarray, variance: np.ndarray, mixing_sd: float, alpha: float) -> Dict[str, np.ndarray]:
+    """正規混合mSPRTの尤度比と常時有効な信頼区間の半幅を算出"""
+    tau2 = mixing_sd ** 2
+    v = np.maximum(variance, 1e-18)
+    log_lr = 0.5 * np.log(v / (v + tau2)) + tau2 * rate_diff ** 2 / (2 * v * (v + tau2))
+    half_width = np.sqrt(v * (v + tau2) / tau2 * (2 * np.log(1 / alpha) + np.log((v + tau2) / v)))
+    return {
+        "p_value": np.minimum(1.0, np.exp(-log_lr)),
+        "half_width": half_width
+    }
+
+
+class Experiment:
+    """バリアント別の十分統計量（訪問者数・コンバージョン数・収益）を保持する実験"""
+
+    def __init__(self, experiment_id: str, variants: Sequence[str], alpha: float = 0.05,
+                 mixing_sd: float = DEFAULT_MIXING_SD, control: int = 0):
+        if len(variants) < 2:
+            raise ValueError("バリアントは2つ以上必要です")
+        self.experiment_id = experiment_id
+        self.variants = list(variants)
+        self.alpha = alpha
+        self.mixing_sd = mixing_sd
+        self.control = control
+        k = len(self.variants)
+        self.visitors = np.zeros(k)
+        self.conversions = np.zeros(k)
+        self.revenue = np.zeros(k)
+        self.revenue_sq = np.zeros(k)
+        self.daily: Dict[str, np.ndarray] = {}
+        # 逐次検定のp値は観測ごとの最小値を保持（常時有効p値）
+        self.running_p = np.ones(k)
+        self.version = 0
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Any] = {}
+
+    def _variant_codes(self, variant) -> np.ndarray:
+        """バリアント名またはインデックスの配列をインデックスに変換"""
+        values = np.atleast_1d(np.asarray(variant))
+        if values.dtype.kind in 'iu':
+            codes = values.astype(np.int64)
+        else:
+            codes = pd.Categorical(values.astype(object), categories=self.variants).codes.astype(np.int64)
+        if (codes < 0).any() or (codes >= len(self.variants)).any():
+            raise ValueError("未知のバリアントが含まれています")
+        return codes
+
+    def record(self, variant, converted, revenue=None, timestamp: Optional[datetime] = None) -> None:
+        """訪問単位のイベントを一括で取り込む（variant・converted・revenueは同じ長さの配列）"""
+        codes = self._variant_codes(variant)
+        converted = np.broadcast_to(np.asarray(converted, dtype=np.float64), codes.shape)
+        revenue = np.zeros(codes.shape) if revenue is None else np.broadcast_to(np.asarray(revenue, dtype=np.float64), codes.shape)
+        k = len(self.variants)
+        self.record_totals(
+            np.bincount(codes, minlength=k),
+            np.bincount(codes, weights=converted, minlength=k),
+            np.bincount(codes, weights=revenue, minlength=k),
+            day=(timestamp or datetime.now()).date(),
+            revenue_sq=np.bincount(codes, weights=revenue ** 2, minlength=k)
+        )
+
+    def record_totals(self, visitors, conversions, revenue=None, day: Optional[date] = None, revenue_sq=None) -> None:
+        """バリアント別の集計値を取り込む（各引数はバリアント数の長さの配列）"""
+        k = len(self.variants)
+        visitors = np.asarray(visitors, dtype=np.float64).reshape(k)
+        conversions = np.asarray(conversions, dtype=np.float64).reshape(k)
+        revenue = np.zeros(k) if revenue is None else np.asarray(revenue, dtype=np.float64).reshape(k)
+        if revenue_sq is None:
+            # 集計値のみの場合はコンバージョンごとの平均収益で近似
+            revenue_sq = np.divide(revenue ** 2, conversions, out=np.zeros(k), where=conversions > 0)
+        key = (day or date.today()).isoformat()
+
+        with self._lock:
+            self.visitors += visitors
+            self.conversions += conversions
+            self.revenue += revenue
+            self.revenue_sq += np.asarray(revenue_sq, dtype=np.float64).reshape(k)
+            daily = self.daily.setdefault(key, np.zeros((3, k)))
+            daily += np.stack([visitors, conversions, revenue])
+            self._monitor()
+            self.version += 1
+            self._cache.clear()
+
+    def _monitor(self) -> None:
+        """観測の追加ごとに常時有効p値を更新（ロック取得済みで呼ぶ）"""
+        rates, variance = self._rates()
+        c = self.control
+        diff = rates - rates[c]
+        total_variance = variance + variance[c]
+        # 少数の観測では分散の推定が不安定で、一度0になったp値が戻らないため更新しない
+        observed = (self.visitors >= MIN_MONITOR_VISITORS) & (self.visitors[c] >= MIN_MONITOR_VISITORS)
+        p = msprt_statistics(diff, total_variance, self.mixing_sd, self.alpha)["p_value"]
+        self.running_p = np.where(observed, np.minimum(self.running_p, p), self.running_p)
+        self.running_p[c] = 1.0
+
+    def _rates(self):
+        """コンバージョン率とその分散を算出（分散はベータ事後分布の分散で、率が0や1でも0にならない）"""
+        rates = np.divide(self.conversions, self.visitors, out=np.zeros(len(self.variants)), where=self.visitors > 0)
+        a = PRIOR_ALPHA + self.conversions
+        b = PRIOR_BETA + self.visitors - self.conversions
+        variance = a * b / ((a + b) ** 2 * (a + b + 1))
+        return rates, variance
+
+    def sequential_test(self) -> List[Dict[str, Any]]:
+        """コントロールに対する各バリアントの常時有効な逐次検定結果（多重比較はボンフェローニ補正）"""
+        with self._lock:
+            rates, variance = self._rates()
+            c = self.control
+            comparisons = max(len(self.variants) - 1, 1)
+            alpha = self.alpha / comparisons
+            diff = rates - rates[c]
+            total_variance = variance + variance[c]
+            half_width = msprt_statistics(diff, total_variance, self.mixing_sd, alpha)["half_width"]
+            adjusted_p = np.minimum(1.0, self.running_p * comparisons)
+
+            # 固定サンプル前提のz値・検出力（参考値）
+            se = np.sqrt(total_variance)
+            z = np.divide(diff, se, out=np.zeros_like(diff), where=se > 0)
+            z_critical = stats.norm.ppf(1 - alpha / 2)
+            power = stats.norm.cdf(np.abs(z) - z_critical)
+
+            results = []
+            for j, name in enumerate(self.variants):
+                if j == c:
+                    continue
+                results.append({
+                    "variant": name,
+                    "rate": float(rates[j]),
+                    "control_rate": float(rates[c]),
+                    "lift": float(diff[j] / rates[c] * 100) if rates[c] > 0 else 0.0,
+                    "p_value": float(adjusted_p[j]),
+                    "is_significant": bool(adjusted_p[j] < self.alpha),
+                    "confidence_interval": (float((diff[j] - half_width[j]) * 100), float((diff[j] + half_width[j]) * 100)),
+                    "z_score": float(z[j]),
+                    "power": float(power[j])
+                })
+            return results
+
+    def posterior(self, draws: int = POSTERIOR_DRAWS, seed: Optional[int] = 0) -> Dict[str, Any]:
+        """ベータ二項モデルの事後分布をまとめてサンプリングし、最良確率・期待損失を算出"""
+        with self._lock:
+            a = PRIOR_ALPHA + self.conversions
+            b = PRIOR_BETA + self.visitors - self.conversions
+        rng = np.random.default_rng(seed)
+        samples = rng.beta(a, b, size=(draws, len(self.variants)))
+        best = samples.max(axis=1)
+        winners = np.bincount(samples.argmax(axis=1), minlength=len(self.variants))
+        lower, upper = stats.beta.ppf([[self.alpha / 2], [1 - self.alpha / 2]], a, b)
+        return {
+            "mean": a / (a + b),
+            "credible_interval": np.stack([lower, upper], axis=1),
+            "prob_best": winners / draws,
+            "prob_beat_control": (samples > samples[:, [self.control]]).mean(axis=0),
+            "expected_loss": (best[:, None] - samples).mean(axis=0)
+        }
+
+    def analyze(self) -> Dict[str, Any]:
+        """逐次検定とベイズ評価をまとめた結果を取得（データが増えるまでキャッシュ）"""
+        with self._lock:
+            cached = self._cache.get("analysis")
+            if cached is not None:
+                return cached
+            version = self.version
+        posterior = self.posterior()
+        analysis = {
+            "version": version,
+            "variants": [
+                {
+                    "name": name,
+                    "visitors": int(self.visitors[j]),
+                    "conversions": int(self.conversions[j]),
+                    "revenue": float(self.revenue[j]),
+                    "posterior_mean": float(posterior["mean"][j]),
+                    "credible_interval": tuple(float(x) for x in posterior["credible_interval"][j]),
+                    "prob_best": float(posterior["prob_best"][j]),
+                    "prob_beat_control": float(posterior["prob_beat_control"][j]),
+                    "expected_loss": float(posterior["expected_loss"][j])
+                }
+                for j, name in enumerate(self.variants)
+            ],
+            "comparisons": self.sequential_test()
+        }
+        with self._lock:
+            if self.version == version:
+                self._cache["analysis"] = analysis
+        return analysis
+
+    def daily_frame(self) -> pd.DataFrame:
+        """日別・バリアント別の集計をDataFrameで取得"""
+        with self._lock:
+            days = sorted(self.daily)
+            values = np.stack([self.daily[d] for d in days]) if days else np.zeros((0, 3, len(self.variants)))
+        k = len(self.variants)
+        df = pd.DataFrame({
+            'date': pd.to_datetime(np.repeat(days, k)),
+            'variant': np.tile(self.variants, len(days)),
+            'visitors': values[:, 0, :].ravel().astype(np.int64),
+            'conversions': values[:, 1, :].ravel().astype(np.int64),
+            'revenue': values[:, 2, :].ravel()
+        })
+        df['conversion_rate'] = np.divide(df['conversions'], df['visitors'], out=np.zeros(len(df)), where=df['visitors'] > 0)
+        return df
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "experiment_id": self.experiment_id,
+                "variants": self.variants,
+                "alpha": self.alpha,
+                "mixing_sd": self.mixing_sd,
+                "control": self.control,
+                "visitors": self.visitors.tolist(),
+                "conversions": self.conversions.tolist(),
+                "revenue": self.revenue.tolist(),
+                "revenue_sq": self.revenue_sq.tolist(),
+                "running_p": self.running_p.tolist(),
+                "daily": {d: v.tolist() for d, v in self.daily.items()}
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Experiment':
+        experiment = cls(data["experiment_id"], data["variants"], data["alpha"], data["mixing_sd"], data["control"])
+        experiment.visitors = np.asarray(data["visitors"], dtype=np.float64)
+        experiment.conversions = np.asarray(data["conversions"], dtype=np.float64)
+        experiment.revenue = np.asarray(data["revenue"], dtype=np.float64)
+        experiment.revenue_sq = np.asarray(data["revenue_sq"], dtype=np.float64)
+        experiment.running_p = np.asarray(data["running_p"], dtype=np.float64)
+        experiment.daily = {d: np.asarray(v, dtype=np.float64) for d, v in data["daily"].items()}
+        return experiment
+
+
+class ExperimentRegistry:
+    """同時実行中の実験を管理し、定期的にスナップショットを保存"""
+
+    def __init__(self, snapshot_path: Optional[str] = DEFAULT_EXPERIMENT_STATE_PATH,
+                 snapshot_interval: float = SNAPSHOT_INTERVAL_SECONDS):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._experiments: Dict[str, Experiment] = {}
+        self._lock = threading.Lock()
+        self._last_snapshot = 0.0
+        if snapshot_path:
+            self.load()
+
+    def create(self, experiment_id: str, variants: Sequence[str], alpha: float = 0.05,
+               mixing_sd: float = DEFAULT_MIXING_SD) -> Experiment:
+        """実験を登録（同じIDが既にあればそれを返す）"""
+        with self._lock:
+            experiment = self._experiments.get(experiment_id)
+            if experiment is None:
+                experiment = Experiment(experiment_id, variants, alpha=alpha, mixing_sd=mixing_sd)
+                self._experiments[experiment_id] = experiment
+        self._maybe_save(force=True)
+        return experiment
+
+    def get(self, experiment_id: str) -> Optional[Experiment]:
+        return self._experiments.get(experiment_id)
+
+    def remove(self, experiment_id: str) -> None:
+        with self._lock:
+            self._experiments.pop(experiment_id, None)
+        self._maybe_save(force=True)
+
+    def record(self, experiment_id: str, variant, converted, revenue=None, timestamp: Optional[datetime] = None) -> None:
+        """イベントを実験に取り込む"""
+        experiment = self._experiments.get(experiment_id)
+        if experiment is None:
+            raise KeyError(f"実験が見つかりません: {experiment_id}")
+        experiment.record(variant, converted, revenue, timestamp)
+        self._maybe_save()
+
+    def analyze_all(self) -> Dict[str, Dict[str, Any]]:
+        """全実験の評価結果を取得（変化のない実験はキャッシュを返す）"""
+        return {experiment_id: experiment.analyze() for experiment_id, experiment in list(self._experiments.items())}
+
+    def _maybe_save(self, force: bool = False) -> None:
+        """前回保存から一定時間経過していればスナップショットを保存"""
+        if not self.snapshot_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_snapshot < self.snapshot_interval:
+            return
+        self._last_snapshot = now
+        self.save()
+
+    def save(self) -> None:
+        """全実験をアトミックに保存"""
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({eid: e.to_dict() for eid, e in list(self._experiments.items())}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.error(f"実験状態の保存エラー: {e}")
+
+    def load(self) -> None:
+        """保存済みの実験を読み込む"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._experiments = {eid: Experiment.from_dict(d) for eid, d in data.items()}
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"実験状態の読み込みエラー: {e}")
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+時系列予測サービス
+指標×プラットフォームなどの系列ごとに減衰トレンド付き加法型Holt-Winters（週次/日次の季節性）を一括で推定し、
+新しいデータ点が届くたびに状態を差分更新して、全系列の予測と予測区間をまとめて計算
+"""
+
+import threading
+import logging
+import warnings
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 平滑化パラメータの候補（level, trend, season）。最後の候補は季節ナイーブ法と同等
+SMOOTHING_GRID = np.array(
+    [(a, b, g) for a in (0.05, 0.2, 0.5) for b in (0.0, 0.02, 0.1) for g in (0.05, 0.2, 0.5)] + [(0.0, 0.0, 1.0)]
+)
+SEASONAL_NAIVE = len(SMOOTHING_GRID) - 1
+
+# トレンドの減衰係数（遠い将来ほどトレンドの寄与を弱め、長期予測での過大な外挿を防ぐ）
+TREND_DAMPING = 0.9
+
+# Holt-Wintersを推定するのに必要な季節周期の数（不足する系列は季節ナイーブ法で予測）
+MIN_SEASONS_FOR_FIT = 2
+
+# パラメータの再推定に使う履歴の長さ（季節周期の数）
+HISTORY_SEASONS = 8
+
+# 予測結果のキャッシュ上限件数
+MAX_CACHED_FORECASTS = 32
+
+
+@dataclass
+class ForecastResult:
+    """全系列の予測値と予測区間（各配列は 系列×予測期間）"""
+    keys: List[Tuple]
+    periods: np.ndarray
+    period_seconds: int
+    mean: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    seasonal: np.ndarray
+    method: np.ndarray
+    accuracy: np.ndarray
+
+    def times(self) -> List[datetime]:
+        """予測期間の開始時刻"""
+        return list(pd.to_datetime(self.periods * self.period_seconds, unit='s'))
+
+    def index(self, key: Tuple) -> int:
+        return self.keys.index(tuple(key))
+
+    def series(self, key: Tuple) -> pd.DataFrame:
+        """1系列の予測表（time, forecast, lower, upper）"""
+        i = self.index(key)
+        return pd.DataFrame({
+            'time': self.times(),
+            'forecast': self.mean[i],
+            'lower': self.lower[i],
+            'upper': self.upper[i]
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """全系列の予測を縦持ちで取得"""
+        n, horizon = self.mean.shape
+        keys = np.empty(n, dtype=object)
+        keys[:] = self.keys
+        return pd.DataFrame({
+            'key': np.repeat(keys, horizon),
+            'time': np.tile(self.times(), n),
+            'forecast': self.mean.ravel(),
+            'lower': self.lower.ravel(),
+            'upper': self.upper.ravel()
+        })
+
+
+def _recursion(values: np.ndarray, first_period: int, season_length: int, params: np.ndarray,
+               level: np.ndarray, trend: np.ndarray, season: np.ndarray):
+    """誤差修正形式の減衰トレンド付きHolt-Winters漸化式を全系列・全候補パラメータでまとめて実行
+
+    values: 系列×期間（欠損はNaN）、params: (..., 3)、状態は params の先頭次元に合わせてブロードキャスト
+    状態はその場で更新し、1期先予測誤差（系列×期間、欠損は0）を返す
+    """
+    alpha, beta, gamma = params[..., 0], params[..., 1], params[..., 2]
+    errors = np.zeros(level.shape + (values.shape[-1],))
+    for t in range(values.shape[-1]):
+        phase = (first_period + t) % season_length
+        y = values[..., t]
+        damped = TREND_DAMPING * trend
+        err = np.nan_to_num(y - (level + damped + season[..., phase]))
+        level += damped + alpha * err
+        trend[...] = damped + beta * err
+        season[..., phase] += gamma * err
+        errors[..., t] = err
+    return errors
+
+
+class ForecastBank:
+    """周期（時間/日）と季節周期を共有する系列群の予測モデル"""
+
+    def __init__(self, season_length: int, period_seconds: int, history_seasons: int = HISTORY_SEASONS,
+                 nonnegative: bool = True):
+        self.season_length = season_length
+        self.period_seconds = period_seconds
+        self.history_length = season_length * history_seasons
+        self.nonnegative = nonnegative
+        self.keys: List[Tuple] = []
+        self._index: Dict[Tuple, int] = {}
+        self.last_period: Optional[int] = None
+        self.version = 0
+
+        m = season_length
+        self.params = np.empty((0, 3))
+        self.method = np.empty(0, dtype=object)
+        self.level = np.empty(0)
+        self.trend = np.empty(0)
+        self.season = np.empty((0, m))
+        self.history = np.empty((0, self.history_length))
+        self._sq_error = np.empty(0)
+        self._abs_error = np.empty(0)
+        self._abs_actual = np.empty(0)
+        self._n_errors = np.empty(0)
+        self._since_fit = 0
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple, ForecastResult] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def sync(self, keys: Sequence[Tuple], periods: np.ndarray, values: np.ndarray) -> int:
+        """系列×期間の観測値を反映（既知の系列は新しい期間だけ差分更新、新しい系列は推定）し、更新した期間数を返す"""
+        keys = [tuple(k) for k in keys]
+        periods = np.asarray(periods, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if not len(periods) or not keys:
+            return 0
+
+        # 連続した期間の行列に並べ替える（抜けた期間は欠損）
+        first, last = int(periods.min()), int(periods.max())
+        dense = np.full((len(keys), last - first + 1), np.nan)
+        dense[:, periods - first] = values
+
+        with self._lock:
+            new_rows = [i for i, key in enumerate(keys) if key not in self._index]
+            known_rows = [i for i, key in enumerate(keys) if key in self._index]
+            updated = 0
+
+            if self.last_period is not None and last > self.last_period and len(self.keys):
+                # 既知の系列は前回の最終期間の次から差分更新（今回与えられなかった系列は欠損として状態だけ進める）
+                start = self.last_period + 1
+                block = np.full((len(self.keys), last - start + 1), np.nan)
+                if known_rows:
+                    targets = np.array([self._index[keys[i]] for i in known_rows])
+                    offset = max(start - first, 0)
+                    block[targets, block.shape[1] - (dense.shape[1] - offset):] = dense[known_rows, offset:]
+                self._update(block, start)
+                updated = block.shape[1]
+
+            if new_rows:
+                self._add_series([keys[i] for i in new_rows], dense[new_rows], first)
+                updated = max(updated, dense.shape[1])
+
+            if updated:
+                self.version += 1
+                self._cache.clear()
+            return updated
+
+    def sync_frame(self, frame: pd.DataFrame, time_col: str, key_cols: Sequence[str],
+                   value_cols: Sequence[str]) -> int:
+        """縦持ちのデータ（時刻・キー列・指標列）を反映。系列キーは (指標名, *キー列の値)"""
+        if frame is None or len(frame) == 0:
+            return 0
+        seconds = pd.to_datetime(frame[time_col]).to_numpy(dtype='datetime64[s]').astype(np.int64)
+        periods, period_index = np.unique(seconds // self.period_seconds, return_inverse=True)
+        if key_cols:
+            group_keys = list(zip(*(frame[c].astype(str).to_numpy() for c in key_cols)))
+        else:
+            group_keys = [()] * len(frame)
+        groups, group_index = np.unique(np.array([' \x1f '.join(k) for k in group_keys], dtype=object),
+                                        return_inverse=True)
+        first_rows = np.unique(group_index, return_index=True)[1]
+
+        keys, blocks = [], []
+        for col in value_cols:
+            block = np.full((len(groups), len(periods)), np.nan)
+            block[group_index, period_index] = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=np.float64)
+            keys.extend((col,) + tuple(group_keys[r]) for r in first_rows)
+            blocks.append(block)
+        return self.sync(keys, periods, np.vstack(blocks))
+
+    def _add_series(self, keys: List[Tuple], values: np.ndarray, first_period: int) -> None:
+        """新しい系列を推定して追加し、既存系列と同じ最終期間に揃える（ロック取得済みで呼ぶ）"""
+        last_period = first_period + values.shape[1] - 1
+        if self.last_period is not None and last_period != self.last_period:
+            # 既存系列の最終期間に合わせて切り詰める・欠損で延長する
+            shift = self.last_period - last_period
+            if shift > 0:
+                values = np.concatenate([values, np.full((len(keys), shift), np.nan)], axis=1)
+            else:
+                values = values[:, :values.shape[1] + shift]
+            last_period = self.last_period
+
+        n = len(keys)
+        for j, key in enumerate(keys):
+            self._index[key] = len(self.keys) + j
+        self.keys.extend(keys)
+        history = np.full((n, self.history_length), np.nan)
+        tail = values[:, -self.history_length:]
+        history[:, self.history_length - tail.shape[1]:] = tail
+
+        self.history = np.concatenate([self.history, history])
+        self.params = np.concatenate([self.params, np.zeros((n, 3))])
+        self.method = np.concatenate([self.method, np.empty(n, dtype=object)])
+        self.level = np.concatenate([self.level, np.zeros(n)])
+        self.trend = np.concatenate([self.trend, np.zeros(n)])
+        self.season = np.concatenate([self.season, np.zeros((n, self.season_length))])
+        for name in ('_sq_error', '_abs_error', '_abs_actual', '_n_errors'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(n)]))
+        self.last_period = last_period
+
+        rows = np.arange(len(self.keys) - n, len(self.keys))
+        self._fit(rows, values, last_period - values.shape[1] + 1)
+
+    def _fit(self, rows: np.ndarray, values: np.ndarray, first_period: int) -> None:
+        """候補パラメータを一括で走らせ、1期先予測誤差が最小のものを系列ごとに選ぶ（ロック取得済みで呼ぶ）"""
+        m = self.season_length
+        n, length = values.shape
+        grid = SMOOTHING_GRID[:, None, :]
+        k = len(SMOOTHING_GRID)
+
+        # 初期状態: 最初の季節周期の平均を水準、2周期目との差をトレンド、平均からの偏差を季節成分とする
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            first_season = values[:, :m]
+            level0 = np.nan_to_num(np.nanmean(first_season, axis=1)) if first_season.size else np.zeros(n)
+            if length >= 2 * m:
+                second = np.nanmean(values[:, m:2 * m], axis=1)
+                trend0 = np.nan_to_num((second - level0) / m)
+            else:
+                trend0 = np.zeros(n)
+        season0 = np.zeros((n, m))
+        phases = (first_period + np.arange(min(m, length))) % m
+        season0[:, phases] = np.nan_to_num(first_season - level0[:, None])
+
+        level = np.broadcast_to(level0, (k, n)).copy()
+        trend = np.broadcast_to(trend0, (k, n)).copy()
+        trend[SEASONAL_NAIVE] = 0.0
+        season = np.broadcast_to(season0, (k, n, m)).copy()
+        errors = _recursion(values[None, :, :], first_period, m, grid, level, trend, season)
+
+        # 最初の季節周期は初期化に使ったため評価から除く
+        observed = ~np.isnan(values)
+        scored = observed.copy()
+        scored[:, :m] = False
+        sse = (errors ** 2 * scored[None]).sum(axis=2)
+        n_valid = observed.sum(axis=1)
+        best = np.where(n_valid >= MIN_SEASONS_FOR_FIT * m, sse.argmin(axis=0), SEASONAL_NAIVE)
+
+        cols = np.arange(n)
+        chosen = errors[best, cols]
+        self.params[rows] = SMOOTHING_GRID[best]
+        self.method[rows] = np.where(best == SEASONAL_NAIVE, 'seasonal_naive', 'holt_winters')
+        self.level[rows] = level[best, cols]
+        self.trend[rows] = trend[best, cols]
+        self.season[rows] = season[best, cols]
+
+        n_scored = scored.sum(axis=1)
+        self._sq_error[rows] = (chosen ** 2 * scored).sum(axis=1)
+        self._abs_error[rows] = (np.abs(chosen) * scored).sum(axis=1)
+        self._abs_actual[rows] = np.abs(np.nan_to_num(values) * scored).sum(axis=1)
+        self._n_errors[rows] = n_scored
+        # 評価できる誤差がない系列は観測値のばらつきで代用
+        no_errors = rows[n_scored == 0]
+        if len(no_errors):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                spread = np.nan_to_num(np.nanstd(values[n_scored == 0], axis=1)) if values.shape[1] else 0.0
+            self._sq_error[no_errors] = spread ** 2
+            self._n_errors[no_errors] = 1.0
+        self._since_fit = 0
+
+    def _update(self, block: np.ndarray, first_period: int) -> None:
+        """全系列の状態を新しい期間ぶん進める（1期間あたり系列数に比例する計算量、ロック取得済みで呼ぶ）"""
+        errors = _recursion(block, first_period, self.season_length, self.params,
+                            self.level, self.trend, self.season)
+        observed = ~np.isnan(block)
+        self._sq_error += (errors ** 2).sum(axis=1)
+        self._abs_error += np.abs(errors).sum(axis=1)
+        self._abs_actual += np.abs(np.nan_to_num(block)).sum(axis=1)
+        self._n_errors += observed.sum(axis=1)
+        self.history = np.concatenate([self.history, block], axis=1)[:, -self.history_length:]
+        self.last_period = first_period + block.shape[1] - 1
+
+        # 季節周期ごとに直近の履歴でパラメータを選び直す
+        self._since_fit += block.shape[1]
+        if self._since_fit >= self.season_length:
+            self._refit()
+
+    def _refit(self) -> None:
+        """保持している直近の履歴から全系列のパラメータを再推定（ロック取得済みで呼ぶ）"""
+        if len(self.keys):
+            self._fit(np.arange(len(self.keys)), self.history, self.last_period - self.history_length + 1)
+
+    def refit(self) -> None:
+        """全系列のパラメータを再推定"""
+        with self._lock:
+            self._refit()
+            self.version += 1
+            self._cache.clear()
+
+    def forecast(self, horizon: int, confidence: float = 0.95) -> ForecastResult:
+        """全系列のhorizon期先までの予測値と予測区間をまとめて計算"""
+        with self._lock:
+            key = (self.version, horizon, confidence)
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+            m = self.season_length
+            steps = np.arange(1, horizon + 1)
+            periods = self.last_period + steps if self.last_period is not None else steps
+            phases = periods % m
+            seasonal = self.season[:, phases]
+            damping = np.cumsum(TREND_DAMPING ** steps)
+            mean = self.level[:, None] + self.trend[:, None] * damping + seasonal
+
+            # h期先の分散: σ²(1 + Σ_{j<h} (α + β(φ+…+φ^j) + γ·[j≡0 mod m])²)
+            alpha, beta, gamma = (self.params[:, i:i + 1] for i in range(3))
+            lags = steps[:-1]
+            c = alpha + damping[:-1] * beta + gamma * (lags % m == 0)
+            variance_factor = 1 + np.concatenate([np.zeros((len(self.keys), 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+            sigma2 = np.divide(self._sq_error, self._n_errors, out=np.zeros(len(self.keys)), where=self._n_errors > 0)
+            margin = stats.norm.ppf((1 + confidence) / 2) * np.sqrt(sigma2[:, None] * variance_factor)
+
+            lower, upper = mean - margin, mean + margin
+            if self.nonnegative:
+                mean, lower, upper = np.maximum(mean, 0), np.maximum(lower, 0), np.maximum(upper, 0)
+            wape = np.divide(self._abs_error, self._abs_actual, out=np.ones(len(self.keys)), where=self._abs_actual > 0)
+
+            result = ForecastResult(
+                keys=list(self.keys),
+                periods=np.asarray(periods),
+                period_seconds=self.period_seconds,
+                mean=mean,
+                lower=lower,
+                upper=upper,
+                seasonal=seasonal,
+                method=self.method.copy(),
+                accuracy=np.clip(1 - wape, 0, 1)
+            )
+            if len(self._cache) >= MAX_CACHED_FORECASTS:
+                self._cache.clear()
+            self._cache[key] = result
+            return result
+
+    def actuals(self, key: Tuple, periods: Optional[int] = None) -> pd.DataFrame:
+        """保持している直近の観測値（time, value）"""
+        with self._lock:
+            values = self.history[self._index[tuple(key)]]
+            last_period = self.last_period
+        if periods is not None:
+            values = values[-periods:]
+        starts = (np.arange(last_period - len(values) + 1, last_period + 1)) * self.period_seconds
+        df = pd.DataFrame({'time': pd.to_datetime(starts, unit='s'), 'value': values})
+        return df.dropna()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """系列ごとの推定手法・パラメータ・精度"""
+        with self._lock:
+            wape = np.divide(self._abs_error, self._abs_actual, out=np.ones(len(self.keys)), where=self._abs_actual > 0)
+            return [
+                {
+                    'key': key,
+                    'method': self.method[i],
+                    'alpha': float(self.params[i, 0]),
+                    'beta': float(self.params[i, 1]),
+                    'gamma': float(self.params[i, 2]),
+                    'accuracy': float(np.clip(1 - wape[i], 0, 1))
+                }
+                for i, key in enumerate(self.keys)
+            ]
+
+
+class ForecastService:
+    """名前ごとの予測モデル群をプロセス内で共有するサービス"""
+
+    def __init__(self):
+        self._banks: Dict[str, ForecastBank] = {}
+        self._lock = threading.Lock()
+
+    def bank(self, name: str, season_length: int, period_seconds: int, **kwargs) -> ForecastBank:
+        """名前に対応する予測モデル群を取得（なければ作成）"""
+        with self._lock:
+            bank = self._banks.get(name)
+            if bank is None or bank.season_length != season_length or bank.period_seconds != period_seconds:
+                bank = ForecastBank(season_length, period_seconds, **kwargs)
+                self._banks[name] = bank
+            return bank
+
+
+# プロセス全体で共有する予測サービス
+forecast_service = ForecastService()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+ジャーニーファネル・ステージメトリクスエンジン
+タイムスタンプ付きステージイベントからステージ遷移、滞在時間分布、コンバージョン率、離脱率を
+獲得週コホート別にインクリメンタル集計
+"""
+
+import os
+import threading
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# ファネルのステージ順（後ろのステージへの遷移を前進とみなす）
+FUNNEL_STAGES = ['Awareness', 'Consideration', 'Trial', 'Purchase', 'Loyalty', 'Retention']
+
+# スナップショットファイル（環境変数で上書き可能）
+DEFAULT_FUNNEL_STATE_PATH = os.getenv(
+    "FUNNEL_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "funnel_state.npz")
+)
+
+SECONDS_PER_DAY = 86400.0
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+# 1970-01-01は木曜日のため、月曜始まりの週番号にするためのオフセット
+WEEK_OFFSET_SECONDS = 3 * SECONDS_PER_DAY
+
+# 滞在時間ヒストグラムのビン境界（秒、1分〜2年を対数等間隔）
+DWELL_BIN_EDGES = np.concatenate([[0.0], np.geomspace(60.0, 2 * 365 * SECONDS_PER_DAY, 256)])
+
+# 出力する滞在時間パーセンタイル
+DWELL_PERCENTILES = (25, 50, 75, 90)
+
+
+def _to_seconds(timestamps) -> np.ndarray:
+    """datetime・文字列・数値（UNIX秒）の配列をUNIX秒に変換"""
+    values = np.asarray(timestamps)
+    if values.dtype.kind in 'iuf':
+        return values.astype(np.float64)
+    parsed = pd.to_datetime(pd.Series(values), utc=True)
+    return (parsed - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(dtype=np.float64)
+
+
+def acquisition_week(seconds) -> np.ndarray:
+    """UNIX秒から月曜始まりの週番号を算出"""
+    return np.floor((np.asarray(seconds, dtype=np.float64) + WEEK_OFFSET_SECONDS) / SECONDS_PER_WEEK).astype(np.int64)
+
+
+def week_start(week: int) -> date:
+    """週番号からその週の月曜日の日付を取得"""
+    seconds = week * SECONDS_PER_WEEK - WEEK_OFFSET_SECONDS
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).date()
+
+
+@dataclass
+class StageEvents:
+    """列指向のステージイベント（顧客がステージに入った時刻）"""
+    customer_ids: np.ndarray
+    stage: np.ndarray
+    timestamp: np.ndarray
+
+    @classmethod
+    def from_columns(cls, customer_ids, stages, timestamps, stage_names: Sequence[str] = FUNNEL_STAGES) -> 'StageEvents':
+        """顧客ID・ステージ名・時刻の列から生成（未知のステージは除外）"""
+        codes = pd.Categorical(np.asarray(stages, dtype=object), categories=list(stage_names)).codes
+        known = codes >= 0
+        if not known.all():
+            logger.warning(f"未知のステージのイベント{int((~known).sum())}件を除外しました")
+        return cls(
+            customer_ids=np.asarray(customer_ids, dtype=object)[known],
+            stage=codes[known].astype(np.int16),
+            timestamp=_to_seconds(timestamps)[known]
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, customer_col: str = 'customer_id', stage_col: str = 'stage',
+                   time_col: str = 'timestamp', stage_names: Sequence[str] = FUNNEL_STAGES) -> 'StageEvents':
+        """DataFrameから生成"""
+        return cls.from_columns(df[customer_col].to_numpy(), df[stage_col].to_numpy(), df[time_col].to_numpy(), stage_names)
+
+    def __len__(self) -> int:
+        return len(self.stage)
+
+
+def _histogram_percentiles(hist: np.ndarray, percentiles: Sequence[float]) -> np.ndarray:
+    """ビン集計から各行のパーセンタイルを線形補間で推定（hist: [行, ビン]）"""
+    totals = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    result = np.zeros((hist.shape[0], len(percentiles)))
+    lower_edges = DWELL_BIN_EDGES[:-1]
+    widths = np.diff(DWELL_BIN_EDGES)
+    rows = np.arange(hist.shape[0])
+    for j, q in enumerate(percentiles):
+        target = totals * (q / 100.0)
+        bins = np.minimum((cumulative < target[:, None]).sum(axis=1), hist.shape[1] - 1)
+        before = np.where(bins > 0, cumulative[rows, np.maximum(bins - 1, 0)], 0)
+        inside = hist[rows, bins]
+        fraction = np.divide(target - before, inside, out=np.zeros_like(target, dtype=np.float64), where=inside > 0)
+        result[:, j] = np.where(totals > 0, lower_edges[bins] + fraction * widths[bins], 0.0)
+    return result
+
+
+class FunnelState:
+    """ステージ遷移・滞在時間を獲得週コホート別に積み上げるファネル集計"""
+
+    def __init__(self, stages: Sequence[str] = FUNNEL_STAGES, snapshot_path: Optional[str] = None):
+        self.stages = list(stages)
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cache: Dict[Tuple, Dict[str, Any]] = {}
+        n_stages = len(self.stages)
+        n_bins = len(DWELL_BIN_EDGES) - 1
+
+        # 顧客ごとの現在ステージ・ステージ開始時刻・コホート行
+        self._index: Dict[str, int] = {}
+        self._customer_ids: List[str] = []
+        self._current = np.zeros(0, dtype=np.int16)
+        self._since = np.zeros(0, dtype=np.float64)
+        self._cohort_row = np.zeros(0, dtype=np.int32)
+
+        # コホート行ごとの集計（行は獲得週）
+        self._weeks: List[int] = []
+        self._week_rows: Dict[int, int] = {}
+        self._entered = np.zeros((0, n_stages), dtype=np.int64)
+        self._advanced = np.zeros((0, n_stages), dtype=np.int64)
+        self._transitions = np.zeros((0, n_stages, n_stages), dtype=np.int64)
+        self._dwell_hist = np.zeros((0, n_stages, n_bins), dtype=np.int64)
+        self._dwell_sum = np.zeros((0, n_stages), dtype=np.float64)
+
+        if snapshot_path:
+            self.load()
+
+    @property
+    def n_customers(self) -> int:
+        return len(self._customer_ids)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _customer_codes(self, customer_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """顧客IDを内部番号に変換し、新規顧客かどうかを返す（ロック取得済みで呼ぶ）"""
+        uniques, inverse = np.unique(customer_ids.astype(str), return_inverse=True)
+        codes = np.empty(len(uniques), dtype=np.int64)
+        known = np.empty(len(uniques), dtype=bool)
+        for i, customer_id in enumerate(uniques):
+            code = self._index.get(customer_id)
+            known[i] = code is not None
+            if code is None:
+                code = len(self._customer_ids)
+                self._index[customer_id] = code
+                self._customer_ids.append(customer_id)
+            codes[i] = code
+
+        n_new = len(self._customer_ids) - len(self._current)
+        if n_new:
+            self._current = np.concatenate([self._current, np.full(n_new, -1, dtype=np.int16)])
+            self._since = np.concatenate([self._since, np.zeros(n_new)])
+            self._cohort_row = np.concatenate([self._cohort_row, np.full(n_new, -1, dtype=np.int32)])
+        return codes[inverse], ~known[inverse]
+
+    def _cohort_rows(self, weeks: np.ndarray) -> np.ndarray:
+        """週番号をコホート行に変換（新しい週は行を追加、ロック取得済みで呼ぶ）"""
+        uniques, inverse = np.unique(weeks, return_inverse=True)
+        rows = np.empty(len(uniques), dtype=np.int32)
+        for i, week in enumerate(uniques.tolist()):
+            row = self._week_rows.get(week)
+            if row is None:
+                row = len(self._weeks)
+                self._week_rows[week] = row
+                self._weeks.append(week)
+            rows[i] = row
+
+        n_new = len(self._weeks) - len(self._entered)
+        if n_new:
+            n_stages = len(self.stages)
+            self._entered = np.concatenate([self._entered, np.zeros((n_new, n_stages), dtype=np.int64)])
+            self._advanced = np.concatenate([self._advanced, np.zeros((n_new, n_stages), dtype=np.int64)])
+            self._transitions = np.concatenate([self._transitions, np.zeros((n_new, n_stages, n_stages), dtype=np.int64)])
+            self._dwell_hist = np.concatenate([self._dwell_hist, np.zeros((n_new,) + self._dwell_hist.shape[1:], dtype=np.int64)])
+            self._dwell_sum = np.concatenate([self._dwell_sum, np.zeros((n_new, n_stages))])
+        return rows[inverse]
+
+    def _previous(self, codes: np.ndarray, stage: np.ndarray, ts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """顧客・時刻順に並んだ各行の直前の状態（先頭行は保存済みの現在ステージ）を取得"""
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[1:] != codes[:-1]
+        prev_stage = np.empty_like(stage)
+        prev_ts = np.empty_like(ts)
+        prev_stage[1:] = stage[:-1]
+        prev_ts[1:] = ts[:-1]
+        prev_stage[first] = self._current[codes[first]]
+        prev_ts[first] = self._since[codes[first]]
+        return first, prev_stage, prev_ts
+
+    def update(self, events: StageEvents) -> int:
+        """ステージイベントを取り込み、集計を更新（取り込んだイベント数を返す）"""
+        if len(events) == 0:
+            return 0
+
+        with self._lock:
+            codes, is_new = self._customer_codes(events.customer_ids)
+            order = np.lexsort((events.timestamp, codes))
+            codes = codes[order]
+            stage = events.stage[order].astype(np.int64)
+            ts = events.timestamp[order]
+            is_new = is_new[order]
+
+            # 現在ステージの開始より古いイベントを除外
+            stored = self._current[codes] >= 0
+            stale = stored & (ts < self._since[codes])
+            if stale.any():
+                logger.debug(f"現在ステージより古いイベント{int(stale.sum())}件を除外しました")
+                codes, stage, ts, is_new = codes[~stale], stage[~stale], ts[~stale], is_new[~stale]
+
+            # 同じステージの連続イベントは最初の1件のみ残す
+            first, prev_stage, prev_ts = self._previous(codes, stage, ts)
+            keep = stage != prev_stage
+            if not keep.any():
+                return 0
+            codes, stage, ts, is_new = codes[keep], stage[keep], ts[keep], is_new[keep]
+            first, prev_stage, prev_ts = self._previous(codes, stage, ts)
+            last = np.ones(len(codes), dtype=bool)
+            last[:-1] = first[1:]
+
+            # 新規顧客は最初のイベントの週をコホートとする
+            new_first = first & is_new
+            self._cohort_row[codes[new_first]] = self._cohort_rows(acquisition_week(ts[new_first]))
+            cohort = self._cohort_row[codes].astype(np.int64)
+
+            n_stages = len(self.stages)
+            n_cohorts = len(self._weeks)
+            n_bins = len(DWELL_BIN_EDGES) - 1
+
+            # 一度のグループ集計で流入・遷移・滞在時間を積み上げ
+            self._entered += np.bincount(cohort * n_stages + stage, minlength=n_cohorts * n_stages).reshape(n_cohorts, n_stages)
+
+            moved = prev_stage >= 0
+            m_cohort, m_prev, m_stage = cohort[moved], prev_stage[moved], stage[moved]
+            dwell = np.maximum(ts[moved] - prev_ts[moved], 0.0)
+            cell = m_cohort * n_stages + m_prev
+            self._transitions += np.bincount(
+                cell * n_stages + m_stage, minlength=n_cohorts * n_stages * n_stages
+            ).reshape(n_cohorts, n_stages, n_stages)
+            self._advanced += np.bincount(
+                cell, weights=(m_stage > m_prev), minlength=n_cohorts * n_stages
+            ).astype(np.int64).reshape(n_cohorts, n_stages)
+            bins = np.clip(np.searchsorted(DWELL_BIN_EDGES, dwell, side='right') - 1, 0, n_bins - 1)
+            self._dwell_hist += np.bincount(
+                cell * n_bins + bins, minlength=n_cohorts * n_stages * n_bins
+            ).reshape(n_cohorts, n_stages, n_bins)
+            self._dwell_sum += np.bincount(cell, weights=dwell, minlength=n_cohorts * n_stages).reshape(n_cohorts, n_stages)
+
+            self._current[codes[last]] = stage[last]
+            self._since[codes[last]] = ts[last]
+            self._version += 1
+            self._cache.clear()
+            self._save()
+            return int(len(codes))
+
+    def cohort_weeks(self) -> List[date]:
+        """集計済みの獲得週（週の月曜日）を古い順に取得"""
+        return [week_start(week) for week in sorted(self._weeks)]
+
+    def _select_rows(self, cohorts: Optional[Sequence[date]]) -> np.ndarray:
+        """対象コホートの行マスクを作成"""
+        if cohorts is None:
+            return np.ones(len(self._weeks), dtype=bool)
+        wanted = {acquisition_week(datetime.combine(c, datetime.min.time(), tzinfo=timezone.utc).timestamp()).item()
+                  for c in cohorts}
+        return np.array([week in wanted for week in self._weeks], dtype=bool)
+
+    def metrics(self, cohorts: Optional[Sequence[date]] = None, now: Optional[datetime] = None,
+                include_open: bool = True) -> Dict[str, Dict[str, Any]]:
+        """ステージ別メトリクスを取得（include_openで現在滞在中の経過時間も分布に含める）"""
+        now_seconds = (now or datetime.now(timezone.utc)).timestamp()
+        key = (tuple(sorted(cohorts)) if cohorts is not None else None, include_open,
+               int(now_seconds // 60) if include_open else None)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+            rows = self._select_rows(cohorts)
+            n_stages = len(self.stages)
+            entered = self._entered[rows].sum(axis=0)
+            advanced = self._advanced[rows].sum(axis=0)
+            transitions = self._transitions[rows].sum(axis=0)
+            exited = transitions.sum(axis=1)
+            hist = self._dwell_hist[rows].sum(axis=0)
+            dwell_sum = self._dwell_sum[rows].sum(axis=0)
+            dwell_count = exited.astype(np.float64)
+
+            in_cohort = rows[self._cohort_row] if len(rows) else np.zeros(self.n_customers, dtype=bool)
+            current = self._current[in_cohort].astype(np.int64)
+            active = current >= 0
+            current = current[active]
+            counts = np.bincount(current, minlength=n_stages)
+
+            if include_open and len(current):
+                ages = np.maximum(now_seconds - self._since[in_cohort][active], 0.0)
+                bins = np.clip(np.searchsorted(DWELL_BIN_EDGES, ages, side='right') - 1, 0, hist.shape[1] - 1)
+                hist = hist + np.bincount(current * hist.shape[1] + bins, minlength=hist.size).reshape(hist.shape)
+                dwell_sum = dwell_sum + np.bincount(current, weights=ages, minlength=n_stages)
+                dwell_count = dwell_count + counts
+
+            avg_days = np.divide(dwell_sum, dwell_count, out=np.zeros(n_stages), where=dwell_count > 0) / SECONDS_PER_DAY
+            percentile_days = _histogram_percentiles(hist, DWELL_PERCENTILES) / SECONDS_PER_DAY
+            conversion = np.divide(advanced, entered, out=np.zeros(n_stages), where=entered > 0)
+            drop_off = np.where(entered > 0, 1.0 - conversion, 0.0)
+
+            result = {}
+            for s, stage in enumerate(self.stages):
+                result[stage] = {
+                    'count': int(counts[s]),
+                    'entered': int(entered[s]),
+                    'advanced': int(advanced[s]),
+                    'avg_time_in_stage': float(avg_days[s]),
+                    'dwell_percentiles': {f'p{q}': float(percentile_days[s, j]) for j, q in enumerate(DWELL_PERCENTILES)},
+                    'conversion_rate': float(conversion[s]),
+                    'drop_off_rate': float(drop_off[s]),
+                    'transitions': {self.stages[t]: int(transitions[s, t]) for t in np.flatnonzero(transitions[s])}
+                }
+            self._cache[key] = result
+            return result
+
+    def cohort_conversion(self) -> pd.DataFrame:
+        """獲得週×ステージのコンバージョン率テーブルを取得"""
+        with self._lock:
+            order = np.argsort(self._weeks)
+            entered = self._entered[order]
+            rates = np.divide(self._advanced[order], entered, out=np.zeros(entered.shape), where=entered > 0)
+            return pd.DataFrame(rates, index=[week_start(self._weeks[i]) for i in order], columns=self.stages)
+
+    def customer_stages(self) -> Dict[str, str]:
+        """顧客ごとの現在ステージを取得"""
+        with self._lock:
+            return {customer_id: self.stages[code]
+                    for customer_id, code in zip(self._customer_ids, self._current.tolist()) if code >= 0}
+
+    def _save(self):
+        """状態をアトミックに保存（ロック取得済みで呼ぶ）"""
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    stages=np.array(self.stages),
+                    customer_ids=np.array(self._customer_ids, dtype=str),
+                    current=self._current,
+                    since=self._since,
+                    cohort_row=self._cohort_row,
+                    weeks=np.array(self._weeks, dtype=np.int64),
+                    entered=self._entered,
+                    advanced=self._advanced,
+                    transitions=self._transitions,
+                    dwell_hist=self._dwell_hist,
+                    dwell_sum=self._dwell_sum
+                )
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.error(f"ファネル状態の保存エラー: {e}")
+
+    def load(self):
+        """保存済みの状態を読み込む（ステージ構成やビンが異なる場合は無視）"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with np.load(self.snapshot_path) as data:
+                if data["stages"].tolist() != self.stages or data["dwell_hist"].shape[2] != len(DWELL_BIN_EDGES) - 1:
+                    logger.warning("ファネル状態の構成が異なるため再集計します")
+                    return
+                self._customer_ids = data["customer_ids"].tolist()
+                self._index = {customer_id: i for i, customer_id in enumerate(self._customer_ids)}
+                self._current = data["current"]
+                self._since = data["since"]
+                self._cohort_row = data["cohort_row"]
+                self._weeks = data["weeks"].tolist()
+                self._week_rows = {week: i for i, week in enumerate(self._weeks)}
+                self._entered = data["entered"]
+                self._advanced = data["advanced"]
+                self._transitions = data["transitions"]
+                self._dwell_hist = data["dwell_hist"]
+                self._dwell_sum = data["dwell_sum"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"ファネル状態の読み込みエラー: {e}")
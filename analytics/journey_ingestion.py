@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+ジャーニー取り込み
+CSV/JSONL/Parquet のイベントログをチャンク単位で読み、ユーザー単位のパーティションへ退避してから
+セッション化し、列指向のジャーニーストアへ書き出す（メモリ使用量はチャンク＋1パーティション分）
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .attribution import TouchpointArrays
+from .funnel import StageEvents
+from .page_cache import page_cache
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# ジャーニーストアの保存先（環境変数で上書き可能）
+DEFAULT_STORE_PATH = os.getenv(
+    "JOURNEY_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "journey_store")
+)
+
+# 1回に読み込むイベント行数
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# ユーザーIDのハッシュで分割するパーティション数
+DEFAULT_PARTITIONS = 64
+
+# コンバージョン前に遡るタッチの期間（日）
+DEFAULT_LOOKBACK_DAYS = 30
+
+# 1ジャーニーに保持するタッチ数の上限（新しい方を残す）
+MAX_TOUCHPOINTS_PER_JOURNEY = 50
+
+# 顧客サマリーのエンゲージメント・離脱確率の推定に使う尺度（最終接触からの日数、ジャーニー数）
+ENGAGEMENT_RECENCY_DAYS = 30
+ENGAGEMENT_FREQUENCY_SCALE = 5
+CHURN_RECENCY_DAYS = 60
+
+# ロイヤル顧客とみなす購入回数（ファネルのLoyalty到達）
+LOYALTY_PURCHASES = 3
+
+# タッチポイント定義（アトリビューション分析ページの名称と、顧客セグメントの獲得チャネル）
+TOUCHPOINT_CATALOG = {
+    "Google Search": {"type": "Paid Search", "channel": "SEM", "acquisition": "Paid Search"},
+    "Facebook Ad": {"type": "Social Media", "channel": "Social", "acquisition": "Social"},
+    "Email Campaign": {"type": "Email", "channel": "Email", "acquisition": "Email"},
+    "Organic Search": {"type": "Organic", "channel": "SEO", "acquisition": "Organic"},
+    "Display Ad": {"type": "Display", "channel": "Display", "acquisition": "Paid Search"},
+    "YouTube Video": {"type": "Video", "channel": "Video", "acquisition": "Social"},
+    "LinkedIn Ad": {"type": "Social Media", "channel": "Social", "acquisition": "Social"},
+    "Direct Visit": {"type": "Direct", "channel": "Direct", "acquisition": "Direct"},
+    "Other": {"type": "Other", "channel": "Other", "acquisition": "Direct"}
+}
+
+# 生ログのソース/メディア表記 → タッチポイント名
+DEFAULT_SOURCE_MAPPING = {
+    "google": "Google Search", "google/cpc": "Google Search", "cpc": "Google Search", "sem": "Google Search",
+    "paid search": "Google Search", "google search": "Google Search",
+    "facebook": "Facebook Ad", "fb": "Facebook Ad", "instagram": "Facebook Ad", "facebook ad": "Facebook Ad",
+    "email": "Email Campaign", "newsletter": "Email Campaign", "mail": "Email Campaign",
+    "email campaign": "Email Campaign",
+    "organic": "Organic Search", "seo": "Organic Search", "google/organic": "Organic Search",
+    "organic search": "Organic Search",
+    "display": "Display Ad", "banner": "Display Ad", "gdn": "Display Ad", "display ad": "Display Ad",
+    "youtube": "YouTube Video", "video": "YouTube Video", "youtube video": "YouTube Video",
+    "linkedin": "LinkedIn Ad", "linkedin ad": "LinkedIn Ad",
+    "direct": "Direct Visit", "(direct)": "Direct Visit", "(none)": "Direct Visit", "direct visit": "Direct Visit"
+}
+
+# コンバージョンとみなすイベント名
+DEFAULT_CONVERSION_EVENTS = ("conversion", "purchase", "order", "signup")
+
+@dataclass
+class EventSchema:
+    """イベントログの列名"""
+    user_id: str = "user_id"
+    timestamp: str = "timestamp"
+    source: str = "source"
+    event: str = "event"
+    value: str = "value"
+    conversion_events: Tuple[str, ...] = DEFAULT_CONVERSION_EVENTS
+    source_mapping: Dict[str, str] = field(default_factory=lambda: dict(DEFAULT_SOURCE_MAPPING))
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.user_id, self.timestamp, self.source, self.event, self.value]
+
+def iter_event_chunks(path: str,
+                      schema: Optional[EventSchema] = None,
+                      chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """イベントファイルを拡張子に応じてチャンク単位で読む"""
+    schema = schema or EventSchema()
+    lower = path.lower()
+
+    if lower.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquetの読み込みには pyarrow が必要です: pip install pyarrow") from e
+        parquet = pq.ParquetFile(path)
+        available = [c for c in schema.columns if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=available):
+            yield batch.to_pandas()
+    elif lower.endswith((".jsonl", ".ndjson", ".json")):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        yield from pd.read_csv(
+            path, chunksize=chunk_rows, usecols=lambda c: c in schema.columns, low_memory=False
+        )
+
+class JourneyStore:
+    """列指向のジャーニーストア（パートファイル単位で追記）
+
+    touchpoints: journey_id, position, channel, timestamp
+    journeys: journey_id, user_id, converted, value, start, end
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self.vocabulary: List[str] = []
+        self.next_journey_id = 0
+        self.parts: List[str] = []
+        self._load_manifest()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.vocabulary = manifest["vocabulary"]
+            self.next_journey_id = manifest["next_journey_id"]
+            self.parts = manifest["parts"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"ジャーニーストアの読み込みエラー: {e}")
+
+    def _save_manifest(self):
+        """マニフェストをアトミックに保存"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "vocabulary": self.vocabulary,
+                "next_journey_id": self.next_journey_id,
+                "parts": self.parts
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def channel_codes(self, names: np.ndarray) -> np.ndarray:
+        """タッチポイント名を語彙の番号へ（未登録は追加）"""
+        uniques, inverse = np.unique(names, return_inverse=True)
+        index = {name: i for i, name in enumerate(self.vocabulary)}
+        mapped = np.empty(len(uniques), dtype=np.int32)
+        for i, name in enumerate(uniques):
+            if name not in index:
+                index[name] = len(self.vocabulary)
+                self.vocabulary.append(str(name))
+            mapped[i] = index[name]
+        return mapped[inverse]
+
+    def append(self, touchpoints: Dict[str, np.ndarray], journeys: Dict[str, np.ndarray]):
+        """1パーティション分のジャーニーをパートファイルとして追記（journey_id はローカル番号）"""
+        if len(journeys["user_id"]) == 0:
+            return
+
+        offset = self.next_journey_id
+        part_name = f"part-{len(self.parts):05d}.npz"
+        os.makedirs(self.path, exist_ok=True)
+        np.savez(
+            os.path.join(self.path, part_name),
+            tp_journey_id=touchpoints["journey_id"] + offset,
+            tp_position=touchpoints["position"],
+            tp_channel=touchpoints["channel"],
+            tp_timestamp=touchpoints["timestamp"],
+            journey_id=np.arange(len(journeys["user_id"]), dtype=np.int64) + offset,
+            user_id=journeys["user_id"].astype(str),
+            converted=journeys["converted"],
+            value=journeys["value"],
+            start=journeys["start"],
+            end=journeys["end"]
+        )
+        self.parts.append(part_name)
+        self.next_journey_id += len(journeys["user_id"])
+        self._save_manifest()
+        # ストアを読むページ計算のキャッシュを無効化
+        page_cache.invalidate('journeys')
+
+    def iter_parts(self) -> Iterator[Tuple[TouchpointArrays, pd.DataFrame]]:
+        """パート毎に (タッチポイント配列, ジャーニー表) を返す"""
+        for part_name in self.parts:
+            with np.load(os.path.join(self.path, part_name)) as part:
+                journeys = pd.DataFrame({
+                    "journey_id": part["journey_id"],
+                    "user_id": part["user_id"],
+                    "converted": part["converted"],
+                    "value": part["value"],
+                    "start": part["start"],
+                    "end": part["end"]
+                })
+                # タッチ行ごとのコンバージョン価値・フラグ
+                local = part["tp_journey_id"] - part["journey_id"][0]
+                arrays = TouchpointArrays.from_columns(
+                    part["tp_journey_id"], part["tp_position"], part["tp_channel"], part["tp_timestamp"],
+                    np.where(part["converted"], part["value"], 0.0)[local], self.vocabulary,
+                    converted=part["converted"][local], assume_sorted=True
+                )
+            yield arrays, journeys
+
+    def load_arrays(self) -> TouchpointArrays:
+        """全パートを1つのタッチポイント配列に結合"""
+        parts = [arrays for arrays, _ in self.iter_parts()]
+        if not parts:
+            return TouchpointArrays.from_columns([], [], [], [], [], self.vocabulary)
+        return TouchpointArrays(
+            *(np.concatenate([getattr(p, name) for p in parts])
+              for name in ("journey_id", "position", "channel", "timestamp", "value")),
+            channels=list(self.vocabulary),
+            converted=np.concatenate([p.is_converted() for p in parts])
+        )
+
+    def to_journeys(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """アトリビューション分析ページ形式（dictのリスト）へ変換"""
+        results: List[Dict[str, Any]] = []
+        for arrays, journeys in self.iter_parts():
+            _, _, journey_index, starts = arrays.journey_layout()
+            ends = np.append(starts[1:], len(arrays))
+            for row, start, end in zip(journeys.itertuples(index=False), starts, ends):
+                results.append({
+                    'id': f"journey_{row.journey_id}",
+                    'customer_id': row.user_id,
+                    'touchpoints': [
+                        {
+                            'name': self.vocabulary[arrays.channel[i]],
+                            **{k: v for k, v in TOUCHPOINT_CATALOG.get(self.vocabulary[arrays.channel[i]], {}).items()
+                               if k != 'acquisition'},
+                            'timestamp': datetime.fromtimestamp(arrays.timestamp[i]),
+                            'position': int(arrays.position[i]) + 1
+                        }
+                        for i in range(start, end)
+                    ],
+                    'conversion_value': float(row.value),
+                    'conversion_date': datetime.fromtimestamp(row.end),
+                    'converted': bool(row.converted)
+                })
+                if limit is not None and len(results) >= limit:
+                    return results
+        return results
+
+    def customer_summary(self, now: Optional[datetime] = None) -> pd.DataFrame:
+        """ユーザー単位の集計（顧客セグメンテーションの入力列）
+
+        engagement_score・churn_probability は最終接触からの日数（recency_days）とジャーニー数（frequency）から
+        推定した値。基準時刻 now の省略時はストア内の最新イベント時刻を使う
+        """
+        frames = []
+        for arrays, journeys in self.iter_parts():
+            _, _, _, starts = arrays.journey_layout()
+            journeys = journeys.assign(first_channel=np.asarray(self.vocabulary, dtype=object)[arrays.channel[starts]])
+            frames.append(journeys)
+        if not frames:
+            return pd.DataFrame(columns=['id', 'acquisition_date', 'channel', 'ltv', 'total_purchases',
+                                         'avg_order_value', 'last_purchase', 'recency_days', 'frequency',
+                                         'engagement_score', 'churn_probability'])
+
+        journeys = pd.concat(frames, ignore_index=True).sort_values(["user_id", "start"], kind="stable")
+        purchases = journeys[journeys["converted"]]
+        grouped = journeys.groupby("user_id", sort=False)
+        summary = pd.DataFrame({
+            'acquisition_date': pd.to_datetime(grouped["start"].min(), unit='s'),
+            'first_touch': grouped["first_channel"].first(),
+            'ltv': purchases.groupby("user_id")["value"].sum(),
+            'total_purchases': purchases.groupby("user_id").size(),
+            'last_purchase': pd.to_datetime(purchases.groupby("user_id")["end"].max(), unit='s'),
+            'last_seen': grouped["end"].max(),
+            'frequency': grouped.size()
+        })
+        summary['ltv'] = summary['ltv'].fillna(0.0)
+        summary['total_purchases'] = summary['total_purchases'].fillna(0).astype(int)
+        summary['avg_order_value'] = np.where(
+            summary['total_purchases'] > 0, summary['ltv'] / summary['total_purchases'].clip(lower=1), 0.0
+        )
+        summary['last_purchase'] = summary['last_purchase'].fillna(summary['acquisition_date'])
+
+        # 最近よく接触している顧客ほどエンゲージメントが高く、購入回数が多い顧客ほど離脱までの猶予が長いとみなす
+        reference = journeys["end"].max() if now is None else pd.Timestamp(now).timestamp()
+        recency = np.maximum(reference - summary.pop('last_seen').to_numpy(dtype=np.float64), 0.0) / 86400
+        frequency = summary['frequency'].to_numpy(dtype=np.float64)
+        summary['recency_days'] = recency
+        summary['engagement_score'] = 0.1 + 0.9 * (
+            0.5 * np.exp(-recency / ENGAGEMENT_RECENCY_DAYS) + 0.5 * (1 - np.exp(-frequency / ENGAGEMENT_FREQUENCY_SCALE))
+        )
+        patience = CHURN_RECENCY_DAYS * (1 + np.log1p(summary['total_purchases'].to_numpy(dtype=np.float64)))
+        summary['churn_probability'] = np.clip(1 - np.exp(-recency / patience), 0.05, 0.95)
+        acquisition = {name: info["acquisition"] for name, info in TOUCHPOINT_CATALOG.items()}
+        summary['channel'] = summary.pop('first_touch').map(acquisition).fillna('Direct')
+        return summary.rename_axis('id').reset_index()
+
+    def stage_events(self) -> StageEvents:
+        """タッチ・コンバージョン時刻からユーザーごとのステージ到達イベントを復元
+
+        Awareness は最初のタッチ、Consideration は初回購入前の再接触、Purchase は初回購入、
+        Loyalty は LOYALTY_PURCHASES 回目の購入。Trial・Retention はイベントログから判定できないため含めない
+        """
+        touches, purchases = [], []
+        for arrays, journeys in self.iter_parts():
+            users = journeys["user_id"].to_numpy()
+            local = arrays.journey_id - journeys["journey_id"].iloc[0]
+            touches.append(pd.DataFrame({"user_id": users[local], "timestamp": arrays.timestamp}))
+            converted = journeys[journeys["converted"]]
+            purchases.append(pd.DataFrame({"user_id": converted["user_id"].to_numpy(), "timestamp": converted["end"].to_numpy()}))
+        if not touches:
+            return StageEvents.from_columns([], [], np.zeros(0))
+
+        touches = pd.concat(touches, ignore_index=True).sort_values(["user_id", "timestamp"], kind="stable")
+        purchases = pd.concat(purchases, ignore_index=True).sort_values(["user_id", "timestamp"], kind="stable")
+        touch_rank = touches.groupby("user_id", sort=False).cumcount().to_numpy()
+        purchase_rank = purchases.groupby("user_id", sort=False).cumcount().to_numpy()
+
+        first_purchase = purchases[purchase_rank == 0].set_index("user_id")["timestamp"]
+        revisits = touches[touch_rank == 1]
+        before_purchase = revisits["timestamp"].to_numpy() < revisits["user_id"].map(first_purchase).fillna(np.inf).to_numpy()
+        revisits = revisits[before_purchase]
+
+        events = pd.concat([
+            touches[touch_rank == 0].assign(stage="Awareness"),
+            revisits.assign(stage="Consideration"),
+            purchases[purchase_rank == 0].assign(stage="Purchase"),
+            purchases[purchase_rank == LOYALTY_PURCHASES - 1].assign(stage="Loyalty")
+        ], ignore_index=True)
+        return StageEvents.from_columns(events["user_id"].to_numpy(), events["stage"].to_numpy(), events["timestamp"].to_numpy())
+
+def sessionize(user_key: np.ndarray,
+               timestamp: np.ndarray,
+               channel: np.ndarray,
+               is_conversion: np.ndarray,
+               value: np.ndarray,
+               lookback_seconds: float,
+               max_touchpoints: int = MAX_TOUCHPOINTS_PER_JOURNEY) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """(ユーザー, 時刻) 順のイベントをジャーニーへ分割
+
+    ユーザーが変わる・直前がコンバージョン・前のイベントから lookback を超えて空いた時点で新しいジャーニー。
+    コンバージョンしたジャーニーはコンバージョン時刻から lookback 以内のタッチのみ残す。
+    戻り値のジャーニー番号はこの呼び出し内のローカル番号、journeys の各列は入力行番号で表す。
+    """
+    n = len(user_key)
+    if n == 0:
+        empty_i = np.zeros(0, dtype=np.int64)
+        return ({"journey_id": empty_i, "position": empty_i.astype(np.int32), "channel": empty_i.astype(np.int32),
+                 "timestamp": np.zeros(0)},
+                {"row": empty_i, "converted": np.zeros(0, dtype=bool), "value": np.zeros(0),
+                 "start": np.zeros(0), "end": np.zeros(0)})
+
+    same_user = np.r_[False, user_key[1:] == user_key[:-1]]
+    gap = np.r_[False, np.diff(timestamp) > lookback_seconds]
+    after_conversion = np.r_[False, is_conversion[:-1]]
+    journey = np.cumsum(~same_user | gap | after_conversion) - 1
+    n_journeys = int(journey[-1]) + 1
+
+    # ジャーニー末尾がコンバージョンなら converted（連続コンバージョンはタッチ無しとして後で除外）
+    last_row = np.flatnonzero(np.r_[journey[1:] != journey[:-1], True])
+    converted = is_conversion[last_row]
+    end_time = timestamp[last_row]
+
+    touch = ~is_conversion
+    keep = touch & (~converted[journey] | (end_time[journey] - timestamp <= lookback_seconds))
+
+    # タッチ数上限（新しい方を残す）
+    kept_journey = journey[keep]
+    counts = np.bincount(kept_journey, minlength=n_journeys)
+    ends = np.cumsum(counts)
+    rank_from_end = ends[kept_journey] - 1 - np.arange(len(kept_journey))
+    trimmed = rank_from_end < max_touchpoints
+    rows = np.flatnonzero(keep)[trimmed]
+    kept_journey = kept_journey[trimmed]
+
+    # タッチの残ったジャーニーだけを詰め直す
+    touches = np.bincount(kept_journey, minlength=n_journeys)
+    valid = touches > 0
+    renumber = np.cumsum(valid) - 1
+    local_journey = renumber[kept_journey]
+    first = np.cumsum(touches[valid]) - touches[valid]
+    position = (np.arange(len(rows)) - first[local_journey]).astype(np.int32)
+
+    touchpoints = {
+        "journey_id": local_journey.astype(np.int64),
+        "position": position,
+        "channel": channel[rows].astype(np.int32),
+        "timestamp": timestamp[rows].astype(np.float64)
+    }
+    journey_rows = last_row[valid]
+    journeys = {
+        "row": journey_rows,
+        "converted": converted[valid],
+        "value": np.where(converted[valid], value[journey_rows], 0.0),
+        "start": timestamp[rows][first],
+        "end": end_time[valid]
+    }
+    return touchpoints, journeys
+
+class JourneyIngestor:
+    """イベントログ → パーティション退避 → セッション化 → ジャーニーストア"""
+
+    def __init__(self,
+                 store: Optional[JourneyStore] = None,
+                 schema: Optional[EventSchema] = None,
+                 partitions: int = DEFAULT_PARTITIONS,
+                 lookback_days: float = DEFAULT_LOOKBACK_DAYS,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                 work_dir: Optional[str] = None):
+        self.store = store if store is not None else JourneyStore()
+        self.schema = schema or EventSchema()
+        self.partitions = partitions
+        self.lookback_seconds = lookback_days * 86400.0
+        self.chunk_rows = chunk_rows
+        self.work_dir = work_dir
+        self._source_lookup = {k.lower(): v for k, v in self.schema.source_mapping.items()}
+        self._conversion_events = {e.lower() for e in self.schema.conversion_events}
+
+    def _normalize(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """チャンクを (user, user_hash, ts, channel, conversion, value) に正規化"""
+        schema = self.schema
+        timestamp = pd.to_datetime(chunk[schema.timestamp], utc=True, errors='coerce')
+        valid = timestamp.notna() & chunk[schema.user_id].notna()
+
+        # ソース表記は種類が少ないため一意値だけ辞書引き
+        raw_source = chunk[schema.source].fillna("(direct)").astype(str) if schema.source in chunk else \
+            pd.Series("(direct)", index=chunk.index)
+        codes, uniques = pd.factorize(raw_source.str.strip().str.lower())
+        names = np.array([self._source_lookup.get(u, "Other") for u in uniques], dtype=object)
+        channel = self.store.channel_codes(names)[codes] if len(uniques) else np.zeros(len(chunk), dtype=np.int32)
+
+        if schema.event in chunk:
+            event_codes, event_uniques = pd.factorize(chunk[schema.event].fillna("").astype(str).str.lower())
+            is_conversion = np.isin(event_uniques, list(self._conversion_events))[event_codes] if len(event_uniques) \
+                else np.zeros(len(chunk), dtype=bool)
+        else:
+            is_conversion = np.zeros(len(chunk), dtype=bool)
+
+        value = pd.to_numeric(chunk[schema.value], errors='coerce').fillna(0.0).to_numpy() \
+            if schema.value in chunk else np.zeros(len(chunk))
+
+        user = chunk[schema.user_id].astype(str)
+        frame = pd.DataFrame({
+            "user": user.to_numpy(),
+            "user_hash": pd.util.hash_pandas_object(user, index=False).to_numpy(),
+            "ts": (timestamp - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(),
+            "channel": channel,
+            "conversion": is_conversion,
+            "value": value
+        })
+        return frame[valid.to_numpy()]
+
+    def ingest(self, paths: List[str]) -> Dict[str, int]:
+        """イベントファイル群を取り込み、件数の統計を返す"""
+        work_dir = tempfile.mkdtemp(prefix="journey_ingest_", dir=self.work_dir)
+        stats = {"events": 0, "dropped_events": 0, "journeys": 0, "touchpoints": 0, "conversions": 0}
+        try:
+            # 1パス目: チャンクを読み、ユーザーハッシュでパーティションへ退避
+            piece = 0
+            for path in paths:
+                for chunk in iter_event_chunks(path, self.schema, self.chunk_rows):
+                    frame = self._normalize(chunk)
+                    stats["events"] += len(chunk)
+                    stats["dropped_events"] += len(chunk) - len(frame)
+                    partition = (frame["user_hash"].to_numpy() % np.uint64(self.partitions)).astype(np.int64)
+                    for p, group in frame.groupby(partition, sort=False):
+                        group.to_pickle(os.path.join(work_dir, f"p{p:04d}-{piece:06d}.pkl"))
+                    piece += 1
+                    logger.info(f"イベント読み込み: {stats['events']:,}行")
+
+            # 2パス目: パーティション毎にソートしてセッション化
+            pieces: Dict[int, List[str]] = {}
+            for name in sorted(os.listdir(work_dir)):
+                pieces.setdefault(int(name[1:5]), []).append(os.path.join(work_dir, name))
+
+            for p in sorted(pieces):
+                frame = pd.concat([pd.read_pickle(f) for f in pieces[p]], ignore_index=True)
+                for f in pieces[p]:
+                    os.remove(f)
+                frame = frame.sort_values(["user_hash", "ts"], kind="stable")
+
+                touchpoints, journeys = sessionize(
+                    frame["user_hash"].to_numpy(),
+                    frame["ts"].to_numpy(),
+                    frame["channel"].to_numpy(),
+                    frame["conversion"].to_numpy(),
+                    frame["value"].to_numpy(),
+                    self.lookback_seconds
+                )
+                self.store.append(touchpoints, {
+                    "user_id": frame["user"].to_numpy()[journeys["row"]],
+                    "converted": journeys["converted"],
+                    "value": journeys["value"],
+                    "start": journeys["start"],
+                    "end": journeys["end"]
+                })
+                stats["journeys"] += len(journeys["row"])
+                stats["touchpoints"] += len(touchpoints["journey_id"])
+                stats["conversions"] += int(journeys["converted"].sum())
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        logger.info(f"ジャーニー取り込み完了: {stats}")
+        return stats
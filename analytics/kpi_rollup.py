@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+KPIロールアップストア
+指標×プロジェクトごとに日次・週次・月次の集計（合計・件数・最小・最大・分位点スケッチ）をデータ到着時に差分更新し、
+任意期間のKPIと比較期間を生の行を走査せずに期間数に比例する計算量で返す
+"""
+
+import threading
+import logging
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 集計の粒度（粗い粒度の期間が範囲に収まる部分はそちらで集計する）
+ROLLUP_GRAINS = ('day', 'week', 'month')
+
+# 全プロジェクト合算の集計に使うプロジェクト名
+ALL_PROJECTS = 'all'
+
+# 分位点スケッチの相対誤差（対数バケットの幅）と、ゼロとみなす絶対値の下限
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MIN_VALUE = 1e-9
+_SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_SKETCH_LOG_GAMMA = np.log(_SKETCH_GAMMA)
+_SKETCH_KEY_OFFSET = int(np.ceil(-np.log(SKETCH_MIN_VALUE) / _SKETCH_LOG_GAMMA)) + 1
+# セル番号とバケット番号を1つの整数にまとめる際のバケット番号の幅（float64 の範囲を収める）
+_SKETCH_KEY_SPAN = 2 * (_SKETCH_KEY_OFFSET + int(np.ceil(np.log(np.finfo(np.float64).max) / _SKETCH_LOG_GAMMA)) + 1)
+
+# frame() で指定できる集計方法
+AGGREGATIONS = ('sum', 'count', 'mean', 'min', 'max')
+
+
+def day_numbers(times: Any) -> np.ndarray:
+    """日時（配列・スカラー）を1970-01-01からの日数に変換（タイムゾーン付きは現地の日付）"""
+    parsed = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(times, dtype=object))))
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed.to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+def period_of(grain: str, days: np.ndarray) -> np.ndarray:
+    """日数を粒度ごとの期間番号に変換（週は月曜始まり）"""
+    days = np.asarray(days, dtype=np.int64)
+    if grain == 'day':
+        return days
+    if grain == 'week':
+        # 1970-01-01 は木曜日
+        return (days + 3) // 7
+    if grain == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f"未対応の粒度です: {grain}")
+
+
+def period_start(grain: str, periods: np.ndarray) -> np.ndarray:
+    """期間番号の開始日（日数）"""
+    periods = np.asarray(periods, dtype=np.int64)
+    if grain == 'day':
+        return periods
+    if grain == 'week':
+        return periods * 7 - 3
+    if grain == 'month':
+        return periods.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    raise ValueError(f"未対応の粒度です: {grain}")
+
+
+def sketch_keys(values: np.ndarray) -> np.ndarray:
+    """値を対数バケットの番号に変換（番号の大小は値の大小と一致し、0はゼロ付近の値）"""
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    keys = np.zeros(len(values), dtype=np.int64)
+    nonzero = magnitude > SKETCH_MIN_VALUE
+    k = np.ceil(np.log(magnitude[nonzero]) / _SKETCH_LOG_GAMMA).astype(np.int64) + _SKETCH_KEY_OFFSET
+    keys[nonzero] = np.where(values[nonzero] > 0, k, -k)
+    return keys
+
+
+def sketch_values(keys: np.ndarray) -> np.ndarray:
+    """バケット番号の代表値（バケット内の値に対する相対誤差が SKETCH_RELATIVE_ACCURACY 以内）"""
+    keys = np.asarray(keys, dtype=np.int64)
+    k = np.abs(keys) - _SKETCH_KEY_OFFSET
+    values = 2 * _SKETCH_GAMMA ** k.astype(np.float64) / (_SKETCH_GAMMA + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+
+def merge_sketches(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """重複するバケット番号の件数をまとめる"""
+    merged, inverse = np.unique(keys, return_inverse=True)
+    return merged, np.bincount(inverse, weights=counts, minlength=len(merged))
+
+
+@dataclass
+class RollupAggregate:
+    """期間内の指標の集計値"""
+    metric: str
+    project: str
+    start: date
+    end: date
+    sum: float
+    count: int
+    min: float
+    max: float
+    sketch_keys: np.ndarray
+    sketch_counts: np.ndarray
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else float('nan')
+
+    def quantile(self, q: float) -> float:
+        """分位点（スケッチから推定し、観測値の範囲に収める）"""
+        if not self.count:
+            return float('nan')
+        cumulative = np.cumsum(self.sketch_counts)
+        rank = q * (cumulative[-1] - 1)
+        value = sketch_values(self.sketch_keys[np.searchsorted(cumulative, rank, side='right')])
+        return float(np.clip(value, self.min, self.max))
+
+    def value(self, agg: str) -> float:
+        """集計方法（sum/count/mean/min/max/p50 など）を指定して値を取得"""
+        if agg.startswith('p') and agg[1:].isdigit():
+            return self.quantile(int(agg[1:]) / 100)
+        return float(getattr(self, agg))
+
+
+class RollupTable:
+    """1つの粒度の系列×期間の集計（期間は連続した配列、スケッチはセルごとの疎な表）"""
+
+    def __init__(self, grain: str):
+        self.grain = grain
+        self.first_period: Optional[int] = None
+        self.sums = np.zeros((0, 0))
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.mins = np.zeros((0, 0))
+        self.maxs = np.zeros((0, 0))
+        self.sketches: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def n_periods(self) -> int:
+        return self.sums.shape[1]
+
+    def _reserve(self, n_rows: int, lo: int, hi: int) -> None:
+        """系列数と期間 [lo, hi] が収まるように配列を拡張"""
+        first = lo if self.first_period is None else min(self.first_period, lo)
+        last = hi if self.first_period is None else max(self.first_period + self.n_periods - 1, hi)
+        before = 0 if self.first_period is None else self.first_period - first
+        shape = (max(n_rows, self.sums.shape[0]), last - first + 1)
+        if shape == self.sums.shape:
+            return
+        old_rows, old_periods = self.sums.shape
+        for name, fill, dtype in (('sums', 0.0, np.float64), ('counts', 0, np.int64),
+                                  ('mins', np.inf, np.float64), ('maxs', -np.inf, np.float64)):
+            grown = np.full(shape, fill, dtype=dtype)
+            grown[:old_rows, before:before + old_periods] = getattr(self, name)
+            setattr(self, name, grown)
+        self.first_period = first
+
+    def add(self, rows: np.ndarray, periods: np.ndarray, values: np.ndarray, n_rows: int) -> None:
+        """観測値を系列・期間のセルに加算"""
+        self._reserve(n_rows, int(periods.min()), int(periods.max()))
+        cols = periods - self.first_period
+        cells = rows * self.n_periods + cols
+        size = self.sums.size
+        self.sums += np.bincount(cells, weights=values, minlength=size).reshape(self.sums.shape)
+        self.counts += np.bincount(cells, minlength=size).reshape(self.counts.shape)
+        np.minimum.at(self.mins, (rows, cols), values)
+        np.maximum.at(self.maxs, (rows, cols), values)
+
+        # セル×バケット単位で件数をまとめてから、更新のあったセルのスケッチだけを統合
+        half = _SKETCH_KEY_SPAN // 2
+        codes, pair_counts = np.unique(cells * _SKETCH_KEY_SPAN + sketch_keys(values) + half, return_counts=True)
+        pair_cells, pair_keys = np.divmod(codes, _SKETCH_KEY_SPAN)
+        starts = np.flatnonzero(np.r_[True, np.diff(pair_cells) != 0])
+        for start, keys, counts in zip(starts, np.split(pair_keys - half, starts[1:]),
+                                       np.split(pair_counts.astype(np.float64), starts[1:])):
+            row, col = divmod(int(pair_cells[start]), self.n_periods)
+            cell = (row, col + self.first_period)
+            existing = self.sketches.get(cell)
+            if existing is None:
+                self.sketches[cell] = (keys, counts)
+            else:
+                self.sketches[cell] = merge_sketches(np.concatenate([existing[0], keys]),
+                                                     np.concatenate([existing[1], counts]))
+
+    def span(self, row: int, lo: int, hi: int) -> Tuple[slice, int, int]:
+        """期間 [lo, hi) のうち保持している範囲の列スライス"""
+        if self.first_period is None or row >= self.sums.shape[0]:
+            return slice(0, 0), lo, lo
+        start = min(max(lo - self.first_period, 0), self.n_periods)
+        stop = min(max(hi - self.first_period, start), self.n_periods)
+        return slice(start, stop), start + self.first_period, stop + self.first_period
+
+
+class KpiRollupStore:
+    """プロセス全体で共有するKPIロールアップストア"""
+
+    def __init__(self, grains: Sequence[str] = ROLLUP_GRAINS):
+        if 'day' not in grains:
+            raise ValueError("日次の粒度は必須です")
+        self.series: List[Tuple[str, str]] = []
+        self._index: Dict[Tuple[str, str], int] = {}
+        self.tables = {grain: RollupTable(grain) for grain in grains}
+        self.version = 0
+        # ソースごとの (取り込み済みの最終日, その日に取り込んだ行数)
+        self._watermarks: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _rows(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        """(指標, プロジェクト) を系列番号に変換（ロック取得済みで呼ぶ）"""
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self._index.get(key)
+            if row is None:
+                row = len(self.series)
+                self._index[key] = row
+                self.series.append(key)
+            rows[i] = row
+        return rows
+
+    def ingest(self, frame: pd.DataFrame, time_col: str, metrics: Sequence[str],
+               project_col: Optional[str] = None) -> int:
+        """観測値（時刻・プロジェクト・指標列）を全粒度の集計に加算し、取り込んだ行数を返す"""
+        if frame is None or len(frame) == 0:
+            return 0
+        days = day_numbers(frame[time_col].to_numpy())
+        if project_col:
+            projects = frame[project_col].astype(str).to_numpy()
+            project_names, project_index = np.unique(projects, return_inverse=True)
+        else:
+            project_names, project_index = np.array([], dtype=object), None
+
+        row_parts, day_parts, value_parts = [], [], []
+        with self._lock:
+            for metric in metrics:
+                values = pd.to_numeric(frame[metric], errors='coerce').to_numpy(dtype=np.float64)
+                valid = np.isfinite(values)
+                # プロジェクト別の系列に加えて、全体の系列にも同じ値を加算する
+                total_row = self._rows([(metric, ALL_PROJECTS)])
+                row_parts.append(np.repeat(total_row, valid.sum()))
+                day_parts.append(days[valid])
+                value_parts.append(values[valid])
+                if project_index is not None:
+                    project_rows = self._rows([(metric, str(name)) for name in project_names])
+                    row_parts.append(project_rows[project_index[valid]])
+                    day_parts.append(days[valid])
+                    value_parts.append(values[valid])
+
+            rows, days_all, values_all = (np.concatenate(parts) for parts in (row_parts, day_parts, value_parts))
+            if not len(rows):
+                return 0
+            for grain, table in self.tables.items():
+                table.add(rows, period_of(grain, days_all), values_all, len(self.series))
+            self.version += 1
+        return len(frame)
+
+    def sync_frame(self, source: str, frame: pd.DataFrame, time_col: str, metrics: Sequence[str],
+                   project_col: Optional[str] = None) -> int:
+        """ソースの追記分だけを取り込む（同じデータの再同期はほぼコストなし）
+
+        ソースは日付順に追記されるものとみなし、取り込み済みの最終日より後の行と、最終日の行のうち
+        前回までに取り込んだ行数より後ろの行を取り込む。最終日より前に遅れて届いた行は ingest() で加算する
+        """
+        if frame is None or len(frame) == 0:
+            return 0
+        days = day_numbers(frame[time_col].to_numpy())
+        # 同じソースの同期が並行して同じ行を二重に取り込まないよう、取り込みと透かしの更新をまとめて直列化
+        with self._sync_lock:
+            with self._lock:
+                last_day, seen = self._watermarks.get(source, (None, 0))
+            if last_day is None:
+                fresh = np.ones(len(days), dtype=bool)
+            else:
+                fresh = days > last_day
+                fresh[np.flatnonzero(days == last_day)[seen:]] = True
+            if not fresh.any():
+                return 0
+
+            ingested = self.ingest(frame[fresh], time_col, metrics, project_col)
+            # 取り込みが成功した場合のみ透かしを進める
+            newest = int(days.max())
+            on_newest = int((days == newest).sum())
+            with self._lock:
+                self._watermarks[source] = (newest, on_newest if newest != last_day else max(on_newest, seen))
+        return ingested
+
+    def _decompose(self, lo: int, hi: int) -> List[Tuple[str, int, int]]:
+        """日の範囲 [lo, hi) を、範囲に収まる最も粗い期間の連続区間 (粒度, 開始期間, 終了期間) に分割"""
+        pieces: List[Tuple[str, int, int]] = []
+        day = lo
+        while day < hi:
+            # 次の月初から丸1か月が範囲に収まるなら、週がその月初をまたがないようにする
+            month = int(period_of('month', np.array([day]))[0])
+            next_month, month_after = (int(d) for d in period_start('month', np.array([month + 1, month + 2])))
+            month_ahead = 'month' in self.tables and month_after <= hi
+            for grain in ('month', 'week', 'day'):
+                if grain not in self.tables:
+                    continue
+                period = int(period_of(grain, np.array([day]))[0])
+                if int(period_start(grain, np.array([period]))[0]) != day:
+                    continue
+                following = int(period_start(grain, np.array([period + 1]))[0])
+                if following > hi:
+                    continue
+                if grain == 'week' and month_ahead and day < next_month < following:
+                    continue
+                if pieces and pieces[-1][0] == grain and pieces[-1][2] == period:
+                    pieces[-1] = (grain, pieces[-1][1], period + 1)
+                else:
+                    pieces.append((grain, period, period + 1))
+                day = following
+                break
+        return pieces
+
+    def aggregate(self, metric: str, start: Any, end: Any, project: str = ALL_PROJECTS) -> RollupAggregate:
+        """期間 [start, end]（日付、両端を含む）の集計値"""
+        lo, hi = int(day_numbers(start)[0]), int(day_numbers(end)[0]) + 1
+        total, count, low, high = 0.0, 0, np.inf, -np.inf
+        keys, counts = [], []
+        with self._lock:
+            row = self._index.get((metric, project))
+            if row is not None:
+                for grain, first, last in self._decompose(lo, hi):
+                    table = self.tables[grain]
+                    cols, first, last = table.span(row, first, last)
+                    total += float(table.sums[row, cols].sum())
+                    count += int(table.counts[row, cols].sum())
+                    if cols.stop > cols.start:
+                        low = min(low, float(table.mins[row, cols].min()))
+                        high = max(high, float(table.maxs[row, cols].max()))
+                    for period in range(first, last):
+                        sketch = table.sketches.get((row, period))
+                        if sketch is not None:
+                            keys.append(sketch[0])
+                            counts.append(sketch[1])
+        if keys:
+            merged_keys, merged_counts = merge_sketches(np.concatenate(keys), np.concatenate(counts))
+        else:
+            merged_keys, merged_counts = np.array([], dtype=np.int64), np.array([])
+        return RollupAggregate(
+            metric=metric,
+            project=project,
+            start=np.datetime64(lo, 'D').astype(date),
+            end=np.datetime64(hi - 1, 'D').astype(date),
+            sum=total,
+            count=count,
+            min=low if count else float('nan'),
+            max=high if count else float('nan'),
+            sketch_keys=merged_keys,
+            sketch_counts=merged_counts
+        )
+
+    def compare(self, metric: str, start: Any, end: Any,
+                project: str = ALL_PROJECTS) -> Tuple[RollupAggregate, RollupAggregate]:
+        """期間の集計値と、その直前の同じ日数の期間の集計値"""
+        lo, hi = int(day_numbers(start)[0]), int(day_numbers(end)[0]) + 1
+        previous_end = np.datetime64(lo - 1, 'D')
+        previous_start = np.datetime64(lo - (hi - lo), 'D')
+        return (self.aggregate(metric, start, end, project),
+                self.aggregate(metric, previous_start, previous_end, project))
+
+    def frame(self, metrics: Sequence[str], start: Any, end: Any, grain: str = 'day',
+              project: str = ALL_PROJECTS, aggs: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """期間内の粒度ごとの集計表（date 列＋指標列。観測のない期間は除く）"""
+        aggs = aggs or {}
+        table = self.tables[grain]
+        lo = int(period_of(grain, day_numbers(start))[0])
+        hi = int(period_of(grain, day_numbers(end))[0]) + 1
+        columns: Dict[str, np.ndarray] = {}
+        observed = None
+        with self._lock:
+            for metric in metrics:
+                agg = aggs.get(metric, 'sum')
+                if agg not in AGGREGATIONS:
+                    raise ValueError(f"未対応の集計方法です: {agg}")
+                row = self._index.get((metric, project))
+                cols, first, last = table.span(row, lo, hi) if row is not None else (slice(0, 0), lo, lo)
+                if cols.stop == cols.start:
+                    values = np.full(hi - lo, np.nan)
+                    counts = np.zeros(hi - lo, dtype=np.int64)
+                else:
+                    sums = table.sums[row, cols]
+                    counts = table.counts[row, cols]
+                    values = {
+                        'sum': sums,
+                        'count': counts.astype(np.float64),
+                        'mean': np.divide(sums, counts, out=np.full(len(sums), np.nan), where=counts > 0),
+                        'min': np.where(counts > 0, table.mins[row, cols], np.nan),
+                        'max': np.where(counts > 0, table.maxs[row, cols], np.nan)
+                    }[agg]
+                    values = np.pad(values.astype(np.float64), (first - lo, hi - last), constant_values=np.nan)
+                    counts = np.pad(counts, (first - lo, hi - last))
+                columns[metric] = values
+                observed = counts > 0 if observed is None else observed | (counts > 0)
+
+        dates = pd.to_datetime(period_start(grain, np.arange(lo, hi)).astype('datetime64[D]'))
+        result = pd.DataFrame({'date': dates, **columns})
+        if observed is None:
+            return result.iloc[:0]
+        return result[observed].reset_index(drop=True)
+
+    def projects(self, metric: Optional[str] = None) -> List[str]:
+        """集計済みのプロジェクト（全体を除く）"""
+        with self._lock:
+            return sorted({p for m, p in self.series if p != ALL_PROJECTS and (metric is None or m == metric)})
+
+    def summary(self) -> Dict[str, Any]:
+        """ストアの保持状況"""
+        with self._lock:
+            return {
+                'series': len(self.series),
+                'version': self.version,
+                'periods': {grain: table.n_periods for grain, table in self.tables.items()},
+                'sketch_cells': sum(len(table.sketches) for table in self.tables.values())
+            }
+
+
+def trailing_range(days: int, end: Optional[Any] = None) -> Tuple[date, date]:
+    """終了日（省略時は今日）を含む直近 days 日間の (開始日, 終了日)"""
+    last = pd.Timestamp(end if end is not None else pd.Timestamp.now()).normalize().date()
+    return last - timedelta(days=days - 1), last
+
+
+# プロセス共通のKPIロールアップ（ページのリランやセッションをまたいで共有）
+kpi_rollups = KpiRollupStore()
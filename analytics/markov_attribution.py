@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+マルコフ連鎖アトリビューション
+開始・コンバージョン・離脱を吸収状態とする遷移行列を疎行列で構築し、除去効果（removal effect）で貢献度を算出
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from .attribution import TouchpointArrays
+
+# 対角要素の計算で一度に解く右辺の列数
+SOLVE_BLOCK_SIZE = 256
+
+@dataclass
+class MarkovStates:
+    """状態番号の割り当て（0: 開始, 1..C: チャネル, C+1: コンバージョン, C+2: 離脱）"""
+    n_channels: int
+
+    @property
+    def start(self) -> int:
+        return 0
+
+    @property
+    def conversion(self) -> int:
+        return self.n_channels + 1
+
+    @property
+    def null(self) -> int:
+        return self.n_channels + 2
+
+    @property
+    def size(self) -> int:
+        return self.n_channels + 3
+
+    def channel_state(self, channel_code: np.ndarray) -> np.ndarray:
+        return channel_code + 1
+
+@dataclass
+class MarkovAttributionResult:
+    """マルコフアトリビューション結果"""
+    channels: List[str]
+    conversion_probability: float
+    removal_effects: np.ndarray
+    credits: np.ndarray
+    transition_counts: sparse.csr_matrix
+
+    def to_dict(self) -> Dict[str, float]:
+        """{チャネル: 貢献値}（貢献の無いチャネルは除外）"""
+        return {self.channels[i]: float(self.credits[i]) for i in np.flatnonzero(self.credits)}
+
+    def removal_effect_dict(self) -> Dict[str, float]:
+        """{チャネル: 除去効果}"""
+        return {channel: float(effect) for channel, effect in zip(self.channels, self.removal_effects)}
+
+def transition_counts(arrays: TouchpointArrays) -> sparse.csr_matrix:
+    """全パスの状態遷移回数を疎行列で集計（開始→先頭、各タッチ→次、末尾→コンバージョン/離脱）"""
+    states = MarkovStates(len(arrays.channels))
+    n = len(arrays)
+    if n == 0:
+        return sparse.csr_matrix((states.size, states.size))
+
+    rank, length, _, starts = arrays.journey_layout()
+    channel_state = states.channel_state(arrays.channel.astype(np.int64))
+    is_last = rank == length - 1
+
+    # 次の行が同じジャーニーならそのチャネル、末尾ならコンバージョン/離脱へ
+    next_state = np.empty(n, dtype=np.int64)
+    next_state[:-1] = channel_state[1:]
+    next_state[is_last] = np.where(arrays.is_converted()[is_last], states.conversion, states.null)
+
+    from_state = np.concatenate([np.full(len(starts), states.start, dtype=np.int64), channel_state])
+    to_state = np.concatenate([channel_state[starts], next_state])
+
+    # COO → CSR で重複 (from, to) が合算される
+    return sparse.coo_matrix(
+        (np.ones(len(from_state)), (from_state, to_state)),
+        shape=(states.size, states.size)
+    ).tocsr()
+
+def channel_transition_matrix(arrays: TouchpointArrays) -> np.ndarray:
+    """チャネル間の遷移回数（C×C の密行列、可視化用）"""
+    counts = transition_counts(arrays)
+    n_channels = len(arrays.channels)
+    return counts[1:n_channels + 1, 1:n_channels + 1].toarray()
+
+def markov_attribution(arrays: TouchpointArrays,
+                       total_value: Optional[float] = None,
+                       counts: Optional[sparse.csr_matrix] = None) -> MarkovAttributionResult:
+    """除去効果によるマルコフ連鎖アトリビューション
+
+    N = (I - Q)^-1 を吸収連鎖の基本行列、x = N r を各状態からのコンバージョン確率とすると、
+    チャネル c を除去した場合の開始状態からのコンバージョン確率は
+    x_start - N[start, c] / N[c, c] * x_c となる（c を経由する経路分が失われる）。
+    これにより1回のLU分解でチャネル数分の除去効果をまとめて求める。
+    """
+    states = MarkovStates(len(arrays.channels))
+    n_channels = states.n_channels
+    counts = counts if counts is not None else transition_counts(arrays)
+
+    if total_value is None:
+        # ジャーニー毎に1回だけ価値を数える
+        rank, length, _, _ = arrays.journey_layout()
+        total_value = float(arrays.value[rank == length - 1].sum())
+
+    # 行正規化して遷移確率に
+    row_sums = np.asarray(counts.sum(axis=1)).ravel()
+    inv = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    probs = sparse.diags(inv) @ counts
+
+    transient = n_channels + 1  # 開始 + チャネル
+    q = probs[:transient, :transient].tocsc()
+    r_conv = probs[:transient, states.conversion].toarray().ravel()
+
+    empty = MarkovAttributionResult(
+        list(arrays.channels), 0.0, np.zeros(n_channels), np.zeros(n_channels), counts
+    )
+    if not r_conv.any():
+        return empty
+
+    lu = splu((sparse.identity(transient, format='csc') - q).tocsc())
+    x = lu.solve(r_conv)
+    p_conv = float(x[states.start])
+    if p_conv <= 0:
+        return empty
+
+    # N の開始行（転置系を1回解く）と対角要素（ブロック単位で解く）
+    e_start = np.zeros(transient)
+    e_start[states.start] = 1.0
+    n_start = lu.solve(e_start, trans='T')
+
+    n_diag = np.empty(transient)
+    for block_start in range(0, transient, SOLVE_BLOCK_SIZE):
+        block = np.arange(block_start, min(block_start + SOLVE_BLOCK_SIZE, transient))
+        rhs = np.zeros((transient, len(block)))
+        rhs[block, np.arange(len(block))] = 1.0
+        n_diag[block] = lu.solve(rhs)[block, np.arange(len(block))]
+
+    channel_states = np.arange(1, n_channels + 1)
+    lost = n_start[channel_states] / n_diag[channel_states] * x[channel_states]
+    removal_effects = np.clip(lost / p_conv, 0.0, 1.0)
+
+    total_effect = removal_effects.sum()
+    credits = removal_effects / total_effect * total_value if total_effect > 0 else np.zeros(n_channels)
+
+    return MarkovAttributionResult(list(arrays.channels), p_conv, removal_effects, credits, counts)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+次アクション予測（バッチ）
+顧客を特徴量バケットにまとめ、バケット毎に1回のAI呼び出し（またはルール評価）で推奨アクションを決定し、
+バケットのシグネチャでキャッシュする
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .background_jobs import job_runner, report_progress
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# バケット境界（predict_next_action のルールの閾値に合わせる）
+CHURN_BINS = [0.4, 0.7]             # ≤0.4 / ≤0.7 / >0.7
+ENGAGEMENT_BINS = [0.3, 0.6, 0.8]   # ≤0.3 / ≤0.6 / ≤0.8 / >0.8
+PURCHASE_BINS = [0, 2]              # 0 / 1-2 / 3+
+RECENCY_BINS = [30, 61]             # <30日 / 30-60日 / >60日
+TENURE_BINS = [7]                   # 獲得後7日以内 / それ以降
+
+# 予測キャッシュの有効期限（秒）
+PREDICTION_TTL_SECONDS = 60 * 60
+
+# AIへの同時リクエスト数
+AI_CONCURRENCY = 4
+
+# 1件のAI呼び出しのタイムアウト（秒）
+AI_TIMEOUT_SECONDS = 30
+
+Signature = Tuple[str, int, int, int, int, int]
+
+def _days_since(values: List[Any], now: np.datetime64) -> np.ndarray:
+    return ((now - pd.DatetimeIndex(values).to_numpy(dtype='datetime64[s]')) // np.timedelta64(1, 'D')).astype(np.int64)
+
+def feature_buckets(customers: List[Dict[str, Any]], now: Optional[datetime] = None) -> Tuple[List[Signature], np.ndarray, Dict[str, np.ndarray]]:
+    """顧客をバケットに分け、(シグネチャ一覧, 顧客→バケット番号, バケット平均特徴) を返す"""
+    now64 = np.datetime64(now or datetime.now(), 's')
+    count = len(customers)
+
+    churn = np.fromiter((c['churn_probability'] for c in customers), dtype=np.float64, count=count)
+    engagement = np.fromiter((c['engagement_score'] for c in customers), dtype=np.float64, count=count)
+    purchases = np.fromiter((c['total_purchases'] for c in customers), dtype=np.float64, count=count)
+    ltv = np.fromiter((c.get('ltv', 0.0) for c in customers), dtype=np.float64, count=count)
+    recency = _days_since([c['last_purchase'] for c in customers], now64)
+    tenure = _days_since([c['acquisition_date'] for c in customers], now64)
+    stage_codes, stages = pd.factorize(pd.Series([c.get('stage', 'unknown') for c in customers], dtype=object))
+
+    bins = np.column_stack([
+        stage_codes,
+        np.digitize(churn, CHURN_BINS, right=True),
+        np.digitize(engagement, ENGAGEMENT_BINS, right=True),
+        np.digitize(purchases, PURCHASE_BINS, right=True),
+        np.digitize(recency, RECENCY_BINS),
+        np.digitize(tenure, TENURE_BINS, right=True)
+    ])
+    unique_bins, inverse = np.unique(bins, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    sizes = np.bincount(inverse, minlength=len(unique_bins))
+    means = {
+        name: np.bincount(inverse, weights=values, minlength=len(unique_bins)) / np.maximum(sizes, 1)
+        for name, values in (('churn_probability', churn), ('engagement_score', engagement),
+                             ('total_purchases', purchases), ('ltv', ltv),
+                             ('days_since_purchase', recency), ('days_since_acquisition', tenure))
+    }
+    means['size'] = sizes
+
+    signatures = [(str(stages[row[0]]), *(int(v) for v in row[1:])) for row in unique_bins]
+    return signatures, inverse, means
+
+def rule_actions(signature: Signature, profile: Dict[str, float]) -> List[Dict[str, Any]]:
+    """ルールエンジン（predict_next_action のフォールバックと同じ判定をバケット単位で評価）"""
+    _, churn_bin, engagement_bin, purchase_bin, recency_bin, tenure_bin = signature
+    actions = []
+
+    if churn_bin == 2:
+        actions.append({
+            'action': 'チャーン防止キャンペーン',
+            'probability': float(profile['churn_probability']),
+            'timing': '即座に',
+            'channel': 'Email + SMS'
+        })
+
+    if purchase_bin == 0 and tenure_bin == 1:
+        actions.append({
+            'action': '初回購入促進',
+            'probability': 0.6,
+            'timing': '3日以内',
+            'channel': 'Retargeting Ad'
+        })
+
+    if engagement_bin == 3 and purchase_bin == 2:
+        actions.append({
+            'action': 'アップセル提案',
+            'probability': 0.7,
+            'timing': '次回訪問時',
+            'channel': 'In-app Message'
+        })
+
+    if recency_bin == 1:
+        actions.append({
+            'action': 'リピート購入促進',
+            'probability': 0.5,
+            'timing': '1週間以内',
+            'channel': 'Email'
+        })
+
+    if not actions:
+        actions.append({
+            'action': 'エンゲージメント向上',
+            'probability': 0.4,
+            'timing': '2週間以内',
+            'channel': 'Social Media'
+        })
+
+    return actions
+
+def _parse_actions(content: str) -> Optional[List[Dict[str, Any]]]:
+    """AI応答から next_actions を取り出す（コードブロック付きにも対応）"""
+    match = re.search(r'\{.*\}', content or '', re.DOTALL)
+    if not match:
+        return None
+    try:
+        actions = json.loads(match.group(0)).get('next_actions')
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(actions, list):
+        return None
+
+    parsed = []
+    for action in actions:
+        if isinstance(action, dict) and 'action' in action:
+            parsed.append({
+                'action': str(action['action']),
+                'probability': float(action.get('probability', 0.5)),
+                'timing': str(action.get('timing', '')),
+                'channel': str(action.get('channel', '')),
+                'reason': str(action.get('reason', ''))
+            })
+    return parsed or None
+
+class BatchPredictions:
+    """バッチ予測結果（顧客はバケット番号でアクションを参照）"""
+
+    def __init__(self, customer_ids: List[str], inverse: np.ndarray, actions: List[List[Dict[str, Any]]],
+                 sources: List[str]):
+        self.customer_ids = customer_ids
+        self.inverse = inverse
+        self.bucket_actions = actions
+        self.bucket_sources = sources
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.customer_ids)
+
+    def get(self, customer_id: str) -> Optional[List[Dict[str, Any]]]:
+        """顧客IDの推奨アクション"""
+        if self._index is None:
+            self._index = {cid: i for i, cid in enumerate(self.customer_ids)}
+        i = self._index.get(customer_id)
+        return self.bucket_actions[self.inverse[i]] if i is not None else None
+
+    def ai_share(self) -> float:
+        """AIで決定した顧客の割合"""
+        if not len(self):
+            return 0.0
+        from_ai = np.array([source == 'ai' for source in self.bucket_sources], dtype=bool)
+        return float(from_ai[self.inverse].mean())
+
+class PredictionJob:
+    """バックグラウンド実行中のバッチ予測（ページはリラン時に done を確認する）"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.result: Optional[BatchPredictions] = None
+        self.error: Optional[str] = None
+        # 共有ジョブランナー上のジョブID（ページはこれで進捗を参照する）
+        self.job_id: Optional[str] = None
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _finish(self, result: Optional[BatchPredictions] = None, error: Optional[str] = None):
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+class NextActionPredictor:
+    """特徴量バケット単位の次アクション予測"""
+
+    def __init__(self, ttl_seconds: float = PREDICTION_TTL_SECONDS, use_ai: Optional[bool] = None):
+        self.ttl_seconds = ttl_seconds
+        self.use_ai = use_ai if use_ai is not None else os.getenv('USE_MOCK_AI', 'false').lower() != 'true'
+        # シグネチャ -> (アクション, 決定元, 期限)
+        self._cache: Dict[Signature, Tuple[List[Dict[str, Any]], str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, signature: Signature) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+        with self._lock:
+            entry = self._cache.get(signature)
+            if entry and entry[2] > time.time():
+                return entry[0], entry[1]
+            return None
+
+    def _store(self, signature: Signature, actions: List[Dict[str, Any]], source: str):
+        with self._lock:
+            self._cache[signature] = (actions, source, time.time() + self.ttl_seconds)
+
+    def predict_rules(self, customers: List[Dict[str, Any]], now: Optional[datetime] = None) -> BatchPredictions:
+        """ルールのみで即時予測（キャッシュ済みのAI結果があればそれを使う）"""
+        signatures, inverse, means = feature_buckets(customers, now)
+        actions, sources = [], []
+        for b, signature in enumerate(signatures):
+            cached = self._cached(signature)
+            if cached is None:
+                cached = (rule_actions(signature, {k: v[b] for k, v in means.items()}), 'rules')
+            actions.append(cached[0])
+            sources.append(cached[1])
+        return BatchPredictions([c['id'] for c in customers], inverse, actions, sources)
+
+    async def predict_async(self,
+                            customers: List[Dict[str, Any]],
+                            context: Optional[Dict[str, Any]] = None,
+                            now: Optional[datetime] = None) -> BatchPredictions:
+        """未キャッシュのバケットだけAIを呼び（並列・上限あり）、顧客毎の推奨アクションを返す"""
+        signatures, inverse, means = feature_buckets(customers, now)
+        actions: List[Optional[List[Dict[str, Any]]]] = [None] * len(signatures)
+        sources = ['rules'] * len(signatures)
+        semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+        resolved = 0
+
+        def advance():
+            nonlocal resolved
+            resolved += 1
+            report_progress(resolved / len(signatures), f"次アクション予測: {resolved}/{len(signatures)}グループ")
+
+        async def resolve(b: int, signature: Signature):
+            cached = self._cached(signature)
+            if cached is not None:
+                actions[b], sources[b] = cached
+                advance()
+                return
+
+            profile = {k: float(v[b]) for k, v in means.items()}
+            result, source = None, 'rules'
+            if self.use_ai:
+                async with semaphore:
+                    result = await self._ask_ai(signature, profile, context or {})
+                source = 'ai' if result else 'rules'
+            if not result:
+                result = rule_actions(signature, profile)
+
+            self._store(signature, result, source)
+            actions[b], sources[b] = result, source
+            advance()
+
+        await asyncio.gather(*(resolve(b, s) for b, s in enumerate(signatures)))
+        logger.info(f"次アクション予測: 顧客{len(customers)}件 / バケット{len(signatures)}件")
+        return BatchPredictions([c['id'] for c in customers], inverse, actions, sources)
+
+    async def _ask_ai(self, signature: Signature, profile: Dict[str, float],
+                      context: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """1バケット分の推奨アクションをAIに問い合わせる（失敗時は None）"""
+        try:
+            from config.ai_client import ai_client
+            from config.ai_models import TaskType
+
+            prompt = f"""
+            以下の顧客グループに対する次の推奨アクションを提案してください。
+
+            グループプロファイル（{int(profile['size'])}人の平均）:
+            - 現在ステージ: {signature[0]}
+            - 購入回数: {profile['total_purchases']:.1f}
+            - エンゲージメントスコア: {profile['engagement_score']:.2f}
+            - チャーンリスク: {profile['churn_probability']:.2f}
+            - LTV: {profile['ltv']:.0f}
+            - 最終購入からの日数: {profile['days_since_purchase']:.0f}
+            - 獲得からの日数: {profile['days_since_acquisition']:.0f}
+
+            ジャーニーコンテキスト:
+            - 総顧客数: {context.get('total_customers', 0)}
+            - アクティブステージ: {list(context.get('journey_metrics', {}).keys())}
+
+            以下の形式でJSON回答してください：
+            {{
+                "next_actions": [
+                    {{
+                        "action": "推奨アクション名",
+                        "probability": 0.8,
+                        "timing": "実行タイミング",
+                        "channel": "推奨チャネル",
+                        "reason": "選択理由"
+                    }}
+                ]
+            }}
+            """
+
+            response = await asyncio.wait_for(
+                ai_client.generate_content(prompt, TaskType.DATA_ANALYSIS),
+                timeout=AI_TIMEOUT_SECONDS
+            )
+            return _parse_actions(response.content)
+        except Exception as e:
+            logger.warning(f"次アクションのAI予測に失敗したためルールで代替します: {e}")
+            return None
+
+    def start(self,
+              customers: List[Dict[str, Any]],
+              context: Optional[Dict[str, Any]] = None) -> PredictionJob:
+        """バッチ予測を共有のジョブランナーで開始（呼び出し元はブロックしない）"""
+        job = PredictionJob()
+        customers = list(customers)
+
+        async def run():
+            try:
+                job._finish(result=await self.predict_async(customers, context))
+            except Exception as e:
+                logger.error(f"次アクションのバッチ予測エラー: {e}")
+                job._finish(error=str(e))
+
+        job.job_id = job_runner.submit(run(), name="next_action_batch")
+        return job
+
+    def clear_cache(self):
+        """予測キャッシュを破棄"""
+        with self._lock:
+            self._cache.clear()
+
+# プロセス共通の予測器（キャッシュをセッション間で共有）
+next_action_predictor = NextActionPredictor()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+ページ計算の共有キャッシュ
+（関数, 入力のフィンガープリント, データバージョン）をキーに、重いデータ生成・モデル計算の結果を
+セッションをまたいでプロセス内で共有する（件数・容量の上限、TTL、データ更新時の無効化、ヒット率の計測）
+"""
+
+import sys
+import copy
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, fields, is_dataclass
+from datetime import date, datetime, timedelta
+from enum import Enum
+from functools import wraps
+from typing import Dict, List, Any, Optional, Callable, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# キャッシュの件数・容量の上限と、既定の有効期間（秒）
+MAX_CACHE_ENTRIES = 512
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_CACHE_TTL_SECONDS = 3600
+
+# サイズ見積もりでコンテナを辿る深さの上限
+SIZE_ESTIMATE_DEPTH = 4
+
+
+def _update_fingerprint(h, value: Any) -> None:
+    """値の内容をハッシュに反映（DataFrame・配列は内容のバイト列、コンテナは再帰）"""
+    if isinstance(value, pd.DataFrame):
+        h.update(b'df')
+        h.update(repr((list(value.columns), [str(t) for t in value.dtypes], value.shape)).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        h.update(b'series')
+        h.update(repr((value.name, str(value.dtype))).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        h.update(b'nd')
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        if value.dtype.kind == 'O':
+            for item in value.ravel():
+                _update_fingerprint(h, item)
+        else:
+            h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(b'dict%d' % len(value))
+        for key in sorted(value, key=repr):
+            _update_fingerprint(h, key)
+            _update_fingerprint(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(b'seq%d' % len(value))
+        for item in value:
+            _update_fingerprint(h, item)
+    elif isinstance(value, (set, frozenset)):
+        h.update(b'set%d' % len(value))
+        for item in sorted(value, key=repr):
+            _update_fingerprint(h, item)
+    elif is_dataclass(value) and not isinstance(value, type):
+        h.update(type(value).__qualname__.encode())
+        for f in fields(value):
+            _update_fingerprint(h, f.name)
+            _update_fingerprint(h, getattr(value, f.name))
+    elif isinstance(value, (str, bytes, int, float, bool, complex, type(None), np.generic,
+                            datetime, date, timedelta, pd.Timestamp, Enum)):
+        h.update(type(value).__name__.encode())
+        h.update(repr(value).encode())
+    else:
+        # 内容を比較できないオブジェクトは同一インスタンスのときだけ一致させる
+        h.update(f"{type(value).__qualname__}@{id(value)}".encode())
+
+
+def fingerprint(*args, **kwargs) -> str:
+    """関数の入力（位置引数・キーワード引数）のフィンガープリント"""
+    h = hashlib.sha1()
+    _update_fingerprint(h, args)
+    _update_fingerprint(h, kwargs)
+    return h.hexdigest()
+
+
+def estimate_size(value: Any, depth: int = 0) -> int:
+    """キャッシュ値のおおよそのメモリ使用量（バイト）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if depth >= SIZE_ESTIMATE_DEPTH:
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, depth + 1) + estimate_size(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, depth + 1) for item in value)
+    if is_dataclass(value) and not isinstance(value, type):
+        return size + sum(estimate_size(getattr(value, f.name), depth + 1) for f in fields(value))
+    return size
+
+
+def function_id(fn: Callable) -> str:
+    """関数の識別子（ページスクリプトはすべて __main__ のためファイル名と処理内容で区別）"""
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', repr(fn))}"
+    digest = hashlib.sha1(code.co_code).hexdigest()[:8]
+    return f"{code.co_filename}:{fn.__qualname__}:{digest}"
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュ済みの計算結果"""
+    value: Any
+    size: int
+    expires_at: float
+    compute_seconds: float
+    function: str
+
+
+@dataclass
+class FunctionStats:
+    """関数別のキャッシュ利用状況"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    compute_seconds: float = 0.0
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+
+class PageCache:
+    """セッション間で共有するLRU・TTL付きの計算結果キャッシュ"""
+
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES, max_bytes: int = MAX_CACHE_BYTES,
+                 default_ttl: float = DEFAULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[Tuple, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[str, int] = {}
+        self._stats: Dict[str, FunctionStats] = {}
+        self._inflight: Dict[Tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def data_version(self, namespace: str) -> int:
+        """名前空間（データソース）の現在のバージョン"""
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """データ更新時に名前空間のバージョンを進め、依存するキャッシュを破棄（省略時は全件）"""
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                self._bytes = 0
+                self._versions = {name: version + 1 for name, version in self._versions.items()}
+                return
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            stale = [key for key in self._entries if namespace in dict(key[2])]
+            for key in stale:
+                self._remove(key)
+        logger.debug(f"キャッシュ無効化: {namespace} ({len(stale)}件)")
+
+    def call(self, fn: Callable, *args, depends_on: Sequence[str] = (), ttl: Optional[float] = None,
+             copy_result: bool = False, **kwargs) -> Any:
+        """fn(*args, **kwargs) の結果をキャッシュから返す（未計算・期限切れなら計算して保存）"""
+        name = function_id(fn)
+        with self._lock:
+            versions = tuple(sorted((ns, self._versions.get(ns, 0)) for ns in depends_on))
+        key = (name, fingerprint(*args, **kwargs), versions)
+
+        while True:
+            with self._lock:
+                stats = self._stats.setdefault(name, FunctionStats())
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    stats.hits += 1
+                    stats.saved_seconds += entry.compute_seconds
+                    value = entry.value
+                    break
+                if entry is not None:
+                    self._remove(key)
+                # 同じキーを計算中のスレッドがあれば完了を待って結果を共有
+                pending = self._inflight.get(key)
+                if pending is None:
+                    self._inflight[key] = threading.Event()
+                    stats.misses += 1
+            if pending is not None:
+                pending.wait()
+                continue
+
+            try:
+                started = time.perf_counter()
+                value = fn(*args, **kwargs)
+                elapsed = time.perf_counter() - started
+                self._store(key, value, elapsed, self.default_ttl if ttl is None else ttl)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key).set()
+            break
+
+        return copy.deepcopy(value) if copy_result else value
+
+    def cached(self, depends_on: Sequence[str] = (), ttl: Optional[float] = None,
+               copy_result: bool = False) -> Callable:
+        """関数をキャッシュ経由で呼び出すデコレーター"""
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                return self.call(fn, *args, depends_on=depends_on, ttl=ttl, copy_result=copy_result, **kwargs)
+            wrapper.invalidate = lambda: self.invalidate_function(fn)
+            return wrapper
+        return decorator
+
+    def invalidate_function(self, fn: Callable) -> int:
+        """関数のキャッシュをすべて破棄"""
+        name = function_id(fn)
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == name]
+            for key in stale:
+                self._remove(key)
+        return len(stale)
+
+    def _store(self, key: Tuple, value: Any, elapsed: float, ttl: float) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            logger.info(f"キャッシュ容量を超えるため保存しません: {key[0]} ({size / 1e6:.1f}MB)")
+            return
+        with self._lock:
+            stats = self._stats.setdefault(key[0], FunctionStats())
+            stats.compute_seconds += elapsed
+            # 計算中に依存データが更新された場合は古いバージョンの結果を保存しない
+            if any(self._versions.get(ns, 0) != version for ns, version in key[2]):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(value, size, time.time() + ttl, elapsed, key[0])
+            self._bytes += size
+            self._evict()
+
+    def _remove(self, key: Tuple) -> None:
+        """エントリを削除（ロック保持中に呼ぶ）"""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        """期限切れ、次に最も使われていないエントリから上限内まで削除（ロック保持中に呼ぶ）"""
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+            self._remove(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._stats[key[0]].evictions += 1
+            self._remove(key)
+
+    def stats(self) -> pd.DataFrame:
+        """関数別のヒット率・計算時間・削減時間・保持件数"""
+        with self._lock:
+            counts: Dict[str, List[int]] = {}
+            for entry in self._entries.values():
+                count = counts.setdefault(entry.function, [0, 0])
+                count[0] += 1
+                count[1] += entry.size
+            rows = [{
+                'function': name.split(':')[-2] if ':' in name else name,
+                'hits': s.hits,
+                'misses': s.misses,
+                'hit_rate': s.hit_rate,
+                'evictions': s.evictions,
+                'compute_seconds': s.compute_seconds,
+                'saved_seconds': s.saved_seconds,
+                'entries': counts.get(name, [0, 0])[0],
+                'bytes': counts.get(name, [0, 0])[1]
+            } for name, s in self._stats.items()]
+        return pd.DataFrame(rows, columns=['function', 'hits', 'misses', 'hit_rate', 'evictions',
+                                           'compute_seconds', 'saved_seconds', 'entries', 'bytes'])
+
+    def summary(self) -> Dict[str, float]:
+        """キャッシュ全体の利用状況"""
+        with self._lock:
+            hits = sum(s.hits for s in self._stats.values())
+            misses = sum(s.misses for s in self._stats.values())
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'saved_seconds': sum(s.saved_seconds for s in self._stats.values())
+            }
+
+
+# プロセス共通のキャッシュ（ページのリランやセッションをまたいで共有）
+page_cache = PageCache()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+価格分析エンジン
+Van Westendorp PSM（価格感度測定）の累積曲線を回答価格の一度のソートと重み集計で一括計算し、
+OPP/IPP/PMC/PME の交点を区分線形曲線の厳密な交点として求める（重み付き回答・ブートストラップ信頼区間に対応）
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# PSMの交点（キー -> 表示名）
+PSM_POINTS = {
+    'pmc': '最低品質保証価格 (PMC)',
+    'opp': '最適価格 (OPP)',
+    'ipp': '妥協価格 (IPP)',
+    'pme': '最高価格 (PME)'
+}
+
+# ブートストラップの1回あたりに処理する「反復×回答者」の要素数の上限（メモリ使用量の目安）
+BOOTSTRAP_CHUNK_ELEMENTS = 4_000_000
+
+# 曲線の表示用グリッドの点数
+DEFAULT_GRID_POINTS = 200
+
+# 累積曲線の差を0とみなす許容誤差（割合の計算の丸め誤差）
+CROSSING_TOLERANCE = 1e-12
+
+
+@dataclass
+class PsmResult:
+    """PSM分析の結果（曲線は回答価格の各ブレークポイントでの割合 0〜1）"""
+    prices: np.ndarray
+    too_cheap: np.ndarray
+    cheap: np.ndarray
+    expensive: np.ndarray
+    too_expensive: np.ndarray
+    points: Dict[str, float]
+    respondents: int
+    dropped: int
+    total_weight: float
+    intervals: Dict[str, Tuple[float, float]] = field(default_factory=dict)
+    confidence: Optional[float] = None
+
+    @property
+    def acceptable_range(self) -> Tuple[float, float]:
+        """受容価格帯（PMC〜PME）"""
+        return self.points['pmc'], self.points['pme']
+
+    @property
+    def optimal_price(self) -> float:
+        return self.points['opp']
+
+    def curve_frame(self, grid_points: int = DEFAULT_GRID_POINTS) -> pd.DataFrame:
+        """表示用の等間隔グリッド上の累積曲線（%）"""
+        grid = np.linspace(self.prices[0], self.prices[-1], grid_points)
+        curves = {
+            'price': grid,
+            'too_cheap': np.interp(grid, self.prices, self.too_cheap),
+            'cheap': np.interp(grid, self.prices, self.cheap),
+            'expensive': np.interp(grid, self.prices, self.expensive),
+            'too_expensive': np.interp(grid, self.prices, self.too_expensive)
+        }
+        frame = pd.DataFrame(curves)
+        frame['not_cheap'] = 1 - frame['cheap']
+        frame['not_expensive'] = 1 - frame['expensive']
+        frame[frame.columns[1:]] *= 100
+        return frame
+
+
+def _crossing(prices: np.ndarray, diff: np.ndarray) -> np.ndarray:
+    """価格に対して非増加な差分 diff（最後の軸がブレークポイント）が0を横切る価格を線形補間で求める
+
+    両曲線が一致したまま（例: どちらも0%）の区間がある場合は、その区間の中点を交点とする
+    """
+    last = diff.shape[-1] - 1
+    below = diff <= CROSSING_TOLERANCE
+    k = np.where(below.any(axis=-1), below.argmax(axis=-1), last)
+    prev = np.maximum(k - 1, 0)
+    d0 = np.take_along_axis(diff, prev[..., None], axis=-1)[..., 0]
+    d1 = np.take_along_axis(diff, k[..., None], axis=-1)[..., 0]
+    p0, p1 = prices[prev], prices[k]
+    step = d0 - d1
+    t = np.divide(d0, step, out=np.zeros_like(d0, dtype=np.float64), where=(step > 0) & (k > 0))
+    crossing = p0 + np.clip(t, 0.0, 1.0) * (p1 - p0)
+
+    # 差が0のまま続く区間の終わり（最初に負になる直前のブレークポイント）
+    negative = diff < -CROSSING_TOLERANCE
+    end = np.maximum(np.where(negative.any(axis=-1), negative.argmax(axis=-1) - 1, last), k)
+    return np.where(np.abs(d1) <= CROSSING_TOLERANCE, (crossing + prices[end]) / 2, crossing)
+
+
+def _curves(totals: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """ブレークポイント別の回答重み（質問×…×価格）から4本の累積曲線を計算"""
+    cum = np.cumsum(totals, axis=-1)
+    total = cum[..., -1:]
+    share_at_or_below = cum / total
+    share_at_or_above = 1 - (cum - totals) / total
+    return share_at_or_above[0], share_at_or_above[1], share_at_or_below[2], share_at_or_below[3]
+
+
+def _points(prices: np.ndarray, too_cheap, cheap, expensive, too_expensive) -> Dict[str, np.ndarray]:
+    """4つの交点（安すぎる・安いは価格とともに減少、高い・高すぎるは増加）"""
+    return {
+        'pmc': _crossing(prices, too_cheap - (1 - cheap)),
+        'opp': _crossing(prices, too_cheap - too_expensive),
+        'ipp': _crossing(prices, cheap - expensive),
+        'pme': _crossing(prices, (1 - expensive) - too_expensive)
+    }
+
+
+def psm_analysis(too_cheap: Sequence[float], cheap: Sequence[float], expensive: Sequence[float],
+                 too_expensive: Sequence[float], weights: Optional[Sequence[float]] = None,
+                 drop_inconsistent: bool = True, n_bootstrap: int = 0, confidence: float = 0.95,
+                 seed: Optional[int] = 0) -> PsmResult:
+    """回答者ごとの4つの価格回答からPSMの累積曲線と交点を計算"""
+    answers = np.vstack([np.asarray(a, dtype=np.float64) for a in (too_cheap, cheap, expensive, too_expensive)])
+    n = answers.shape[1]
+    w = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    if len(w) != n:
+        raise ValueError("回答数とウェイト数が一致しません")
+
+    valid = np.isfinite(answers).all(axis=0) & (w > 0)
+    if drop_inconsistent:
+        # 安すぎる ≤ 安い ≤ 高い ≤ 高すぎる の順になっていない回答は除外
+        valid &= (np.diff(answers, axis=0) >= 0).all(axis=0)
+    dropped = int(n - valid.sum())
+    answers, w = answers[:, valid], w[valid]
+    if answers.shape[1] == 0:
+        raise ValueError("有効な回答がありません")
+    if dropped:
+        logger.info(f"PSM: 矛盾または欠損のある回答 {dropped}件を除外しました")
+
+    # 全質問の回答価格をブレークポイントとして、回答ごとの位置を一度だけ求める
+    prices, index = np.unique(answers, return_inverse=True)
+    index = index.reshape(answers.shape)
+    k = len(prices)
+    totals = np.stack([np.bincount(index[q], weights=w, minlength=k) for q in range(4)])
+    curves = _curves(totals)
+    points = {name: float(value) for name, value in _points(prices, *curves).items()}
+
+    intervals = {}
+    if n_bootstrap > 0:
+        samples = _bootstrap_points(prices, index, w, n_bootstrap, seed)
+        alpha = (1 - confidence) / 2
+        intervals = {
+            name: (float(np.nanquantile(values, alpha)), float(np.nanquantile(values, 1 - alpha)))
+            for name, values in samples.items()
+        }
+
+    return PsmResult(
+        prices=prices,
+        too_cheap=curves[0],
+        cheap=curves[1],
+        expensive=curves[2],
+        too_expensive=curves[3],
+        points=points,
+        respondents=int(answers.shape[1]),
+        dropped=dropped,
+        total_weight=float(w.sum()),
+        intervals=intervals,
+        confidence=confidence if n_bootstrap > 0 else None
+    )
+
+
+def _bootstrap_points(prices: np.ndarray, index: np.ndarray, weights: np.ndarray, n_bootstrap: int,
+                      seed: Optional[int]) -> Dict[str, np.ndarray]:
+    """回答者単位のリサンプリング（ポアソン重み）で交点の分布を一括計算"""
+    rng = np.random.default_rng(seed)
+    n, k = index.shape[1], len(prices)
+    chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // n)
+    results = {name: [] for name in PSM_POINTS}
+    for start in range(0, n_bootstrap, chunk):
+        b = min(chunk, n_bootstrap - start)
+        replicate = rng.poisson(1.0, (b, n)) * weights
+        # (反復, 回答者) の重みを (質問, 反復, ブレークポイント) に集計
+        offsets = np.arange(b)[:, None] * k
+        totals = np.stack([
+            np.bincount((offsets + index[q]).ravel(), weights=replicate.ravel(), minlength=b * k).reshape(b, k)
+            for q in range(4)
+        ])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            points = _points(prices, *_curves(totals))
+        for name, values in points.items():
+            results[name].append(values)
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def simulate_psm_responses(n: int = 1000, center: float = 1500.0, seed: Optional[int] = 42) -> pd.DataFrame:
+    """デモ用のPSM回答（回答者ごとに 安すぎる < 安い < 高い < 高すぎる）を生成"""
+    rng = np.random.default_rng(seed)
+    anchor = center * rng.lognormal(0, 0.25, n)
+    ratios = np.cumsum(rng.lognormal(np.log([0.35, 0.5, 0.6, 0.55]), 0.2, (n, 4)), axis=1)
+    answers = np.round(anchor[:, None] * ratios / ratios[:, 1:3].mean(axis=1, keepdims=True), -1)
+    return pd.DataFrame(answers, columns=['too_cheap', 'cheap', 'expensive', 'too_expensive'])
+
+
+# 需要曲線の推定ができない（価格が1点しかない）プランに使う弾力性の事前値と標準偏差
+DEFAULT_CONVERSION_ELASTICITY = (-1.0, 0.5)
+DEFAULT_CHURN_ELASTICITY = (0.5, 0.5)
+
+# 月次解約率の上限
+MAX_MONTHLY_CHURN = 0.9
+
+# モンテカルロの標本数と、月ごとの需要のばらつき（対数標準偏差）のデフォルト
+DEFAULT_SIMULATION_SAMPLES = 300
+DEFAULT_DEMAND_NOISE = 0.1
+
+# デモ用の価格テストを生成するプラン別の想定値（基準価格, 基準CV率, CV弾力性, 基準解約率, 解約弾力性, 顧客あたり月額原価）
+SIMULATED_PLAN_PROFILES = {
+    'Starter': (980.0, 0.045, -1.6, 0.06, 0.6, 350.0),
+    'Pro': (2980.0, 0.018, -1.3, 0.035, 0.4, 700.0),
+    'Enterprise': (9800.0, 0.006, -0.8, 0.015, 0.5, 2000.0)
+}
+
+
+@dataclass
+class DemandModel:
+    """プラン別の定弾力性の需要・解約モデル（rate = base * (price / ref_price) ** elasticity）"""
+    plans: np.ndarray
+    ref_price: np.ndarray
+    conversion: np.ndarray
+    conversion_cov: np.ndarray
+    churn: np.ndarray
+    churn_cov: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.plans)
+
+    @property
+    def conversion_elasticity(self) -> np.ndarray:
+        return self.conversion[:, 1]
+
+    @property
+    def churn_elasticity(self) -> np.ndarray:
+        return self.churn[:, 1]
+
+    def conversion_rate(self, prices: np.ndarray) -> np.ndarray:
+        """価格（最後の軸がプラン）でのコンバージョン率の点推定"""
+        return np.exp(self.conversion[:, 0] + self.conversion[:, 1] * np.log(prices / self.ref_price))
+
+    def churn_rate(self, prices: np.ndarray) -> np.ndarray:
+        """価格（最後の軸がプラン）での月次解約率の点推定"""
+        rate = np.exp(self.churn[:, 0] + self.churn[:, 1] * np.log(prices / self.ref_price))
+        return np.minimum(rate, MAX_MONTHLY_CHURN)
+
+    def to_frame(self) -> pd.DataFrame:
+        """プラン別の推定値"""
+        return pd.DataFrame({
+            'plan': self.plans,
+            'ref_price': self.ref_price,
+            'conversion_rate': np.exp(self.conversion[:, 0]),
+            'conversion_elasticity': self.conversion[:, 1],
+            'conversion_elasticity_se': np.sqrt(self.conversion_cov[:, 1, 1]),
+            'churn_rate': np.exp(self.churn[:, 0]),
+            'churn_elasticity': self.churn[:, 1],
+            'churn_elasticity_se': np.sqrt(self.churn_cov[:, 1, 1])
+        })
+
+    def sample(self, n: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """推定誤差を反映したパラメータの標本（標本×プラン×[切片, 弾力性]）を需要・解約それぞれで生成"""
+        return _sample_normal(self.conversion, self.conversion_cov, n, rng), _sample_normal(self.churn, self.churn_cov, n, rng)
+
+
+def _sample_normal(mean: np.ndarray, cov: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    """プランごとの2変量正規分布から一括で標本を生成（2×2のコレスキー分解を直接計算）"""
+    a = np.sqrt(np.maximum(cov[:, 0, 0], 0.0))
+    b = np.divide(cov[:, 0, 1], a, out=np.zeros_like(a), where=a > 0)
+    c = np.sqrt(np.maximum(cov[:, 1, 1] - b * b, 0.0))
+    z = rng.standard_normal((n, len(mean), 2))
+    return mean + np.stack([a * z[..., 0], b * z[..., 0] + c * z[..., 1]], axis=-1)
+
+
+def _fit_log_linear(inverse: np.ndarray, k: int, x: np.ndarray, events: np.ndarray, exposure: np.ndarray,
+                    prior: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+    """プラン別に log(率) = 切片 + 弾力性 * log(価格/基準価格) を重み付き最小二乗で一括推定（係数と共分散）"""
+    y = np.log((events + 0.5) / np.maximum(exposure, 1.0))
+    w = events + 0.5
+
+    def total(values):
+        return np.bincount(inverse, weights=values, minlength=k)
+
+    sw = total(w)
+    x_mean, y_mean = total(w * x) / sw, total(w * y) / sw
+    dx, dy = x - x_mean[inverse], y - y_mean[inverse]
+    sxx, sxy = total(w * dx * dx), total(w * dx * dy)
+    identified = sxx > 1e-9
+    slope = np.where(identified, np.divide(sxy, sxx, out=np.zeros(k), where=identified), prior[0])
+    intercept = y_mean - slope * x_mean
+
+    # 過分散を残差から推定（ポアソン近似の分散を下回らない）
+    n = np.bincount(inverse, minlength=k)
+    resid = y - intercept[inverse] - slope[inverse] * x
+    dispersion = np.maximum(np.divide(total(w * resid * resid), n - 2, out=np.ones(k), where=n > 2), 1.0)
+
+    cov = np.zeros((k, 2, 2))
+    slope_var = np.where(identified, np.divide(dispersion, sxx, out=np.zeros(k), where=identified), prior[1] ** 2)
+    cov[:, 1, 1] = slope_var
+    cov[:, 0, 1] = cov[:, 1, 0] = -x_mean * slope_var
+    cov[:, 0, 0] = dispersion / sw + x_mean * x_mean * slope_var
+    return np.stack([intercept, slope], axis=1), cov
+
+
+def fit_demand_curves(observations: pd.DataFrame, plan_col: str = 'plan', price_col: str = 'price',
+                      visitors_col: str = 'visitors', conversions_col: str = 'conversions',
+                      customers_col: str = 'customers', churned_col: str = 'churned') -> DemandModel:
+    """価格テストの観測（プラン・価格・訪問数・CV数・既存顧客数・解約数）からプラン別の需要・解約曲線を推定"""
+    df = observations[observations[price_col] > 0]
+    plans, inverse = np.unique(df[plan_col].to_numpy().astype(str), return_inverse=True)
+    k = len(plans)
+    price = df[price_col].to_numpy(dtype=np.float64)
+    visitors = df[visitors_col].to_numpy(dtype=np.float64)
+
+    # 基準価格は訪問数で重み付けした幾何平均
+    ref_price = np.exp(np.bincount(inverse, weights=visitors * np.log(price), minlength=k)
+                       / np.bincount(inverse, weights=visitors, minlength=k))
+    x = np.log(price / ref_price[inverse])
+
+    conversion, conversion_cov = _fit_log_linear(
+        inverse, k, x, df[conversions_col].to_numpy(dtype=np.float64), visitors, DEFAULT_CONVERSION_ELASTICITY
+    )
+    if customers_col in df and churned_col in df:
+        churn, churn_cov = _fit_log_linear(
+            inverse, k, x, df[churned_col].to_numpy(dtype=np.float64),
+            df[customers_col].to_numpy(dtype=np.float64), DEFAULT_CHURN_ELASTICITY
+        )
+    else:
+        churn = np.tile([np.log(0.05), DEFAULT_CHURN_ELASTICITY[0]], (k, 1))
+        churn_cov = np.zeros((k, 2, 2))
+        churn_cov[:, 1, 1] = DEFAULT_CHURN_ELASTICITY[1] ** 2
+
+    return DemandModel(plans=plans, ref_price=ref_price, conversion=conversion, conversion_cov=conversion_cov,
+                       churn=churn, churn_cov=churn_cov)
+
+
+def demand_model_from_rates(plans: Sequence[str], prices: Sequence[float], conversion_rates: Sequence[float],
+                            churn_rates: Sequence[float], conversion_elasticity: Tuple[float, float] = DEFAULT_CONVERSION_ELASTICITY,
+                            churn_elasticity: Tuple[float, float] = DEFAULT_CHURN_ELASTICITY) -> DemandModel:
+    """価格テストの観測がない場合に、現行の率と弾力性の想定（平均, 標準偏差）からモデルを構成"""
+    k = len(plans)
+    conversion_cov = np.zeros((k, 2, 2))
+    conversion_cov[:, 1, 1] = conversion_elasticity[1] ** 2
+    churn_cov = np.zeros((k, 2, 2))
+    churn_cov[:, 1, 1] = churn_elasticity[1] ** 2
+    return DemandModel(
+        plans=np.asarray(plans, dtype=str),
+        ref_price=np.asarray(prices, dtype=np.float64),
+        conversion=np.stack([np.log(conversion_rates), np.full(k, conversion_elasticity[0])], axis=1),
+        conversion_cov=conversion_cov,
+        churn=np.stack([np.log(churn_rates), np.full(k, churn_elasticity[0])], axis=1),
+        churn_cov=churn_cov
+    )
+
+
+def price_grid(model: DemandModel, multipliers: Sequence[float], months: int) -> np.ndarray:
+    """基準価格に対する倍率のグリッドから一定価格のシナリオ（シナリオ×プラン×月）を作成"""
+    multipliers = np.asarray(multipliers, dtype=np.float64)
+    prices = multipliers[:, None] * model.ref_price[None, :]
+    return np.repeat(prices[:, :, None], months, axis=2)
+
+
+@dataclass
+class PricingSimulation:
+    """価格シナリオ×プラン×月の収益シミュレーション結果（先頭の軸はモンテカルロ標本）"""
+    plans: np.ndarray
+    prices: np.ndarray
+    new_customers: np.ndarray
+    churned: np.ndarray
+    customers: np.ndarray
+    mrr: np.ndarray
+    gross_profit: np.ndarray
+
+    @property
+    def n_scenarios(self) -> int:
+        """評価したシナリオ数（標本×価格×プラン）"""
+        return int(np.prod(self.mrr.shape[:3]))
+
+    @property
+    def cumulative_revenue(self) -> np.ndarray:
+        return np.cumsum(self.mrr, axis=-1)
+
+    @property
+    def cumulative_profit(self) -> np.ndarray:
+        return np.cumsum(self.gross_profit, axis=-1)
+
+    def band(self, metric: str = 'mrr', lower: float = 5, upper: float = 95) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """指標（mrr, customers, gross_profit, cumulative_revenue, cumulative_profit 等）のパーセンタイル（価格×プラン×月）"""
+        lo, mid, hi = np.percentile(getattr(self, metric), [lower, 50, upper], axis=0)
+        return lo, mid, hi
+
+    def best_scenarios(self, metric: str = 'cumulative_profit') -> np.ndarray:
+        """プラン別に最終月の指標の中央値が最大となる価格シナリオの番号"""
+        return self.band(metric)[1][:, :, -1].argmax(axis=0)
+
+    def summary(self, lower: float = 5, upper: float = 95) -> pd.DataFrame:
+        """価格シナリオ×プラン別の最終月の指標（中央値と不確実性の幅）"""
+        mrr_lo, mrr_mid, mrr_hi = self.band('mrr', lower, upper)
+        rev_lo, rev_mid, rev_hi = self.band('cumulative_revenue', lower, upper)
+        profit_lo, profit_mid, profit_hi = self.band('cumulative_profit', lower, upper)
+        customers = np.median(self.customers[..., -1], axis=0)
+        churn_rate = np.median(self.churned.sum(axis=-1) / np.maximum(
+            self.customers.sum(axis=-1) - self.new_customers.sum(axis=-1) + self.churned.sum(axis=-1), 1e-9
+        ), axis=0)
+        n_prices, n_plans = self.prices.shape[:2]
+        return pd.DataFrame({
+            'scenario': np.repeat(np.arange(n_prices), n_plans),
+            'plan': np.tile(self.plans, n_prices),
+            'price': self.prices[:, :, 0].ravel(),
+            'final_mrr': mrr_mid[:, :, -1].ravel(),
+            'final_mrr_low': mrr_lo[:, :, -1].ravel(),
+            'final_mrr_high': mrr_hi[:, :, -1].ravel(),
+            'cumulative_revenue': rev_mid[:, :, -1].ravel(),
+            'cumulative_revenue_low': rev_lo[:, :, -1].ravel(),
+            'cumulative_revenue_high': rev_hi[:, :, -1].ravel(),
+            'cumulative_profit': profit_mid[:, :, -1].ravel(),
+            'cumulative_profit_low': profit_lo[:, :, -1].ravel(),
+            'cumulative_profit_high': profit_hi[:, :, -1].ravel(),
+            'final_customers': customers.ravel(),
+            'monthly_churn': churn_rate.ravel()
+        })
+
+
+def simulate_pricing(model: DemandModel, prices: np.ndarray, visitors: Sequence[float],
+                     initial_customers: Optional[Sequence[float]] = None, unit_costs: Optional[Sequence[float]] = None,
+                     visitor_growth: float = 0.0,
+                     n_samples: int = DEFAULT_SIMULATION_SAMPLES, demand_noise: float = DEFAULT_DEMAND_NOISE,
+                     seed: Optional[int] = 0) -> PricingSimulation:
+    """価格シナリオ（シナリオ×プラン×月）ごとの新規獲得・解約・顧客数・MRRをモンテカルロで一括計算"""
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim != 3 or prices.shape[1] != len(model):
+        raise ValueError("prices は (シナリオ, プラン, 月) の形で指定してください")
+    months = prices.shape[2]
+    rng = np.random.default_rng(seed)
+    conversion, churn = model.sample(n_samples, rng)
+
+    # 標本×シナリオ×プラン×月
+    log_price = np.log(prices / model.ref_price[None, :, None])[None]
+    conversion_rate = np.exp(conversion[:, None, :, 0, None] + conversion[:, None, :, 1, None] * log_price)
+    churn_rate = np.minimum(np.exp(churn[:, None, :, 0, None] + churn[:, None, :, 1, None] * log_price), MAX_MONTHLY_CHURN)
+
+    traffic = np.broadcast_to(np.asarray(visitors, dtype=np.float64), (len(model),))[:, None] \
+        * (1 + visitor_growth) ** np.arange(months)
+    noise = rng.lognormal(-demand_noise ** 2 / 2, demand_noise, (n_samples, 1, len(model), months)) if demand_noise > 0 else 1.0
+    new_customers = traffic * conversion_rate * noise
+
+    # C_t = C_{t-1} (1 - r_t) + N_t を累積積と累積和で解く
+    survival = np.cumprod(1 - churn_rate, axis=-1)
+    start = np.zeros(len(model)) if initial_customers is None else np.asarray(initial_customers, dtype=np.float64)
+    customers = survival * (start[:, None] + np.cumsum(new_customers / survival, axis=-1))
+    previous = np.concatenate([np.broadcast_to(start[:, None], customers.shape[:-1] + (1,)), customers[..., :-1]], axis=-1)
+    churned = previous * churn_rate
+    cost = np.zeros(len(model)) if unit_costs is None else np.asarray(unit_costs, dtype=np.float64)
+    return PricingSimulation(
+        plans=model.plans,
+        prices=prices,
+        new_customers=new_customers,
+        churned=churned,
+        customers=customers,
+        mrr=customers * prices[None],
+        gross_profit=customers * (prices - cost[:, None])[None]
+    )
+
+
+def simulate_price_tests(profiles: Optional[Dict[str, Tuple[float, ...]]] = None, tests_per_plan: int = 8,
+                         visitors: int = 6000, seed: Optional[int] = 42) -> pd.DataFrame:
+    """デモ用の価格テスト結果（プラン・価格ごとの訪問数・CV数・既存顧客数・解約数）を生成"""
+    profiles = profiles or SIMULATED_PLAN_PROFILES
+    rng = np.random.default_rng(seed)
+    names = list(profiles)
+    ref_price, base_conversion, conversion_elasticity, base_churn, churn_elasticity = (
+        np.array(v) for v in list(zip(*profiles.values()))[:5]
+    )
+    multipliers = np.exp(rng.uniform(np.log(0.6), np.log(1.6), (tests_per_plan, len(names))))
+    prices = np.round(ref_price * multipliers, -1)
+    traffic = rng.poisson(visitors, prices.shape)
+    conversions = rng.binomial(traffic, np.minimum(base_conversion * multipliers ** conversion_elasticity, 1.0))
+    customers = rng.poisson(visitors * base_conversion * 10, prices.shape)
+    churned = rng.binomial(customers, np.minimum(base_churn * multipliers ** churn_elasticity, 1.0))
+    return pd.DataFrame({
+        'plan': np.tile(names, tests_per_plan),
+        'price': prices.ravel(),
+        'visitors': traffic.ravel(),
+        'conversions': conversions.ravel(),
+        'customers': customers.ravel(),
+        'churned': churned.ravel()
+    })
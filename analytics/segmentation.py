@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+顧客セグメンテーション
+特徴量の一括抽出、オンライン標準化＋ミニバッチk-means（partial_fit対応）、再学習をまたいで安定したセグメント名
+"""
+
+import os
+import json
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Union
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import kmeans_plusplus
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 学習済みモデルの保存先（環境変数で上書き可能）
+DEFAULT_SEGMENT_MODEL_PATH = os.getenv(
+    "CUSTOMER_SEGMENT_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "customer_segments.json")
+)
+
+# セグメンテーションに使う特徴量（順序はモデルの列順）
+SEGMENT_FEATURES = [
+    'ltv',
+    'total_purchases',
+    'avg_order_value',
+    'engagement_score',
+    'churn_probability',
+    'days_since_acquisition'
+]
+
+SEGMENT_NAMES = [
+    'High-Value Champions',
+    'Potential Loyalists',
+    'New Customers',
+    'At-Risk Customers',
+    'Cannot Lose Them'
+]
+
+# 初回学習時の命名に使う、標準化後の重心に対する特徴量の重み
+SEGMENT_PROFILES = {
+    'High-Value Champions': {'ltv': 1.0, 'engagement_score': 1.0, 'churn_probability': -0.5},
+    'Potential Loyalists': {'engagement_score': 1.0, 'ltv': -0.5, 'churn_probability': -0.5},
+    'New Customers': {'days_since_acquisition': -1.5},
+    'At-Risk Customers': {'churn_probability': 1.0, 'engagement_score': -1.0},
+    'Cannot Lose Them': {'ltv': 1.0, 'churn_probability': 1.0}
+}
+
+# ミニバッチの行数とフル学習のエポック数
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_EPOCHS = 5
+
+# 割り当て時に一度に距離を計算する行数
+ASSIGN_BLOCK_SIZE = 262144
+
+CustomerInput = Union[List[Dict[str, Any]], pd.DataFrame]
+
+def _group_sums(X: np.ndarray, labels: np.ndarray, n_groups: int) -> np.ndarray:
+    """ラベル別の列合計（n_groups×列数）"""
+    return np.column_stack([
+        np.bincount(labels, weights=X[:, j], minlength=n_groups) for j in range(X.shape[1])
+    ])
+
+def customer_feature_matrix(customers: CustomerInput, now: Optional[datetime] = None) -> np.ndarray:
+    """顧客データから特徴量行列（n×len(SEGMENT_FEATURES)）を一括抽出"""
+    now64 = np.datetime64(now or datetime.now(), 's')
+
+    if isinstance(customers, pd.DataFrame):
+        acquisition = customers['acquisition_date'].to_numpy(dtype='datetime64[s]')
+        columns = [customers[name].to_numpy(dtype=np.float64) for name in SEGMENT_FEATURES[:-1]]
+    else:
+        count = len(customers)
+        acquisition = pd.DatetimeIndex([c['acquisition_date'] for c in customers]).to_numpy(dtype='datetime64[s]')
+        columns = [
+            np.fromiter((c[name] for c in customers), dtype=np.float64, count=count)
+            for name in SEGMENT_FEATURES[:-1]
+        ]
+
+    days = ((now64 - acquisition) // np.timedelta64(1, 'D')).astype(np.float64)
+    return np.column_stack(columns + [days]) if len(acquisition) else np.zeros((0, len(SEGMENT_FEATURES)))
+
+class RunningScaler:
+    """追加データで平均・分散を更新できる標準化"""
+
+    def __init__(self, n_features: int):
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+
+    @property
+    def scale(self) -> np.ndarray:
+        std = np.sqrt(self.m2 / self.n) if self.n else np.ones_like(self.mean)
+        return np.where(std > 0, std, 1.0)
+
+    def partial_fit(self, X: np.ndarray):
+        """バッチの統計量を合成（Chanの並列分散公式）"""
+        count = len(X)
+        if count == 0:
+            return
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        total = self.n + count
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.n * count / total
+        self.n = total
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return (X - self.mean) / self.scale
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"n": self.n, "mean": self.mean.tolist(), "m2": self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningScaler":
+        scaler = cls(len(data["mean"]))
+        scaler.n = data["n"]
+        scaler.mean = np.asarray(data["mean"], dtype=np.float64)
+        scaler.m2 = np.asarray(data["m2"], dtype=np.float64)
+        return scaler
+
+class CustomerSegmenter:
+    """ミニバッチk-meansによる顧客セグメンテーション
+
+    重心は元の特徴量空間で保持し、距離は現在の標準化で計算するため、
+    partial_fit で標準化の統計量が変わっても重心をそのまま使える。
+    """
+
+    def __init__(self,
+                 n_segments: int = len(SEGMENT_NAMES),
+                 model_path: Optional[str] = DEFAULT_SEGMENT_MODEL_PATH,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 random_state: int = 42):
+        self.n_segments = n_segments
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+        self.scaler = RunningScaler(len(SEGMENT_FEATURES))
+        self.centers: Optional[np.ndarray] = None
+        self.counts = np.zeros(n_segments)
+        self.names: List[str] = list(SEGMENT_NAMES[:n_segments])
+        # 学習に使ったデータの版（データソースや取り込みが変わったら再学習する）
+        self.data_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.load()
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.centers is not None
+
+    def _scaled_centers(self) -> np.ndarray:
+        return self.scaler.transform(self.centers)
+
+    def _nearest(self, X_scaled: np.ndarray, centers_scaled: np.ndarray) -> np.ndarray:
+        """最近傍の重心番号（ブロック単位で距離計算）"""
+        labels = np.empty(len(X_scaled), dtype=np.int64)
+        center_norms = (centers_scaled ** 2).sum(axis=1)
+        for start in range(0, len(X_scaled), ASSIGN_BLOCK_SIZE):
+            block = X_scaled[start:start + ASSIGN_BLOCK_SIZE]
+            # |x-c|^2 の x 項は argmin に影響しないため省略
+            labels[start:start + len(block)] = np.argmin(center_norms - 2.0 * block @ centers_scaled.T, axis=1)
+        return labels
+
+    def _update_centers(self, X: np.ndarray, labels: np.ndarray):
+        """ミニバッチで重心を更新（重心毎の学習率 = 新規件数 / 累計件数）"""
+        batch_counts = np.bincount(labels, minlength=self.n_segments).astype(np.float64)
+        sums = _group_sums(X, labels, self.n_segments)
+
+        hit = batch_counts > 0
+        self.counts[hit] += batch_counts[hit]
+        rate = np.zeros(self.n_segments)
+        rate[hit] = batch_counts[hit] / self.counts[hit]
+        batch_means = np.divide(sums, batch_counts[:, None], out=np.zeros_like(sums), where=hit[:, None])
+        self.centers += (batch_means - self.centers) * rate[:, None]
+
+    def _mini_batches(self, X: np.ndarray, epochs: int):
+        rng = np.random.default_rng(self.random_state)
+        for _ in range(epochs):
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), self.batch_size):
+                yield X[order[start:start + self.batch_size]]
+
+    def fit(self, X: np.ndarray, epochs: int = DEFAULT_EPOCHS, data_version: Optional[str] = None) -> "CustomerSegmenter":
+        """全データで再学習（既存モデルがあれば前回の重心から始め、セグメント名を重心の対応で引き継ぐ）"""
+        with self._lock:
+            self.data_version = data_version
+            previous = self.centers.copy() if self.centers is not None else None
+            previous_names = list(self.names)
+
+            self.scaler = RunningScaler(X.shape[1])
+            self.scaler.partial_fit(X)
+            X_scaled = self.scaler.transform(X)
+
+            if previous is not None and len(previous) == self.n_segments:
+                self.centers = previous.copy()
+            else:
+                initial, _ = kmeans_plusplus(X_scaled, self.n_segments, random_state=self.random_state)
+                self.centers = initial * self.scaler.scale + self.scaler.mean
+            self.counts = np.zeros(self.n_segments)
+            for batch in self._mini_batches(X, epochs):
+                self._update_centers(batch, self._nearest(self.scaler.transform(batch), self._scaled_centers()))
+
+            self._assign_names(previous, previous_names)
+            self._save()
+        return self
+
+    def partial_fit(self, X: np.ndarray) -> "CustomerSegmenter":
+        """新しい顧客でモデルを更新（未学習なら通常の学習）"""
+        if not self.is_fitted:
+            return self.fit(X)
+
+        with self._lock:
+            self.scaler.partial_fit(X)
+            for start in range(0, len(X), self.batch_size):
+                batch = X[start:start + self.batch_size]
+                self._update_centers(batch, self._nearest(self.scaler.transform(batch), self._scaled_centers()))
+            self._save()
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """各顧客の重心番号"""
+        with self._lock:
+            return self._nearest(self.scaler.transform(X), self._scaled_centers())
+
+    def _assign_names(self, previous: Optional[np.ndarray], previous_names: List[str]):
+        """重心にセグメント名を割り当てる（前回の重心があれば最も近いものの名前を引き継ぐ）"""
+        if previous is not None and len(previous) == self.n_segments:
+            scale = self.scaler.scale
+            cost = (((self.centers[:, None, :] - previous[None, :, :]) / scale) ** 2).sum(axis=2)
+            rows, cols = linear_sum_assignment(cost)
+            names = [None] * self.n_segments
+            for row, col in zip(rows, cols):
+                names[row] = previous_names[col]
+            self.names = names
+            return
+
+        # 初回は特徴プロファイルとの一致度が最大になるよう割り当て
+        scaled = self._scaled_centers()
+        profiles = list(SEGMENT_PROFILES.items())[:self.n_segments]
+        score = np.zeros((self.n_segments, len(profiles)))
+        for j, (_, weights) in enumerate(profiles):
+            for feature, weight in weights.items():
+                score[:, j] += weight * scaled[:, SEGMENT_FEATURES.index(feature)]
+        rows, cols = linear_sum_assignment(-score)
+        names = [f"Segment {i + 1}" for i in range(self.n_segments)]
+        for row, col in zip(rows, cols):
+            names[row] = profiles[col][0]
+        self.names = names
+
+    def segment(self, customers: CustomerInput, now: Optional[datetime] = None,
+                data_version: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """顧客をセグメントに割り当て、セグメント毎のメンバーと平均値を返す
+
+        未学習、または data_version が学習時と異なる場合は再学習する
+        """
+        X = customer_feature_matrix(customers, now)
+        if len(X) == 0:
+            return {}
+        if not self.is_fitted or (data_version is not None and data_version != self.data_version):
+            self.fit(X, data_version=data_version)
+
+        labels = self.predict(X)
+        order = np.argsort(labels, kind='stable')
+        sizes = np.bincount(labels, minlength=self.n_segments)
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        means = _group_sums(X, labels, self.n_segments) / np.maximum(sizes, 1)[:, None]
+
+        column = {name: i for i, name in enumerate(SEGMENT_FEATURES)}
+        segments = {}
+        for slot in sorted(range(self.n_segments), key=lambda i: self._name_rank(self.names[i])):
+            if sizes[slot] == 0:
+                continue
+            members = order[bounds[slot]:bounds[slot + 1]]
+            segments[self.names[slot]] = {
+                'customers': customers.iloc[members] if isinstance(customers, pd.DataFrame)
+                else [customers[i] for i in members],
+                'size': int(sizes[slot]),
+                'avg_ltv': float(means[slot, column['ltv']]),
+                'avg_purchases': float(means[slot, column['total_purchases']]),
+                'avg_engagement': float(means[slot, column['engagement_score']]),
+                'churn_risk': float(means[slot, column['churn_probability']]),
+                'characteristics': []
+            }
+        return segments
+
+    @staticmethod
+    def _name_rank(name: str) -> int:
+        return SEGMENT_NAMES.index(name) if name in SEGMENT_NAMES else len(SEGMENT_NAMES)
+
+    def _save(self):
+        """モデルをアトミックに保存（ロック取得済みで呼ぶ）"""
+        if not self.model_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+            tmp_path = f"{self.model_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "features": SEGMENT_FEATURES,
+                    "scaler": self.scaler.to_dict(),
+                    "centers": self.centers.tolist(),
+                    "counts": self.counts.tolist(),
+                    "names": self.names,
+                    "data_version": self.data_version
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.model_path)
+        except OSError as e:
+            logger.error(f"セグメントモデルの保存エラー: {e}")
+
+    def load(self):
+        """保存済みモデルを読み込む（特徴量やセグメント数が異なる場合は無視）"""
+        if not self.model_path or not os.path.exists(self.model_path):
+            return
+        try:
+            with open(self.model_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data["features"] != SEGMENT_FEATURES or len(data["centers"]) != self.n_segments:
+                logger.warning("セグメントモデルの構成が異なるため再学習します")
+                return
+            self.scaler = RunningScaler.from_dict(data["scaler"])
+            self.centers = np.asarray(data["centers"], dtype=np.float64)
+            self.counts = np.asarray(data["counts"], dtype=np.float64)
+            self.names = data["names"]
+            self.data_version = data.get("data_version")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"セグメントモデルの読み込みエラー: {e}")
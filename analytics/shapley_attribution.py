@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+シャープレイ値アトリビューション
+パスをチャネル集合（コアリション）ごとに一度だけ集計し、少数チャネルは厳密計算、多数チャネルは順列サンプリングで近似
+"""
+
+import os
+import math
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Iterable, Sequence, Tuple
+
+import numpy as np
+
+from .attribution import TouchpointArrays
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 厳密計算（2^C 個のコアリション）を行うチャネル数の上限
+EXACT_MAX_CHANNELS = 16
+
+# サンプリング時のデフォルト順列数
+DEFAULT_PERMUTATIONS = 2000
+
+# 1バッチで評価する順列数と、バッチ内の要素数（順列数×メンバー数）の上限
+PERMUTATION_BATCH_SIZE = 256
+MAX_BATCH_ELEMENTS = 4_000_000
+
+# この順列数以上でプロセスプールに分散する（DEFAULT_PERMUTATIONS より小さく保つ）
+PARALLEL_MIN_PERMUTATIONS = 1024
+
+# 打ち切り判定（tolerance 指定時）を行う順列数の間隔
+SAMPLING_ROUND_SIZE = 1024
+
+# 信頼区間（95%）の係数
+CONFIDENCE_Z = 1.96
+
+# 特性関数の種類
+CHARACTERISTICS = ('rate', 'value')
+
+@dataclass
+class CoalitionTable:
+    """コアリション別集計（チャネル番号は出現チャネルのみに詰め直したローカル番号）
+
+    members[indptr[k]:indptr[k+1]] がコアリション k のチャネル。
+    """
+    channel_codes: np.ndarray
+    indptr: np.ndarray
+    members: np.ndarray
+    paths: np.ndarray
+    conversions: np.ndarray
+    value: np.ndarray
+    _value_cache: Dict[Tuple[str, frozenset], float] = field(default_factory=dict, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @classmethod
+    def from_counts(cls, coalitions: Dict[Tuple[int, ...], Sequence[float]]) -> "CoalitionTable":
+        """{チャネル番号のタプル: (パス数, コンバージョン数, 価値)} から生成"""
+        keys = list(coalitions)
+        counts = np.asarray([coalitions[key] for key in keys], dtype=np.float64).reshape(-1, 3)
+        sizes = np.fromiter((len(key) for key in keys), dtype=np.int64, count=len(keys))
+        codes = np.fromiter((c for key in keys for c in key), dtype=np.int64, count=int(sizes.sum()))
+
+        channel_codes, members = np.unique(codes, return_inverse=True)
+        return cls(
+            channel_codes=channel_codes,
+            indptr=np.concatenate([[0], np.cumsum(sizes)]),
+            members=members.astype(np.int64),
+            paths=counts[:, 0].copy(),
+            conversions=counts[:, 1].copy(),
+            value=counts[:, 2].copy()
+        )
+
+    @property
+    def n_channels(self) -> int:
+        return len(self.channel_codes)
+
+    def masks(self) -> np.ndarray:
+        """コアリションのビットマスク（63チャネル以下のみ）"""
+        if self.n_channels > 63:
+            raise ValueError("ビットマスクは63チャネルまでです")
+        bits = np.left_shift(np.uint64(1), self.members.astype(np.uint64))
+        return np.bitwise_or.reduceat(bits, self.indptr[:-1]) if len(self) else np.zeros(0, dtype=np.uint64)
+
+    def gain(self, characteristic: str) -> np.ndarray:
+        """特性関数の分子（rate: コンバージョン数, value: コンバージョン価値）"""
+        return self.conversions if characteristic == 'rate' else self.value
+
+    def coalition_value(self, members: Iterable[int], characteristic: str = 'rate') -> float:
+        """v(S): チャネル集合 S に含まれるパスのみでのコンバージョン率（または価値）（メモ化）"""
+        key = (characteristic, frozenset(members))
+        cached = self._value_cache.get(key)
+        if cached is not None:
+            return cached
+
+        in_coalition = np.zeros(self.n_channels, dtype=bool)
+        in_coalition[list(key[1])] = True
+        contained = np.minimum.reduceat(in_coalition[self.members], self.indptr[:-1]) if len(self) else in_coalition[:0]
+
+        gain = float(self.gain(characteristic)[contained].sum())
+        if characteristic == 'rate':
+            paths = float(self.paths[contained].sum())
+            gain = gain / paths if paths > 0 else 0.0
+
+        self._value_cache[key] = gain
+        return gain
+
+def build_coalition_table(arrays: TouchpointArrays) -> CoalitionTable:
+    """タッチポイント配列をコアリション別のパス数・コンバージョン数・価値に集計"""
+    n_total_channels = len(arrays.channels)
+    empty = np.zeros(0, dtype=np.int64)
+    if len(arrays) == 0:
+        return CoalitionTable(empty, np.zeros(1, dtype=np.int64), empty, np.zeros(0), np.zeros(0), np.zeros(0))
+
+    _, _, journey_index, starts = arrays.journey_layout()
+
+    # ジャーニー内の重複チャネルを除去（ジャーニー順・チャネル順に並ぶ）
+    pairs = np.unique(journey_index * n_total_channels + arrays.channel.astype(np.int64))
+    pair_journey = pairs // n_total_channels
+    channel_codes, local = np.unique(pairs % n_total_channels, return_inverse=True)
+    local = local.astype(np.int64)
+    n_channels = len(channel_codes)
+
+    journey_starts = np.flatnonzero(np.r_[True, pair_journey[1:] != pair_journey[:-1]])
+    sizes = np.diff(np.append(journey_starts, len(pairs)))
+
+    if n_channels <= 63:
+        bits = np.left_shift(np.uint64(1), local.astype(np.uint64))
+        keys = np.bitwise_or.reduceat(bits, journey_starts)
+    else:
+        # ビットマスクに収まらない場合はチャネル毎の64bit乱数のXORで識別（衝突確率は無視できる）
+        hashes = np.random.default_rng(0).integers(0, np.iinfo(np.int64).max, size=n_channels, dtype=np.int64)
+        keys = np.bitwise_xor.reduceat(hashes[local], journey_starts)
+
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    converted = arrays.is_converted()[starts].astype(np.float64)
+    journey_value = np.where(converted > 0, arrays.value[starts], 0.0)
+    n_coalitions = len(first)
+
+    # 各コアリションの代表ジャーニーからメンバーをCSRで取り出す
+    member_sizes = sizes[first]
+    indptr = np.concatenate([[0], np.cumsum(member_sizes)])
+    offsets = np.arange(indptr[-1]) - np.repeat(indptr[:-1], member_sizes)
+    members = local[np.repeat(journey_starts[first], member_sizes) + offsets]
+
+    return CoalitionTable(
+        channel_codes=channel_codes,
+        indptr=indptr,
+        members=members,
+        paths=np.bincount(inverse, minlength=n_coalitions).astype(np.float64),
+        conversions=np.bincount(inverse, weights=converted, minlength=n_coalitions),
+        value=np.bincount(inverse, weights=journey_value, minlength=n_coalitions)
+    )
+
+def exact_shapley(table: CoalitionTable, characteristic: str = 'rate') -> np.ndarray:
+    """全 2^C コアリションの v(S) を部分集合和変換で一括計算し、厳密なシャープレイ値を求める"""
+    n = table.n_channels
+    if n == 0:
+        return np.zeros(0)
+
+    size = 1 << n
+    masks = table.masks().astype(np.int64)
+
+    # 観測コアリション毎の値を置き、部分集合和（zeta変換）で v(S) = Σ_{T⊆S} を得る
+    gain = np.zeros(size)
+    gain[masks] = table.gain(characteristic)
+    paths = np.zeros(size)
+    paths[masks] = table.paths
+    popcount = np.zeros(size, dtype=np.int64)
+
+    for i in range(n):
+        bit = 1 << i
+        for values in (gain, paths):
+            view = values.reshape(-1, 2, bit)
+            view[:, 1, :] += view[:, 0, :]
+        popcount.reshape(-1, 2, bit)[:, 1, :] += 1
+
+    if characteristic == 'rate':
+        values = np.divide(gain, paths, out=np.zeros(size), where=paths > 0)
+    else:
+        values = gain
+
+    # φ_i = Σ_{S∌i} |S|!(n-|S|-1)!/n! · (v(S∪{i}) - v(S))
+    weights = np.array([1.0 / (n * math.comb(n - 1, s)) for s in range(n)])
+    shapley = np.empty(n)
+    for i in range(n):
+        bit = 1 << i
+        view = values.reshape(-1, 2, bit)
+        without = popcount.reshape(-1, 2, bit)[:, 0, :]
+        shapley[i] = float((weights[without] * (view[:, 1, :] - view[:, 0, :])).sum())
+    return shapley
+
+def _sample_permutations(indptr: np.ndarray,
+                         members: np.ndarray,
+                         gain: np.ndarray,
+                         paths: Optional[np.ndarray],
+                         n_channels: int,
+                         n_permutations: int,
+                         seed) -> Tuple[np.ndarray, np.ndarray]:
+    """ランダム順列での限界貢献の和と二乗和（プロセスプールから呼ぶためモジュール関数）
+
+    各コアリションは順列上でメンバーが全て揃った位置で初めて v に寄与するため、
+    「揃う位置」を求めて bincount するだけで全プレフィックスの v(S) をまとめて評価できる。
+    """
+    rng = np.random.default_rng(seed)
+    n_coalitions = len(gain)
+    batch_size = max(1, min(PERMUTATION_BATCH_SIZE, MAX_BATCH_ELEMENTS // max(len(members), 1)))
+    positions = np.arange(n_channels)
+
+    total = np.zeros(n_channels)
+    total_sq = np.zeros(n_channels)
+
+    for batch_start in range(0, n_permutations, batch_size):
+        count = min(batch_size, n_permutations - batch_start)
+
+        # order[p, j] = 順列 p で j 番目に加わるチャネル、pos はその逆写像
+        order = rng.permuted(np.tile(positions, (count, 1)), axis=1)
+        pos = np.empty_like(order)
+        np.put_along_axis(pos, order, np.broadcast_to(positions, order.shape), axis=1)
+
+        completion = np.maximum.reduceat(pos[:, members], indptr[:-1], axis=1)
+        flat = (np.arange(count)[:, None] * n_channels + completion).ravel()
+
+        def by_position(weights: np.ndarray) -> np.ndarray:
+            return np.bincount(
+                flat, weights=np.broadcast_to(weights, (count, n_coalitions)).ravel(), minlength=count * n_channels
+            ).reshape(count, n_channels)
+
+        gained = by_position(gain)
+        if paths is not None:
+            cum_gain = np.cumsum(gained, axis=1)
+            cum_paths = np.cumsum(by_position(paths), axis=1)
+            value = np.divide(cum_gain, cum_paths, out=np.zeros_like(cum_gain), where=cum_paths > 0)
+            marginal = np.diff(value, axis=1, prepend=0.0)
+        else:
+            marginal = gained
+
+        # 位置ごとの限界貢献をチャネルへ戻す
+        contribution = np.empty_like(marginal)
+        np.put_along_axis(contribution, order, marginal, axis=1)
+        total += contribution.sum(axis=0)
+        total_sq += np.square(contribution).sum(axis=0)
+
+    return total, total_sq
+
+def sampled_shapley(table: CoalitionTable,
+                    characteristic: str = 'rate',
+                    n_permutations: int = DEFAULT_PERMUTATIONS,
+                    workers: Optional[int] = None,
+                    seed: Optional[int] = None,
+                    tolerance: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+    """モンテカルロ順列サンプリングによるシャープレイ値・標準誤差・使用した順列数
+
+    tolerance を指定すると、最大の標準誤差が最大のシャープレイ値（絶対値）の tolerance 倍以下になった
+    時点で n_permutations に達する前でも打ち切る。
+    """
+    n = table.n_channels
+    if n == 0 or n_permutations <= 0:
+        return np.zeros(n), np.zeros(n), 0
+
+    gain = table.gain(characteristic)
+    paths = table.paths if characteristic == 'rate' else None
+    args = (table.indptr, table.members, gain, paths, n)
+
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    chunks = min(workers, max(1, n_permutations // PERMUTATION_BATCH_SIZE))
+    round_size = n_permutations if tolerance is None else max(SAMPLING_ROUND_SIZE, chunks * PERMUTATION_BATCH_SIZE)
+    seeds = iter(np.random.SeedSequence(seed).spawn(chunks * ((n_permutations + round_size - 1) // round_size)))
+
+    executor = None
+    if chunks > 1 and n_permutations >= PARALLEL_MIN_PERMUTATIONS:
+        try:
+            executor = ProcessPoolExecutor(max_workers=chunks)
+        except Exception as e:
+            logger.warning(f"プロセスプールを起動できないため逐次計算します: {e}")
+
+    total = np.zeros(n)
+    total_sq = np.zeros(n)
+    used = 0
+    try:
+        while used < n_permutations:
+            size = min(round_size, n_permutations - used)
+            counts = [size // chunks + (1 if i < size % chunks else 0) for i in range(chunks)]
+            jobs = [(c, next(seeds)) for c in counts if c > 0]
+
+            results = None
+            if executor is not None:
+                try:
+                    results = [f.result() for f in [executor.submit(_sample_permutations, *args, c, s) for c, s in jobs]]
+                except Exception as e:
+                    # プロセスが使えない環境では同一プロセスで計算
+                    logger.warning(f"シャープレイ値の並列計算に失敗したため逐次計算します: {e}")
+                    executor.shutdown(cancel_futures=True)
+                    executor = None
+            if results is None:
+                results = [_sample_permutations(*args, c, s) for c, s in jobs]
+
+            for round_total, round_sq in results:
+                total += round_total
+                total_sq += round_sq
+            used += size
+
+            mean = total / used
+            std_error = np.sqrt(np.maximum(total_sq / used - np.square(mean), 0.0) / max(used - 1, 1))
+            if tolerance is not None and std_error.max() <= tolerance * np.abs(mean).max():
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return mean, std_error, used
+
+@dataclass
+class ShapleyAttributionResult:
+    """シャープレイ値アトリビューション結果（配列は元のチャネル番号順）"""
+    channels: List[str]
+    method: str
+    shapley_values: np.ndarray
+    std_errors: np.ndarray
+    credits: np.ndarray
+    n_permutations: int = 0
+
+    def to_dict(self) -> Dict[str, float]:
+        """{チャネル: 貢献値}（貢献の無いチャネルは除外）"""
+        return {self.channels[i]: float(self.credits[i]) for i in np.flatnonzero(self.credits)}
+
+    def confidence_intervals(self, z: float = CONFIDENCE_Z) -> Dict[str, Tuple[float, float]]:
+        """{チャネル: (下限, 上限)} 貢献値の信頼区間（厳密計算では幅0）"""
+        scale = np.divide(self.credits, self.shapley_values,
+                          out=np.zeros_like(self.credits), where=self.shapley_values != 0)
+        half_width = z * self.std_errors * np.abs(scale)
+        return {
+            self.channels[i]: (float(self.credits[i] - half_width[i]), float(self.credits[i] + half_width[i]))
+            for i in np.flatnonzero(self.credits)
+        }
+
+def shapley_attribution(arrays: TouchpointArrays,
+                        characteristic: str = 'rate',
+                        total_value: Optional[float] = None,
+                        exact_max_channels: int = EXACT_MAX_CHANNELS,
+                        n_permutations: int = DEFAULT_PERMUTATIONS,
+                        workers: Optional[int] = None,
+                        seed: Optional[int] = None,
+                        tolerance: Optional[float] = None,
+                        table: Optional[CoalitionTable] = None) -> ShapleyAttributionResult:
+    """シャープレイ値によるチャネル貢献度
+
+    characteristic='rate' は v(S) を S に含まれるパスのコンバージョン率とし、未コンバージョンのパスも使う。
+    'value' は S に含まれるパスのコンバージョン価値の合計とする。
+    貢献値はシャープレイ値の合計が total_value（省略時は総コンバージョン価値）になるよう按分する。
+    """
+    if characteristic not in CHARACTERISTICS:
+        raise ValueError(f"Unknown characteristic: {characteristic}")
+
+    table = table if table is not None else build_coalition_table(arrays)
+    total_value = float(table.value.sum()) if total_value is None else total_value
+
+    if table.n_channels <= exact_max_channels:
+        method, permutations = 'exact', 0
+        local_values, local_errors = exact_shapley(table, characteristic), np.zeros(table.n_channels)
+    else:
+        method = 'sampling'
+        local_values, local_errors, permutations = sampled_shapley(
+            table, characteristic, n_permutations, workers, seed, tolerance
+        )
+
+    n_total = len(arrays.channels)
+    shapley_values = np.zeros(n_total)
+    shapley_values[table.channel_codes] = local_values
+    std_errors = np.zeros(n_total)
+    std_errors[table.channel_codes] = local_errors
+
+    total_effect = shapley_values.sum()
+    credits = shapley_values / total_effect * total_value if total_effect > 0 else np.zeros(n_total)
+
+    return ShapleyAttributionResult(list(arrays.channels), method, shapley_values, std_errors, credits, permutations)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+メディアアップロードパイプライン
+Twitter/X のチャンクアップロード（INIT/APPEND/FINALIZE）、中断再開、ファイルハッシュによるキャッシュ
+"""
+
+import os
+import json
+import mmap
+import time
+import asyncio
+import hashlib
+import mimetypes
+import threading
+import logging
+from typing import Dict, List, Optional, Any, Callable
+import requests
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# キャッシュ・再開情報ファイル（環境変数で上書き可能）
+DEFAULT_MEDIA_CACHE_PATH = os.getenv(
+    "SOCIAL_MEDIA_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "media_upload_cache.json")
+)
+
+# APPEND 1回あたりのサイズ（Twitterの上限は5MB）
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# 同一ファイル内のAPPEND同時実行数
+APPEND_CONCURRENCY = 3
+
+# アップロード済みmedia_idの有効期限（Twitterは24時間）
+MEDIA_ID_TTL_SECONDS = 23 * 60 * 60
+
+# ハッシュ計算時の読み込みバッファ
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# FINALIZE後の処理待ちの最大回数
+MAX_STATUS_CHECKS = 60
+
+def file_sha256(path: str) -> str:
+    """ファイルのSHA-256（固定サイズで逐次読み込み）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb', buffering=HASH_BUFFER_SIZE) as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def media_category_for(media_type: str) -> str:
+    """MIMEタイプからTwitterのmedia_categoryを決定"""
+    if media_type.startswith("video/"):
+        return "tweet_video"
+    if media_type == "image/gif":
+        return "tweet_gif"
+    return "tweet_image"
+
+class MediaUploadCache:
+    """アップロード済みmedia_idと再開用セッションの永続キャッシュ"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_MEDIA_CACHE_PATH, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        # file_hash -> {"media_id", "expires_at"}
+        self.uploaded: Dict[str, Dict[str, Any]] = {}
+        # file_hash -> {"media_id", "total_bytes", "segments", "expires_at"}
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.uploaded = data.get("uploaded", {})
+            self.sessions = data.get("sessions", {})
+        except (OSError, ValueError) as e:
+            logger.error(f"メディアキャッシュ読み込みエラー: {e}")
+
+    def _save(self):
+        """アトミックに保存（ロック取得済みで呼ぶ）"""
+        if not self.path:
+            return
+        now = self.clock()
+        self.uploaded = {k: v for k, v in self.uploaded.items() if v["expires_at"] > now}
+        self.sessions = {k: v for k, v in self.sessions.items() if v["expires_at"] > now}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"uploaded": self.uploaded, "sessions": self.sessions}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"メディアキャッシュ保存エラー: {e}")
+
+    def get_media_id(self, file_hash: str) -> Optional[str]:
+        """有効なアップロード済みmedia_idを取得"""
+        with self._lock:
+            entry = self.uploaded.get(file_hash)
+            if entry and entry["expires_at"] > self.clock():
+                return entry["media_id"]
+            return None
+
+    def set_media_id(self, file_hash: str, media_id: str, ttl_seconds: float = MEDIA_ID_TTL_SECONDS):
+        """アップロード完了を記録し再開セッションを破棄"""
+        with self._lock:
+            self.uploaded[file_hash] = {"media_id": media_id, "expires_at": self.clock() + ttl_seconds}
+            self.sessions.pop(file_hash, None)
+            self._save()
+
+    def get_session(self, file_hash: str, total_bytes: int) -> Optional[Dict[str, Any]]:
+        """再開可能なアップロードセッションを取得"""
+        with self._lock:
+            session = self.sessions.get(file_hash)
+            if session and session["total_bytes"] == total_bytes and session["expires_at"] > self.clock():
+                return session
+            return None
+
+    def start_session(self, file_hash: str, media_id: str, total_bytes: int, expires_after: float) -> Dict[str, Any]:
+        """新規アップロードセッションを記録"""
+        with self._lock:
+            session = {
+                "media_id": media_id,
+                "total_bytes": total_bytes,
+                "segments": [],
+                "expires_at": self.clock() + expires_after
+            }
+            self.sessions[file_hash] = session
+            self._save()
+            return session
+
+    def mark_segment(self, file_hash: str, segment_index: int):
+        """APPEND済みセグメントを記録"""
+        with self._lock:
+            session = self.sessions.get(file_hash)
+            if session is not None and segment_index not in session["segments"]:
+                session["segments"].append(segment_index)
+                self._save()
+
+    def drop_session(self, file_hash: str):
+        """セッションを破棄（FINALIZE失敗などで再開不能な場合）"""
+        with self._lock:
+            if self.sessions.pop(file_hash, None) is not None:
+                self._save()
+
+class ChunkedMediaUploader:
+    """Twitterチャンクアップロード"""
+
+    def __init__(self,
+                 upload_url: str,
+                 headers_factory: Callable[[], Dict[str, str]],
+                 cache: Optional[MediaUploadCache] = None,
+                 chunk_size: int = CHUNK_SIZE,
+                 append_concurrency: int = APPEND_CONCURRENCY):
+        self.upload_url = upload_url
+        self.headers_factory = headers_factory
+        self.cache = cache if cache is not None else MediaUploadCache()
+        self.chunk_size = chunk_size
+        self.append_concurrency = append_concurrency
+        # 同一ファイルの同時アップロードを1回にまとめる
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def _request(self, method: str, **kwargs) -> Dict[str, Any]:
+        """ブロッキングHTTPをワーカースレッドで実行"""
+        response = await asyncio.to_thread(
+            getattr(requests, method), self.upload_url, headers=self.headers_factory(), timeout=120, **kwargs
+        )
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    async def upload(self, media_path: str) -> str:
+        """メディアをアップロードしmedia_idを返す（キャッシュ済みなら再アップロードしない）"""
+        file_hash = await asyncio.to_thread(file_sha256, media_path)
+
+        cached = self.cache.get_media_id(file_hash)
+        if cached:
+            logger.info(f"メディアキャッシュ使用: {os.path.basename(media_path)} -> {cached}")
+            return cached
+
+        task = self._inflight.get(file_hash)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._upload_chunked(media_path, file_hash))
+            self._inflight[file_hash] = task
+            task.add_done_callback(
+                lambda finished: self._inflight.pop(file_hash, None) if self._inflight.get(file_hash) is finished else None
+            )
+        return await asyncio.shield(task)
+
+    async def _upload_chunked(self, media_path: str, file_hash: str) -> str:
+        """INIT → APPEND（並列） → FINALIZE → STATUS"""
+        total_bytes = os.path.getsize(media_path)
+        media_type = mimetypes.guess_type(media_path)[0] or "application/octet-stream"
+
+        session = self.cache.get_session(file_hash, total_bytes)
+        if session:
+            logger.info(f"メディアアップロード再開: {os.path.basename(media_path)} ({len(session['segments'])}セグメント完了済み)")
+        else:
+            init = await self._request("post", data={
+                "command": "INIT",
+                "total_bytes": total_bytes,
+                "media_type": media_type,
+                "media_category": media_category_for(media_type)
+            })
+            session = self.cache.start_session(
+                file_hash,
+                init["media_id_string"],
+                total_bytes,
+                init.get("expires_after_secs", MEDIA_ID_TTL_SECONDS)
+            )
+
+        media_id = session["media_id"]
+        segment_count = max(1, (total_bytes + self.chunk_size - 1) // self.chunk_size)
+        done = set(session["segments"])
+        pending = [i for i in range(segment_count) if i not in done]
+
+        await self._append_segments(media_path, file_hash, media_id, pending)
+
+        try:
+            finalize = await self._request("post", data={"command": "FINALIZE", "media_id": media_id})
+            await self._wait_for_processing(media_id, finalize.get("processing_info"))
+        except Exception:
+            # FINALIZE失敗後は同じmedia_idで再開できないため最初からやり直す
+            self.cache.drop_session(file_hash)
+            raise
+
+        self.cache.set_media_id(file_hash, media_id, finalize.get("expires_after_secs", MEDIA_ID_TTL_SECONDS))
+        logger.info(f"メディアアップロード完了: {os.path.basename(media_path)} -> {media_id}")
+        return media_id
+
+    async def _append_segments(self, media_path: str, file_hash: str, media_id: str, segments: List[int]):
+        """未送信セグメントをメモリマップから切り出して並列APPEND"""
+        if not segments:
+            return
+
+        semaphore = asyncio.Semaphore(self.append_concurrency)
+
+        with open(media_path, 'rb') as f:
+            # 空ファイルはmmapできないため通常読み込み
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(media_path) else None
+            try:
+                async def append(segment_index: int):
+                    async with semaphore:
+                        start = segment_index * self.chunk_size
+                        chunk = mapped[start:start + self.chunk_size] if mapped is not None else b""
+                        await self._request(
+                            "post",
+                            data={"command": "APPEND", "media_id": media_id, "segment_index": segment_index},
+                            files={"media": chunk}
+                        )
+                        self.cache.mark_segment(file_hash, segment_index)
+
+                tasks = [asyncio.ensure_future(append(i)) for i in segments]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    # 1つでも失敗したら残りのAPPENDを止め、終了を待ってからmmapを閉じる
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                if mapped is not None:
+                    mapped.close()
+
+    async def _wait_for_processing(self, media_id: str, processing_info: Optional[Dict[str, Any]]):
+        """動画等のサーバー側処理完了を待機"""
+        checks = 0
+        while processing_info and processing_info.get("state") in ("pending", "in_progress"):
+            if checks >= MAX_STATUS_CHECKS:
+                raise TimeoutError(f"メディア処理がタイムアウトしました: {media_id}")
+            await asyncio.sleep(processing_info.get("check_after_secs", 1))
+            status = await self._request("get", params={"command": "STATUS", "media_id": media_id})
+            processing_info = status.get("processing_info")
+            checks += 1
+
+        if processing_info and processing_info.get("state") == "failed":
+            error = processing_info.get("error", {}).get("message", "unknown")
+            raise RuntimeError(f"メディア処理に失敗しました: {error}")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+投稿履歴ストア
+全件をJSONLへ書き込み、最新分だけをメモリに読み取りキャッシュとして保持し、プラットフォーム/ステータス別にインクリメンタル集計
+"""
+
+import os
+import json
+import threading
+import logging
+from array import array
+from collections import deque
+from typing import Dict, List, Optional, Any, Callable
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 履歴ファイル（環境変数で上書き可能）
+DEFAULT_HISTORY_PATH = os.getenv(
+    "SOCIAL_POST_HISTORY_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "post_history.jsonl")
+)
+
+# メモリ上に保持する最新履歴の件数
+DEFAULT_MAX_IN_MEMORY = 1000
+
+class PostHistoryStore:
+    """投稿履歴ストア（全件をJSONLへ追記し、最新分はメモリから返す）"""
+
+    def __init__(self,
+                 history_path: Optional[str] = DEFAULT_HISTORY_PATH,
+                 max_in_memory: int = DEFAULT_MAX_IN_MEMORY,
+                 serializer: Callable[[Any], Dict[str, Any]] = None,
+                 deserializer: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 platforms: Optional[List[str]] = None,
+                 statuses: Optional[List[str]] = None):
+        self.history_path = history_path
+        self.max_in_memory = max_in_memory
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.platforms = list(platforms or [])
+        self.statuses = list(statuses or [])
+
+        # 最新履歴の読み取りキャッシュ（古い分はファイルから読む）
+        self.recent = deque(maxlen=max_in_memory)
+        # ファイル上の各レコードのバイトオフセット（古い順）
+        self._offsets = array('Q')
+        self._file = None
+        self._lock = threading.Lock()
+
+        # インクリメンタル集計
+        self.total = 0
+        self.by_status = {status: 0 for status in self.statuses}
+        self.by_platform = {
+            platform: {status: 0 for status in self.statuses}
+            for platform in self.platforms
+        }
+
+        self._load()
+
+    def __len__(self) -> int:
+        """保持中の件数（ファイルが無い場合はメモリ上の件数）"""
+        return len(self._offsets) if self.history_path else len(self.recent)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def _count(self, platform: str, status: str):
+        """集計カウンタを更新"""
+        self.total += 1
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+        platform_counts = self.by_platform.setdefault(platform, {s: 0 for s in self.statuses})
+        platform_counts[status] = platform_counts.get(status, 0) + 1
+
+    def append(self, post):
+        """履歴を追加（ファイルへ即時書き込み）"""
+        with self._lock:
+            self.recent.append(post)
+            self._count(post.platform.value, post.status.value)
+            if self.history_path:
+                self._write(post)
+
+    def _write(self, post):
+        """1件をJSONLへ追記（ロック取得済みで呼ぶ）"""
+        line = json.dumps(self.serializer(post), ensure_ascii=False, default=str).encode('utf-8') + b"\n"
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+                self._file = open(self.history_path, 'ab')
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            self._offsets.append(offset)
+        except OSError as e:
+            logger.error(f"投稿履歴の書き込みエラー: {e}")
+
+    def _load(self):
+        """既存の履歴ファイルからオフセット・集計・最新分のキャッシュを復元"""
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+
+        try:
+            offset = 0
+            with open(self.history_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    if line.strip():
+                        record = json.loads(line)
+                        self._offsets.append(offset)
+                        self._count(record["platform"], record["status"])
+                    offset += len(line)
+            # 書き込み途中で止まった末尾の行は次の追記と混ざらないよう切り捨てる
+            if offset < os.path.getsize(self.history_path):
+                os.truncate(self.history_path, offset)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"投稿履歴の読み込みエラー: {e}")
+            return
+
+        tail = self._read(max(len(self._offsets) - self.max_in_memory, 0), len(self._offsets))
+        self.recent.extend(self.deserializer(record) if self.deserializer else record for record in tail)
+
+        logger.info(f"投稿履歴を復元: {len(self._offsets)}件")
+
+    def recent_posts(self, limit: int = 10) -> List[Any]:
+        """最新履歴（新しい順、メモリ上の件数まで）"""
+        with self._lock:
+            count = min(limit, len(self.recent))
+            return [self.recent[-1 - i] for i in range(count)]
+
+    def page(self, page: int = 1, page_size: int = 100) -> List[Dict[str, Any]]:
+        """履歴をページ単位で取得（新しい順、1始まり）"""
+        with self._lock:
+            total = len(self)
+            start = max(page - 1, 0) * page_size
+            end = min(start + page_size, total)
+            if start >= end:
+                return []
+
+            memory_count = len(self.recent)
+            records = [
+                self._serialize(self.recent[memory_count - 1 - i])
+                for i in range(start, min(end, memory_count))
+            ]
+
+            # メモリに無い古い分は履歴ファイルから連続読み出し
+            if end > memory_count:
+                first = total - end
+                last = total - max(start, memory_count)
+                records.extend(reversed(self._read(first, last)))
+
+            return records
+
+    def _serialize(self, post) -> Dict[str, Any]:
+        return post if isinstance(post, dict) else self.serializer(post)
+
+    def _read(self, first: int, last: int) -> List[Dict[str, Any]]:
+        """ファイル上のレコード [first, last) を古い順に読む"""
+        if first >= last:
+            return []
+        try:
+            with open(self.history_path, 'rb') as f:
+                f.seek(self._offsets[first])
+                return [json.loads(f.readline()) for _ in range(last - first)]
+        except (OSError, ValueError) as e:
+            logger.error(f"投稿履歴の読み出しエラー: {e}")
+            return []
+
+    def close(self):
+        """追記用のファイルを閉じる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_counts(self) -> Dict[str, Any]:
+        """集計値のスナップショット"""
+        with self._lock:
+            return {
+                "total": self.total,
+                "by_status": dict(self.by_status),
+                "by_platform": {platform: dict(counts) for platform, counts in self.by_platform.items()}
+            }
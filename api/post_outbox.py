@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+投稿アウトボックス
+SQLiteによる冪等キー付き配信記録（at-least-once配信と重複排除）
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# アウトボックスDBファイル（環境変数で上書き可能）
+DEFAULT_OUTBOX_PATH = os.getenv(
+    "SOCIAL_POST_OUTBOX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "post_outbox.db")
+)
+
+# 即時投稿で同一内容を重複とみなす時間幅（秒）
+DEDUP_WINDOW_SECONDS = 60 * 60
+
+# 送信中のまま放置された行を再送対象とするまでの秒数
+SENDING_LEASE_SECONDS = 5 * 60
+
+class OutboxStatus:
+    """アウトボックス行の状態"""
+    PENDING = "pending"
+    SENDING = "sending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+def make_idempotency_key(platform: str,
+                         content: str,
+                         media_urls: Optional[List[str]] = None,
+                         scheduled_time: Optional[datetime] = None,
+                         now: Optional[float] = None,
+                         caller_key: Optional[str] = None) -> str:
+    """投稿内容から冪等キーを生成
+
+    予約投稿は予約時刻を、即時投稿は DEDUP_WINDOW_SECONDS 単位の時間枠をキーに含める。
+    caller_key を指定した場合は内容に関係なくプラットフォームと caller_key のみで決まる。
+    """
+    if caller_key is not None:
+        canonical = json.dumps([platform, "caller", caller_key], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    if scheduled_time is not None:
+        slot = scheduled_time.isoformat()
+    else:
+        slot = f"window:{int((now if now is not None else time.time()) // DEDUP_WINDOW_SECONDS)}"
+
+    canonical = json.dumps(
+        [platform, content, sorted(media_urls or []), slot],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class PostOutbox:
+    """SQLiteトランザクショナルアウトボックス"""
+
+    def __init__(self, db_path: Optional[str] = DEFAULT_OUTBOX_PATH):
+        self.db_path = db_path or ":memory:"
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        # Streamlitはスクリプト実行毎にスレッドが変わるため接続を共有しロックで保護
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self):
+        """テーブル作成"""
+        with self._lock, self._conn:
+            if self.db_path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS post_outbox (
+                    idempotency_key TEXT PRIMARY KEY,
+                    post_id TEXT NOT NULL,
+                    platform TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_at REAL,
+                    remote_id TEXT,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    delivered_at REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_post_outbox_status ON post_outbox (status)"
+            )
+
+    def enqueue(self, key: str, post_id: str, platform: str, payload: Dict[str, Any]) -> bool:
+        """配信予定を登録（既に同じキーがあれば False）"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO post_outbox
+                    (idempotency_key, post_id, platform, payload, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, post_id, platform, json.dumps(payload, ensure_ascii=False, default=str),
+                 OutboxStatus.PENDING, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, key: str, lease_seconds: float = SENDING_LEASE_SECONDS) -> bool:
+        """送信権を取得（配信済み・他で送信中なら False）"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                UPDATE post_outbox
+                SET status = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ?
+                WHERE idempotency_key = ?
+                  AND (status IN (?, ?) OR (status = ? AND claimed_at < ?))
+                """,
+                (OutboxStatus.SENDING, now, now, key,
+                 OutboxStatus.PENDING, OutboxStatus.FAILED,
+                 OutboxStatus.SENDING, now - lease_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def mark_delivered(self, key: str, remote_id: Optional[str] = None):
+        """配信完了を記録"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                UPDATE post_outbox
+                SET status = ?, remote_id = ?, delivered_at = ?, updated_at = ?, last_error = NULL
+                WHERE idempotency_key = ?
+                """,
+                (OutboxStatus.DELIVERED, remote_id, now, now, key)
+            )
+
+    def mark_failed(self, key: str, error: str):
+        """配信失敗を記録"""
+        self._set_status(key, OutboxStatus.FAILED, error)
+
+    def release(self, key: str, reason: Optional[str] = None):
+        """送信権を返却して未送信に戻す（レート制限による延期など）"""
+        self._set_status(key, OutboxStatus.PENDING, reason)
+
+    def discard(self, keys: List[str]):
+        """未送信の行を取り消す（キュー投入に失敗した場合の補償）"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM post_outbox WHERE idempotency_key = ? AND status = ?",
+                [(key, OutboxStatus.PENDING) for key in keys]
+            )
+
+    def _set_status(self, key: str, status: str, error: Optional[str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE post_outbox SET status = ?, last_error = ?, updated_at = ? WHERE idempotency_key = ?",
+                (status, error, time.time(), key)
+            )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """キーで行を取得"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM post_outbox WHERE idempotency_key = ?", (key,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def recover(self, lease_seconds: float = SENDING_LEASE_SECONDS) -> List[Dict[str, Any]]:
+        """起動時リカバリ: 送信中のまま停止した行を未送信に戻し、未配信行を返す"""
+        now = time.time()
+        with self._lock, self._conn:
+            reset = self._conn.execute(
+                "UPDATE post_outbox SET status = ?, updated_at = ? WHERE status = ? AND claimed_at < ?",
+                (OutboxStatus.PENDING, now, OutboxStatus.SENDING, now - lease_seconds)
+            ).rowcount
+            rows = self._conn.execute(
+                "SELECT * FROM post_outbox WHERE status = ? ORDER BY created_at",
+                (OutboxStatus.PENDING,)
+            ).fetchall()
+
+        if reset:
+            logger.warning(f"アウトボックス: 送信中のまま停止した投稿 {reset}件を再送対象に戻しました")
+        return [self._row_to_dict(row) for row in rows]
+
+    def get_statistics(self) -> Dict[str, int]:
+        """状態別件数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS count FROM post_outbox GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        record["payload"] = json.loads(record["payload"])
+        return record
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
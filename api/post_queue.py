@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+投稿キューとレート制限
+プラットフォーム別の時刻順キュー（ヒープ）とトークンバケットによる送信制御
+キューの変更はジャーナルへ追記し、一定量たまったらスナップショットへ圧縮する
+"""
+
+import os
+import json
+import heapq
+import asyncio
+import itertools
+import logging
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Any, Tuple, Callable
+from dataclasses import dataclass
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# キュー永続化ファイル（環境変数で上書き可能）
+DEFAULT_QUEUE_PATH = os.getenv(
+    "SOCIAL_POST_QUEUE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "post_queue.json")
+)
+
+# プラットフォーム別の最大キュー長（超過時はバックプレッシャー）
+DEFAULT_MAX_QUEUE_SIZE = 5000
+
+# ジャーナルをスナップショットへ圧縮する最小エントリ数（キュー長の2倍を超えた時点で圧縮）
+JOURNAL_COMPACT_MIN_ENTRIES = 1000
+
+@dataclass
+class RateLimit:
+    """レート制限設定（window_seconds 内に limit 回まで）"""
+    limit: int
+    window_seconds: float
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.limit / self.window_seconds
+
+# プラットフォーム/エンドポイント別のレート制限
+RATE_LIMITS: Dict[Tuple[str, str], RateLimit] = {
+    ("twitter", "post"): RateLimit(limit=200, window_seconds=15 * 60),
+    ("twitter", "media"): RateLimit(limit=415, window_seconds=15 * 60),
+    ("linkedin", "post"): RateLimit(limit=150, window_seconds=24 * 60 * 60),
+    ("linkedin", "profile"): RateLimit(limit=500, window_seconds=24 * 60 * 60),
+    ("facebook", "post"): RateLimit(limit=200, window_seconds=60 * 60),
+    ("instagram", "post"): RateLimit(limit=25, window_seconds=24 * 60 * 60),
+}
+
+# 未定義エンドポイント用のデフォルト
+DEFAULT_RATE_LIMIT = RateLimit(limit=60, window_seconds=60)
+
+class PostQueueFullError(Exception):
+    """キュー満杯エラー（呼び出し側へのバックプレッシャー）"""
+    def __init__(self, platform: str, size: int, retry_after: float):
+        self.platform = platform
+        self.size = size
+        self.retry_after = retry_after
+        super().__init__(f"Post queue for {platform} is full ({size} posts queued), retry after {retry_after:.0f}s")
+
+class TokenBucket:
+    """トークンバケット"""
+
+    def __init__(self, rate_limit: RateLimit, clock: Callable[[], float] = time.time):
+        self.capacity = float(rate_limit.limit)
+        self.refill_per_second = rate_limit.refill_per_second
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        """経過時間分のトークンを補充"""
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """トークン取得可能になるまでの秒数"""
+        now = self.clock()
+        self._refill(now)
+        blocked = max(0.0, self.blocked_until - now)
+        if self.tokens >= tokens:
+            return blocked
+        shortfall = (tokens - self.tokens) / self.refill_per_second
+        return max(blocked, shortfall)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """トークンを取得（不足時は False）"""
+        if self.wait_time(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def block_until(self, until: float):
+        """Retry-After等により指定時刻まで送信停止"""
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0.0
+        self.updated_at = self.clock()
+
+    def sync_remaining(self, remaining: int, reset_at: Optional[float] = None):
+        """APIが返した残り回数に合わせる"""
+        now = self.clock()
+        self._refill(now)
+        self.tokens = min(self.tokens, float(remaining))
+        if remaining <= 0 and reset_at:
+            self.block_until(reset_at)
+
+def parse_rate_limit_headers(headers: Optional[Dict[str, str]], now: Optional[float] = None) -> Dict[str, Any]:
+    """レスポンスヘッダーからレート制限情報を抽出"""
+    if not headers:
+        return {}
+
+    now = now if now is not None else time.time()
+    lowered = {k.lower(): v for k, v in headers.items()}
+    info = {}
+
+    # Retry-After（秒数 or HTTP-date）
+    retry_after = lowered.get("retry-after")
+    if retry_after:
+        try:
+            info["retry_at"] = now + float(retry_after)
+        except ValueError:
+            try:
+                info["retry_at"] = parsedate_to_datetime(retry_after).timestamp()
+            except (TypeError, ValueError):
+                pass
+
+    # Twitter/X 形式: x-rate-limit-remaining / x-rate-limit-reset（UNIX秒）
+    for prefix in ("x-rate-limit", "x-ratelimit", "ratelimit"):
+        remaining = lowered.get(f"{prefix}-remaining")
+        if remaining is not None:
+            try:
+                info["remaining"] = int(remaining)
+            except ValueError:
+                pass
+            reset = lowered.get(f"{prefix}-reset")
+            if reset is not None:
+                try:
+                    reset_value = float(reset)
+                    # 小さい値は相対秒とみなす
+                    info["reset_at"] = reset_value if reset_value > 1e9 else now + reset_value
+                except ValueError:
+                    pass
+            break
+
+    # Facebook 形式: x-app-usage / x-business-use-case-usage（使用率%）
+    usage = lowered.get("x-app-usage")
+    if usage:
+        try:
+            usage_data = json.loads(usage)
+            info["usage_percent"] = max(float(v) for v in usage_data.values() if isinstance(v, (int, float)))
+        except (ValueError, TypeError):
+            pass
+
+    return info
+
+class PlatformRateLimiter:
+    """プラットフォーム/エンドポイント別レート制御"""
+
+    def __init__(self, limits: Optional[Dict[Tuple[str, str], RateLimit]] = None, clock: Callable[[], float] = time.time):
+        self.limits = dict(RATE_LIMITS if limits is None else limits)
+        self.clock = clock
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def _bucket(self, platform: str, endpoint: str) -> TokenBucket:
+        key = (platform, endpoint)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.limits.get(key, DEFAULT_RATE_LIMIT), self.clock)
+        return self.buckets[key]
+
+    def try_acquire(self, platform: str, endpoint: str = "post") -> bool:
+        """即時にトークン取得を試行"""
+        return self._bucket(platform, endpoint).try_acquire()
+
+    def wait_time(self, platform: str, endpoint: str = "post") -> float:
+        """送信可能になるまでの秒数"""
+        return self._bucket(platform, endpoint).wait_time()
+
+    async def acquire(self, platform: str, endpoint: str = "post", max_wait: Optional[float] = None) -> bool:
+        """トークン取得まで待機（max_wait超過が見込まれる場合は False）"""
+        bucket = self._bucket(platform, endpoint)
+        while True:
+            wait = bucket.wait_time()
+            if wait <= 0:
+                bucket.try_acquire()
+                return True
+            if max_wait is not None and wait > max_wait:
+                return False
+            await asyncio.sleep(wait)
+
+    def apply_rate_limit_info(self, platform: str, endpoint: str, info: Dict[str, Any]):
+        """APIレスポンスのレート制限情報を反映"""
+        if not info:
+            return
+
+        bucket = self._bucket(platform, endpoint)
+        if "retry_at" in info:
+            bucket.block_until(info["retry_at"])
+            logger.warning(f"{platform}/{endpoint} レート制限: {info['retry_at'] - self.clock():.0f}秒停止")
+        if "remaining" in info:
+            bucket.sync_remaining(info["remaining"], info.get("reset_at"))
+        if info.get("usage_percent", 0) >= 100:
+            bucket.block_until(self.clock() + 60 * 60)
+
+    def get_status(self) -> Dict[str, Any]:
+        """バケット状態取得"""
+        return {
+            f"{platform}/{endpoint}": {
+                "tokens": round(bucket.tokens, 2),
+                "capacity": bucket.capacity,
+                "wait_seconds": round(bucket.wait_time(), 2)
+            }
+            for (platform, endpoint), bucket in self.buckets.items()
+        }
+
+class ScheduledPostQueue:
+    """プラットフォーム別の時刻順投稿キュー
+
+    追加・取り出しは storage_path + ".journal" へ1行ずつ追記し、
+    エントリ数がキュー長に比べて大きくなったら storage_path のスナップショットへ圧縮する。
+    投稿は id 属性で識別する。
+    """
+
+    def __init__(self,
+                 storage_path: Optional[str] = DEFAULT_QUEUE_PATH,
+                 max_size_per_platform: int = DEFAULT_MAX_QUEUE_SIZE,
+                 serializer: Optional[Callable[[Any], Dict[str, Any]]] = None,
+                 deserializer: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 compact_min_entries: int = JOURNAL_COMPACT_MIN_ENTRIES):
+        self.storage_path = storage_path
+        self.journal_path = f"{storage_path}.journal" if storage_path else None
+        self.max_size_per_platform = max_size_per_platform
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.compact_min_entries = compact_min_entries
+
+        # platform -> [(scheduled_ts, seq, post)]
+        self.heaps: Dict[str, List[Tuple[float, int, Any]]] = {}
+        self._sequence = itertools.count()
+        self._journal_file = None
+        self._journal_entries = 0
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self.heaps.values())
+
+    def __iter__(self):
+        for heap in self.heaps.values():
+            for _, _, post in heap:
+                yield post
+
+    @staticmethod
+    def _timestamp(post) -> float:
+        return post.scheduled_time.timestamp() if post.scheduled_time else 0.0
+
+    def _check_capacity(self, platform: str, incoming: int = 1):
+        """キュー容量確認（超過時は PostQueueFullError）"""
+        size = len(self.heaps.get(platform, []))
+        if size + incoming > self.max_size_per_platform:
+            raise PostQueueFullError(platform, size, self.estimated_drain_seconds(platform))
+
+    def _push(self, post):
+        platform = post.platform.value
+        heapq.heappush(self.heaps.setdefault(platform, []), (self._timestamp(post), next(self._sequence), post))
+
+    def push(self, post):
+        """投稿を追加"""
+        self._check_capacity(post.platform.value)
+        self._push(post)
+        self._journal([{"op": "push", "post": self.serializer(post)}] if self.serializer else [])
+
+    def push_many(self, posts: List[Any]):
+        """複数投稿を一括追加（ジャーナルへの書き込みは1回）"""
+        incoming: Dict[str, int] = {}
+        for post in posts:
+            incoming[post.platform.value] = incoming.get(post.platform.value, 0) + 1
+        for platform, count in incoming.items():
+            self._check_capacity(platform, count)
+
+        self.requeue_many(posts)
+
+    def requeue(self, post):
+        """レート制限等で延期された投稿を容量に関係なく戻す"""
+        self.requeue_many([post])
+
+    def requeue_many(self, posts: List[Any]):
+        """複数投稿を容量に関係なく戻す（ジャーナルへの書き込みは1回）"""
+        for post in posts:
+            self._push(post)
+        self._journal([{"op": "push", "post": self.serializer(post)} for post in posts] if self.serializer else [])
+
+    def next_due(self, platform: str) -> Optional[float]:
+        """次の投稿予定時刻（UNIX秒）"""
+        heap = self.heaps.get(platform)
+        return heap[0][0] if heap else None
+
+    def pop_ready(self, platform: str, now: float, admit: Callable[[], bool] = lambda: True, limit: Optional[int] = None) -> List[Any]:
+        """期限到来した投稿を時刻順に取り出す（admit が False を返したら停止）"""
+        heap = self.heaps.get(platform, [])
+        ready = []
+        while heap and heap[0][0] <= now and (limit is None or len(ready) < limit):
+            if not admit():
+                break
+            ready.append(heapq.heappop(heap)[2])
+        self._journal([{"op": "pop", "id": post.id} for post in ready])
+        return ready
+
+    def estimated_drain_seconds(self, platform: str, rate_limit: Optional[RateLimit] = None) -> float:
+        """現在のキューを捌くのに必要な目安秒数"""
+        rate_limit = rate_limit or RATE_LIMITS.get((platform, "post"), DEFAULT_RATE_LIMIT)
+        return len(self.heaps.get(platform, [])) / rate_limit.refill_per_second
+
+    def _journal(self, entries: List[Dict[str, Any]]):
+        """変更をジャーナルへ追記し、たまったらスナップショットへ圧縮"""
+        if not entries or not self.journal_path or not self.serializer:
+            return
+
+        try:
+            if self._journal_file is None:
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+            self._journal_file.write("".join(
+                json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries
+            ))
+            self._journal_file.flush()
+            self._journal_entries += len(entries)
+        except OSError as e:
+            logger.error(f"投稿キューのジャーナル書き込みエラー: {e}")
+            return
+
+        if self._journal_entries > max(self.compact_min_entries, 2 * len(self)):
+            self.save()
+
+    def save(self):
+        """キュー全体をスナップショットへ書き出し（アトミック書き込み）、ジャーナルを空にする"""
+        if not self.storage_path or not self.serializer:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
+            data = {
+                "saved_at": datetime.now().isoformat(),
+                "posts": [self.serializer(post) for post in self]
+            }
+            tmp_path = f"{self.storage_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.storage_path)
+
+            # スナップショット確定後にジャーナルを切り詰める（途中で止まっても再生結果は同じ）
+            if self._journal_file is not None:
+                self._journal_file.close()
+            self._journal_file = open(self.journal_path, 'w', encoding='utf-8')
+            self._journal_entries = 0
+        except OSError as e:
+            logger.error(f"投稿キュー保存エラー: {e}")
+
+    def load(self) -> int:
+        """スナップショットにジャーナルを再生してキューを復元"""
+        if not self.storage_path or not self.deserializer:
+            return 0
+
+        # id -> 投稿データ（挿入順を保つ）
+        entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.storage_path):
+            try:
+                with open(self.storage_path, 'r', encoding='utf-8') as f:
+                    for item in json.load(f).get("posts", []):
+                        entries[item.get("id")] = item
+            except (OSError, ValueError) as e:
+                logger.error(f"投稿キュー読み込みエラー: {e}")
+                return 0
+
+        if os.path.exists(self.journal_path):
+            try:
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        # 書き込み途中で止まった末尾の行は無視
+                        if not line.endswith("\n"):
+                            break
+                        entry = json.loads(line)
+                        if entry["op"] == "push":
+                            entries.pop(entry["post"].get("id"), None)
+                            entries[entry["post"].get("id")] = entry["post"]
+                        else:
+                            entries.pop(entry["id"], None)
+                        self._journal_entries += 1
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"投稿キューのジャーナル読み込みエラー: {e}")
+
+        for item in entries.values():
+            try:
+                self._push(self.deserializer(item))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"投稿キューの不正なエントリをスキップ: {e}")
+
+        # 再生済みのジャーナルは圧縮して末尾の書きかけ行も取り除く
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+            self.save()
+
+        logger.info(f"投稿キューを復元: {len(self)}件")
+        return len(self)
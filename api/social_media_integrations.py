@@ -8,6 +8,7 @@ import os
 import asyncio
 import json
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
@@ -15,6 +16,22 @@ from enum import Enum
 import requests
 import base64
 
+from .media_upload import ChunkedMediaUploader
+from .post_history import DEFAULT_HISTORY_PATH, PostHistoryStore
+from .post_outbox import (
+    DEFAULT_OUTBOX_PATH,
+    OutboxStatus,
+    PostOutbox,
+    make_idempotency_key
+)
+from .post_queue import (
+    DEFAULT_QUEUE_PATH,
+    PlatformRateLimiter,
+    PostQueueFullError,
+    ScheduledPostQueue,
+    parse_rate_limit_headers
+)
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -52,6 +69,42 @@ class SocialPost:
             self.hashtags = []
         if self.metadata is None:
             self.metadata = {}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """永続化用の辞書に変換"""
+        return {
+            "id": self.id,
+            "platform": self.platform.value,
+            "content": self.content,
+            "media_urls": self.media_urls,
+            "scheduled_time": self.scheduled_time.isoformat() if self.scheduled_time else None,
+            "hashtags": self.hashtags,
+            "status": self.status.value,
+            "metadata": self.metadata
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SocialPost":
+        """辞書から復元"""
+        return cls(
+            id=data["id"],
+            platform=PlatformType(data["platform"]),
+            content=data["content"],
+            media_urls=data.get("media_urls"),
+            scheduled_time=datetime.fromisoformat(data["scheduled_time"]) if data.get("scheduled_time") else None,
+            hashtags=data.get("hashtags"),
+            status=PostStatus(data.get("status", PostStatus.SCHEDULED.value)),
+            metadata=data.get("metadata")
+        )
+
+def _error_response(error: requests.exceptions.RequestException) -> Dict[str, Any]:
+    """リクエストエラーをレスポンス形式に変換（レート制限情報付き）"""
+    result = {"error": str(error)}
+    response = getattr(error, "response", None)
+    if response is not None:
+        result["status_code"] = response.status_code
+        result["rate_limit"] = parse_rate_limit_headers(response.headers)
+    return result
 
 class TwitterAPI:
     """Twitter/X API統合"""
@@ -66,6 +119,10 @@ class TwitterAPI:
         # API v2エンドポイント
         self.base_url = "https://api.twitter.com/2"
         
+        # Twitter Media Upload API (v1.1)
+        self.upload_url = "https://upload.twitter.com/1.1/media/upload.json"
+        self.media_uploader = ChunkedMediaUploader(self.upload_url, self._get_upload_headers)
+        
     def _get_headers(self) -> Dict[str, str]:
         """認証ヘッダー生成"""
         if not self.bearer_token:
@@ -91,16 +148,17 @@ class TwitterAPI:
             payload["media"] = {"media_ids": media_ids}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = await asyncio.to_thread(requests.post, url, headers=headers, json=payload)
             response.raise_for_status()
             
             result = response.json()
+            result["rate_limit"] = parse_rate_limit_headers(response.headers)
             logger.info(f"Twitter投稿成功: {result.get('data', {}).get('id')}")
             return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Twitter投稿エラー: {e}")
-            return {"error": str(e)}
+            return _error_response(e)
     
     def _mock_tweet_response(self, content: str) -> Dict[str, Any]:
         """モック用レスポンス（API未設定時）"""
@@ -115,24 +173,13 @@ class TwitterAPI:
         }
     
     async def upload_media(self, media_path: str) -> Optional[str]:
-        """メディアアップロード"""
+        """メディアアップロード（チャンク分割・中断再開・同一ファイルはキャッシュ済みIDを再利用）"""
         if not os.path.exists(media_path):
             logger.error(f"メディアファイルが見つかりません: {media_path}")
             return None
         
-        # Twitter Media Upload API (v1.1)
-        upload_url = "https://upload.twitter.com/1.1/media/upload.json"
-        
         try:
-            with open(media_path, 'rb') as f:
-                files = {'media': f}
-                headers = self._get_upload_headers()
-                
-                response = requests.post(upload_url, headers=headers, files=files)
-                response.raise_for_status()
-                
-                result = response.json()
-                return result.get('media_id_string')
+            return await self.media_uploader.upload(media_path)
                 
         except Exception as e:
             logger.error(f"メディアアップロードエラー: {e}")
@@ -192,16 +239,17 @@ class LinkedInAPI:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = await asyncio.to_thread(requests.post, url, headers=headers, json=payload)
             response.raise_for_status()
             
             result = response.json()
+            result["rate_limit"] = parse_rate_limit_headers(response.headers)
             logger.info(f"LinkedIn投稿成功: {result.get('id')}")
             return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"LinkedIn投稿エラー: {e}")
-            return {"error": str(e)}
+            return _error_response(e)
     
     async def _get_profile_id(self) -> Optional[str]:
         """ユーザープロファイルID取得"""
@@ -209,7 +257,7 @@ class LinkedInAPI:
         headers = self._get_headers()
         
         try:
-            response = requests.get(url, headers=headers)
+            response = await asyncio.to_thread(requests.get, url, headers=headers)
             response.raise_for_status()
             
             result = response.json()
@@ -255,16 +303,17 @@ class FacebookAPI:
         params.update({"message": content})
         
         try:
-            response = requests.post(url, params=params)
+            response = await asyncio.to_thread(requests.post, url, params=params)
             response.raise_for_status()
             
             result = response.json()
+            result["rate_limit"] = parse_rate_limit_headers(response.headers)
             logger.info(f"Facebook投稿成功: {result.get('id')}")
             return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Facebook投稿エラー: {e}")
-            return {"error": str(e)}
+            return _error_response(e)
     
     def _mock_facebook_response(self, content: str) -> Dict[str, Any]:
         """モック用レスポンス（API未設定時）"""
@@ -275,53 +324,177 @@ class FacebookAPI:
             "mock": True
         }
 
+# プラットフォーム別の同時投稿数上限
+PLATFORM_CONCURRENCY_LIMITS = {
+    PlatformType.TWITTER: 2,
+    PlatformType.LINKEDIN: 2,
+    PlatformType.FACEBOOK: 2,
+    PlatformType.INSTAGRAM: 1,
+}
+
+# メディアアップロードの同時実行数上限
+MEDIA_UPLOAD_CONCURRENCY = 4
+
+# 即時投稿でレート制限待ちを許容する最大秒数（超過時はキューへ延期）
+IMMEDIATE_PUBLISH_MAX_WAIT = 30
+
+# 投稿履歴エクスポートの1ページあたり件数
+EXPORT_PAGE_SIZE = 1000
+
 class SocialMediaManager:
     """ソーシャルメディア統合管理"""
     
-    def __init__(self):
+    def __init__(self,
+                 queue_path: Optional[str] = DEFAULT_QUEUE_PATH,
+                 outbox_path: Optional[str] = DEFAULT_OUTBOX_PATH,
+                 history_path: Optional[str] = DEFAULT_HISTORY_PATH):
         self.twitter = TwitterAPI()
         self.linkedin = LinkedInAPI()
         self.facebook = FacebookAPI()
         
-        self.post_queue = []
-        self.post_history = []
+        # プラットフォーム別レート制御と時刻順キュー（永続化済みの投稿を復元）
+        self.rate_limiter = PlatformRateLimiter()
+        self.post_queue = ScheduledPostQueue(
+            storage_path=queue_path,
+            serializer=SocialPost.to_dict,
+            deserializer=SocialPost.from_dict
+        )
+        self.post_queue.load()
+        
+        # 全件をディスクへ書き込み最新分のみメモリ保持、集計は追加時に更新
+        self.post_history = PostHistoryStore(
+            history_path=history_path,
+            serializer=SocialPost.to_dict,
+            deserializer=SocialPost.from_dict,
+            platforms=[platform.value for platform in PlatformType],
+            statuses=[status.value for status in PostStatus]
+        )
+        
+        # 冪等キー付きアウトボックス（起動時に未配信分をキューへ戻す）
+        self.outbox = PostOutbox(outbox_path)
+        self._recover_outbox()
+        
+        # プラットフォーム別レイテンシ統計
+        self.platform_metrics = {
+            platform.value: {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": None}
+            for platform in PlatformType
+        }
+        
+        # セマフォはイベントループ単位で生成（Streamlitは実行毎にループを作り直すため）
+        self._semaphore_loop = None
+        self._platform_semaphores = {}
+        self._media_semaphore = None
+    
+    def _ensure_semaphores(self):
+        """現在のイベントループ用のセマフォを準備"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore_loop = loop
+            self._platform_semaphores = {
+                platform: asyncio.Semaphore(PLATFORM_CONCURRENCY_LIMITS.get(platform, 1))
+                for platform in PlatformType
+            }
+            self._media_semaphore = asyncio.Semaphore(MEDIA_UPLOAD_CONCURRENCY)
+    
+    def _recover_outbox(self):
+        """起動時リカバリ: キューに無い未配信投稿を再投入"""
+        queued_keys = {post.metadata.get("idempotency_key") for post in self.post_queue}
+        recovered = []
+        
+        for record in self.outbox.recover():
+            if record["idempotency_key"] in queued_keys:
+                continue
+            post = SocialPost.from_dict(record["payload"])
+            post.status = PostStatus.SCHEDULED
+            post.scheduled_time = post.scheduled_time or datetime.now()
+            recovered.append(post)
+        
+        if recovered:
+            self.post_queue.requeue_many(recovered)
+            logger.info(f"アウトボックスから未配信投稿を復元: {len(recovered)}件")
     
     async def create_post(self, 
                          content: str, 
                          platforms: List[PlatformType],
                          scheduled_time: Optional[datetime] = None,
                          hashtags: List[str] = None,
-                         media_paths: List[str] = None) -> List[SocialPost]:
-        """複数プラットフォーム用投稿作成"""
+                         media_paths: List[str] = None,
+                         idempotency_key: Optional[str] = None) -> List[SocialPost]:
+        """複数プラットフォーム用投稿作成
+        
+        idempotency_key を指定すると同じキーでの再実行は重複投稿されない。
+        未指定時は投稿内容・メディア・予約時刻のハッシュを使用する。
+        """
         
         posts = []
         
         for platform in platforms:
-            post_id = f"{platform.value}_{int(datetime.now().timestamp())}"
-            
             # プラットフォーム別のコンテンツ調整
             adjusted_content = self._adjust_content_for_platform(content, platform, hashtags)
             
+            key = make_idempotency_key(
+                platform.value, adjusted_content, media_paths, scheduled_time, caller_key=idempotency_key
+            )
+            
             post = SocialPost(
-                id=post_id,
+                id=f"{platform.value}_{key[:16]}",
                 platform=platform,
                 content=adjusted_content,
                 scheduled_time=scheduled_time,
                 hashtags=hashtags or [],
-                media_urls=media_paths or []
+                media_urls=media_paths or [],
+                metadata={"idempotency_key": key}
             )
             
             posts.append(post)
-            
-            # 即座投稿 or スケジュール
-            if scheduled_time is None:
-                await self._publish_post(post)
-            else:
+        
+        # アウトボックスへ登録（重複分は既存の配信状態を反映して送信対象から外す）
+        new_posts = [post for post in posts if self._register_in_outbox(post)]
+        
+        # 即座投稿 or スケジュール
+        if scheduled_time is None:
+            # 全プラットフォームへ並列投稿（戻り値の順序は platforms の順序のまま）
+            await asyncio.gather(*[self._publish_when_allowed(post) for post in new_posts])
+        else:
+            for post in new_posts:
                 post.status = PostStatus.SCHEDULED
-                self.post_queue.append(post)
+            # キュー満杯時は PostQueueFullError で呼び出し側へ通知
+            try:
+                self.post_queue.push_many(new_posts)
+            except PostQueueFullError:
+                self.outbox.discard([post.metadata["idempotency_key"] for post in new_posts])
+                raise
         
         return posts
     
+    def _register_in_outbox(self, post: SocialPost) -> bool:
+        """アウトボックスへ登録し、送信が必要なら True"""
+        key = post.metadata.setdefault(
+            "idempotency_key",
+            make_idempotency_key(post.platform.value, post.content, post.media_urls, post.scheduled_time)
+        )
+        if self.outbox.enqueue(key, post.id, post.platform.value, post.to_dict()):
+            return True
+        
+        record = self.outbox.get(key)
+        if record and record["status"] == OutboxStatus.FAILED:
+            # 失敗済みは再送可能
+            return True
+        
+        self._apply_duplicate(post, record)
+        return False
+    
+    def _apply_duplicate(self, post: SocialPost, record: Optional[Dict[str, Any]]):
+        """重複投稿に既存の配信状態を反映"""
+        post.metadata["duplicate"] = True
+        if record and record["status"] == OutboxStatus.DELIVERED:
+            post.status = PostStatus.PUBLISHED
+            post.metadata["remote_id"] = record["remote_id"]
+        else:
+            post.status = PostStatus.SCHEDULED
+        
+        logger.info(f"{post.platform.value}重複投稿をスキップ: {post.id}")
+    
     def _adjust_content_for_platform(self, 
                                    content: str, 
                                    platform: PlatformType, 
@@ -351,19 +524,76 @@ class SocialMediaManager:
         
         return content
     
+    async def _upload_twitter_media(self, media_paths: List[str]) -> List[str]:
+        """Twitterメディアを並列アップロード（順序保持）"""
+        async def upload(media_path: str) -> Optional[str]:
+            async with self._media_semaphore:
+                await self.rate_limiter.acquire(PlatformType.TWITTER.value, "media")
+                return await self.twitter.upload_media(media_path)
+        
+        media_ids = await asyncio.gather(*[
+            upload(media_path) for media_path in media_paths if os.path.exists(media_path)
+        ])
+        return [media_id for media_id in media_ids if media_id]
+    
+    async def _publish_when_allowed(self, post: SocialPost) -> bool:
+        """レート制限内なら即時投稿、長く待つ場合はキューへ延期"""
+        platform = post.platform.value
+        if await self.rate_limiter.acquire(platform, "post", max_wait=IMMEDIATE_PUBLISH_MAX_WAIT):
+            return await self._publish_post(post)
+        
+        self._defer_post(post, self.rate_limiter.wait_time(platform, "post"), "rate_limited")
+        return False
+    
+    def _defer_post(self, post: SocialPost, delay_seconds: float, reason: str):
+        """投稿を延期してキューへ戻す（失われないよう容量制限は無視）"""
+        post.status = PostStatus.SCHEDULED
+        post.scheduled_time = datetime.now() + timedelta(seconds=max(delay_seconds, 1))
+        post.metadata["deferred_reason"] = reason
+        post.metadata["deferred_count"] = post.metadata.get("deferred_count", 0) + 1
+        self.post_queue.requeue(post)
+        
+        logger.warning(f"{post.platform.value}投稿を延期: {post.id} ({reason}, {delay_seconds:.0f}秒後)")
+    
     async def _publish_post(self, post: SocialPost) -> bool:
         """投稿実行"""
+        self._ensure_semaphores()
+        
+        async with self._platform_semaphores[post.platform]:
+            start = time.perf_counter()
+            try:
+                return await self._send_post(post)
+            finally:
+                self._record_latency(post, time.perf_counter() - start)
+                # 延期された投稿は履歴ではなくキューに残る（重複スキップ分も記録しない）
+                if post.status != PostStatus.SCHEDULED and not post.metadata.get("duplicate"):
+                    self.post_history.append(post)
+    
+    def _record_latency(self, post: SocialPost, elapsed: float):
+        """プラットフォーム別レイテンシを記録"""
+        metrics = self.platform_metrics[post.platform.value]
+        metrics["count"] += 1
+        metrics["total_seconds"] += elapsed
+        metrics["max_seconds"] = max(metrics["max_seconds"], elapsed)
+        metrics["last_seconds"] = elapsed
+        post.metadata["latency_seconds"] = round(elapsed, 4)
+    
+    async def _send_post(self, post: SocialPost) -> bool:
+        """プラットフォームAPIへ送信し結果を反映"""
+        # 送信権の取得（配信済み・他で送信中ならスキップ）
+        if "idempotency_key" not in post.metadata and not self._register_in_outbox(post):
+            return post.status == PostStatus.PUBLISHED
+        key = post.metadata["idempotency_key"]
+        if not self.outbox.claim(key):
+            self._apply_duplicate(post, self.outbox.get(key))
+            return post.status == PostStatus.PUBLISHED
+        
         try:
             result = None
             
             if post.platform == PlatformType.TWITTER:
                 # メディアアップロード
-                media_ids = []
-                for media_url in post.media_urls:
-                    if os.path.exists(media_url):
-                        media_id = await self.twitter.upload_media(media_url)
-                        if media_id:
-                            media_ids.append(media_id)
+                media_ids = await self._upload_twitter_media(post.media_urls)
                 
                 result = await self.twitter.post_tweet(post.content, media_ids)
                 
@@ -373,17 +603,27 @@ class SocialMediaManager:
             elif post.platform == PlatformType.FACEBOOK:
                 result = await self.facebook.post_to_page(post.content)
             
+            # レート制限情報を反映し、429 は失敗ではなく延期扱い
+            if result:
+                self.rate_limiter.apply_rate_limit_info(post.platform.value, "post", result.pop("rate_limit", None))
+                if result.get("status_code") == 429:
+                    self.outbox.release(key, "http_429")
+                    self._defer_post(post, self.rate_limiter.wait_time(post.platform.value, "post"), "http_429")
+                    return False
+            
             # 結果処理
             if result and not result.get("error"):
                 post.status = PostStatus.PUBLISHED
                 post.metadata["api_response"] = result
                 post.metadata["published_at"] = datetime.now().isoformat()
+                self.outbox.mark_delivered(key, self._remote_id(result))
                 
                 logger.info(f"{post.platform.value}投稿成功: {post.id}")
                 return True
             else:
                 post.status = PostStatus.FAILED
                 post.metadata["error"] = result.get("error", "Unknown error")
+                self.outbox.mark_failed(key, post.metadata["error"])
                 
                 logger.error(f"{post.platform.value}投稿失敗: {post.id}")
                 return False
@@ -391,31 +631,66 @@ class SocialMediaManager:
         except Exception as e:
             post.status = PostStatus.FAILED
             post.metadata["error"] = str(e)
+            self.outbox.mark_failed(key, str(e))
             
             logger.error(f"投稿実行エラー: {e}")
             return False
-        
-        finally:
-            self.post_history.append(post)
     
-    async def process_scheduled_posts(self):
+    @staticmethod
+    def _remote_id(result: Dict[str, Any]) -> Optional[str]:
+        """APIレスポンスからプラットフォーム側の投稿IDを取得"""
+        data = result.get("data")
+        if isinstance(data, dict) and data.get("id"):
+            return str(data["id"])
+        return str(result["id"]) if result.get("id") else None
+    
+    async def process_scheduled_posts(self) -> Dict[str, int]:
         """スケジュール投稿処理"""
-        current_time = datetime.now()
+        current_time = datetime.now().timestamp()
         
-        ready_posts = [
-            post for post in self.post_queue 
-            if post.scheduled_time and post.scheduled_time <= current_time
-        ]
+        # 期限到来分をプラットフォーム別に時刻順で取り出す（トークンが尽きたら次回へ持ち越し）
+        ready_posts = []
+        for platform in list(self.post_queue.heaps):
+            ready_posts.extend(self.post_queue.pop_ready(
+                platform,
+                current_time,
+                admit=lambda platform=platform: self.rate_limiter.try_acquire(platform, "post")
+            ))
+        
+        await asyncio.gather(*[self._publish_post(post) for post in ready_posts])
         
-        for post in ready_posts:
-            await self._publish_post(post)
-            self.post_queue.remove(post)
+        published = len([p for p in ready_posts if p.status == PostStatus.PUBLISHED])
+        deferred = len([p for p in ready_posts if p.status == PostStatus.SCHEDULED])
         
-        logger.info(f"スケジュール投稿処理完了: {len(ready_posts)}件実行")
+        logger.info(f"スケジュール投稿処理完了: {len(ready_posts)}件実行 (延期 {deferred}件, 待機中 {len(self.post_queue)}件)")
+        return {"processed": len(ready_posts), "published": published, "deferred": deferred, "queued": len(self.post_queue)}
+    
+    def get_backpressure(self) -> Dict[str, Any]:
+        """プラットフォーム別のキュー負荷（呼び出し側の投入調整用）"""
+        status = {}
+        for platform in PlatformType:
+            queued = len(self.post_queue.heaps.get(platform.value, []))
+            capacity = self.post_queue.max_size_per_platform
+            next_due = self.post_queue.next_due(platform.value)
+            status[platform.value] = {
+                "queued": queued,
+                "capacity": capacity,
+                "utilization": queued / capacity if capacity else 1.0,
+                "accepting": queued < capacity,
+                "rate_limit_wait_seconds": self.rate_limiter.wait_time(platform.value, "post"),
+                "estimated_drain_seconds": self.post_queue.estimated_drain_seconds(platform.value),
+                "next_due": datetime.fromtimestamp(next_due).isoformat() if next_due else None
+            }
+        return status
+    
+    def get_recent_posts(self, limit: int = 10) -> List[SocialPost]:
+        """最新の投稿履歴（新しい順）"""
+        return self.post_history.recent_posts(limit)
     
     def get_post_analytics(self) -> Dict[str, Any]:
-        """投稿分析データ取得"""
-        total_posts = len(self.post_history)
+        """投稿分析データ取得（履歴追加時に更新済みのカウンタから算出）"""
+        counts = self.post_history.get_counts()
+        total_posts = counts["total"]
         
         if total_posts == 0:
             return {"total": 0, "by_platform": {}, "by_status": {}}
@@ -423,44 +698,47 @@ class SocialMediaManager:
         # プラットフォーム別統計
         platform_stats = {}
         for platform in PlatformType:
-            platform_posts = [p for p in self.post_history if p.platform == platform]
+            platform_counts = counts["by_platform"].get(platform.value, {})
             platform_stats[platform.value] = {
-                "total": len(platform_posts),
-                "published": len([p for p in platform_posts if p.status == PostStatus.PUBLISHED]),
-                "failed": len([p for p in platform_posts if p.status == PostStatus.FAILED])
+                "total": sum(platform_counts.values()),
+                "published": platform_counts.get(PostStatus.PUBLISHED.value, 0),
+                "failed": platform_counts.get(PostStatus.FAILED.value, 0)
             }
         
         # ステータス別統計
-        status_stats = {}
-        for status in PostStatus:
-            status_posts = [p for p in self.post_history if p.status == status]
-            status_stats[status.value] = len(status_posts)
+        status_stats = {status.value: counts["by_status"].get(status.value, 0) for status in PostStatus}
         
         return {
             "total": total_posts,
             "by_platform": platform_stats,
             "by_status": status_stats,
-            "success_rate": len([p for p in self.post_history if p.status == PostStatus.PUBLISHED]) / total_posts * 100
+            "success_rate": status_stats[PostStatus.PUBLISHED.value] / total_posts * 100
         }
     
-    def export_post_history(self) -> Dict[str, Any]:
-        """投稿履歴エクスポート"""
+    def get_latency_metrics(self) -> Dict[str, Any]:
+        """プラットフォーム別レイテンシ統計取得"""
+        return {
+            platform: {
+                "count": metrics["count"],
+                "avg_seconds": metrics["total_seconds"] / metrics["count"] if metrics["count"] else 0.0,
+                "max_seconds": metrics["max_seconds"],
+                "last_seconds": metrics["last_seconds"]
+            }
+            for platform, metrics in self.platform_metrics.items()
+        }
+    
+    def export_post_history(self, page: int = 1, page_size: int = EXPORT_PAGE_SIZE) -> Dict[str, Any]:
+        """投稿履歴エクスポート（新しい順、ページ単位）"""
+        total_posts = len(self.post_history)
         return {
             "export_time": datetime.now().isoformat(),
-            "total_posts": len(self.post_history),
-            "posts": [
-                {
-                    "id": post.id,
-                    "platform": post.platform.value,
-                    "content": post.content,
-                    "status": post.status.value,
-                    "scheduled_time": post.scheduled_time.isoformat() if post.scheduled_time else None,
-                    "hashtags": post.hashtags,
-                    "metadata": post.metadata
-                }
-                for post in self.post_history
-            ],
-            "analytics": self.get_post_analytics()
+            "total_posts": total_posts,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total_posts + page_size - 1) // page_size,
+            "posts": self.post_history.page(page, page_size),
+            "analytics": self.get_post_analytics(),
+            "latency": self.get_latency_metrics()
         }
 
 # グローバルマネージャーインスタンス
@@ -5,6 +5,7 @@
 """
 
 import asyncio
+import queue
 import schedule
 import threading
 import time
@@ -20,6 +21,9 @@ import uuid
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 他スレッドから受け付けるイベントタスクの上限件数（超えた分は破棄）
+MAX_PENDING_EVENTS = 1000
+
 class TaskStatus(Enum):
     """タスク実行ステータス"""
     PENDING = "pending"
@@ -174,12 +178,23 @@ class MarketingTaskRegistry:
                 "timestamp": datetime.now().isoformat()
             }
         
+        async def notify_kpi_alert(alert: Dict[str, Any]):
+            """KPI異常アラート通知"""
+            logger.warning(f"KPIアラート [{alert.get('severity')}]: {alert.get('message')}")
+            
+            return {
+                "alert_id": alert.get("alert_id"),
+                "notified": True,
+                "timestamp": datetime.now().isoformat()
+            }
+        
         # タスク登録
         self.register("generate_social_content", generate_social_content)
         self.register("analyze_competitors", analyze_competitors)
         self.register("post_to_social_media", post_to_social_media)
         self.register("generate_performance_report", generate_performance_report)
         self.register("send_marketing_email", send_marketing_email)
+        self.register("notify_kpi_alert", notify_kpi_alert)
 
 class MarketingScheduler:
     """マーケティングスケジューラー"""
@@ -192,6 +207,10 @@ class MarketingScheduler:
         self.scheduler_thread = None
         self.execution_loop = None
         
+        # 他スレッドからのイベントタスク（スケジューラースレッドで tasks に登録し、完了後に削除）
+        self._event_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        self._event_task_ids = set()
+        
         # スケジューラー統計
         self.stats = {
             "total_tasks": 0,
@@ -242,6 +261,43 @@ class MarketingScheduler:
         logger.info(f"タスクを追加: {name} (ID: {task_id})")
         return task_id
     
+    def submit_event(self, name: str, description: str, function_name: str,
+                     kwargs: Dict[str, Any] = None,
+                     priority: TaskPriority = TaskPriority.HIGH,
+                     max_retries: int = 1) -> bool:
+        """他スレッドからイベントタスクを受け付ける（スケジューラースレッドで登録・実行し、完了後に破棄）"""
+        try:
+            self._event_queue.put_nowait({
+                "name": name,
+                "description": description,
+                "function_name": function_name,
+                "kwargs": kwargs or {},
+                "trigger_type": TriggerType.EVENT,
+                "priority": priority,
+                "max_retries": max_retries
+            })
+            return True
+        except queue.Full:
+            logger.warning(f"イベントタスクの受付上限を超えたため破棄: {name}")
+            return False
+    
+    def _drain_events(self):
+        """受け付けたイベントタスクを登録（スケジューラースレッドで呼ぶ）"""
+        while True:
+            try:
+                event = self._event_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._event_task_ids.add(self.add_task(**event))
+    
+    def _discard_finished_events(self, tasks: List[ScheduledTask]):
+        """完了・失敗したイベントタスクと結果を削除（スケジューラースレッドで呼ぶ）"""
+        for task in tasks:
+            if task.id in self._event_task_ids and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                self.tasks.pop(task.id, None)
+                self.task_results.pop(task.id, None)
+                self._event_task_ids.discard(task.id)
+    
     def _calculate_next_run(self, trigger_type: TriggerType, config: Dict[str, Any]) -> Optional[datetime]:
         """次回実行時間を計算"""
         now = datetime.now()
@@ -405,11 +461,12 @@ class MarketingScheduler:
         
         while self.is_running:
             try:
+                self._drain_events()
                 current_time = datetime.now()
                 
                 # 実行すべきタスクを取得
                 ready_tasks = [
-                    task for task in self.tasks.values()
+                    task for task in list(self.tasks.values())
                     if (task.status == TaskStatus.PENDING and 
                         task.next_run and 
                         task.next_run <= current_time)
@@ -432,6 +489,7 @@ class MarketingScheduler:
                             *[self.execute_task(task) for task in batch],
                             return_exceptions=True
                         )
+                        self._discard_finished_events(batch)
                 
                 # 1秒待機
                 await asyncio.sleep(1)
@@ -488,8 +546,8 @@ class MarketingScheduler:
     
     def get_statistics(self) -> Dict[str, Any]:
         """スケジューラー統計を取得"""
-        pending_tasks = len([t for t in self.tasks.values() if t.status == TaskStatus.PENDING])
-        running_tasks = len([t for t in self.tasks.values() if t.status == TaskStatus.RUNNING])
+        pending_tasks = len([t for t in list(self.tasks.values()) if t.status == TaskStatus.PENDING])
+        running_tasks = len([t for t in list(self.tasks.values()) if t.status == TaskStatus.RUNNING])
         
         return {
             **self.stats,
@@ -513,7 +571,7 @@ class MarketingScheduler:
                     "priority": task.priority.value,
                     "status": task.status.value
                 }
-                for task in self.tasks.values()
+                for task in list(self.tasks.values())
             ],
             "statistics": self.get_statistics()
         }
@@ -17,6 +17,10 @@ from scipy import stats
 from typing import Dict, List, Any, Optional
 import uuid
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.experiments import Experiment
+from analytics.bandit import get_allocator
+
 # ページ設定
 st.set_page_config(
     page_title="A/Bテスト自動化",
@@ -206,6 +210,28 @@ class ABTest:
         self.sample_size = 0
         self.confidence_level = 0.95
         self.minimum_detectable_effect = 0.05
+        # バリアント別の十分統計量（イベント到着ごとに積み上げ）
+        self.experiment = Experiment(self.id, [v['name'] for v in variants], alpha=1 - self.confidence_level)
+        # トラフィック配分（fixed: 均等分割、thompson/ucb: バンディット）
+        self.allocation_mode = "fixed"
+        self.bandit = None
+    
+    def enable_bandit(self, policy: str):
+        """バンディットによる配分に切り替える（プロセス内で共有される配分器を使用）"""
+        self.allocation_mode = policy
+        self.bandit = get_allocator(f"ab_{self.id}", [v['name'] for v in self.variants], policy=policy)
+    
+    def choose_variant(self) -> str:
+        """訪問者に表示するバリアントを選択"""
+        if self.bandit is not None:
+            return self.bandit.choose_variant()
+        return self.variants[np.random.randint(len(self.variants))]['name']
+    
+    def record_outcome(self, variant_name: str, converted: bool, revenue: float = 0.0):
+        """訪問結果を記録"""
+        if self.bandit is not None:
+            self.bandit.record_outcome(variant_name, float(converted))
+        self.experiment.record([variant_name], [float(converted)], [revenue])
         
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -219,84 +245,60 @@ class ABTest:
             "end_date": self.end_date.isoformat() if self.end_date else None,
             "sample_size": self.sample_size,
             "confidence_level": self.confidence_level,
-            "minimum_detectable_effect": self.minimum_detectable_effect
+            "minimum_detectable_effect": self.minimum_detectable_effect,
+            "allocation_mode": self.allocation_mode
         }
 
-def generate_test_data(test: ABTest, days: int = 7) -> pd.DataFrame:
-    """テスト結果のサンプルデータを生成"""
-    np.random.seed(42)
-    
-    dates = pd.date_range(end=datetime.now(), periods=days, freq='D')
-    data = []
-    
-    for date in dates:
-        for i, variant in enumerate(test.variants):
-            # バリアントごとに異なる成果を設定
-            base_conversion_rate = 0.03 + (i * 0.005)  # バリアントBの方が少し高い
-            daily_visitors = np.random.poisson(1000)
-            conversions = np.random.binomial(daily_visitors, base_conversion_rate)
-            
-            data.append({
-                'date': date,
-                'variant': variant['name'],
-                'visitors': daily_visitors,
-                'conversions': conversions,
-                'conversion_rate': conversions / daily_visitors if daily_visitors > 0 else 0,
-                'revenue': conversions * np.random.normal(5000, 1000)
-            })
-    
-    return pd.DataFrame(data)
+def generate_test_data(test: ABTest, days: int = 14) -> pd.DataFrame:
+    """テスト結果のサンプルデータを生成し、実験の集計に取り込む（初回のみ）"""
+    if test.experiment.version == 0:
+        rng = np.random.default_rng(42)
+        dates = pd.date_range(end=datetime.now(), periods=days, freq='D')
+        n_variants = len(test.variants)
+        # バリアントごとに異なる成果を設定（後のバリアントほど少し高い）
+        base_conversion_rates = 0.03 + np.arange(n_variants) * 0.005
+        
+        for date in dates:
+            if test.bandit is not None:
+                # バンディット配分では当日の訪問者をまとめて割り当て、結果を配分器に返す
+                assigned = test.bandit.choose_batch(rng.poisson(1000 * n_variants))
+                codes = pd.Categorical(assigned, categories=test.experiment.variants).codes
+                converted = (rng.random(len(codes)) < base_conversion_rates[codes]).astype(np.float64)
+                revenue = converted * rng.normal(5000, 1000, len(codes))
+                test.bandit.record_outcomes(assigned, converted)
+                test.experiment.record(codes, converted, revenue, timestamp=date.to_pydatetime())
+                continue
+            daily_visitors = rng.poisson(1000, n_variants)
+            conversions = rng.binomial(daily_visitors, base_conversion_rates)
+            revenue = conversions * rng.normal(5000, 1000, n_variants)
+            test.experiment.record_totals(daily_visitors, conversions, revenue, day=date.date())
+    
+    return test.experiment.daily_frame()
 
-def calculate_statistical_significance(control_data: pd.DataFrame, variant_data: pd.DataFrame) -> Dict[str, Any]:
-    """統計的有意性を計算"""
-    # コンバージョン率の計算
-    control_conversions = control_data['conversions'].sum()
-    control_visitors = control_data['visitors'].sum()
-    control_rate = control_conversions / control_visitors if control_visitors > 0 else 0
-    
-    variant_conversions = variant_data['conversions'].sum()
-    variant_visitors = variant_data['visitors'].sum()
-    variant_rate = variant_conversions / variant_visitors if variant_visitors > 0 else 0
-    
-    # 効果サイズ（リフト）
-    lift = ((variant_rate - control_rate) / control_rate * 100) if control_rate > 0 else 0
-    
-    # Z検定
-    pooled_rate = (control_conversions + variant_conversions) / (control_visitors + variant_visitors)
-    se = np.sqrt(pooled_rate * (1 - pooled_rate) * (1/control_visitors + 1/variant_visitors))
-    
-    if se > 0:
-        z_score = (variant_rate - control_rate) / se
-        p_value = 2 * (1 - stats.norm.cdf(abs(z_score)))
-    else:
-        z_score = 0
-        p_value = 1
-    
-    # 信頼区間の計算
-    confidence_level = 0.95
-    z_critical = stats.norm.ppf((1 + confidence_level) / 2)
-    margin_of_error = z_critical * se
-    ci_lower = (variant_rate - control_rate - margin_of_error) * 100
-    ci_upper = (variant_rate - control_rate + margin_of_error) * 100
-    
-    # 検出力（パワー）の計算
-    effect_size = abs(variant_rate - control_rate) / np.sqrt(pooled_rate * (1 - pooled_rate))
-    sample_size = (control_visitors + variant_visitors) / 2
-    power = 1 - stats.norm.cdf(z_critical - effect_size * np.sqrt(sample_size))
+def calculate_statistical_significance(test: ABTest) -> Dict[str, Any]:
+    """統計的有意性を計算（常時有効な逐次検定とベイズ評価、最も有望なバリアントをコントロールと比較）"""
+    analysis = test.experiment.analyze()
+    comparisons = analysis['comparisons']
+    best = max(comparisons, key=lambda c: (c['is_significant'] and c['lift'] > 0, c['lift']))
+    control = analysis['variants'][test.experiment.control]
+    challenger = next(v for v in analysis['variants'] if v['name'] == best['variant'])
     
     return {
-        'control_rate': control_rate,
-        'variant_rate': variant_rate,
-        'lift': lift,
-        'p_value': p_value,
-        'is_significant': p_value < 0.05,
-        'confidence_interval': (ci_lower, ci_upper),
-        'z_score': z_score,
-        'power': power,
+        'control_rate': best['control_rate'],
+        'variant_rate': best['rate'],
+        'variant_name': best['variant'],
+        'lift': best['lift'],
+        'p_value': best['p_value'],
+        'is_significant': best['is_significant'],
+        'confidence_interval': best['confidence_interval'],
+        'z_score': best['z_score'],
+        'power': best['power'],
         'sample_size': {
-            'control': control_visitors,
-            'variant': variant_visitors
-        }
+            'control': control['visitors'],
+            'variant': challenger['visitors']
+        },
+        'comparisons': comparisons,
+        'variants': analysis['variants']
     }
 
 def calculate_sample_size_needed(baseline_rate: float, mde: float, power: float = 0.8, alpha: float = 0.05) -> int:
@@ -335,16 +337,15 @@ with tabs[0]:
             </div>
             """, unsafe_allow_html=True)
             
-            # テストデータを生成
-            test_data = generate_test_data(test)
+            # テストデータを取り込み、実験の集計値を表示
+            generate_test_data(test)
+            experiment = test.experiment
             
             # バリアント別の結果表示
-            col1, col2 = st.columns(2)
+            variant_cols = st.columns(len(test.variants))
             
             for i, variant in enumerate(test.variants):
-                variant_data = test_data[test_data['variant'] == variant['name']]
-                
-                with col1 if i == 0 else col2:
+                with variant_cols[i]:
                     is_control = variant.get('is_control', False)
                     st.markdown(f"""
                     <div class="variant-card">
@@ -356,10 +357,10 @@ with tabs[0]:
                     """, unsafe_allow_html=True)
                     
                     # メトリクス表示
-                    total_visitors = variant_data['visitors'].sum()
-                    total_conversions = variant_data['conversions'].sum()
+                    total_visitors = int(experiment.visitors[i])
+                    total_conversions = int(experiment.conversions[i])
                     avg_conversion_rate = (total_conversions / total_visitors * 100) if total_visitors > 0 else 0
-                    total_revenue = variant_data['revenue'].sum()
+                    total_revenue = experiment.revenue[i]
                     
                     metrics_col1, metrics_col2 = st.columns(2)
                     
@@ -371,6 +372,12 @@ with tabs[0]:
                         st.metric("CVR", f"{avg_conversion_rate:.2f}%")
                         st.metric("収益", f"¥{total_revenue:,.0f}")
             
+            if test.bandit is not None:
+                allocation = test.bandit.allocation()
+                st.caption("現在のトラフィック配分（バンディット）: " + " / ".join(
+                    f"{name} {share*100:.1f}%" for name, share in allocation.items()
+                ))
+            
             # アクションボタン
             action_col1, action_col2, action_col3 = st.columns(3)
             
@@ -410,6 +417,8 @@ with tabs[0]:
 with tabs[1]:
     st.header("新規A/Bテスト作成")
     
+    n_challengers = st.number_input("テストバリアント数（コントロール以外）", min_value=1, max_value=5, value=1)
+    
     with st.form("create_ab_test"):
         test_name = st.text_input("テスト名*", placeholder="例: ホームページCTAボタンテスト")
         
@@ -428,6 +437,14 @@ with tabs[1]:
             test_duration = st.number_input("テスト期間（日）", min_value=1, value=14)
             expected_daily_traffic = st.number_input("予想日次トラフィック", min_value=100, value=1000)
         
+        allocation_labels = {"fixed": "固定分割", "thompson": "バンディット（Thompson Sampling）", "ucb": "バンディット（UCB）"}
+        allocation_mode = st.selectbox(
+            "トラフィック配分",
+            list(allocation_labels.keys()),
+            format_func=lambda x: allocation_labels[x],
+            help="バンディットは成果の良いバリアントへ自動的にトラフィックを寄せます"
+        )
+        
         st.markdown("### バリアント設定")
         
         # コントロール（A）
@@ -435,19 +452,26 @@ with tabs[1]:
         control_name = st.text_input("名前", value="コントロール", key="control_name")
         control_description = st.text_area("説明", placeholder="現在のバージョンの説明", key="control_desc")
         
-        # バリアント（B）
-        st.markdown("#### バリアントB")
-        variant_name = st.text_input("名前", value="バリアント", key="variant_name")
-        variant_description = st.text_area("説明", placeholder="テストバージョンの説明", key="variant_desc")
-        variant_hypothesis = st.text_area(
-            "仮説",
-            placeholder="例: CTAボタンの色を青から緑に変更することで、クリック率が10%向上する"
-        )
+        # テストバリアント（B以降）
+        challengers = []
+        for i in range(int(n_challengers)):
+            label = chr(ord('B') + i)
+            st.markdown(f"#### バリアント{label}")
+            challengers.append({
+                "name": st.text_input("名前", value="バリアント" if n_challengers == 1 else f"バリアント{label}", key=f"variant_name_{i}"),
+                "description": st.text_area("説明", placeholder="テストバージョンの説明", key=f"variant_desc_{i}"),
+                "hypothesis": st.text_area(
+                    "仮説",
+                    placeholder="例: CTAボタンの色を青から緑に変更することで、クリック率が10%向上する",
+                    key=f"variant_hypothesis_{i}"
+                ),
+                "is_control": False
+            })
         
         # サンプルサイズ計算
         baseline_rate = st.number_input("現在のコンバージョン率 (%)", min_value=0.1, max_value=100.0, value=3.0) / 100
         required_sample_size = calculate_sample_size_needed(baseline_rate, minimum_detectable_effect)
-        days_needed = required_sample_size / (expected_daily_traffic * 2)  # 2バリアント
+        days_needed = required_sample_size / expected_daily_traffic * (len(challengers) + 1)
         
         st.info(f"""
         **推奨サンプルサイズ**: 各バリアント {required_sample_size:,} 訪問者
@@ -457,30 +481,29 @@ with tabs[1]:
         submitted = st.form_submit_button("テストを開始", type="primary", use_container_width=True)
         
         if submitted:
-            if test_name:
-                variants = [
-                    {
-                        "name": control_name,
-                        "description": control_description,
-                        "is_control": True
-                    },
-                    {
-                        "name": variant_name,
-                        "description": variant_description,
-                        "hypothesis": variant_hypothesis,
-                        "is_control": False
-                    }
-                ]
-                
+            variants = [
+                {
+                    "name": control_name,
+                    "description": control_description,
+                    "is_control": True
+                }
+            ] + challengers
+            
+            if not test_name:
+                st.error("テスト名を入力してください")
+            elif len({v['name'] for v in variants}) < len(variants):
+                st.error("バリアント名が重複しています")
+            else:
                 new_test = ABTest(test_name, test_type, variants)
                 new_test.confidence_level = confidence_level
                 new_test.minimum_detectable_effect = minimum_detectable_effect
+                new_test.experiment.alpha = 1 - confidence_level
+                if allocation_mode != "fixed":
+                    new_test.enable_bandit(allocation_mode)
                 
                 st.session_state.ab_tests[new_test.id] = new_test
                 st.success(f"A/Bテスト '{test_name}' を開始しました！")
                 st.rerun()
-            else:
-                st.error("テスト名を入力してください")
 
 # 結果分析タブ
 with tabs[2]:
@@ -501,12 +524,8 @@ with tabs[2]:
             test = st.session_state.ab_tests[selected_test_id]
             test_data = generate_test_data(test, days=14)
             
-            # コントロールとバリアントのデータを分離
-            control_data = test_data[test_data['variant'] == test.variants[0]['name']]
-            variant_data = test_data[test_data['variant'] == test.variants[1]['name']]
-            
-            # 統計的有意性の計算
-            results = calculate_statistical_significance(control_data, variant_data)
+            # 統計的有意性の計算（集計済みの十分統計量から算出）
+            results = calculate_statistical_significance(test)
             
             # 結果サマリー
             st.markdown("### 🎯 結果サマリー")
@@ -515,7 +534,7 @@ with tabs[2]:
                 if results['lift'] > 0:
                     st.markdown(f"""
                     <div class="winner-badge">
-                        🏆 バリアントBが勝利！ +{results['lift']:.1f}%のリフト
+                        🏆 {results['variant_name']}が勝利！ +{results['lift']:.1f}%のリフト
                     </div>
                     """, unsafe_allow_html=True)
                 else:
@@ -545,7 +564,7 @@ with tabs[2]:
             with metrics_cols[1]:
                 st.markdown(f"""
                 <div class="result-card">
-                    <div class="result-label">バリアントCVR</div>
+                    <div class="result-label">{results['variant_name']} CVR</div>
                     <div class="result-value">{results['variant_rate']*100:.2f}%</div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -563,7 +582,7 @@ with tabs[2]:
             with metrics_cols[3]:
                 st.markdown(f"""
                 <div class="result-card">
-                    <div class="result-label">p値</div>
+                    <div class="result-label">p値（逐次検定）</div>
                     <div class="result-value">{results['p_value']:.4f}</div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -576,7 +595,7 @@ with tabs[2]:
             with detail_col1:
                 st.markdown("#### 統計的検定結果")
                 st.write(f"**Z値**: {results['z_score']:.3f}")
-                st.write(f"**信頼区間 (95%)**: {results['confidence_interval'][0]:.2f}% ~ {results['confidence_interval'][1]:.2f}%")
+                st.write(f"**常時有効信頼区間 ({test.confidence_level:.0%})**: {results['confidence_interval'][0]:.2f}% ~ {results['confidence_interval'][1]:.2f}%")
                 st.write(f"**検出力**: {results['power']*100:.1f}%")
                 
                 # 信頼区間の視覚化
@@ -610,6 +629,25 @@ with tabs[2]:
                 else:
                     st.success("十分な検出力があります。")
             
+            # バリアント別のベイズ評価
+            st.markdown("### 🎲 ベイズ評価（全バリアント）")
+            
+            bayes_df = pd.DataFrame([
+                {
+                    'バリアント': v['name'],
+                    '訪問者数': v['visitors'],
+                    'コンバージョン': v['conversions'],
+                    '事後平均CVR': f"{v['posterior_mean']*100:.2f}%",
+                    '信用区間': f"{v['credible_interval'][0]*100:.2f}% ~ {v['credible_interval'][1]*100:.2f}%",
+                    '最良である確率': f"{v['prob_best']*100:.1f}%",
+                    'コントロール超え確率': f"{v['prob_beat_control']*100:.1f}%",
+                    '期待損失': f"{v['expected_loss']*100:.3f}pt"
+                }
+                for v in results['variants']
+            ])
+            st.dataframe(bayes_df, use_container_width=True, hide_index=True)
+            st.caption("p値と信頼区間は常時有効な逐次検定（mSPRT）によるもので、途中で何度確認しても有意水準が保たれます。3バリアント以上はボンフェローニ補正済みです。")
+            
             # 時系列グラフ
             st.markdown("### 📊 コンバージョン率の推移")
             
@@ -676,7 +714,7 @@ with tabs[2]:
             if results['is_significant']:
                 if results['lift'] > 0:
                     st.success(f"""
-                    **バリアントBを採用することを推奨します。**
+                    **{results['variant_name']}を採用することを推奨します。**
                     
                     - 統計的に有意な{results['lift']:.1f}%の改善が確認されました
                     - p値（{results['p_value']:.4f}）は有意水準を下回っています
@@ -686,7 +724,7 @@ with tabs[2]:
                     st.warning(f"""
                     **コントロール（現在のバージョン）を維持することを推奨します。**
                     
-                    - バリアントBは{abs(results['lift']):.1f}%のパフォーマンス低下を示しました
+                    - {results['variant_name']}は{abs(results['lift']):.1f}%のパフォーマンス低下を示しました
                     - 変更による悪影響を避けるため、現状維持が賢明です
                     """)
             else:
@@ -711,10 +749,8 @@ with tabs[3]:
         
         # テスト一覧
         for test_id, test in completed_tests.items():
-            test_data = generate_test_data(test)
-            control_data = test_data[test_data['variant'] == test.variants[0]['name']]
-            variant_data = test_data[test_data['variant'] == test.variants[1]['name']]
-            results = calculate_statistical_significance(control_data, variant_data)
+            generate_test_data(test)
+            results = calculate_statistical_significance(test)
             
             st.markdown(f"""
             <div class="test-card">
@@ -7,7 +7,6 @@ AI模型設定画面
 import streamlit as st
 import sys
 import os
-import asyncio
 import json
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
@@ -18,6 +17,7 @@ import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.ai_models import model_manager, TaskType, AI_MODELS, AIProvider
 from config.ai_client import ai_client
+from analytics.background_jobs import JobStatus, job_runner
 
 # ページ設定
 st.set_page_config(
@@ -476,52 +476,64 @@ with tabs[3]:
     
     with col2:
         if st.button("🚀 テスト実行", type="primary"):
-            with st.spinner("AI模型をテスト中..."):
-                try:
-                    # 非同期処理のためのイベントループ処理
-                    import asyncio
-                    
-                    async def run_test():
-                        return await ai_client.generate_content(test_prompt, test_task_type)
-                    
-                    # 既存のイベントループがある場合の処理
-                    try:
-                        loop = asyncio.get_event_loop()
-                        if loop.is_running():
-                            # Streamlitの環境では新しいスレッドで実行
-                            import concurrent.futures
-                            with concurrent.futures.ThreadPoolExecutor() as executor:
-                                future = executor.submit(asyncio.run, run_test())
-                                response = future.result(timeout=30)
-                        else:
-                            response = loop.run_until_complete(run_test())
-                    except RuntimeError:
-                        response = asyncio.run(run_test())
-                    
-                    # 結果を保存
-                    test_result = {
-                        "timestamp": datetime.now(),
-                        "prompt": test_prompt,
-                        "task_type": test_task_type.value,
-                        "response": response.to_dict()
-                    }
-                    st.session_state.ai_test_results.append(test_result)
-                    
-                    # 結果表示
-                    st.success("✅ テスト完了！")
-                    
-                    with st.expander("📋 テスト結果", expanded=True):
-                        st.write(f"**使用模型:** {response.model}")
-                        st.write(f"**プロバイダー:** {response.provider}")
-                        st.write(f"**レスポンス時間:** {response.response_time:.2f}秒")
-                        st.write(f"**使用トークン:** {response.tokens_used}")
-                        st.write(f"**コスト:** ¥{response.cost:.4f}")
-                        
-                        st.markdown("**生成内容:**")
-                        st.info(response.content)
+            st.session_state.ai_test_job = (test_prompt, test_task_type, job_runner.submit(
+                ai_client.generate_content(test_prompt, test_task_type),
+                name="ai_model_test"
+            ))
+    
+    # テストジョブの状態を確認（バックグラウンド実行、リラン時に結果を反映）
+    if 'ai_test_job' in st.session_state:
+        job_prompt, job_task_type, job_id = st.session_state.ai_test_job
+        test_job = job_runner.get(job_id)
+        if test_job is None:
+            # 結果が破棄されたジョブは同じ入力で再投入
+            st.session_state.ai_test_job = (job_prompt, job_task_type, job_runner.submit(
+                ai_client.generate_content(job_prompt, job_task_type),
+                name="ai_model_test"
+            ))
+            st.rerun()
+        elif not test_job.done:
+            col1, col2, col3 = st.columns([4, 1, 1])
+            with col1:
+                st.info(f"AI模型をテスト中... ({test_job.elapsed:.0f}秒経過)")
+            with col2:
+                if st.button("🔄 更新", key="refresh_ai_test"):
+                    st.rerun()
+            with col3:
+                if st.button("⏹️ キャンセル", key="cancel_ai_test"):
+                    job_runner.cancel(test_job.job_id)
+                    st.rerun()
+        elif test_job.status == JobStatus.COMPLETED:
+            del st.session_state.ai_test_job
+            response = test_job.result
+            
+            # 結果を保存
+            test_result = {
+                "timestamp": datetime.now(),
+                "prompt": job_prompt,
+                "task_type": job_task_type.value,
+                "response": response.to_dict()
+            }
+            st.session_state.ai_test_results.append(test_result)
+            
+            # 結果表示
+            st.success("✅ テスト完了！")
+            
+            with st.expander("📋 テスト結果", expanded=True):
+                st.write(f"**使用模型:** {response.model}")
+                st.write(f"**プロバイダー:** {response.provider}")
+                st.write(f"**レスポンス時間:** {response.response_time:.2f}秒")
+                st.write(f"**使用トークン:** {response.tokens_used}")
+                st.write(f"**コスト:** ¥{response.cost:.4f}")
                 
-                except Exception as e:
-                    st.error(f"テスト実行エラー: {e}")
+                st.markdown("**生成内容:**")
+                st.info(response.content)
+        elif test_job.status == JobStatus.CANCELLED:
+            del st.session_state.ai_test_job
+            st.warning("テストをキャンセルしました")
+        else:
+            del st.session_state.ai_test_job
+            st.error(f"テスト実行エラー: {test_job.error}")
     
     # テスト履歴
     if st.session_state.ai_test_results:
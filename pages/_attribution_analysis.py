@@ -19,6 +19,14 @@ from scipy import stats
 import networkx as nx
 import asyncio
 
+# パス追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.attribution import journeys_to_arrays
+from analytics.markov_attribution import channel_transition_matrix
+from analytics.attribution_state import DEFAULT_STATE_DIR, AttributionState
+from analytics.journey_ingestion import JourneyStore
+from analytics.page_cache import page_cache
+
 # AI機能
 async def analyze_attribution_with_ai(
     attribution_data: Dict,
@@ -603,6 +611,9 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 取り込み済みジャーニーから画面に読み込む最大件数
+MAX_PAGE_JOURNEYS = 50000
+
 # セッション状態初期化
 if 'attribution_data' not in st.session_state:
     st.session_state.attribution_data = {}
@@ -650,81 +661,11 @@ def generate_customer_journey_data():
     
     return journeys
 
-def calculate_attribution_models(journeys):
-    """各アトリビューションモデルの結果を計算"""
-    models = {
-        'First-Touch': {},
-        'Last-Touch': {},
-        'Linear': {},
-        'Time-Decay': {},
-        'U-Shaped': {},
-        'W-Shaped': {},
-        'Custom ML': {}
-    }
-    
-    for journey in journeys:
-        if not journey['converted']:
-            continue
-            
-        touchpoints = journey['touchpoints']
-        conversion_value = journey['conversion_value']
-        
-        if len(touchpoints) == 0:
-            continue
-        
-        # First-Touch Attribution
-        first_tp = touchpoints[0]['name']
-        models['First-Touch'][first_tp] = models['First-Touch'].get(first_tp, 0) + conversion_value
-        
-        # Last-Touch Attribution
-        last_tp = touchpoints[-1]['name']
-        models['Last-Touch'][last_tp] = models['Last-Touch'].get(last_tp, 0) + conversion_value
-        
-        # Linear Attribution
-        value_per_touchpoint = conversion_value / len(touchpoints)
-        for tp in touchpoints:
-            tp_name = tp['name']
-            models['Linear'][tp_name] = models['Linear'].get(tp_name, 0) + value_per_touchpoint
-        
-        # Time-Decay Attribution
-        total_weight = sum(2**i for i in range(len(touchpoints)))
-        for i, tp in enumerate(touchpoints):
-            weight = 2**i / total_weight
-            tp_name = tp['name']
-            models['Time-Decay'][tp_name] = models['Time-Decay'].get(tp_name, 0) + (conversion_value * weight)
-        
-        # U-Shaped Attribution (40% first, 40% last, 20% middle)
-        if len(touchpoints) == 1:
-            tp_name = touchpoints[0]['name']
-            models['U-Shaped'][tp_name] = models['U-Shaped'].get(tp_name, 0) + conversion_value
-        elif len(touchpoints) == 2:
-            for tp in touchpoints:
-                tp_name = tp['name']
-                models['U-Shaped'][tp_name] = models['U-Shaped'].get(tp_name, 0) + (conversion_value * 0.5)
-        else:
-            # First touchpoint: 40%
-            first_tp = touchpoints[0]['name']
-            models['U-Shaped'][first_tp] = models['U-Shaped'].get(first_tp, 0) + (conversion_value * 0.4)
-            
-            # Last touchpoint: 40%
-            last_tp = touchpoints[-1]['name']
-            models['U-Shaped'][last_tp] = models['U-Shaped'].get(last_tp, 0) + (conversion_value * 0.4)
-            
-            # Middle touchpoints: 20% split
-            middle_touchpoints = touchpoints[1:-1]
-            if middle_touchpoints:
-                value_per_middle = (conversion_value * 0.2) / len(middle_touchpoints)
-                for tp in middle_touchpoints:
-                    tp_name = tp['name']
-                    models['U-Shaped'][tp_name] = models['U-Shaped'].get(tp_name, 0) + value_per_middle
-        
-        # Custom ML Model (シミュレーション)
-        ml_weights = np.random.dirichlet(np.ones(len(touchpoints)), size=1)[0]
-        for i, tp in enumerate(touchpoints):
-            tp_name = tp['name']
-            models['Custom ML'][tp_name] = models['Custom ML'].get(tp_name, 0) + (conversion_value * ml_weights[i])
-    
-    return models
+def calculate_attribution_models(journeys, state=None):
+    """各アトリビューションモデルの結果を計算（集計状態に未反映のジャーニーだけ加算して読む）"""
+    state = state if state is not None else AttributionState(state_dir=None)
+    state.update(journeys)
+    return state.model_results()
 
 def calculate_roi_metrics(attribution_results, touchpoint_costs):
     """ROIメトリクスを計算"""
@@ -785,9 +726,39 @@ def perform_statistical_significance_test(model1_data, model2_data):
         'effect_size': abs(effect_size)
     }
 
-# データ生成
-customer_journeys = generate_customer_journey_data()
-attribution_results = calculate_attribution_models(customer_journeys)
+def load_store_journeys(path: str, limit: int) -> List[Dict[str, Any]]:
+    """ジャーニーストアからページ表示用のジャーニーを読み込む"""
+    return JourneyStore(path).to_journeys(limit=limit)
+
+# データ生成（データソースが変わった時のみ。リラン時は集計済みの値を読むだけ）
+journey_store = JourneyStore()
+# 取り込み済みのイベントログがあれば実データ、無ければ合成データ
+journey_source = (
+    (journey_store.path, len(journey_store.parts), page_cache.data_version('journeys')) if journey_store.parts else None
+)
+if not st.session_state.customer_journeys or st.session_state.get('journey_source') != journey_source:
+    if journey_store.parts:
+        # 取り込みのたびに無効化されるため、同じストアの読み込みはセッション間で共有
+        st.session_state.customer_journeys = page_cache.call(
+            load_store_journeys, journey_store.path, MAX_PAGE_JOURNEYS, depends_on=('journeys',), copy_result=True
+        )
+    else:
+        st.session_state.customer_journeys = generate_customer_journey_data()
+    st.session_state.journey_source = journey_source
+    st.session_state.attribution_synced = False
+customer_journeys = st.session_state.customer_journeys
+
+real_data = journey_source is not None
+if st.session_state.get('attribution_real_data') != real_data or 'attribution_state' not in st.session_state:
+    # 実データは日次バケットを保存して次のセッションでも使い、合成データはセッション毎に異なるため保存しない
+    st.session_state.attribution_state = AttributionState(state_dir=DEFAULT_STATE_DIR if real_data else None)
+    st.session_state.attribution_real_data = real_data
+    st.session_state.attribution_synced = False
+if st.session_state.attribution_synced:
+    attribution_results = st.session_state.attribution_state.model_results()
+else:
+    attribution_results = calculate_attribution_models(customer_journeys, st.session_state.attribution_state)
+    st.session_state.attribution_synced = True
 
 # タッチポイントコスト（仮想データ）
 touchpoint_costs = {
@@ -1008,11 +979,17 @@ with tabs[0]:
             'pros': '認知とコンバージョンのバランス評価',
             'cons': '中間タッチポイントの評価が低い'
         },
-        'Custom ML': {
-            'description': '機械学習による動的な貢献度算出',
-            'use_case': '複雑な顧客ジャーニーの高精度分析',
-            'pros': 'データドリブンで最適化',
-            'cons': 'ブラックボックス化、解釈が困難'
+        'Markov Chain': {
+            'description': '遷移確率から各タッチポイントを除去した際のコンバージョン低下率で貢献を分配',
+            'use_case': '離脱パスも含めたチャネル間の相互作用の評価',
+            'pros': 'データドリブンで解釈可能（除去効果）',
+            'cons': '直前のタッチポイントのみに依存する1次の近似'
+        },
+        'Shapley': {
+            'description': 'チャネルの組み合わせ毎のコンバージョン率から協力ゲームの限界貢献を平均して分配',
+            'use_case': 'チャネル間のシナジーを公平に評価したい場合',
+            'pros': '組み合わせ効果を公理的に公平に分配',
+            'cons': 'チャネル数が多いとサンプリング近似になる'
         }
     }
     
@@ -1120,14 +1097,9 @@ with tabs[1]:
     
     # 遷移マトリックス作成
     touchpoint_names = list(touchpoint_costs.keys())
-    transition_matrix = np.zeros((len(touchpoint_names), len(touchpoint_names)))
-    
-    for journey in filtered_journeys:
-        touchpoints = [tp['name'] for tp in journey['touchpoints']]
-        for i in range(len(touchpoints) - 1):
-            from_idx = touchpoint_names.index(touchpoints[i])
-            to_idx = touchpoint_names.index(touchpoints[i + 1])
-            transition_matrix[from_idx][to_idx] += 1
+    transition_matrix = channel_transition_matrix(
+        journeys_to_arrays(filtered_journeys, channels=touchpoint_names, converted_only=False)
+    )[:len(touchpoint_names), :len(touchpoint_names)]
     
     # 遷移確率に変換
     row_sums = transition_matrix.sum(axis=1, keepdims=True)
@@ -1186,7 +1158,7 @@ with tabs[1]:
                 </div>
                 <div class="step-metrics">
                     <div class="step-metric">
-                        <div class="metric-value">¥{touchpoint['cost']:,.0f}</div>
+                        <div class="metric-value">¥{touchpoint.get('cost', 0):,.0f}</div>
                         <div class="metric-label">コスト</div>
                     </div>
                     <div class="step-metric">
@@ -17,6 +17,7 @@ import plotly.graph_objects as go
 # パス追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from api.social_media_integrations import social_manager, PlatformType, PostStatus, validate_api_keys, quick_post
+from analytics.background_jobs import JobStatus, job_key, job_runner, report_progress
 from config.ai_models import TaskType
 from config.ai_client import ai_client
 
@@ -229,8 +230,6 @@ st.markdown("""
 # セッション状態初期化
 if 'draft_posts' not in st.session_state:
     st.session_state.draft_posts = {}
-if 'posting_in_progress' not in st.session_state:
-    st.session_state.posting_in_progress = False
 if 'projects' not in st.session_state:
     st.session_state.projects = {}
 if 'current_project_id' not in st.session_state:
@@ -319,6 +318,35 @@ async def generate_social_content(product_info: dict, platform: str) -> str:
     
     return response.content
 
+def submit_content_generation(product_info: dict, platform: str) -> str:
+    """コンテンツ生成ジョブを投入し、ジョブIDを返す"""
+    return job_runner.submit(
+        generate_social_content(product_info, platform),
+        name="social_content_generation",
+        key=job_key("social_content_generation", product_info, platform)
+    )
+
+async def publish_drafts(drafts: dict) -> list:
+    """プラットフォーム別に編集した投稿を1つのジョブ内で並行投稿（完了したプラットフォームごとに進捗を記録）"""
+    finished = []
+
+    async def post(platform_key: str, draft: dict):
+        try:
+            return await quick_post(content=draft['content'], platforms=[platform_key], hashtags=draft['hashtags'])
+        finally:
+            finished.append(platform_key)
+            report_progress(len(finished) / len(drafts), f"{platform_key} の投稿が完了 ({len(finished)}/{len(drafts)})")
+
+    report_progress(0.0, f"{len(drafts)}件のプラットフォームへ投稿中")
+    results = await asyncio.gather(*[
+        post(platform_key, draft) for platform_key, draft in drafts.items()
+    ], return_exceptions=True)
+    return [
+        {"platform": platform_key,
+         "result": {"success": False, "error": str(result)} if isinstance(result, Exception) else result}
+        for platform_key, result in zip(drafts, results)
+    ]
+
 def render_platform_status():
     """プラットフォーム接続状況表示"""
     st.header("📱 プラットフォーム接続状況")
@@ -386,24 +414,41 @@ def render_post_editor():
     
     with col2:
         if st.button("🚀 AI生成", type="primary"):
-            with st.spinner("AI投稿を生成中..."):
-                try:
-                    # 非同期AI生成
-                    import concurrent.futures
-                    
-                    async def generate():
-                        return await generate_social_content(product_info, selected_platform.value)
-                    
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(asyncio.run, generate())
-                        generated_content = future.result(timeout=30)
-                    
-                    st.session_state.draft_posts[selected_platform.value] = generated_content
-                    st.success("✅ AI投稿を生成しました")
+            # 生成はバックグラウンドで実行し、同じ入力の生成結果は再利用
+            st.session_state.content_generation_job = (
+                selected_platform.value, submit_content_generation(product_info, selected_platform.value)
+            )
+    
+    # 生成ジョブの状態を確認し、完了していればドラフトに反映
+    if 'content_generation_job' in st.session_state:
+        platform_key, job_id = st.session_state.content_generation_job
+        generation_job = job_runner.get(job_id)
+        if generation_job is None:
+            # 結果が破棄されたジョブは同じ入力で再投入
+            st.session_state.content_generation_job = (
+                platform_key, submit_content_generation(product_info, platform_key)
+            )
+            st.rerun()
+        elif not generation_job.done:
+            col1, col2, col3 = st.columns([4, 1, 1])
+            with col1:
+                st.info(f"🤖 AI投稿を生成中... ({generation_job.elapsed:.0f}秒経過)")
+            with col2:
+                if st.button("🔄 更新", key="refresh_generation"):
+                    st.rerun()
+            with col3:
+                if st.button("⏹️ キャンセル", key="cancel_generation"):
+                    job_runner.cancel(generation_job.job_id)
                     st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"AI生成エラー: {e}")
+        else:
+            del st.session_state.content_generation_job
+            if generation_job.status == JobStatus.COMPLETED:
+                st.session_state.draft_posts[platform_key] = generation_job.result
+                st.success("✅ AI投稿を生成しました")
+            elif generation_job.status == JobStatus.CANCELLED:
+                st.warning("AI投稿の生成をキャンセルしました")
+            else:
+                st.error(f"AI生成エラー: {generation_job.error or 'キャンセルされました'}")
     
     st.markdown("---")
     
@@ -509,40 +554,44 @@ def render_post_editor():
             for p in selected_platforms
         )
         
-        if st.button("📤 投稿実行", type="primary", disabled=not can_post or st.session_state.posting_in_progress):
-            if can_post:
-                st.session_state.posting_in_progress = True
-                st.rerun()
-    
-    # 投稿実行処理
-    if st.session_state.posting_in_progress:
-        with st.spinner("投稿を実行中..."):
-            try:
-                results = []
-                
-                for platform in selected_platforms:
-                    platform_key = platform.value
-                    post_data = edited_posts.get(platform_key, {})
-                    
-                    if post_data.get('is_valid'):
-                        # 投稿実行
-                        import concurrent.futures
-                        
-                        async def post():
-                            return await quick_post(
-                                content=post_data['content'],
-                                platforms=[platform_key],
-                                hashtags=post_data['hashtags']
-                            )
-                        
-                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                            future = executor.submit(asyncio.run, post())
-                            result = future.result(timeout=30)
-                        
-                        results.append({
-                            "platform": platform_key,
-                            "result": result
-                        })
+        if st.button("📤 投稿実行", type="primary", disabled=not can_post or 'posting_job' in st.session_state):
+            drafts = {
+                platform.value: {
+                    'content': edited_posts[platform.value]['content'],
+                    'hashtags': edited_posts[platform.value]['hashtags']
+                }
+                for platform in selected_platforms
+                if edited_posts.get(platform.value, {}).get('is_valid')
+            }
+            # 投稿はバックグラウンドの1ジョブで実行し、結果はリラン時に表示
+            st.session_state.posting_job = (drafts, job_runner.submit(publish_drafts(drafts), name="social_post"))
+            st.rerun()
+    
+    # 投稿ジョブの状態を確認
+    if 'posting_job' in st.session_state:
+        drafts, job_id = st.session_state.posting_job
+        posting_job = job_runner.get(job_id)
+        if posting_job is None:
+            # 結果が破棄されたジョブは再投入（冪等キーにより投稿済みの分は重複しない）
+            st.session_state.posting_job = (drafts, job_runner.submit(publish_drafts(drafts), name="social_post"))
+            st.rerun()
+        elif not posting_job.done:
+            col1, col2, col3 = st.columns([4, 1, 1])
+            with col1:
+                st.info(f"📤 投稿を実行中... ({posting_job.elapsed:.0f}秒経過)")
+                if posting_job.events:
+                    st.progress(posting_job.progress, text=posting_job.message)
+            with col2:
+                if st.button("🔄 更新", key="refresh_posting"):
+                    st.rerun()
+            with col3:
+                if st.button("⏹️ キャンセル", key="cancel_posting"):
+                    job_runner.cancel(posting_job.job_id)
+                    st.rerun()
+        else:
+            del st.session_state.posting_job
+            if posting_job.status == JobStatus.COMPLETED:
+                results = posting_job.result
                 
                 # 結果表示
                 success_count = sum(1 for r in results if r["result"].get("success"))
@@ -560,19 +609,13 @@ def render_post_editor():
                     else:
                         st.error(f"❌ {platform_name}: 投稿失敗")
                 
-                st.session_state.posting_in_progress = False
-                
                 # ドラフトをクリア
-                for platform_key in selected_platforms:
-                    if platform_key.value in st.session_state.draft_posts:
-                        del st.session_state.draft_posts[platform_key.value]
-                
-                st.rerun()
-                
-            except Exception as e:
-                st.error(f"投稿実行エラー: {e}")
-                st.session_state.posting_in_progress = False
-                st.rerun()
+                for platform_key in drafts:
+                    st.session_state.draft_posts.pop(platform_key, None)
+            elif posting_job.status == JobStatus.CANCELLED:
+                st.warning("投稿をキャンセルしました（完了済みのプラットフォームは投稿履歴で確認できます）")
+            else:
+                st.error(f"投稿実行エラー: {posting_job.error}")
 
 def render_post_history():
     """投稿履歴表示"""
@@ -672,7 +715,7 @@ def render_post_history():
     
     if social_manager.post_history:
         # 最新10件表示
-        recent_posts = social_manager.post_history[-10:][::-1]
+        recent_posts = social_manager.get_recent_posts(10)
         
         for post in recent_posts:
             platform_info = PLATFORM_INFO.get(post.platform, {"icon": "📱", "name": post.platform.value})
@@ -16,9 +16,15 @@ import plotly.express as px
 from typing import Dict, List, Any, Optional
 import uuid
 import networkx as nx
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import asyncio
+
+# パス追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.segmentation import CustomerSegmenter
+from analytics.next_action import next_action_predictor
+from analytics.background_jobs import JobStatus, job_key, job_runner
+from analytics.page_cache import page_cache
+from analytics.journey_ingestion import JourneyStore
+from analytics.funnel import FUNNEL_STAGES, FunnelState, StageEvents
 
 # AI機能のインポート
 async def analyze_customer_journey_with_ai(customer_data: Dict, journey_data: Dict) -> Dict[str, Any]:
@@ -777,8 +783,9 @@ if 'customer_segments' not in st.session_state:
 if 'prediction_models' not in st.session_state:
     st.session_state.prediction_models = {}
 
+@page_cache.cached(ttl=600)
 def generate_customer_data():
-    """顧客データを生成"""
+    """顧客データを生成（セッション間で共有し、10分ごとに再生成）"""
     np.random.seed(42)
     
     # 顧客基本データ
@@ -800,71 +807,40 @@ def generate_customer_data():
             'churn_probability': np.random.uniform(0.05, 0.95)
         }
         
-        # ジャーニーステージを決定
-        days_since_acquisition = (datetime.now() - customer['acquisition_date']).days
-        if days_since_acquisition <= 7:
-            customer['stage'] = 'Awareness'
-        elif days_since_acquisition <= 30:
-            customer['stage'] = 'Consideration'
-        elif customer['total_purchases'] == 0:
-            customer['stage'] = 'Trial'
-        elif customer['total_purchases'] <= 2:
-            customer['stage'] = 'Purchase'
-        elif customer['engagement_score'] > 0.7:
-            customer['stage'] = 'Loyalty'
-        else:
-            customer['stage'] = 'Retention'
-        
+        customer['stage'] = journey_stage(customer)
         customers.append(customer)
     
     return customers
 
-def segment_customers(customers):
-    """顧客セグメンテーション"""
-    # セグメンテーション用データ準備
-    features = []
+def journey_stage(customer: Dict[str, Any], now: Optional[datetime] = None) -> str:
+    """獲得からの日数・購入回数・エンゲージメントからジャーニーステージを決定"""
+    days_since_acquisition = ((now or datetime.now()) - customer['acquisition_date']).days
+    if days_since_acquisition <= 7:
+        return 'Awareness'
+    elif days_since_acquisition <= 30:
+        return 'Consideration'
+    elif customer['total_purchases'] == 0:
+        return 'Trial'
+    elif customer['total_purchases'] <= 2:
+        return 'Purchase'
+    elif customer['engagement_score'] > 0.7:
+        return 'Loyalty'
+    return 'Retention'
+
+def load_store_customers(path: str) -> List[Dict[str, Any]]:
+    """ジャーニーストアのユーザー別サマリーを顧客データとして読み込む（基準時刻はストアの最新イベント）"""
+    summary = JourneyStore(path).customer_summary()
+    reference = max(summary['acquisition_date'].max(), summary['last_purchase'].max()) if len(summary) else datetime.now()
+    customers = summary.to_dict('records')
     for customer in customers:
-        feature_vector = [
-            customer['ltv'],
-            customer['total_purchases'],
-            customer['avg_order_value'],
-            customer['engagement_score'],
-            customer['churn_probability'],
-            (datetime.now() - customer['acquisition_date']).days
-        ]
-        features.append(feature_vector)
-    
-    # 正規化
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(features)
-    
-    # K-meansクラスタリング
-    kmeans = KMeans(n_clusters=5, random_state=42)
-    cluster_labels = kmeans.fit_predict(features_scaled)
-    
-    # セグメント定義
-    segment_names = [
-        'High-Value Champions',
-        'Potential Loyalists', 
-        'New Customers',
-        'At-Risk Customers',
-        'Cannot Lose Them'
-    ]
-    
-    segments = {}
-    for i, name in enumerate(segment_names):
-        segment_customers = [customers[j] for j, label in enumerate(cluster_labels) if label == i]
-        
-        if segment_customers:
-            segments[name] = {
-                'customers': segment_customers,
-                'size': len(segment_customers),
-                'avg_ltv': np.mean([c['ltv'] for c in segment_customers]),
-                'avg_purchases': np.mean([c['total_purchases'] for c in segment_customers]),
-                'avg_engagement': np.mean([c['engagement_score'] for c in segment_customers]),
-                'churn_risk': np.mean([c['churn_probability'] for c in segment_customers]),
-                'characteristics': []
-            }
+        customer['stage'] = journey_stage(customer, reference)
+    return customers
+
+def segment_customers(customers, data_version: str):
+    """顧客セグメンテーション（学習済みモデルで一括割り当て、未学習時とデータの版が変わった時に再学習）"""
+    if 'customer_segmenter' not in st.session_state:
+        st.session_state.customer_segmenter = CustomerSegmenter()
+    segments = st.session_state.customer_segmenter.segment(customers, data_version=data_version)
     
     # セグメント特性を追加
     if 'High-Value Champions' in segments:
@@ -905,117 +881,100 @@ def segment_customers(customers):
     return segments
 
 def predict_next_action(customer):
-    """次のアクション予測（AI機能統合版）"""
-    # AI分析を実行（非同期関数を同期的に呼び出し）
-    try:
-        # ダミージャーニーデータ
-        journey_data = {
-            'total_customers': 1000,
-            'journey_metrics': {
-                'Awareness': {'count': 500},
-                'Consideration': {'count': 300},
-                'Purchase': {'count': 150}
-            }
-        }
-        
-        # 非同期関数を同期実行
-        loop = None
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        if loop.is_running():
-            # 既に実行中のループがある場合は新しいタスクを作成
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, analyze_customer_journey_with_ai(customer, journey_data))
-                result = future.result(timeout=10)
-        else:
-            result = loop.run_until_complete(analyze_customer_journey_with_ai(customer, journey_data))
-        
-        return result.get('next_actions', [])
-        
-    except Exception as e:
-        print(f"AI prediction error: {e}")
-        # フォールバック：シンプルな予測ロジック
-        actions = []
-        
-        if customer['churn_probability'] > 0.7:
-            actions.append({
-                'action': 'チャーン防止キャンペーン',
-                'probability': customer['churn_probability'],
-                'timing': '即座に',
-                'channel': 'Email + SMS'
-            })
-        
-        if customer['total_purchases'] == 0 and (datetime.now() - customer['acquisition_date']).days > 7:
-            actions.append({
-                'action': '初回購入促進',
-                'probability': 0.6,
-                'timing': '3日以内',
-                'channel': 'Retargeting Ad'
-            })
-        
-        if customer['engagement_score'] > 0.8 and customer['total_purchases'] > 2:
-            actions.append({
-                'action': 'アップセル提案',
-                'probability': 0.7,
-                'timing': '次回訪問時',
-                'channel': 'In-app Message'
-            })
-        
-        days_since_purchase = (datetime.now() - customer['last_purchase']).days
-        if 30 <= days_since_purchase <= 60:
-            actions.append({
-                'action': 'リピート購入促進',
-                'probability': 0.5,
-                'timing': '1週間以内',
-                'channel': 'Email'
-            })
-        
-        if not actions:
-            actions.append({
-                'action': 'エンゲージメント向上',
-                'probability': 0.4,
-                'timing': '2週間以内',
-                'channel': 'Social Media'
-            })
-        
-        return actions
+    """次のアクション予測（バッチ予測の結果を参照し、未完了の間はルールで即時表示）"""
+    job = st.session_state.get('next_action_job')
+    if job is not None and job.done and job.result is not None:
+        actions = job.result.get(customer['id'])
+        if actions:
+            return actions
+    
+    return next_action_predictor.predict_rules([customer]).get(customer['id'])
 
-def calculate_journey_metrics(customers):
-    """ジャーニーメトリクスを計算"""
-    stages = ['Awareness', 'Consideration', 'Trial', 'Purchase', 'Loyalty', 'Retention']
-    stage_metrics = {}
+def load_store_stage_events(path: str) -> StageEvents:
+    """ジャーニーストアのタッチ・購入時刻からステージ到達イベントを読み込む"""
+    return JourneyStore(path).stage_events()
+
+def build_stage_events(customers):
+    """合成顧客データのステージ判定ルールからステージ到達イベントを復元（滞在時間はルールの閾値になる）"""
+    df = pd.DataFrame(customers, columns=['id', 'acquisition_date', 'last_purchase', 'stage'])
+    acquired = pd.to_datetime(df['acquisition_date'])
+    considered = acquired + pd.Timedelta(days=7)
+    decided = acquired + pd.Timedelta(days=30)
+    repeat = df['stage'].isin(['Loyalty', 'Retention'])
+    
+    frames = [
+        pd.DataFrame({'customer_id': df['id'], 'stage': 'Awareness', 'timestamp': acquired}),
+        pd.DataFrame({'customer_id': df['id'], 'stage': 'Consideration', 'timestamp': considered})[df['stage'] != 'Awareness'],
+        pd.DataFrame({'customer_id': df['id'], 'stage': np.where(repeat, 'Purchase', df['stage']), 'timestamp': decided})[
+            ~df['stage'].isin(['Awareness', 'Consideration'])
+        ],
+        pd.DataFrame({
+            'customer_id': df['id'],
+            'stage': df['stage'],
+            'timestamp': np.maximum(pd.to_datetime(df['last_purchase']), decided + pd.Timedelta(days=1))
+        })[repeat]
+    ]
+    events = pd.concat(frames, ignore_index=True)
+    events['timestamp'] = events['timestamp'].dt.tz_localize(datetime.now().astimezone().tzinfo)
+    return StageEvents.from_frame(events)
+
+def calculate_journey_metrics(customers, stage_events: StageEvents, source: Optional[str]):
+    """ジャーニーメトリクスを計算（ファネル集計はデータソースが同じ間セッション内で使い回し、新規イベントのみ追加）"""
+    if 'funnel_state' not in st.session_state or st.session_state.get('funnel_source') != source:
+        st.session_state.funnel_state = FunnelState()
+        st.session_state.funnel_source = source
+    funnel = st.session_state.funnel_state
+    funnel.update(stage_events)
+    funnel_metrics = funnel.metrics()
+    
+    # 顧客属性はステージ別に一括集計
+    stage_codes = pd.Categorical([c['stage'] for c in customers], categories=FUNNEL_STAGES).codes
+    valid = stage_codes >= 0
+    counts = np.bincount(stage_codes[valid], minlength=len(FUNNEL_STAGES))
+    ltv_sums = np.bincount(stage_codes[valid], weights=np.array([c['ltv'] for c in customers])[valid], minlength=len(FUNNEL_STAGES))
+    churn_sums = np.bincount(
+        stage_codes[valid], weights=np.array([c['churn_probability'] for c in customers])[valid], minlength=len(FUNNEL_STAGES)
+    )
     
-    for stage in stages:
-        stage_customers = [c for c in customers if c['stage'] == stage]
-        
-        if stage_customers:
-            stage_metrics[stage] = {
-                'count': len(stage_customers),
-                'avg_time_in_stage': np.random.uniform(5, 30),  # 簡易計算
-                'conversion_rate': np.random.uniform(0.15, 0.85),
-                'avg_value': np.mean([c['ltv'] for c in stage_customers]),
-                'churn_risk': np.mean([c['churn_probability'] for c in stage_customers])
-            }
-        else:
-            stage_metrics[stage] = {
-                'count': 0,
-                'avg_time_in_stage': 0,
-                'conversion_rate': 0,
-                'avg_value': 0,
-                'churn_risk': 0
-            }
+    stage_metrics = {}
+    for s, stage in enumerate(FUNNEL_STAGES):
+        metrics = funnel_metrics[stage]
+        stage_metrics[stage] = {
+            'count': int(counts[s]),
+            'avg_time_in_stage': metrics['avg_time_in_stage'],
+            'dwell_percentiles': metrics['dwell_percentiles'],
+            'conversion_rate': metrics['conversion_rate'],
+            'drop_off_rate': metrics['drop_off_rate'],
+            'avg_value': ltv_sums[s] / counts[s] if counts[s] else 0,
+            'churn_risk': churn_sums[s] / counts[s] if counts[s] else 0
+        }
     
     return stage_metrics
 
-# データ生成
-customers = generate_customer_data()
-customer_segments = segment_customers(customers)
-journey_metrics = calculate_journey_metrics(customers)
+# データ準備（取り込み済みのイベントログがあれば実データ、無ければ合成データ）
+journey_store = JourneyStore()
+if journey_store.parts:
+    customers = page_cache.call(load_store_customers, journey_store.path, depends_on=('journeys',))
+    stage_events = page_cache.call(load_store_stage_events, journey_store.path, depends_on=('journeys',))
+    stage_source = journey_store.path
+    # 取り込みのたびにパートが増えるため、パート数をデータの版とする
+    data_version = f"{journey_store.path}:{len(journey_store.parts)}"
+else:
+    customers = generate_customer_data()
+    stage_events = build_stage_events(customers)
+    stage_source = None
+    data_version = "synthetic"
+# 合成データの滞在時間はステージ判定ルールの閾値を再生したものなのでシミュレーション値として表示
+dwell_simulated = stage_source is None
+dwell_label = "（シミュレーション）" if dwell_simulated else ""
+customer_segments = segment_customers(customers, data_version)
+journey_metrics = calculate_journey_metrics(customers, stage_events, stage_source)
+
+# 全顧客の次アクションをバケット単位でバッチ予測（バックグラウンド実行、結果はリラン時に反映）
+if 'next_action_job' not in st.session_state:
+    st.session_state.next_action_job = next_action_predictor.start(
+        customers, {'total_customers': len(customers), 'journey_metrics': journey_metrics}
+    )
 
 # ヘッダー
 st.markdown("""
@@ -1130,7 +1089,7 @@ with tabs[0]:
             st.markdown(f"""
             <div class="segment-metric">
                 <div class="metric-value">{metrics['avg_time_in_stage']:.0f}日</div>
-                <div class="metric-label">平均滞在期間</div>
+                <div class="metric-label">平均滞在期間{dwell_label}</div>
             </div>
             """, unsafe_allow_html=True)
         
@@ -1260,7 +1219,7 @@ with tabs[0]:
             y=stage_times,
             color=stage_times,
             color_continuous_scale="Teal",
-            title="平均ステージ滞在時間"
+            title=f"平均ステージ滞在時間{dwell_label}"
         )
         
         fig_time.update_layout(
@@ -1271,6 +1230,19 @@ with tabs[0]:
         )
         
         st.plotly_chart(fig_time, use_container_width=True)
+        if dwell_simulated:
+            st.caption("※ 合成データのため、滞在時間はステージ判定ルールの閾値から復元したシミュレーション値です。イベントログを取り込むと実際のタッチ・購入時刻から算出します。")
+    
+    with st.expander("📅 獲得週コホート別コンバージョン率"):
+        cohort_table = st.session_state.funnel_state.cohort_conversion()
+        st.dataframe(
+            cohort_table[funnel_stages].tail(12).style.format("{:.1%}"),
+            use_container_width=True
+        )
+        st.caption(f"滞在日数パーセンタイル（P50 / P90）{dwell_label}: " + " / ".join(
+            f"{stage} {journey_metrics[stage]['dwell_percentiles']['p50']:.0f}日・{journey_metrics[stage]['dwell_percentiles']['p90']:.0f}日"
+            for stage in funnel_stages
+        ))
 
 # 顧客セグメントタブ
 with tabs[1]:
@@ -1443,6 +1415,11 @@ with tabs[2]:
         predicted_actions = predict_next_action(selected_customer)
         
         st.markdown("##### 🎯 推奨アクション")
+        if not st.session_state.next_action_job.done:
+            st.caption("AI予測を実行中のため、ルールベースの推奨を表示しています")
+            prediction_job = job_runner.get(st.session_state.next_action_job.job_id)
+            if prediction_job is not None:
+                st.progress(prediction_job.progress, text=prediction_job.message)
         
         for i, action in enumerate(predicted_actions, 1):
             probability_color = "#10b981" if action['probability'] > 0.6 else "#f59e0b" if action['probability'] > 0.4 else "#ef4444"
@@ -1474,22 +1451,17 @@ with tabs[2]:
             'journey_metrics': journey_metrics
         }
         
-        # 非同期関数を同期実行
-        loop = None
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        if loop.is_running():
-            # 既に実行中のループがある場合は新しいタスクを作成
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, analyze_customer_journey_with_ai(selected_customer, journey_data))
-                ai_analysis = future.result(timeout=10)
+        # AI分析はバックグラウンドで実行し、完了までは同じ入力のジョブを共有してルールベースの分析を表示
+        analysis_job = job_runner.get(job_runner.submit(
+            analyze_customer_journey_with_ai(selected_customer, journey_data),
+            name="customer_journey_ai_analysis",
+            key=job_key("customer_journey_ai_analysis", selected_customer, journey_data)
+        ))
+        if analysis_job.status == JobStatus.COMPLETED:
+            ai_analysis = analysis_job.result
         else:
-            ai_analysis = loop.run_until_complete(analyze_customer_journey_with_ai(selected_customer, journey_data))
+            st.caption("AI分析を実行中のため、ルールベースの分析を表示しています（ページ更新時に反映されます）")
+            ai_analysis = analyze_customer_journey_mock(selected_customer, journey_data)
         
         # AI分析結果を表示
         col1, col2 = st.columns(2)
@@ -15,7 +15,13 @@ import plotly.graph_objects as go
 import plotly.express as px
 from typing import Dict, List, Any, Optional
 import uuid
-import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.background_jobs import JobStatus, job_key, job_runner
+from analytics.page_cache import page_cache
+from analytics.budget_allocator import (
+    BudgetConstraints, fit_platform_curves, optimize_budget, platform_summary, simulate_platform_history
+)
 
 # AI機能
 async def analyze_multiplatform_with_ai(
@@ -540,102 +546,23 @@ if 'cross_platform_campaigns' not in st.session_state:
 if 'automation_rules' not in st.session_state:
     st.session_state.automation_rules = []
 
+if 'platform_history' not in st.session_state:
+    st.session_state.platform_history = page_cache.call(simulate_platform_history, ttl=86400)
+
+# プラットフォームの表示設定と接続状態
+PLATFORM_META = {
+    'Google Ads': {'icon': '🔍', 'color': '#4285f4', 'api_status': 'active', 'campaigns': 32},
+    'Facebook Ads': {'icon': '📘', 'color': '#1877f2', 'api_status': 'active', 'campaigns': 24},
+    'Instagram Ads': {'icon': '📷', 'color': '#E4405F', 'api_status': 'warning', 'campaigns': 16},
+    'LinkedIn Ads': {'icon': '💼', 'color': '#0077b5', 'api_status': 'active', 'campaigns': 11},
+    'Twitter Ads': {'icon': '🐦', 'color': '#1da1f2', 'api_status': 'error', 'campaigns': 7},
+    'TikTok Ads': {'icon': '🎵', 'color': '#ff0050', 'api_status': 'active', 'campaigns': 9}
+}
+
 def generate_platform_data():
-    """プラットフォーム別データを生成"""
-    platforms = {
-        'Google Ads': {
-            'icon': '🔍',
-            'color': '#4285f4',
-            'api_status': 'active',
-            'campaigns': np.random.randint(15, 45),
-            'daily_spend': np.random.uniform(15000, 50000),
-            'impressions': np.random.randint(50000, 200000),
-            'clicks': np.random.randint(1500, 8000),
-            'conversions': np.random.randint(80, 400),
-            'ctr': np.random.uniform(2.1, 6.8),
-            'cpc': np.random.uniform(200, 800),
-            'cpa': np.random.uniform(3000, 12000),
-            'roas': np.random.uniform(2.5, 8.2),
-            'quality_score': np.random.uniform(6.5, 9.2)
-        },
-        'Facebook Ads': {
-            'icon': '📘',
-            'color': '#1877f2',
-            'api_status': 'active',
-            'campaigns': np.random.randint(12, 35),
-            'daily_spend': np.random.uniform(8000, 35000),
-            'impressions': np.random.randint(80000, 300000),
-            'clicks': np.random.randint(2000, 12000),
-            'conversions': np.random.randint(100, 600),
-            'ctr': np.random.uniform(1.8, 5.5),
-            'cpc': np.random.uniform(150, 600),
-            'cpa': np.random.uniform(2500, 10000),
-            'roas': np.random.uniform(3.0, 9.1),
-            'relevance_score': np.random.uniform(7.2, 9.8)
-        },
-        'Instagram Ads': {
-            'icon': '📷',
-            'color': '#E4405F',
-            'api_status': 'warning',
-            'campaigns': np.random.randint(8, 25),
-            'daily_spend': np.random.uniform(5000, 25000),
-            'impressions': np.random.randint(60000, 250000),
-            'clicks': np.random.randint(1800, 10000),
-            'conversions': np.random.randint(70, 450),
-            'ctr': np.random.uniform(2.2, 6.1),
-            'cpc': np.random.uniform(180, 650),
-            'cpa': np.random.uniform(2800, 9500),
-            'roas': np.random.uniform(2.8, 7.9),
-            'engagement_rate': np.random.uniform(4.5, 12.3)
-        },
-        'LinkedIn Ads': {
-            'icon': '💼',
-            'color': '#0077b5',
-            'api_status': 'active',
-            'campaigns': np.random.randint(5, 18),
-            'daily_spend': np.random.uniform(3000, 18000),
-            'impressions': np.random.randint(20000, 80000),
-            'clicks': np.random.randint(400, 2500),
-            'conversions': np.random.randint(25, 150),
-            'ctr': np.random.uniform(0.8, 3.2),
-            'cpc': np.random.uniform(800, 2500),
-            'cpa': np.random.uniform(8000, 25000),
-            'roas': np.random.uniform(1.8, 5.5),
-            'lead_quality': np.random.uniform(7.5, 9.5)
-        },
-        'Twitter Ads': {
-            'icon': '🐦',
-            'color': '#1da1f2',
-            'api_status': 'error',
-            'campaigns': np.random.randint(3, 12),
-            'daily_spend': np.random.uniform(2000, 12000),
-            'impressions': np.random.randint(30000, 120000),
-            'clicks': np.random.randint(600, 3500),
-            'conversions': np.random.randint(15, 80),
-            'ctr': np.random.uniform(1.2, 4.1),
-            'cpc': np.random.uniform(300, 1200),
-            'cpa': np.random.uniform(5000, 18000),
-            'roas': np.random.uniform(1.5, 4.8),
-            'engagement_rate': np.random.uniform(2.1, 8.7)
-        },
-        'TikTok Ads': {
-            'icon': '🎵',
-            'color': '#ff0050',
-            'api_status': 'active',
-            'campaigns': np.random.randint(4, 15),
-            'daily_spend': np.random.uniform(4000, 20000),
-            'impressions': np.random.randint(100000, 400000),
-            'clicks': np.random.randint(3000, 15000),
-            'conversions': np.random.randint(120, 600),
-            'ctr': np.random.uniform(3.5, 8.2),
-            'cpc': np.random.uniform(120, 450),
-            'cpa': np.random.uniform(2000, 7500),
-            'roas': np.random.uniform(3.5, 10.2),
-            'view_rate': np.random.uniform(45, 85)
-        }
-    }
-    
-    return platforms
+    """プラットフォーム別データを生成（指標は日別履歴の直近7日平均）"""
+    summary = platform_summary(st.session_state.platform_history)
+    return {name: {**meta, **summary.get(name, {})} for name, meta in PLATFORM_META.items()}
 
 def calculate_cross_platform_metrics(platforms):
     """クロスプラットフォーム統合メトリクスを計算"""
@@ -664,6 +591,7 @@ def calculate_cross_platform_metrics(platforms):
 # データ生成
 platform_data = generate_platform_data()
 cross_metrics = calculate_cross_platform_metrics(platform_data)
+platform_curves = page_cache.call(fit_platform_curves, st.session_state.platform_history)
 
 # ヘッダー
 st.markdown("""
@@ -826,53 +754,50 @@ with tabs[0]:
 # AI分析セクション
 st.markdown("### 🤖 AI高度分析")
 
+def submit_multiplatform_analysis() -> str:
+    """AI分析ジョブを投入（同じ入力の分析は実行中・完了済みのジョブを再利用）"""
+    return job_runner.submit(
+        analyze_multiplatform_with_ai(platform_data, cross_metrics, st.session_state.cross_platform_campaigns),
+        name="multiplatform_ai_analysis",
+        key=job_key("multiplatform_ai_analysis", platform_data, cross_metrics, st.session_state.cross_platform_campaigns)
+    )
+
 if st.button("🔍 AI プラットフォーム分析を実行", key="ai_multiplatform_analysis"):
-    with st.spinner("AI分析を実行中..."):
-        try:
-            # Handle async execution in Streamlit context
-            loop = None
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            
-            if loop.is_running():
-                # Event loop is already running, use a workaround
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(
-                        lambda: asyncio.run(
-                            analyze_multiplatform_with_ai(
-                                platform_data,
-                                cross_metrics,
-                                st.session_state.cross_platform_campaigns
-                            )
-                        )
-                    )
-                    ai_analysis = future.result()
-            else:
-                ai_analysis = loop.run_until_complete(
-                    analyze_multiplatform_with_ai(
-                        platform_data,
-                        cross_metrics,
-                        st.session_state.cross_platform_campaigns
-                    )
-                )
-            
-            st.session_state.multiplatform_ai_analysis = ai_analysis
-            st.success("✅ AI分析が完了しました！")
-            
-        except Exception as e:
-            st.error(f"❌ AI分析でエラーが発生しました: {str(e)}")
-            # フォールバックとしてモック分析を使用
-            ai_analysis = analyze_multiplatform_mock(
-                platform_data,
-                cross_metrics,
-                st.session_state.cross_platform_campaigns
-            )
-            st.session_state.multiplatform_ai_analysis = ai_analysis
-            st.info("📊 モックデータによる分析結果を表示しています")
+    st.session_state.multiplatform_ai_job = submit_multiplatform_analysis()
+
+# バックグラウンドのAI分析ジョブ（リラン時に状態を確認して結果を取り込む）
+ai_job = job_runner.get(st.session_state.get('multiplatform_ai_job'))
+if ai_job is None and 'multiplatform_ai_job' in st.session_state:
+    # 結果が破棄されたジョブは同じ入力で再投入
+    st.session_state.multiplatform_ai_job = submit_multiplatform_analysis()
+    st.rerun()
+elif ai_job is not None and not ai_job.done:
+    col1, col2, col3 = st.columns([4, 1, 1])
+    with col1:
+        st.info(f"🤖 AI分析を実行中... ({ai_job.elapsed:.0f}秒経過)")
+    with col2:
+        if st.button("🔄 更新", key="refresh_multiplatform_ai"):
+            st.rerun()
+    with col3:
+        if st.button("⏹️ キャンセル", key="cancel_multiplatform_ai"):
+            job_runner.cancel(ai_job.job_id)
+            st.rerun()
+elif ai_job is not None:
+    del st.session_state.multiplatform_ai_job
+    if ai_job.status == JobStatus.COMPLETED:
+        st.session_state.multiplatform_ai_analysis = ai_job.result
+        st.success("✅ AI分析が完了しました！")
+    elif ai_job.status == JobStatus.CANCELLED:
+        st.warning("AI分析をキャンセルしました")
+    else:
+        st.error(f"❌ AI分析でエラーが発生しました: {ai_job.error}")
+        # フォールバックとしてモック分析を使用
+        st.session_state.multiplatform_ai_analysis = analyze_multiplatform_mock(
+            platform_data,
+            cross_metrics,
+            st.session_state.cross_platform_campaigns
+        )
+        st.info("📊 モックデータによる分析結果を表示しています")
 
 # AI分析結果の表示
 if 'multiplatform_ai_analysis' in st.session_state:
@@ -1358,39 +1283,160 @@ with tabs[3]:
     </div>
     """, unsafe_allow_html=True)
     
+    # 反応曲線に基づく最適配分
+    st.markdown("#### 🧮 最適配分")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        optimization_budget = st.number_input(
+            "日予算 (¥)", min_value=10000, value=int(round(total_budget, -3)), step=5000
+        )
+    
+    with col2:
+        objective_label = st.selectbox("最適化の目的", ["売上", "コンバージョン"])
+    
+    with col3:
+        max_daily_change = st.slider("1日の最大変更率 (%)", 5, 100, 30, 5)
+    
+    with col4:
+        min_share = st.slider("最低配分比率 (%)", 0, 15, 3, 1)
+    
+    allocation = page_cache.call(
+        optimize_budget,
+        platform_curves,
+        optimization_budget,
+        BudgetConstraints(min_share=min_share / 100, max_daily_change=max_daily_change / 100),
+        objective='revenue' if objective_label == "売上" else 'conversions'
+    )
+    allocation_totals = allocation.totals()
+    allocation_df = allocation.to_frame()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric(
+            "期待売上 (日別)",
+            f"¥{allocation_totals['expected_revenue']:,.0f}",
+            f"{allocation_totals['expected_revenue'] - allocation_totals['current_revenue']:+,.0f}"
+        )
+    
+    with col2:
+        st.metric(
+            "期待コンバージョン (日別)",
+            f"{allocation_totals['expected_conversions']:,.1f}",
+            f"{allocation_totals['expected_conversions'] - allocation_totals['current_conversions']:+,.1f}"
+        )
+    
+    with col3:
+        st.metric(
+            "期待ROAS",
+            f"{allocation_totals['expected_roas']:.2f}x",
+            f"{allocation_totals['expected_roas'] - allocation_totals['current_roas']:+.2f}"
+        )
+    
+    with col4:
+        st.metric(
+            "候補配分との比較",
+            f"{allocation_totals['candidate_percentile']:.1f} パーセンタイル",
+            f"{allocation_totals['candidates']:,}候補を評価",
+            delta_color="off"
+        )
+    
+    st.dataframe(
+        allocation_df.rename(columns={
+            'platform': 'プラットフォーム',
+            'current_spend': '現在の日予算',
+            'recommended_spend': '推奨日予算',
+            'change': '変更率',
+            'share': '配分比率',
+            'expected_conversions': '期待CV',
+            'expected_revenue': '期待売上',
+            'marginal_roas': '限界ROAS'
+        }).style.format({
+            '現在の日予算': '¥{:,.0f}',
+            '推奨日予算': '¥{:,.0f}',
+            '変更率': '{:+.1%}',
+            '配分比率': '{:.1%}',
+            '期待CV': '{:,.1f}',
+            '期待売上': '¥{:,.0f}',
+            '限界ROAS': '{:.2f}'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # 候補配分の成果分布と最適解
+    fig_candidates = go.Figure()
+    
+    fig_candidates.add_trace(go.Scattergl(
+        x=allocation.candidate_conversions,
+        y=allocation.candidate_revenue,
+        mode='markers',
+        name='候補配分',
+        marker=dict(color='rgba(148, 163, 184, 0.35)', size=4)
+    ))
+    
+    fig_candidates.add_trace(go.Scatter(
+        x=[allocation_totals['current_conversions']],
+        y=[allocation_totals['current_revenue']],
+        mode='markers',
+        name='現在の配分',
+        marker=dict(color='#f59e0b', size=14, symbol='diamond')
+    ))
+    
+    fig_candidates.add_trace(go.Scatter(
+        x=[allocation_totals['expected_conversions']],
+        y=[allocation_totals['expected_revenue']],
+        mode='markers',
+        name='推奨配分',
+        marker=dict(color='#10b981', size=16, symbol='star')
+    ))
+    
+    fig_candidates.update_layout(
+        title="候補配分ごとの期待成果",
+        xaxis_title="期待コンバージョン (日別)",
+        yaxis_title="期待売上 (¥)",
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white')
+    )
+    
+    st.plotly_chart(fig_candidates, use_container_width=True)
+    
     # 予算最適化推奨
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("#### 🎯 AI最適化推奨")
         
-        # ROAS基準の最適化推奨
-        platform_roas = [(name, data['roas']) for name, data in platform_data.items()]
-        platform_roas.sort(key=lambda x: x[1], reverse=True)
-        
-        best_performer = platform_roas[0]
-        worst_performer = platform_roas[-1]
+        # 最適配分との差分が大きいプラットフォームから推奨
+        changes = allocation_df.assign(delta=allocation_df['recommended_spend'] - allocation_df['current_spend'])
+        increase = changes.sort_values('delta', ascending=False).iloc[0]
+        decrease = changes.sort_values('delta').iloc[0]
         
-        optimizations = [
-            {
-                "type": "予算再配分",
-                "description": f"{best_performer[0]} (ROAS {best_performer[1]:.1f}x) への予算追加を推奨",
-                "impact": "+23% ROI向上",
-                "urgency": "high"
-            },
-            {
+        optimizations = []
+        if increase['delta'] > 0:
+            optimizations.append({
+                "type": "予算追加",
+                "description": f"{increase['platform']} (限界ROAS {increase['marginal_roas']:.2f}x) に ¥{increase['delta']:,.0f} を追加",
+                "impact": f"{increase['change']:+.0%} 日予算",
+                "urgency": "high" if increase['change'] >= 0.2 else "medium"
+            })
+        if decrease['delta'] < 0:
+            optimizations.append({
                 "type": "予算削減",
-                "description": f"{worst_performer[0]} (ROAS {worst_performer[1]:.1f}x) の予算を削減",
-                "impact": "¥12,000 コスト削減",
-                "urgency": "medium"
-            },
-            {
-                "type": "時間帯最適化",
-                "description": "高パフォーマンス時間帯への予算集中",
-                "impact": "+18% CTR改善",
-                "urgency": "low"
-            }
-        ]
+                "description": f"{decrease['platform']} (限界ROAS {decrease['marginal_roas']:.2f}x) の予算を ¥{-decrease['delta']:,.0f} 削減",
+                "impact": f"{decrease['change']:+.0%} 日予算",
+                "urgency": "high" if decrease['change'] <= -0.2 else "medium"
+            })
+        revenue_lift = allocation_totals['expected_revenue'] - allocation_totals['current_revenue']
+        optimizations.append({
+            "type": "配分全体",
+            "description": f"推奨配分の適用で期待売上 ¥{revenue_lift:+,.0f}/日 (ROAS {allocation_totals['current_roas']:.2f}x → {allocation_totals['expected_roas']:.2f}x)",
+            "impact": f"{revenue_lift / allocation_totals['current_revenue']:+.1%} 売上" if allocation_totals['current_revenue'] > 0 else "-",
+            "urgency": "low"
+        })
         
         for opt in optimizations:
             urgency_color = {"high": "#ef4444", "medium": "#f59e0b", "low": "#10b981"}[opt['urgency']]
@@ -1424,13 +1470,17 @@ with tabs[3]:
             # シミュレーション結果
             source_current = platform_data[source_platform]['daily_spend']
             target_current = platform_data[target_platform]['daily_spend']
-            source_roas = platform_data[source_platform]['roas']
-            target_roas = platform_data[target_platform]['roas']
             
-            # 予想効果計算
-            lost_revenue = move_amount * source_roas
-            gained_revenue = move_amount * target_roas
-            net_impact = gained_revenue - lost_revenue
+            # 反応曲線で移動前後の期待売上を比較（逓減効果を反映）
+            curve_index = {name: i for i, name in enumerate(platform_curves.group_ids)}
+            moved_spend = platform_curves.current_spend.copy()
+            moved_spend[curve_index[source_platform]] = max(source_current - move_amount, 0.0)
+            moved_spend[curve_index[target_platform]] = target_current + move_amount
+            value = platform_curves.value_per_conversion
+            net_impact = float(
+                (platform_curves.conversions(moved_spend) * value).sum()
+                - (platform_curves.conversions(platform_curves.current_spend) * value).sum()
+            )
             
             impact_color = "#10b981" if net_impact > 0 else "#ef4444"
             impact_text = f"+¥{net_impact:,.0f}" if net_impact > 0 else f"¥{net_impact:,.0f}"
@@ -1440,7 +1490,7 @@ with tabs[3]:
                 <h5 style="color: #667eea; margin-bottom: 15px;">シミュレーション結果</h5>
                 
                 <div style="margin-bottom: 15px;">
-                    <strong>{source_platform}:</strong> ¥{source_current:,.0f} → ¥{source_current - move_amount:,.0f}<br>
+                    <strong>{source_platform}:</strong> ¥{source_current:,.0f} → ¥{max(source_current - move_amount, 0):,.0f}<br>
                     <strong>{target_platform}:</strong> ¥{target_current:,.0f} → ¥{target_current + move_amount:,.0f}
                 </div>
                 
@@ -1461,14 +1511,10 @@ with tabs[3]:
     # 予算パフォーマンス履歴
     st.markdown("#### 📈 予算パフォーマンス履歴")
     
-    # サンプル履歴データ
-    dates = pd.date_range(end=datetime.now(), periods=30, freq='D')
-    budget_history = pd.DataFrame({
-        'date': dates,
-        'total_spend': np.random.uniform(80000, 120000, 30),
-        'total_revenue': np.random.uniform(200000, 400000, 30),
-        'roas': np.random.uniform(2.5, 4.2, 30)
-    })
+    # 直近30日の日別合計
+    budget_history = st.session_state.platform_history.groupby('date')[['spend', 'revenue']].sum().tail(30)
+    budget_history = budget_history.rename(columns={'spend': 'total_spend', 'revenue': 'total_revenue'}).reset_index()
+    budget_history['roas'] = budget_history['total_revenue'] / budget_history['total_spend']
     
     fig_budget = go.Figure()
     
@@ -1538,10 +1584,20 @@ with tabs[4]:
             
             if st.form_submit_button("🎯 キャンペーンを作成", type="primary"):
                 if campaign_name and target_platforms:
-                    # 予算配分計算
-                    platform_weights = {p: platform_data[p]['roas'] for p in target_platforms}
-                    total_weight = sum(platform_weights.values())
-                    budget_allocation = {p: (weight/total_weight) * total_budget for p, weight in platform_weights.items()}
+                    # 予算配分計算（対象プラットフォームの反応曲線で日予算を最適化し、期間分に換算）
+                    campaign_curves = fit_platform_curves(
+                        st.session_state.platform_history[st.session_state.platform_history['platform'].isin(target_platforms)]
+                    )
+                    campaign_allocation = optimize_budget(
+                        campaign_curves,
+                        total_budget / campaign_duration,
+                        BudgetConstraints(min_share=0.05, max_daily_change=None),
+                        objective='conversions' if priority_metric in ("CPA", "CPC", "CTR") else 'revenue'
+                    )
+                    budget_allocation = {
+                        str(p): float(spend * campaign_duration)
+                        for p, spend in zip(campaign_allocation.platforms, campaign_allocation.recommended_spend)
+                    }
                     
                     new_campaign = {
                         'id': str(uuid.uuid4()),
@@ -1739,7 +1795,11 @@ with st.sidebar:
         st.warning("⚠️ 全キャンペーンを一時停止しました")
     
     if st.button("🚀 予算最適化実行", use_container_width=True, type="primary"):
-        st.success("🎯 AI予算最適化を実行中...")
+        sidebar_totals = page_cache.call(optimize_budget, platform_curves, cross_metrics['total_spend']).totals()
+        st.success(
+            f"🎯 最適配分で期待売上 ¥{sidebar_totals['expected_revenue'] - sidebar_totals['current_revenue']:+,.0f}/日 "
+            f"(ROAS {sidebar_totals['current_roas']:.2f}x → {sidebar_totals['expected_roas']:.2f}x)"
+        )
     
     st.markdown("---")
     
@@ -8,13 +8,17 @@ import streamlit as st
 import os
 import sys
 import json
-from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from typing import Dict, List, Any
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.forecasting import forecast_service
+from analytics.page_cache import page_cache
+from analytics.kpi_rollup import kpi_rollups, trailing_range
+
 # ページ設定
 st.set_page_config(
     page_title="パフォーマンスダッシュボード",
@@ -171,9 +175,10 @@ if 'performance_data' not in st.session_state:
 if 'time_range' not in st.session_state:
     st.session_state.time_range = "7d"
 
+@page_cache.cached(ttl=3600, copy_result=True)
 def generate_sample_data(days: int = 30) -> pd.DataFrame:
     """サンプルパフォーマンスデータを生成"""
-    dates = pd.date_range(end=datetime.now(), periods=days, freq='D')
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq='D')
     
     # 基本的なトレンドを持つランダムデータ
     np.random.seed(42)
@@ -218,24 +223,60 @@ def calculate_kpi_change(current: float, previous: float) -> Dict[str, Any]:
         "symbol": symbol
     }
 
-def get_time_range_data(df: pd.DataFrame, time_range: str) -> pd.DataFrame:
-    """指定された期間のデータを取得"""
-    days_map = {
-        "24h": 1,
-        "7d": 7,
-        "30d": 30,
-        "90d": 90
-    }
-    
-    days = days_map.get(time_range, 7)
-    cutoff_date = datetime.now() - timedelta(days=days)
-    
-    return df[df['date'] >= cutoff_date]
+def add_forecast_traces(fig: go.Figure, result, metric: str, name: str, color: str, **trace_kwargs) -> None:
+    """予測値と予測区間のトレースを追加"""
+    forecast = result.series((metric,))
+    fig.add_trace(go.Scatter(
+        x=pd.concat([forecast['time'], forecast['time'][::-1]]),
+        y=pd.concat([forecast['upper'], forecast['lower'][::-1]]),
+        fill='toself',
+        fillcolor='rgba(255, 255, 255, 0.08)',
+        line=dict(width=0),
+        name=f'{name}予測区間',
+        hoverinfo='skip',
+        **trace_kwargs
+    ))
+    fig.add_trace(go.Scatter(
+        x=forecast['time'],
+        y=forecast['forecast'],
+        mode='lines',
+        name=f'{name}予測',
+        line=dict(color=color, width=2, dash='dot'),
+        **trace_kwargs
+    ))
+
+# 予測対象の指標
+FORECAST_METRICS = ['traffic', 'conversions', 'revenue', 'social_engagement']
+
+# 時間範囲ごとの日数（今日を含む）
+TIME_RANGE_DAYS = {"24h": 1, "7d": 7, "30d": 30, "90d": 90}
+
+# ロールアップする指標と日別推移の集計方法（件数・金額は合計、率・時間は平均）
+ROLLUP_AGGREGATIONS = {
+    'traffic': 'sum',
+    'conversions': 'sum',
+    'revenue': 'sum',
+    'bounce_rate': 'mean',
+    'avg_session_duration': 'mean',
+    'social_engagement': 'sum',
+    'email_open_rate': 'mean',
+    'ctr': 'mean'
+}
+
+# 前期間と比較する主要KPI
+KPI_METRICS = ['traffic', 'conversions', 'revenue', 'social_engagement']
 
 # データ準備
 if 'sample_data' not in st.session_state:
     st.session_state.sample_data = generate_sample_data(90)
 
+# 日別データを共有の予測モデルに反映（既知の日は差分更新されないため再実行時はほぼコストなし）
+forecast_bank = forecast_service.bank('performance_dashboard_daily', 7, 86400)
+forecast_bank.sync_frame(st.session_state.sample_data, 'date', [], FORECAST_METRICS)
+
+# 日別データを共有のKPIロールアップに反映（取り込み済みの日より新しい行だけを加算）
+kpi_rollups.sync_frame('performance_dashboard_daily', st.session_state.sample_data, 'date', list(ROLLUP_AGGREGATIONS))
+
 # ヘッダー
 st.title("📈 パフォーマンス追跡ダッシュボード")
 st.caption("マーケティング施策のリアルタイムKPI監視と分析")
@@ -255,8 +296,10 @@ for i, (col, option) in enumerate(zip([col1, col2, col3, col4], time_options)):
             st.session_state.time_range = option
             st.rerun()
 
-# 現在の期間のデータを取得
-current_data = get_time_range_data(st.session_state.sample_data, st.session_state.time_range)
+# 現在の期間の日別推移と、主要KPIの前期間比較をロールアップから取得
+range_start, range_end = trailing_range(TIME_RANGE_DAYS.get(st.session_state.time_range, 7))
+current_data = kpi_rollups.frame(list(ROLLUP_AGGREGATIONS), range_start, range_end, aggs=ROLLUP_AGGREGATIONS)
+kpi_comparisons = {metric: kpi_rollups.compare(metric, range_start, range_end) for metric in KPI_METRICS}
 
 # 主要KPI表示
 st.markdown("### 🎯 主要KPI")
@@ -265,11 +308,11 @@ kpi_cols = st.columns(4)
 
 # トラフィック
 with kpi_cols[0]:
-    current_traffic = current_data['traffic'].sum()
-    avg_traffic = current_data['traffic'].mean()
-    prev_traffic = st.session_state.sample_data['traffic'].iloc[-len(current_data)-1:-1].sum() if len(current_data) < len(st.session_state.sample_data) else current_traffic
+    current, previous = kpi_comparisons['traffic']
+    current_traffic = int(current.sum)
+    avg_traffic = current.mean
     
-    change = calculate_kpi_change(current_traffic, prev_traffic)
+    change = calculate_kpi_change(current.sum, previous.sum)
     
     st.markdown(f"""
     <div class="kpi-card">
@@ -283,52 +326,73 @@ with kpi_cols[0]:
 
 # コンバージョン
 with kpi_cols[1]:
-    current_conversions = current_data['conversions'].sum()
+    current, previous = kpi_comparisons['conversions']
+    current_conversions = int(current.sum)
     conversion_rate = (current_conversions / current_traffic * 100) if current_traffic > 0 else 0
+    change = calculate_kpi_change(current.sum, previous.sum)
     
     st.markdown(f"""
     <div class="kpi-card">
         <div class="kpi-label">コンバージョン</div>
         <div class="kpi-value">{current_conversions:,}</div>
-        <div class="kpi-change kpi-neutral">
-            CVR: {conversion_rate:.2f}%
+        <div class="kpi-change kpi-{change['status']}">
+            {change['symbol']} {change['value']:.1f}% ・ CVR: {conversion_rate:.2f}%
         </div>
     </div>
     """, unsafe_allow_html=True)
 
 # 収益
 with kpi_cols[2]:
-    current_revenue = current_data['revenue'].sum()
+    current, previous = kpi_comparisons['revenue']
+    current_revenue = current.sum
     avg_order_value = current_revenue / current_conversions if current_conversions > 0 else 0
+    change = calculate_kpi_change(current.sum, previous.sum)
     
     st.markdown(f"""
     <div class="kpi-card">
         <div class="kpi-label">総収益</div>
         <div class="kpi-value">¥{current_revenue:,.0f}</div>
-        <div class="kpi-change kpi-up">
-            AOV: ¥{avg_order_value:,.0f}
+        <div class="kpi-change kpi-{change['status']}">
+            {change['symbol']} {change['value']:.1f}% ・ AOV: ¥{avg_order_value:,.0f}
         </div>
     </div>
     """, unsafe_allow_html=True)
 
 # エンゲージメント
 with kpi_cols[3]:
-    current_engagement = current_data['social_engagement'].sum()
+    current, previous = kpi_comparisons['social_engagement']
+    current_engagement = int(current.sum)
     engagement_rate = current_engagement / current_traffic * 100 if current_traffic > 0 else 0
+    change = calculate_kpi_change(current.sum, previous.sum)
     
     st.markdown(f"""
     <div class="kpi-card">
         <div class="kpi-label">エンゲージメント</div>
         <div class="kpi-value">{current_engagement:,}</div>
-        <div class="kpi-change kpi-up">
-            Rate: {engagement_rate:.1f}%
+        <div class="kpi-change kpi-{change['status']}">
+            {change['symbol']} {change['value']:.1f}% ・ Rate: {engagement_rate:.1f}%
         </div>
     </div>
     """, unsafe_allow_html=True)
 
+# 日次の分布（ロールアップのスケッチから推定した分位点）
+traffic_stats = kpi_comparisons['traffic'][0]
+revenue_stats = kpi_comparisons['revenue'][0]
+if traffic_stats.count:
+    st.caption(
+        f"日次の中央値 / P90 — トラフィック: {traffic_stats.quantile(0.5):,.0f} / {traffic_stats.quantile(0.9):,.0f}"
+        f" ・ 収益: ¥{revenue_stats.quantile(0.5):,.0f} / ¥{revenue_stats.quantile(0.9):,.0f}"
+        f"（前期間: {kpi_comparisons['traffic'][1].start:%m/%d}〜{kpi_comparisons['traffic'][1].end:%m/%d}）"
+    )
+
 # チャートセクション
 st.markdown("### 📊 パフォーマンストレンド")
 
+forecast_col1, forecast_col2 = st.columns([1, 3])
+with forecast_col1:
+    forecast_days = st.selectbox("予測期間", [0, 7, 14, 30], index=2, format_func=lambda d: "予測なし" if d == 0 else f"{d}日間")
+forecast_result = forecast_bank.forecast(forecast_days, 0.9) if forecast_days else None
+
 # タブで異なるメトリクスを表示
 chart_tabs = st.tabs(["トラフィック", "コンバージョン", "収益", "エンゲージメント", "詳細メトリクス"])
 
@@ -346,6 +410,9 @@ with chart_tabs[0]:
         fillcolor='rgba(59, 130, 246, 0.1)'
     ))
     
+    if forecast_result is not None:
+        add_forecast_traces(fig_traffic, forecast_result, 'traffic', 'トラフィック', '#3b82f6')
+    
     fig_traffic.update_layout(
         title="日別トラフィック推移",
         xaxis_title="日付",
@@ -411,6 +478,9 @@ with chart_tabs[1]:
         yaxis='y2'
     ))
     
+    if forecast_result is not None:
+        add_forecast_traces(fig_conversion, forecast_result, 'conversions', 'コンバージョン', '#10b981', yaxis='y')
+    
     fig_conversion.update_layout(
         title="コンバージョン推移",
         xaxis_title="日付",
@@ -474,6 +544,9 @@ with chart_tabs[2]:
         line=dict(color='#10b981', width=3, dash='dash')
     ))
     
+    if forecast_result is not None:
+        add_forecast_traces(fig_revenue, forecast_result, 'revenue', '収益', '#8b5cf6')
+    
     fig_revenue.update_layout(
         title="収益推移",
         xaxis_title="日付",
@@ -719,7 +792,7 @@ with alert_cols[0]:
     st.markdown("#### ⚠️ 要注意項目")
     
     # 直帰率が高い場合
-    avg_bounce = current_data['bounce_rate'].mean()
+    avg_bounce = kpi_rollups.aggregate('bounce_rate', range_start, range_end).mean
     if avg_bounce > 40:
         st.markdown(f"""
         <div class="alert-box">
@@ -753,16 +826,14 @@ with alert_cols[1]:
         </div>
         """, unsafe_allow_html=True)
     
-    # 収益が増加している場合
-    revenue_growth = calculate_kpi_change(
-        current_data['revenue'].iloc[-1],
-        current_data['revenue'].iloc[0]
-    )
+    # 収益が前期間より増加している場合
+    current, previous = kpi_comparisons['revenue']
+    revenue_growth = calculate_kpi_change(current.sum, previous.sum)
     if revenue_growth['status'] == 'up':
         st.markdown(f"""
         <div class="alert-box success-box">
             <strong>収益成長</strong><br>
-            期間中の収益が{revenue_growth['value']:.1f}%増加しました。<br>
+            収益が前期間比で{revenue_growth['value']:.1f}%増加しました。<br>
             成功要因を分析して横展開しましょう。
         </div>
         """, unsafe_allow_html=True)
@@ -15,6 +15,14 @@ import asyncio
 import os
 from datetime import datetime
 from typing import Dict, List, Any, Optional
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.page_cache import page_cache
+from analytics.pricing import (
+    PSM_POINTS, demand_model_from_rates, fit_demand_curves, price_grid, psm_analysis,
+    simulate_price_tests, simulate_pricing, simulate_psm_responses
+)
 
 # AI価格戦略分析関数
 async def analyze_pricing_strategy_with_ai(
@@ -278,23 +286,30 @@ def optimize_price_mock(current_price: float, performance_data: Dict, goals: Dic
     conversion_rate = performance_data.get('conversion_rate', 0.02)
     satisfaction = performance_data.get('satisfaction_score', 3.5)
     churn_rate = performance_data.get('churn_rate', 0.05)
+    monthly_new_customers = performance_data.get('monthly_new_customers', 50)
+    
+    # 顧客満足度が高いほど価格に鈍感とみなして需要・解約モデルを構成
+    price_elasticity = -1.0 * 3.5 / max(satisfaction, 1.0)
+    model = demand_model_from_rates(
+        ['現行'], [current_price], [conversion_rate], [churn_rate],
+        conversion_elasticity=(price_elasticity, 0.2),
+        churn_elasticity=(0.5, 0.2)
+    )
     
-    # 最適化ロジック
-    price_elasticity = -0.5  # 価格弾力性仮定
-    
-    # 顧客満足度に基づく価格調整余地
-    if satisfaction > 4.0:
-        price_multiplier = 1.1  # 10%値上げ余地
-    elif satisfaction < 3.0:
-        price_multiplier = 0.9  # 10%値下げ推奨
-    else:
-        price_multiplier = 1.0
-    
-    # 解約率に基づく調整
-    if churn_rate > 0.1:
-        price_multiplier *= 0.95  # 価格競争力向上
+    # 現行価格の ±20% を12ヶ月の累計売上（中央値）で比較
+    multipliers = np.linspace(0.8, 1.2, 41)
+    simulation = simulate_pricing(
+        model,
+        price_grid(model, multipliers, 12),
+        visitors=[monthly_new_customers / conversion_rate],
+        initial_customers=[goals.get('customer_target', 500) / 2]
+    )
+    revenue = simulation.band('cumulative_revenue')[1][:, 0, -1]
+    customers = np.median(simulation.customers[:, :, 0, -1], axis=0)
+    best = int(revenue.argmax())
+    baseline = int(np.abs(multipliers - 1.0).argmin())
     
-    recommended_price = int(current_price * price_multiplier)
+    recommended_price = int(current_price * multipliers[best])
     adjustment_percentage = (recommended_price / current_price - 1) * 100
     
     return {
@@ -304,18 +319,18 @@ def optimize_price_mock(current_price: float, performance_data: Dict, goals: Dic
                 "min": int(recommended_price * 0.9),
                 "max": int(recommended_price * 1.1)
             },
-            "adjustment_percentage": adjustment_percentage,
-            "reasoning": f"顧客満足度{satisfaction:.1f}と解約率{churn_rate*100:.1f}%を考慮した最適化"
+            "adjustment_percentage": float(adjustment_percentage),
+            "reasoning": f"顧客満足度{satisfaction:.1f}と解約率{churn_rate*100:.1f}%から構成した需要・解約モデルで12ヶ月の累計売上を最大化"
         },
         "ab_test_suggestions": [
             {
                 "price": int(current_price * 0.95),
-                "expected_conversion": conversion_rate * 1.1,
+                "expected_conversion": float(model.conversion_rate(np.array([current_price * 0.95]))[0]),
                 "risk_level": "low"
             },
             {
                 "price": int(current_price * 1.05),
-                "expected_conversion": conversion_rate * 0.95,
+                "expected_conversion": float(model.conversion_rate(np.array([current_price * 1.05]))[0]),
                 "risk_level": "medium"
             }
         ],
@@ -325,9 +340,9 @@ def optimize_price_mock(current_price: float, performance_data: Dict, goals: Dic
             "announcement_timing": "実装2週間前に事前告知"
         },
         "expected_impact": {
-            "revenue_change": adjustment_percentage * 0.7,  # 価格弾力性考慮
-            "customer_change": adjustment_percentage * price_elasticity,
-            "conversion_change": -adjustment_percentage * 0.3
+            "revenue_change": float((revenue[best] / revenue[baseline] - 1) * 100),
+            "customer_change": float((customers[best] / customers[baseline] - 1) * 100),
+            "conversion_change": float((multipliers[best] ** price_elasticity - 1) * 100)
         },
         "risks_and_mitigation": [
             "既存顧客の離脱リスク → 段階的移行でソフトランディング",
@@ -626,70 +641,105 @@ with tab2:
     
     sample_data = st.checkbox("サンプルデータを使用（SaaS月額料金の例）", value=True)
     
+    weights = None
+    
     if sample_data:
-        # SaaSの月額料金サンプル（50人の回答想定）
-        np.random.seed(42)
-        too_cheap = np.random.normal(500, 150, 50).astype(int)
-        cheap = np.random.normal(800, 200, 50).astype(int)
-        expensive = np.random.normal(2000, 300, 50).astype(int)
-        too_expensive = np.random.normal(3500, 500, 50).astype(int)
-        
-        st.info("💡 SaaS月額料金の調査例（50人の回答）を表示中")
+        # SaaSの月額料金サンプル（回答者ごとに 安すぎる < 安い < 高い < 高すぎる）
+        sample_size = st.select_slider("回答者数", options=[50, 500, 5000, 50000], value=500)
+        responses = page_cache.call(simulate_psm_responses, sample_size)
+        too_cheap = responses['too_cheap'].to_numpy()
+        cheap = responses['cheap'].to_numpy()
+        expensive = responses['expensive'].to_numpy()
+        too_expensive = responses['too_expensive'].to_numpy()
+        
+        st.info(f"💡 SaaS月額料金の調査例（{sample_size:,}人の回答）を表示中")
     else:
-        st.markdown("**カスタムデータ入力**（カンマ区切りで価格を入力）:")
-        too_cheap_input = st.text_area("安すぎる価格", "500,400,600,550...")
-        cheap_input = st.text_area("安い価格", "800,750,900,850...")
-        expensive_input = st.text_area("高い価格", "2000,1800,2200,1900...")
-        too_expensive_input = st.text_area("高すぎる価格", "3500,3000,4000,3200...")
+        st.markdown("**カスタムデータ入力**（カンマ区切りで価格を入力、回答者の順に揃えてください）:")
+        too_cheap_input = st.text_area("安すぎる価格", "500,400,600,550")
+        cheap_input = st.text_area("安い価格", "800,750,900,850")
+        expensive_input = st.text_area("高い価格", "2000,1800,2200,1900")
+        too_expensive_input = st.text_area("高すぎる価格", "3500,3000,4000,3200")
+        weights_input = st.text_area("回答者ウェイト（任意）", "")
         
         try:
-            too_cheap = [int(x.strip()) for x in too_cheap_input.split(',') if x.strip()]
-            cheap = [int(x.strip()) for x in cheap_input.split(',') if x.strip()]
-            expensive = [int(x.strip()) for x in expensive_input.split(',') if x.strip()]
-            too_expensive = [int(x.strip()) for x in too_expensive_input.split(',') if x.strip()]
-        except:
+            too_cheap = [float(x.strip()) for x in too_cheap_input.split(',') if x.strip()]
+            cheap = [float(x.strip()) for x in cheap_input.split(',') if x.strip()]
+            expensive = [float(x.strip()) for x in expensive_input.split(',') if x.strip()]
+            too_expensive = [float(x.strip()) for x in too_expensive_input.split(',') if x.strip()]
+            weights = [float(x.strip()) for x in weights_input.split(',') if x.strip()] or None
+            if len({len(too_cheap), len(cheap), len(expensive), len(too_expensive)}) > 1:
+                st.error("4つの質問の回答数を揃えてください")
+                too_cheap = cheap = expensive = too_expensive = []
+        except ValueError:
             st.error("数値を正しく入力してください")
             too_cheap = cheap = expensive = too_expensive = []
     
+    use_bootstrap = st.checkbox("ブートストラップで信頼区間を計算（95%、200回）", value=False)
+    
+    psm = None
     if len(too_cheap) > 0:
-        # PSM分析計算
-        all_prices = sorted(set(too_cheap + cheap + expensive + too_expensive))
-        min_price, max_price = min(all_prices), max(all_prices)
-        price_range = np.linspace(min_price, max_price, 100)
-        
-        # 累積パーセンテージ計算
-        too_cheap_cum = [sum(1 for x in too_cheap if x >= p) / len(too_cheap) * 100 for p in price_range]
-        cheap_cum = [sum(1 for x in cheap if x >= p) / len(cheap) * 100 for p in price_range]
-        expensive_cum = [sum(1 for x in expensive if x <= p) / len(expensive) * 100 for p in price_range]
-        too_expensive_cum = [sum(1 for x in too_expensive if x <= p) / len(too_expensive) * 100 for p in price_range]
+        try:
+            psm = page_cache.call(
+                psm_analysis,
+                too_cheap, cheap, expensive, too_expensive,
+                weights=weights,
+                n_bootstrap=200 if use_bootstrap else 0
+            )
+        except ValueError as e:
+            st.error(f"PSM分析エラー: {e}")
+    
+    if psm is not None:
+        # PSM分析計算（累積曲線と交点は analytics.pricing で一括計算）
+        curves = psm.curve_frame()
+        if psm.dropped:
+            st.caption(f"回答順序に矛盾のある {psm.dropped:,}件を除外して分析しています")
         
         # グラフ作成
         fig = go.Figure()
         
         fig.add_trace(go.Scatter(
-            x=price_range, y=too_cheap_cum,
+            x=curves['price'], y=curves['too_cheap'],
             name='安すぎる', line=dict(color='red', dash='dash'),
             hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
         ))
         
         fig.add_trace(go.Scatter(
-            x=price_range, y=cheap_cum,
+            x=curves['price'], y=curves['cheap'],
             name='安い', line=dict(color='green'),
             hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
         ))
         
         fig.add_trace(go.Scatter(
-            x=price_range, y=expensive_cum,
+            x=curves['price'], y=curves['expensive'],
             name='高い', line=dict(color='orange'),
             hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
         ))
         
         fig.add_trace(go.Scatter(
-            x=price_range, y=too_expensive_cum,
+            x=curves['price'], y=curves['too_expensive'],
             name='高すぎる', line=dict(color='red'),
             hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
         ))
         
+        fig.add_trace(go.Scatter(
+            x=curves['price'], y=curves['not_cheap'],
+            name='安くない', line=dict(color='green', dash='dot'),
+            hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=curves['price'], y=curves['not_expensive'],
+            name='高くない', line=dict(color='orange', dash='dot'),
+            hovertemplate='価格: ¥%{x:,.0f}<br>%{y:.1f}%<extra></extra>'
+        ))
+        
+        # 交点
+        for point, label in PSM_POINTS.items():
+            fig.add_vline(
+                x=psm.points[point], line_dash='dot', line_color='rgba(255, 255, 255, 0.4)',
+                annotation_text=label.split(' ')[-1], annotation_position='top'
+            )
+        
         fig.update_layout(
             title='PSM分析結果 - 価格感度曲線',
             xaxis_title='価格 (¥)',
@@ -700,10 +750,9 @@ with tab2:
         
         st.plotly_chart(fig, use_container_width=True)
         
-        # 最適価格帯の計算（簡単な交点計算）
-        acceptable_range_low = np.interp(50, cheap_cum[::-1], price_range[::-1])
-        acceptable_range_high = np.interp(50, expensive_cum, price_range)
-        optimal_price = (acceptable_range_low + acceptable_range_high) / 2
+        # 最適価格帯（受容価格帯は PMC〜PME、最適価格は OPP）
+        acceptable_range_low, acceptable_range_high = psm.acceptable_range
+        optimal_price = psm.optimal_price
         
         # 結果表示
         col1, col2, col3 = st.columns(3)
@@ -735,6 +784,23 @@ with tab2:
             </div>
             """, unsafe_allow_html=True)
         
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    '指標': label,
+                    '価格': f"¥{psm.points[point]:,.0f}",
+                    '95%信頼区間': (
+                        f"¥{psm.intervals[point][0]:,.0f} 〜 ¥{psm.intervals[point][1]:,.0f}"
+                        if point in psm.intervals else '-'
+                    )
+                }
+                for point, label in PSM_POINTS.items()
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(f"有効回答 {psm.respondents:,}件 / ウェイト合計 {psm.total_weight:,.1f}")
+        
         # 価格戦略提案
         st.markdown("### 🎯 価格戦略提案")
         
@@ -1320,6 +1386,132 @@ with tab4:
         </div>
         """, unsafe_allow_html=True)
 
+    # 需要曲線ベースの価格×プラン×月シミュレーション
+    st.markdown("---")
+    st.markdown("### 🧪 需要曲線シミュレーション")
+    st.markdown("**価格テストの結果から需要・解約曲線を推定し、価格×プラン×月の収益を不確実性付きで一括試算**")
+    
+    uploaded_tests = st.file_uploader(
+        "価格テスト結果CSV（plan, price, visitors, conversions, customers, churned）", type=["csv"]
+    )
+    if uploaded_tests is not None:
+        price_tests = pd.read_csv(uploaded_tests)
+    else:
+        if 'price_test_data' not in st.session_state:
+            st.session_state.price_test_data = simulate_price_tests()
+        price_tests = st.session_state.price_test_data
+        st.caption("サンプルの価格テスト結果（Starter / Pro / Enterprise）を使用しています")
+    
+    demand_model = page_cache.call(fit_demand_curves, price_tests)
+    
+    engine_cols = st.columns(4)
+    with engine_cols[0]:
+        sim_months = st.slider("試算期間（月）", 6, 36, 24)
+    with engine_cols[1]:
+        multiplier_range = st.slider("価格倍率の範囲", 0.3, 3.0, (0.5, 2.0), 0.1)
+    with engine_cols[2]:
+        monthly_visitors = st.number_input("月間訪問数（全プラン合計）", value=30000, step=1000)
+    with engine_cols[3]:
+        mc_samples = st.select_slider("モンテカルロ標本数", options=[100, 300, 1000], value=300)
+    
+    visitor_growth = st.slider("訪問数の月次成長率 (%)", 0.0, 10.0, 2.0, 0.5) / 100
+    
+    # 訪問数は価格テストの訪問数の比率で各プランに配分し、原価は運営コスト率から換算
+    plan_traffic = price_tests.groupby('plan')['visitors'].sum().reindex(demand_model.plans).to_numpy(dtype=float)
+    plan_visitors = monthly_visitors * plan_traffic / plan_traffic.sum()
+    plan_costs = demand_model.ref_price * operational_cost_ratio / 100
+    multipliers = np.linspace(multiplier_range[0], multiplier_range[1], 60)
+    
+    pricing_sim = page_cache.call(
+        simulate_pricing,
+        demand_model,
+        price_grid(demand_model, multipliers, sim_months),
+        visitors=plan_visitors,
+        unit_costs=plan_costs,
+        visitor_growth=visitor_growth,
+        n_samples=mc_samples
+    )
+    sim_summary = pricing_sim.summary()
+    best = pricing_sim.best_scenarios('cumulative_profit')
+    
+    st.caption(f"{pricing_sim.n_scenarios:,} シナリオ（価格 {len(multipliers)} × プラン {len(demand_model)} × 標本 {mc_samples}）× {sim_months}ヶ月を評価")
+    
+    # 推定した需要曲線
+    model_display = demand_model.to_frame()
+    model_display.columns = ['プラン', '基準価格', '基準CV率', 'CV弾力性', 'CV弾力性SE', '基準解約率', '解約弾力性', '解約弾力性SE']
+    st.dataframe(
+        model_display.style.format({
+            '基準価格': '¥{:,.0f}', '基準CV率': '{:.2%}', 'CV弾力性': '{:.2f}', 'CV弾力性SE': '{:.2f}',
+            '基準解約率': '{:.2%}', '解約弾力性': '{:.2f}', '解約弾力性SE': '{:.2f}'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # プラン別の推奨価格
+    best_cols = st.columns(len(demand_model))
+    for i, plan in enumerate(demand_model.plans):
+        row = sim_summary[(sim_summary['scenario'] == best[i]) & (sim_summary['plan'] == plan)].iloc[0]
+        with best_cols[i]:
+            st.markdown(f"""
+            <div class="result-highlight">
+                <h4>{plan}</h4>
+                <h3>¥{row['price']:,.0f}</h3>
+                <p>{sim_months}ヶ月累計粗利: ¥{row['cumulative_profit']:,.0f}<br>
+                (90%区間 ¥{row['cumulative_profit_low']:,.0f} 〜 ¥{row['cumulative_profit_high']:,.0f})</p>
+                <p>最終MRR: ¥{row['final_mrr']:,.0f} / 顧客 {row['final_customers']:,.0f}人</p>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    # 価格別の累計粗利（中央値と90%区間）
+    profit_low, profit_mid, profit_high = (band[:, :, -1] for band in pricing_sim.band('cumulative_profit'))
+    fig_price_curve = make_subplots(rows=1, cols=len(demand_model), subplot_titles=list(demand_model.plans))
+    for i, plan in enumerate(demand_model.plans):
+        plan_prices = pricing_sim.prices[:, i, 0]
+        fig_price_curve.add_trace(
+            go.Scatter(x=plan_prices, y=profit_high[:, i], line=dict(width=0), showlegend=False, hoverinfo='skip'),
+            row=1, col=i + 1
+        )
+        fig_price_curve.add_trace(
+            go.Scatter(x=plan_prices, y=profit_low[:, i], line=dict(width=0), fill='tonexty',
+                       fillcolor='rgba(102, 126, 234, 0.25)', showlegend=False, hoverinfo='skip'),
+            row=1, col=i + 1
+        )
+        fig_price_curve.add_trace(
+            go.Scatter(x=plan_prices, y=profit_mid[:, i], name=plan, line=dict(color='#667eea'),
+                       hovertemplate='価格: ¥%{x:,.0f}<br>累計粗利: ¥%{y:,.0f}<extra></extra>'),
+            row=1, col=i + 1
+        )
+        fig_price_curve.add_vline(x=plan_prices[best[i]], line_dash='dot', line_color='#10b981', row=1, col=i + 1)
+    fig_price_curve.update_layout(
+        title=f"価格別の{sim_months}ヶ月累計粗利（中央値と90%区間）",
+        template='plotly_dark',
+        showlegend=False,
+        height=400
+    )
+    st.plotly_chart(fig_price_curve, use_container_width=True)
+    
+    # 推奨価格でのMRR推移
+    selected_plan = st.selectbox("MRR推移を表示するプラン", list(demand_model.plans))
+    plan_index = list(demand_model.plans).index(selected_plan)
+    mrr_low, mrr_mid, mrr_high = (band[best[plan_index], plan_index] for band in pricing_sim.band('mrr'))
+    sim_month_axis = np.arange(1, sim_months + 1)
+    
+    fig_mrr = go.Figure()
+    fig_mrr.add_trace(go.Scatter(x=sim_month_axis, y=mrr_high, line=dict(width=0), showlegend=False, hoverinfo='skip'))
+    fig_mrr.add_trace(go.Scatter(
+        x=sim_month_axis, y=mrr_low, line=dict(width=0), fill='tonexty',
+        fillcolor='rgba(16, 185, 129, 0.2)', name='90%区間'
+    ))
+    fig_mrr.add_trace(go.Scatter(x=sim_month_axis, y=mrr_mid, name='MRR（中央値）', line=dict(color='#10b981')))
+    fig_mrr.update_layout(
+        title=f"{selected_plan}: 推奨価格 ¥{pricing_sim.prices[best[plan_index], plan_index, 0]:,.0f} でのMRR推移",
+        xaxis_title='月',
+        yaxis_title='MRR (¥)',
+        template='plotly_dark'
+    )
+    st.plotly_chart(fig_mrr, use_container_width=True)
+
 # タブ5: 成長戦略
 with tab5:
     st.markdown("## 📈 成長戦略ガイド")
@@ -1416,24 +1608,59 @@ with tab5:
         target_price = st.number_input("目標価格", value=2000, key="postpmf_target")
         months_to_target = st.slider("達成期間（月）", 3, 24, 12, key="postpmf_months")
         
+        schedule_cols = st.columns(3)
+        with schedule_cols[0]:
+            schedule_customers = st.number_input("現在の顧客数", value=300, step=50, key="postpmf_customers")
+        with schedule_cols[1]:
+            schedule_new_customers = st.number_input("月間新規顧客数", value=40, step=5, key="postpmf_new")
+        with schedule_cols[2]:
+            schedule_churn = st.slider("月次解約率 (%)", 0.5, 15.0, 5.0, 0.5, key="postpmf_churn")
+        
         if target_price > current_price:
             monthly_increase = (target_price / current_price) ** (1/months_to_target) - 1
             
-            price_schedule = []
-            for month in range(months_to_target + 1):
-                price = current_price * ((1 + monthly_increase) ** month)
-                price_schedule.append({"Month": month, "Price": price})
+            # 価格スケジュールとMRRの見通し（需要・解約の弾力性の不確実性を含む）
+            schedule_months = np.arange(months_to_target + 1)
+            schedule_prices = current_price * (1 + monthly_increase) ** schedule_months
+            schedule_model = demand_model_from_rates(
+                ['現行プラン'], [current_price], [schedule_new_customers / 1000], [schedule_churn / 100]
+            )
+            schedule_sim = simulate_pricing(
+                schedule_model, schedule_prices[None, None, :], visitors=[1000],
+                initial_customers=[schedule_customers]
+            )
+            mrr_low, mrr_mid, mrr_high = (band[0, 0] for band in schedule_sim.band('mrr'))
             
-            df_schedule = pd.DataFrame(price_schedule)
+            df_schedule = pd.DataFrame({"Month": schedule_months, "Price": schedule_prices})
             
-            fig_price_schedule = px.line(
-                df_schedule, x="Month", y="Price",
-                title="段階的価格上昇スケジュール",
-                template="plotly_dark"
+            fig_price_schedule = make_subplots(specs=[[{"secondary_y": True}]])
+            fig_price_schedule.add_trace(
+                go.Scatter(x=schedule_months, y=mrr_high, line=dict(width=0), showlegend=False, hoverinfo='skip'),
+                secondary_y=True
+            )
+            fig_price_schedule.add_trace(
+                go.Scatter(x=schedule_months, y=mrr_low, line=dict(width=0), fill='tonexty',
+                           fillcolor='rgba(16, 185, 129, 0.2)', name='MRR 90%区間'),
+                secondary_y=True
             )
-            fig_price_schedule.update_traces(mode='markers+lines')
+            fig_price_schedule.add_trace(
+                go.Scatter(x=schedule_months, y=mrr_mid, name='MRR（中央値）', line=dict(color='#10b981')),
+                secondary_y=True
+            )
+            fig_price_schedule.add_trace(
+                go.Scatter(x=df_schedule["Month"], y=df_schedule["Price"], mode='markers+lines', name='価格',
+                           line=dict(color='#667eea')),
+                secondary_y=False
+            )
+            fig_price_schedule.update_layout(title="段階的価格上昇スケジュール", template="plotly_dark")
+            fig_price_schedule.update_xaxes(title_text="Month")
+            fig_price_schedule.update_yaxes(title_text="価格 (¥)", secondary_y=False)
+            fig_price_schedule.update_yaxes(title_text="MRR (¥)", secondary_y=True)
             st.plotly_chart(fig_price_schedule, use_container_width=True)
             
+            st.caption(
+                f"最終月のMRR見通し: ¥{mrr_mid[-1]:,.0f}（90%区間 ¥{mrr_low[-1]:,.0f} 〜 ¥{mrr_high[-1]:,.0f}）"
+            )
             st.info(f"📈 月次価格上昇率: {monthly_increase*100:.1f}% | 最終価格: ¥{target_price:,.0f}")
     
     with growth_stages[2]:
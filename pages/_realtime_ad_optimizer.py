@@ -8,6 +8,7 @@ import streamlit as st
 import os
 import sys
 import json
+import re
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
@@ -18,6 +19,13 @@ import uuid
 import time
 import asyncio
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics.bandit import get_allocator
+from analytics.ad_metrics import ad_metrics_store, refresh_sources
+from analytics.bid_optimizer import fit_response_curves, simulate_ad_group_history, submit_optimization
+from analytics.forecasting import forecast_service
+from analytics.anomaly import alert_bus, anomaly_monitor
+
 # ページ設定
 st.set_page_config(
     page_title="リアルタイム広告最適化",
@@ -391,34 +399,52 @@ if 'auto_optimization_enabled' not in st.session_state:
 if 'realtime_alerts' not in st.session_state:
     st.session_state.realtime_alerts = []
 
+if 'bid_adjustment_history' not in st.session_state:
+    st.session_state.bid_adjustment_history = []
+
+if 'optimization_queue' not in st.session_state:
+    st.session_state.optimization_queue = []
+
+# 期待インパクト文字列から数値（%）を取り出すパターン
+IMPACT_PATTERN = re.compile(r'(\d+(?:\.\d+)?)%')
+
+# 予測モデルで追跡する指標
+FORECAST_METRICS = ['impressions', 'clicks', 'conversions', 'cost', 'ctr', 'cpa', 'roas']
+
+if 'ad_creatives' not in st.session_state:
+    # 配信中のクリエイティブ（expected_ctrはシミュレーション用の想定CTR）
+    st.session_state.ad_creatives = [
+        {'id': 'creative_001', 'name': '商品訴求バナー', 'platform': 'Google Ads', 'expected_ctr': 0.021},
+        {'id': 'creative_002', 'name': '価格訴求バナー', 'platform': 'Google Ads', 'expected_ctr': 0.028},
+        {'id': 'creative_003', 'name': 'UGC動画', 'platform': 'Instagram Ads', 'expected_ctr': 0.034},
+        {'id': 'creative_004', 'name': 'カルーセル広告', 'platform': 'Facebook Ads', 'expected_ctr': 0.025},
+        {'id': 'creative_005', 'name': '事例紹介', 'platform': 'LinkedIn Ads', 'expected_ctr': 0.017}
+    ]
+
 def generate_realtime_data():
-    """リアルタイムデータを生成"""
+    """リアルタイムデータを生成（指標は共有メトリクスストアの直近1時間の集計、状態は異常検知の結果）"""
     current_time = datetime.now()
+    refresh_sources()
+    snapshot = ad_metrics_store.snapshot('1h')
+    platform_status = anomaly_monitor.platform_status(list(snapshot['platforms']))
     
     # ベースメトリクス
-    base_metrics = {
-        'impressions': np.random.randint(10000, 50000),
-        'clicks': np.random.randint(200, 2000),
-        'conversions': np.random.randint(10, 100),
-        'cost': np.random.uniform(5000, 25000),
-        'ctr': np.random.uniform(0.5, 5.0),
-        'cpc': np.random.uniform(100, 1000),
-        'cpa': np.random.uniform(2000, 8000),
-        'roas': np.random.uniform(2.0, 8.0)
-    }
+    total = snapshot['total']
+    base_metrics = {key: int(total[key]) for key in ['impressions', 'clicks', 'conversions']}
+    base_metrics.update({key: total[key] for key in ['cost', 'ctr', 'cpc', 'cpa', 'roas']})
     
-    # プラットフォーム別データ
-    platforms = ['Google Ads', 'Facebook Ads', 'Instagram Ads', 'LinkedIn Ads', 'Twitter Ads']
+    # プラットフォーム別データ（パフォーマンスは最もROASが高いプラットフォームとの比）
     platform_data = {}
+    best_roas = max([p['roas'] for p in snapshot['platforms'].values()] or [0])
     
-    for platform in platforms:
+    for platform, metrics in snapshot['platforms'].items():
         platform_data[platform] = {
-            'status': np.random.choice(['active', 'warning', 'error'], p=[0.7, 0.2, 0.1]),
-            'spend': np.random.uniform(1000, 8000),
-            'performance': np.random.uniform(0.6, 0.95),
-            'impressions': np.random.randint(2000, 15000),
-            'clicks': np.random.randint(40, 500),
-            'ctr': np.random.uniform(0.8, 4.5)
+            'status': platform_status[platform],
+            'spend': metrics['cost'],
+            'performance': metrics['roas'] / best_roas if best_roas > 0 else 0,
+            'impressions': int(metrics['impressions']),
+            'clicks': int(metrics['clicks']),
+            'ctr': metrics['ctr']
         }
     
     return {
@@ -449,8 +475,23 @@ def generate_optimization_recommendations_mock(data: Dict) -> List[Dict]:
             'action': 'A/Bテストで3つの新しいクリエイティブをテスト'
         })
     
-    # CPAベースの推奨
-    if metrics['cpa'] > 6000:
+    # CPAベースの推奨（入札最適化の計算結果があればその数値を使う）
+    plan = st.session_state.get('bid_plan')
+    if plan is not None:
+        totals = plan.totals()
+        cpa_change = (totals['expected_cpa'] / totals['current_cpa'] - 1) * 100 if totals['current_cpa'] > 0 else 0
+        if cpa_change < -1:
+            changed = int((np.abs(plan.bid_multiplier - 1) >= 0.01).sum())
+            recommendations.append({
+                'type': 'bid_adjustment',
+                'priority': 'high' if cpa_change < -10 else 'medium',
+                'title': '入札・予算配分の最適化',
+                'description': f"限界ROASを均等化する配分で、CPAを¥{totals['current_cpa']:,.0f}から¥{totals['expected_cpa']:,.0f}に改善できます。",
+                'expected_impact': f"{cpa_change:.0f}% CPA削減",
+                'confidence': 0.9,
+                'action': f"{changed:,}件の広告グループの入札・予算を計算済みプランに更新"
+            })
+    elif metrics['cpa'] > 6000:
         recommendations.append({
             'type': 'bid_adjustment',
             'priority': 'high',
@@ -623,61 +664,80 @@ async def detect_anomalies(data: Dict) -> List[Dict]:
     return anomalies
 
 def prioritize_recommendations(recommendations: List[Dict], data: Dict) -> List[Dict]:
-    """推奨事項の優先順位付け"""
-    # スコアリングロジック
-    for rec in recommendations:
-        score = 0
-        
-        # 優先度によるスコア
-        priority_scores = {'high': 3, 'medium': 2, 'low': 1}
-        score += priority_scores.get(rec['priority'], 1)
+    """推奨事項の優先順位付け（優先度・信頼度・期待インパクトをまとめてスコアリング）"""
+    if not recommendations:
+        return recommendations
+    
+    frame = pd.DataFrame(recommendations, columns=['priority', 'confidence', 'expected_impact'])
+    priority_scores = {'high': 3, 'medium': 2, 'low': 1}
+    
+    # 期待インパクトは数値を抽出して評価（20%で1ポイント）
+    impact = pd.to_numeric(
+        frame['expected_impact'].astype(str).str.extract(IMPACT_PATTERN, expand=False), errors='coerce'
+    ).fillna(0)
+    score = frame['priority'].map(priority_scores).fillna(1) + frame['confidence'].astype(float) * 2 + impact / 20
+    
+    # スコアでソート（同点は元の順序を維持）
+    order = np.argsort(-score.to_numpy(), kind='stable')
+    return [recommendations[i] for i in order]
+
+def execute_optimization(recommendation: Dict) -> Dict[str, Any]:
+    """最適化を実行（入札・予算配分は計算済みのプランを適用し、それ以外は実行キューに登録）"""
+    started = time.perf_counter()
+    
+    if recommendation['type'] in ('bid_adjustment', 'platform_reallocation'):
+        plan = st.session_state.get('bid_plan')
+        if plan is None:
+            return {
+                'status': 'error',
+                'message': f"{recommendation['title']}: 入札最適化の計算が完了していません",
+                'execution_time': time.perf_counter() - started,
+                'error_code': 'OPT_PLAN_PENDING'
+            }
         
-        # 信頼度によるスコア
-        score += rec['confidence'] * 2
+        frame = plan.to_frame()
+        changed = frame[np.abs(frame['bid_multiplier'] - 1) >= 0.01]
+        st.session_state.applied_bid_plan = plan
         
-        # 期待インパクトによるスコア（数値を抽出して評価）
-        import re
-        impact_match = re.search(r'(\d+)%', rec['expected_impact'])
-        if impact_match:
-            impact_value = int(impact_match.group(1))
-            score += impact_value / 20  # 20%で1ポイント
+        # 変更幅の大きい広告グループを入札調整履歴に記録
+        top_changes = changed.reindex(changed['spend_change'].abs().sort_values(ascending=False).index).head(20)
+        applied_at = datetime.now()
+        st.session_state.bid_adjustment_history.extend({
+            'timestamp': applied_at,
+            'keyword': f"{row.group_id} ({row.platform})",
+            'old_spend': row.current_spend,
+            'new_spend': row.recommended_spend,
+            'bid_change': (row.bid_multiplier - 1) * 100,
+            'reason': f"限界ROAS {row.marginal_roas:.2f}"
+        } for row in top_changes.itertuples())
         
-        rec['_score'] = score
-    
-    # スコアでソート
-    recommendations.sort(key=lambda x: x['_score'], reverse=True)
-    
-    # スコアフィールドを削除
-    for rec in recommendations:
-        rec.pop('_score', None)
-    
-    return recommendations
-
-def execute_optimization(recommendation: Dict) -> Dict[str, Any]:
-    """最適化を実行（スタブ）"""
-    
-    # 実行シミュレーション
-    execution_time = np.random.uniform(2, 8)
-    success_probability = recommendation['confidence']
-    
-    time.sleep(min(execution_time / 4, 2))  # 実際の実行時間をシミュレート
-    
-    is_successful = np.random.random() < success_probability
-    
-    if is_successful:
         return {
             'status': 'success',
-            'message': f"{recommendation['title']}を正常に実行しました",
-            'execution_time': execution_time,
+            'message': f"{len(changed):,}件の広告グループの入札・予算を更新しました",
+            'execution_time': time.perf_counter() - started,
             'estimated_impact': recommendation['expected_impact']
         }
-    else:
-        return {
-            'status': 'error',
-            'message': f"{recommendation['title']}の実行中にエラーが発生しました",
-            'execution_time': execution_time,
-            'error_code': 'OPT_' + str(np.random.randint(1000, 9999))
-        }
+    
+    st.session_state.optimization_queue.append({**recommendation, 'queued_at': datetime.now().isoformat()})
+    return {
+        'status': 'success',
+        'message': f"{recommendation['title']}を実行キューに登録しました",
+        'execution_time': time.perf_counter() - started,
+        'estimated_impact': recommendation['expected_impact']
+    }
+
+def start_bid_optimization(budget: Optional[float] = None, target_cpa: Optional[float] = None,
+                           max_bid_adjustment: float = 0.2):
+    """入札・予算配分の最適化をバックグラウンドで開始"""
+    if 'bid_curves' not in st.session_state:
+        st.session_state.bid_curves = fit_response_curves(simulate_ad_group_history())
+    curves = st.session_state.bid_curves
+    st.session_state.bid_plan_future = submit_optimization(
+        curves,
+        budget if budget is not None else float(curves.current_spend.sum()),
+        target_cpa=target_cpa,
+        max_bid_adjustment=max_bid_adjustment
+    )
 
 # ヘッダー
 st.markdown("""
@@ -687,11 +747,23 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# 異常検知ワーカーを開始（プロセスで1つ、開始済みなら何もしない）
+anomaly_monitor.start()
+
 # リアルタイムデータ生成
 if 'last_update' not in st.session_state or (datetime.now() - datetime.fromisoformat(st.session_state.get('last_update', datetime.now().isoformat()))).seconds > 30:
     st.session_state.realtime_data = generate_realtime_data()
     st.session_state.last_update = datetime.now().isoformat()
 
+# 入札最適化（初回はバックグラウンドで計算し、完了していれば結果を取り込む）
+if 'bid_plan_future' not in st.session_state:
+    start_bid_optimization()
+if st.session_state.bid_plan_future.done():
+    try:
+        st.session_state.bid_plan = st.session_state.bid_plan_future.result()
+    except Exception as e:
+        st.error(f"入札最適化エラー: {str(e)}")
+
 # ライブインジケーター
 st.markdown("""
 <div class="live-indicator">
@@ -877,20 +949,62 @@ with tabs[0]:
         # 緊急アラート
         st.markdown("#### 🚨 アラート")
         
-        alerts = [
-            {"type": "urgent", "message": "Google Ads CTRが急低下中", "time": "2分前"},
-            {"type": "warning", "message": "CPCが目標を20%上回り", "time": "15分前"},
-            {"type": "info", "message": "新しい最適化機会を検出", "time": "1時間前"}
-        ]
+        recent_alerts = alert_bus.recent(limit=5)
         
-        for alert in alerts:
-            alert_class = "alert-urgent" if alert['type'] == 'urgent' else "alert-card"
+        for alert in recent_alerts:
+            alert_class = "alert-urgent" if alert.severity == 'critical' else "alert-card"
+            elapsed_minutes = int((time.time() - alert.created_at) // 60)
+            elapsed = f"{elapsed_minutes}分前" if elapsed_minutes < 60 else f"{elapsed_minutes // 60}時間前"
+            repeated = f" ・ {alert.occurrences}回検知" if alert.occurrences > 1 else ""
             st.markdown(f"""
             <div class="{alert_class}">
-                <strong>{alert['message']}</strong><br>
-                <small>{alert['time']}</small>
+                <strong>{alert.message}</strong><br>
+                <small>{elapsed}{repeated}</small>
             </div>
             """, unsafe_allow_html=True)
+        
+        if not recent_alerts:
+            st.info("KPIの異常は検知されていません")
+
+    # クリエイティブ配信配分
+    st.markdown("#### 🎨 クリエイティブ配信配分（バンディット）")
+    
+    creatives = {c['id']: c for c in st.session_state.ad_creatives}
+    policy_labels = {'thompson': 'Thompson Sampling', 'ucb': 'UCB'}
+    bandit_col1, bandit_col2 = st.columns([1, 3])
+    
+    with bandit_col1:
+        bandit_policy = st.radio("配分ポリシー", list(policy_labels.keys()), format_func=lambda x: policy_labels[x])
+        creative_bandit = get_allocator('ad_creatives', list(creatives.keys()), policy=bandit_policy)
+        
+        if st.button("📡 配信シミュレーション（5,000imp）", use_container_width=True):
+            served = creative_bandit.choose_batch(5000)
+            expected_ctr = np.array([creatives[c]['expected_ctr'] for c in served])
+            creative_bandit.record_outcomes(served, (np.random.random(len(served)) < expected_ctr).astype(float))
+    
+    with bandit_col2:
+        arm_summary = pd.DataFrame(creative_bandit.summary())
+        arm_summary = arm_summary[arm_summary['arm_id'].isin(creatives.keys())]
+        arm_summary['name'] = arm_summary['arm_id'].map(lambda c: creatives[c]['name'])
+        arm_summary['platform'] = arm_summary['arm_id'].map(lambda c: creatives[c]['platform'])
+        
+        fig_arms = px.bar(
+            arm_summary,
+            x='name',
+            y='allocation',
+            color='platform',
+            hover_data={'pulls': True, 'mean_reward': ':.2%'},
+            labels={'name': 'クリエイティブ', 'allocation': '配分比率', 'pulls': 'インプレッション', 'mean_reward': 'CTR'},
+            title="次の配信の配分比率"
+        )
+        fig_arms.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white'),
+            yaxis_tickformat='.0%',
+            height=300
+        )
+        st.plotly_chart(fig_arms, use_container_width=True)
 
 # リアルタイム分析タブ
 with tabs[1]:
@@ -899,18 +1013,8 @@ with tabs[1]:
     # 時系列グラフ
     st.markdown("#### 📈 パフォーマンストレンド")
     
-    # サンプル時系列データ生成
-    hours = pd.date_range(end=datetime.now(), periods=24, freq='H')
-    trend_data = pd.DataFrame({
-        'time': hours,
-        'impressions': np.random.randint(1000, 3000, 24),
-        'clicks': np.random.randint(20, 100, 24),
-        'conversions': np.random.randint(1, 10, 24),
-        'cost': np.random.uniform(500, 1500, 24)
-    })
-    
-    trend_data['ctr'] = (trend_data['clicks'] / trend_data['impressions']) * 100
-    trend_data['cpc'] = trend_data['cost'] / trend_data['clicks']
+    # 共有メトリクスストアの時間別集計（直近24時間）
+    trend_data = ad_metrics_store.series('24h')
     
     # CTRとCPCの推移
     fig_trends = go.Figure()
@@ -994,16 +1098,13 @@ with tabs[1]:
     # ヒートマップ
     st.markdown("#### 🔥 時間帯×プラットフォーム パフォーマンスヒートマップ")
     
-    # サンプルヒートマップデータ
-    hours_24 = [f"{i:02d}:00" for i in range(24)]
-    platforms_5 = list(platform_data.keys())
-    
-    heatmap_data = np.random.uniform(0.5, 5.0, (len(platforms_5), 24))
+    # 共有メトリクスストアの時間帯別CTR（直近24時間）
+    heatmap_table = ad_metrics_store.hourly_heatmap('ctr')
     
     fig_heatmap = go.Figure(data=go.Heatmap(
-        z=heatmap_data,
-        x=hours_24,
-        y=platforms_5,
+        z=heatmap_table.to_numpy(),
+        x=list(heatmap_table.columns),
+        y=list(heatmap_table.index),
         colorscale='Reds',
         colorbar=dict(title="CTR (%)")
     ))
@@ -1178,31 +1279,80 @@ with tabs[3]:
             if st.button(f"🚀 {rec['strategy']}を適用", key=f"apply_{rec['strategy']}"):
                 st.success(f"✅ {rec['strategy']}を適用しました！変更は5-10分で反映されます。")
     
+    # 予算配分最適化
+    st.markdown("#### 🧮 予算配分最適化")
+    
+    curves = st.session_state.get('bid_curves')
+    opt_col1, opt_col2, opt_col3 = st.columns(3)
+    
+    with opt_col1:
+        default_budget = float(curves.current_spend.sum()) if curves is not None else 1000000.0
+        optimization_budget = st.number_input("日次予算 (¥)", min_value=0.0, value=round(default_budget, -3), step=10000.0)
+    
+    with opt_col2:
+        use_target_cpa = st.checkbox("目標CPAを制約に含める")
+        target_cpa = st.number_input("目標CPA (¥)", min_value=100.0, value=4000.0, step=100.0, disabled=not use_target_cpa)
+    
+    with opt_col3:
+        st.markdown("<br>", unsafe_allow_html=True)
+        if st.button("🧮 配分を再計算", type="primary", use_container_width=True):
+            start_bid_optimization(
+                optimization_budget,
+                target_cpa if use_target_cpa else None,
+                max_bid_adjustment / 100
+            )
+            st.rerun()
+    
+    plan = st.session_state.get('bid_plan')
+    if not st.session_state.bid_plan_future.done():
+        st.info("⏳ 入札最適化を計算中です...")
+    elif plan is not None:
+        totals = plan.totals()
+        binding_labels = {'budget': '予算', 'target_cpa': '目標CPA', 'marginal_roas': '限界ROAS', 'min_spend': '最低支出'}
+        
+        result_cols = st.columns(4)
+        result_cols[0].metric("推奨支出", f"¥{totals['recommended_spend']:,.0f}",
+                              f"{totals['recommended_spend'] - totals['current_spend']:+,.0f}")
+        result_cols[1].metric("予想CV", f"{totals['expected_conversions']:,.0f}",
+                              f"{totals['expected_conversions'] - totals['current_conversions']:+,.0f}")
+        result_cols[2].metric("予想CPA", f"¥{totals['expected_cpa']:,.0f}",
+                              f"{totals['expected_cpa'] - totals['current_cpa']:+,.0f}", delta_color="inverse")
+        result_cols[3].metric("予想ROAS", f"{totals['expected_roas']:.2f}x",
+                              f"{totals['expected_roas'] - totals['current_roas']:+.2f}")
+        st.caption(f"{len(plan.curves):,}件の広告グループを最適化 | 制約: {binding_labels.get(plan.binding, plan.binding)} | 限界ROAS: {totals['marginal_roas']:.2f}")
+        
+        platform_plan = plan.platform_summary().reset_index()
+        fig_plan = go.Figure(data=[
+            go.Bar(name='現在', x=platform_plan['platform'], y=platform_plan['current_spend'], marker_color='#64748b'),
+            go.Bar(name='推奨', x=platform_plan['platform'], y=platform_plan['recommended_spend'], marker_color='#ff6b6b')
+        ])
+        fig_plan.update_layout(
+            title="プラットフォーム別支出配分",
+            barmode='group',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='white')
+        )
+        st.plotly_chart(fig_plan, use_container_width=True)
+    
     # 入札調整履歴
     st.markdown("#### 📊 入札調整履歴")
     
-    # サンプル履歴データ
-    adjustment_history = pd.DataFrame({
-        'timestamp': pd.date_range(end=datetime.now(), periods=10, freq='2H'),
-        'keyword': ['マーケティング ツール', 'AI 広告', 'デジタル 戦略', '自動化 ソフト', 'SaaS 営業'] * 2,
-        'old_bid': np.random.randint(100, 500, 10),
-        'new_bid': np.random.randint(120, 600, 10),
-        'reason': ['CTR向上', 'CPA最適化', '競合対応', '品質スコア改善', 'コンバージョン増加'] * 2
-    })
-    
-    adjustment_history['change'] = ((adjustment_history['new_bid'] - adjustment_history['old_bid']) / adjustment_history['old_bid'] * 100).round(1)
-    
-    st.dataframe(
-        adjustment_history[['timestamp', 'keyword', 'old_bid', 'new_bid', 'change', 'reason']].rename(columns={
-            'timestamp': '時刻',
-            'keyword': 'キーワード',
-            'old_bid': '変更前入札価格(¥)',
-            'new_bid': '変更後入札価格(¥)',
-            'change': '変更率(%)',
-            'reason': '調整理由'
-        }),
-        use_container_width=True
-    )
+    if st.session_state.bid_adjustment_history:
+        adjustment_history = pd.DataFrame(st.session_state.bid_adjustment_history[-50:])
+        st.dataframe(
+            adjustment_history[['timestamp', 'keyword', 'old_spend', 'new_spend', 'bid_change', 'reason']].rename(columns={
+                'timestamp': '時刻',
+                'keyword': '広告グループ',
+                'old_spend': '変更前支出(¥)',
+                'new_spend': '変更後支出(¥)',
+                'bid_change': '入札変更率(%)',
+                'reason': '調整理由'
+            }).round(1),
+            use_container_width=True
+        )
+    else:
+        st.info("まだ入札調整は適用されていません。AI推奨事項から入札・予算配分の最適化を実行してください。")
 
 # パフォーマンス予測タブ
 with tabs[4]:
@@ -1217,35 +1367,50 @@ with tabs[4]:
     with col2:
         confidence_interval = st.selectbox("信頼区間", ["90%", "95%", "99%"])
     
+    # 予測期間ごとの（集計ウィンドウ, 予測モデル群, 季節周期, 周期の秒数, 予測期間数）
+    forecast_specs = {
+        "24時間": ('7d', 'ad_metrics_hourly', 24, 3600, 24),
+        "7日間": ('90d', 'ad_metrics_daily', 7, 86400, 7),
+        "30日間": ('90d', 'ad_metrics_daily', 7, 86400, 30),
+        "90日間": ('90d', 'ad_metrics_daily', 7, 86400, 90)
+    }
+    window, bank_name, season_length, period_seconds, periods = forecast_specs[forecast_period]
+    
+    # 確定済みのバケットだけを予測モデルに反映（既知の系列は新しい期間のみ差分更新）
+    refresh_sources()
+    forecast_bank = forecast_service.bank(bank_name, season_length, period_seconds)
+    forecast_bank.sync_frame(
+        ad_metrics_store.platform_series(window), 'time', ['platform'], FORECAST_METRICS
+    )
+    
     with col3:
         if st.button("🔮 予測実行", type="primary"):
-            with st.spinner("AI予測モデルを実行中..."):
-                time.sleep(2)
-                st.success("✅ 予測完了！")
+            forecast_bank.refit()
+            st.success("✅ 予測モデルを再推定しました")
     
     # 予測グラフ
     st.markdown("#### 📊 パフォーマンス予測")
     
-    # サンプル予測データ
-    periods_map = {"24時間": 24, "7日間": 7, "30日間": 30, "90日間": 90}
-    periods = periods_map[forecast_period]
-    freq = 'H' if forecast_period == "24時間" else 'D'
-    
-    forecast_dates = pd.date_range(start=datetime.now(), periods=periods, freq=freq)
-    
-    # 基本トレンド + ノイズ
-    base_trend = np.linspace(metrics['ctr'], metrics['ctr'] * 1.15, periods)
-    noise = np.random.normal(0, 0.1, periods)
-    forecast_ctr = base_trend + noise
-    
-    # 信頼区間
     confidence = float(confidence_interval[:-1]) / 100
-    margin = np.random.uniform(0.2, 0.5, periods)
-    upper_bound = forecast_ctr + margin
-    lower_bound = forecast_ctr - margin
+    forecast_result = forecast_bank.forecast(periods, confidence)
+    forecast_table = forecast_result.series(('ctr', 'total'))
+    actual_table = forecast_bank.actuals(('ctr', 'total'), periods=min(periods, 4 * season_length))
+    forecast_dates = forecast_table['time']
+    forecast_ctr = forecast_table['forecast'].to_numpy()
+    upper_bound = forecast_table['upper'].to_numpy()
+    lower_bound = forecast_table['lower'].to_numpy()
     
     fig_forecast = go.Figure()
     
+    # 実績
+    fig_forecast.add_trace(go.Scatter(
+        x=actual_table['time'],
+        y=actual_table['value'],
+        mode='lines',
+        name='CTR実績',
+        line=dict(color='#9ca3af', width=2)
+    ))
+    
     # 信頼区間
     fig_forecast.add_trace(go.Scatter(
         x=forecast_dates,
@@ -1292,7 +1457,7 @@ with tabs[4]:
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        predicted_improvement = ((forecast_ctr[-1] - forecast_ctr[0]) / forecast_ctr[0] * 100)
+        predicted_improvement = ((forecast_ctr[-1] - forecast_ctr[0]) / forecast_ctr[0] * 100) if forecast_ctr[0] > 0 else 0.0
         st.markdown(f"""
         <div class="perf-metric">
             <div class="metric-value">{predicted_improvement:+.1f}%</div>
@@ -1301,7 +1466,7 @@ with tabs[4]:
         """, unsafe_allow_html=True)
     
     with col2:
-        forecast_volatility = np.std(forecast_ctr) / np.mean(forecast_ctr) * 100
+        forecast_volatility = np.std(forecast_ctr) / np.mean(forecast_ctr) * 100 if np.mean(forecast_ctr) > 0 else 0.0
         st.markdown(f"""
         <div class="perf-metric">
             <div class="metric-value">{forecast_volatility:.1f}%</div>
@@ -1310,7 +1475,8 @@ with tabs[4]:
         """, unsafe_allow_html=True)
     
     with col3:
-        confidence_score = np.random.uniform(75, 95)
+        # 1期先予測の精度（1 - 加重平均絶対誤差率）
+        confidence_score = forecast_result.accuracy[forecast_result.index(('ctr', 'total'))] * 100
         st.markdown(f"""
         <div class="perf-metric">
             <div class="metric-value">{confidence_score:.1f}%</div>
@@ -1321,12 +1487,35 @@ with tabs[4]:
     # 予測に基づく推奨事項
     st.markdown("#### 💡 予測ベース推奨事項")
     
+    # プラットフォーム別のROAS予測（直近の同じ期間の実績平均との比較）と、季節成分が最も低い時間帯・曜日
+    roas_changes = {}
+    for key in forecast_result.keys:
+        if key[0] == 'roas' and key[1] != 'total':
+            recent = forecast_bank.actuals(key, periods=periods)['value'].mean()
+            predicted = forecast_result.mean[forecast_result.index(key)].mean()
+            roas_changes[key[1]] = (predicted - recent) / recent * 100 if recent > 0 else 0.0
+    seasonal_ctr = forecast_result.seasonal[forecast_result.index(('ctr', 'total'))][:season_length]
+    low_time = forecast_result.times()[int(np.argmin(seasonal_ctr))]
+    weekday_labels = ['月曜', '火曜', '水曜', '木曜', '金曜', '土曜', '日曜']
+    low_label = f"{low_time.hour:02d}時台" if season_length == 24 else weekday_labels[low_time.weekday()]
+    
     forecast_recommendations = [
-        f"予測では{forecast_period}で CTR が {predicted_improvement:.1f}% 改善する見込みです",
-        f"現在の入札戦略を維持することで、安定したパフォーマンス向上が期待できます",
-        f"予測変動率 {forecast_volatility:.1f}% は適正範囲内です",
-        f"週末にかけてパフォーマンスの一時的な低下が予想されます"
+        f"予測では{forecast_period}で CTR が {predicted_improvement:+.1f}% 変化する見込みです"
     ]
+    if roas_changes:
+        best_platform = max(roas_changes, key=roas_changes.get)
+        worst_platform = min(roas_changes, key=roas_changes.get)
+        forecast_recommendations.append(
+            f"{best_platform}のROASは{roas_changes[best_platform]:+.1f}%の見込みです。予算配分の優先度を上げることを推奨します"
+        )
+        if roas_changes[worst_platform] < 0:
+            forecast_recommendations.append(
+                f"{worst_platform}のROASは{roas_changes[worst_platform]:+.1f}%の見込みです。入札の見直しを検討してください"
+            )
+    forecast_recommendations.extend([
+        f"予測変動率 {forecast_volatility:.1f}% は{'適正範囲内です' if forecast_volatility < 10 else '高めです。配信量の急変に注意してください'}",
+        f"{low_label}にかけてCTRが周期的に低下する傾向があります"
+    ])
     
     for i, recommendation in enumerate(forecast_recommendations, 1):
         st.markdown(f"""
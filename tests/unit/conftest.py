@@ -0,0 +1,64 @@
+"""
+ユニットテスト用の設定
+analytics/ api/ などのモジュール単体のテストではStreamlitサーバーを起動しない
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def streamlit_server():
+    """上位のconftestのサーバー起動を無効化"""
+    yield
+
+
+def _random_touchpoints(n_journeys: int = 300, n_channels: int = 5, max_length: int = 6, seed: int = 0):
+    """ランダムなジャーニーのタッチポイント配列（同じチャネルの連続タッチを含む）"""
+    from analytics.attribution import TouchpointArrays
+
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_length + 1, n_journeys)
+    converted = rng.random(n_journeys) < 0.4
+    value = np.where(converted, rng.uniform(1000, 10000, n_journeys), 0.0)
+    journey_id = np.repeat(np.arange(n_journeys), lengths)
+    position = np.arange(len(journey_id)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return TouchpointArrays.from_columns(
+        journey_id,
+        position,
+        rng.integers(0, n_channels, len(journey_id)),
+        np.repeat(rng.uniform(0, 30 * 86400, n_journeys), lengths) + position * 43200.0,
+        np.repeat(value, lengths),
+        [f"ch{c}" for c in range(n_channels)],
+        converted=np.repeat(converted, lengths)
+    )
+
+
+def _split_journeys(arrays):
+    """タッチポイント配列をジャーニー単位の辞書（channels, timestamps, value, converted）に戻す"""
+    converted = arrays.is_converted()
+    journeys = []
+    for row in range(len(arrays)):
+        if row == 0 or arrays.journey_id[row] != arrays.journey_id[row - 1]:
+            journeys.append({'channels': [], 'timestamps': [], 'value': float(arrays.value[row]),
+                             'converted': bool(converted[row])})
+        journeys[-1]['channels'].append(int(arrays.channel[row]))
+        journeys[-1]['timestamps'].append(float(arrays.timestamp[row]))
+    return journeys
+
+
+@pytest.fixture
+def make_touchpoints():
+    """ランダムなタッチポイント配列を作る関数"""
+    return _random_touchpoints
+
+
+@pytest.fixture
+def split_journeys():
+    """タッチポイント配列をジャーニー単位に戻す関数"""
+    return _split_journeys
@@ -0,0 +1,79 @@
+"""
+KPI異常検知のテスト
+現地時刻がUTCでない環境でも確定済みの周期だけを検知器に渡せることを確認
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.ad_metrics import AdMetricsStore
+from analytics.anomaly import AlertBus, AnomalyMonitor, RobustEwmaDetector, frame_to_matrix
+
+
+@pytest.fixture(params=["Asia/Tokyo", "America/New_York"])
+def local_timezone(request, monkeypatch):
+    """プロセスの現地タイムゾーンを切り替える"""
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def make_store(now: float, minutes: int = 60, spike_bucket: bool = False) -> AdMetricsStore:
+    """1分ごとに一定量のイベントを持つストア（spike_bucket で直近の確定済み5分を急増させる）"""
+    store = AdMetricsStore()
+    timestamps = now - 60 * np.arange(minutes, 0, -1) + 1
+    impressions = np.full(minutes, 1000.0)
+    if spike_bucket:
+        last_closed = (now // 300 - 1) * 300
+        impressions[(timestamps >= last_closed) & (timestamps < last_closed + 300)] = 20000.0
+    store.ingest(pd.DataFrame({
+        'platform': 'Google Ads',
+        'timestamp': timestamps,
+        'impressions': impressions,
+        'clicks': impressions * 0.02,
+        'conversions': impressions * 0.001,
+        'cost': impressions * 2.0,
+        'revenue': impressions * 5.0
+    }))
+    return store
+
+
+def test_frame_to_matrix_uses_epoch_periods(local_timezone):
+    now = 1_760_000_000.0 + 150
+    store = make_store(now)
+    frame = store.platform_series('1h', now, include_total=False)
+
+    keys, periods, values = frame_to_matrix(frame, ['impressions'], 300, now)
+
+    assert keys == [('impressions', 'Google Ads')]
+    assert periods[-1] == now // 300 - 1
+    assert len(periods) == 12
+    # 確定済みの5分は1分あたり1000件×5分（先頭はウィンドウの端で欠ける）
+    assert np.allclose(values[0, 1:], 5000.0)
+
+
+def test_hourly_periods_keep_latest_hours(local_timezone):
+    now = 1_760_000_000.0 + 150
+    store = make_store(now, minutes=12 * 60)
+    frame = store.platform_series('7d', now, include_total=False)
+
+    _, periods, _ = frame_to_matrix(frame, ['impressions'], 3600, now)
+
+    assert periods[-1] == now // 3600 - 1
+
+
+def test_monitor_alerts_on_spike_in_non_utc_timezone(local_timezone):
+    now = 1_760_000_000.0 + 150
+    store = make_store(now, spike_bucket=True)
+    monitor = AnomalyMonitor(store, AlertBus())
+    monitor.detectors = [(RobustEwmaDetector('5min', 300, warmup=5), '1h', ('impressions',))]
+    frame = store.platform_series('1h', now, include_total=False)
+
+    alerts = monitor.detectors[0][0].observe(*frame_to_matrix(frame, ['impressions'], 300, now))
+
+    assert [(a.metric, a.direction) for a in alerts] == [('impressions', 'up')]
@@ -0,0 +1,130 @@
+"""
+インクリメンタルアトリビューション集計のテスト
+更新した日のバケットだけを保存し、再起動後も処理済みIDの重複排除と集計結果が保たれることを確認
+"""
+
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from analytics.attribution_state import BUCKET_DIR, AttributionState
+
+CHANNELS = ['google', 'facebook', 'email', 'direct']
+
+
+def make_journeys(day: date, n: int, prefix: str, seed: int = 0):
+    """指定日にコンバージョンするジャーニー"""
+    rng = np.random.default_rng(seed)
+    journeys = []
+    for i in range(n):
+        start = datetime.combine(day, datetime.min.time())
+        touchpoints = [
+            {'name': str(rng.choice(CHANNELS)), 'timestamp': start + timedelta(hours=h)}
+            for h in range(int(rng.integers(1, 5)))
+        ]
+        journeys.append({
+            'id': f"{prefix}-{i}",
+            'touchpoints': touchpoints,
+            'converted': bool(rng.random() < 0.5),
+            'conversion_value': float(rng.uniform(1000, 5000)),
+            'conversion_date': touchpoints[-1]['timestamp']
+        })
+    return journeys
+
+
+def bucket_files(state_dir):
+    return sorted(os.listdir(os.path.join(state_dir, BUCKET_DIR)))
+
+
+def test_update_writes_only_touched_days(tmp_path):
+    today = date(2025, 6, 30)
+    state = AttributionState(str(tmp_path), retention_days=30)
+    state.update(make_journeys(today - timedelta(days=1), 20, 'a'), today=today)
+    older = os.path.join(tmp_path, BUCKET_DIR, f"{today - timedelta(days=1)}.json")
+    written = os.stat(older).st_mtime_ns
+
+    state.update(make_journeys(today, 20, 'b', seed=1), today=today)
+
+    assert bucket_files(tmp_path) == [f"{today - timedelta(days=1)}.json", f"{today}.json"]
+    assert os.stat(older).st_mtime_ns == written
+
+
+def test_reload_keeps_results_and_dedup(tmp_path):
+    today = date(2025, 6, 30)
+    journeys = make_journeys(today - timedelta(days=2), 30, 'a') + make_journeys(today, 30, 'b', seed=1)
+    state = AttributionState(str(tmp_path), retention_days=30)
+    assert state.update(journeys, today=today) == 60
+
+    restored = AttributionState(str(tmp_path), retention_days=30)
+
+    # 処理済みIDは再起動後もスキップされる
+    assert restored.update(journeys, today=today) == 0
+    assert restored.summary() == state.summary()
+    for model, credits in state.model_results().items():
+        assert restored.model_results()[model] == pytest.approx(credits)
+
+
+def test_duplicate_ids_within_batch_are_counted_once(tmp_path):
+    today = date(2025, 6, 30)
+    journeys = make_journeys(today, 10, 'a')
+
+    state = AttributionState(None)
+
+    assert state.update(journeys + journeys[:3], today=today) == 10
+    assert state.summary()['journeys'] == 10
+
+
+def test_journeys_without_id_are_deduped_by_content():
+    today = date(2025, 6, 30)
+    journeys = make_journeys(today, 10, 'a')
+    for journey in journeys:
+        del journey['id']
+
+    state = AttributionState(None)
+
+    assert state.update(journeys, today=today) == 10
+    assert state.update(journeys, today=today) == 0
+    assert state.update(make_journeys(today, 1, 'x', seed=5)[:1] + journeys, today=today) == 1
+    assert state.summary()['journeys'] == 11
+
+
+def test_expired_days_are_removed_from_disk_and_dedup(tmp_path):
+    start = date(2025, 6, 1)
+    state = AttributionState(str(tmp_path), retention_days=3)
+    journeys = make_journeys(start, 10, 'a')
+    state.update(journeys, today=start)
+
+    state.update(make_journeys(start + timedelta(days=3), 10, 'b'), today=start + timedelta(days=3))
+
+    assert bucket_files(tmp_path) == [f"{start + timedelta(days=3)}.json"]
+    # 保持期間外のIDは重複排除の対象から外れる
+    assert all(len(bucket.journey_keys) == 10 for bucket in state.buckets.values())
+    assert len(state._seen_keys) == 10
+
+
+def test_model_results_is_safe_under_concurrent_updates():
+    today = date(2025, 6, 30)
+    state = AttributionState(None, retention_days=30)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(20):
+                results = state.model_results()
+                assert set(results) >= {'Linear', 'Markov Chain', 'Shapley'}
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(20):
+        state.update(make_journeys(today, 5, f"r{i}", seed=i), today=today)
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+    assert state.summary()['journeys'] == 100
@@ -0,0 +1,92 @@
+"""
+バックグラウンドジョブ実行のテスト
+同じ入力のジョブを共有し、ページが参照するまで完了済みの結果を破棄しないことを確認
+"""
+
+import asyncio
+import time
+
+from analytics.background_jobs import JobRunner, JobStatus, job_key, report_progress
+
+
+async def echo(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+def run_all(runner, values):
+    job_ids = [runner.submit(echo(value), name="echo") for value in values]
+    for job_id in job_ids:
+        runner._jobs[job_id].wait(5)
+    return job_ids
+
+
+def test_same_key_shares_job():
+    runner = JobRunner()
+    first = runner.submit(echo(1, 0.05), key=job_key("echo", 1))
+    second = runner.submit(echo(1, 0.05), key=job_key("echo", 1))
+
+    assert first == second
+    assert runner.result(first, timeout=5) == 1
+
+
+def test_uncollected_results_survive_job_limit():
+    runner = JobRunner(max_jobs=3)
+    job_ids = run_all(runner, range(6))
+
+    # 上限を超えても誰も参照していない結果は残る
+    run_all(runner, [6])
+    job = runner.get(job_ids[0])
+    assert job is not None and job.status == JobStatus.COMPLETED and job.result == 0
+
+
+def test_collected_results_are_pruned_first():
+    runner = JobRunner(max_jobs=3)
+    job_ids = run_all(runner, range(3))
+    for job_id in job_ids[:2]:
+        runner.get(job_id)
+
+    run_all(runner, [3])
+
+    assert runner.get(job_ids[0]) is None
+    assert runner.get(job_ids[2]).result == 2
+
+
+def test_uncollected_results_expire_after_ttl():
+    runner = JobRunner(max_jobs=1, uncollected_ttl=0.0)
+    job_ids = run_all(runner, range(2))
+
+    run_all(runner, [2])
+
+    assert runner.get(job_ids[0]) is None
+
+
+def test_progress_is_reported_from_subtasks():
+    runner = JobRunner()
+
+    async def steps(n):
+        async def step(i):
+            await asyncio.sleep(0.01 * i)
+            report_progress((i + 1) / n, f"step {i + 1}")
+        await asyncio.gather(*(step(i) for i in range(n)))
+        return n
+
+    job_id = runner.submit(steps(4), name="steps")
+    assert runner.result(job_id, timeout=5) == 4
+
+    job = runner.get(job_id)
+    assert [event['message'] for event in job.events] == ["step 1", "step 2", "step 3", "step 4"]
+    assert job.progress == 1.0
+
+
+def test_cancel_running_job():
+    runner = JobRunner()
+    job_id = runner.submit(echo(1, 5.0), name="slow")
+    job = runner.get(job_id)
+    while job.status != JobStatus.RUNNING:
+        time.sleep(0.01)
+
+    assert runner.cancel(job_id)
+    job.wait(5)
+
+    assert job.status == JobStatus.CANCELLED
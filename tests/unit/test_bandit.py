@@ -0,0 +1,91 @@
+"""
+バンディット配分のテスト
+Thompson Samplingの配分比率が最良確率と一致し、UCBの一括決定が逐次の UCB1 と同じ選択をすることを確認
+"""
+
+import numpy as np
+import pytest
+from scipy import integrate, stats
+
+from analytics.bandit import BanditAllocator
+
+
+def test_thompson_allocation_is_probability_of_being_best():
+    allocator = BanditAllocator(["A", "B"], seed=0)
+    allocator.record_outcomes(["A"] * 200 + ["B"] * 200, [1.0] * 20 + [0.0] * 180 + [1.0] * 28 + [0.0] * 172)
+
+    allocation = allocator.allocation()
+
+    a, b = stats.beta(1 + 20, 1 + 180), stats.beta(1 + 28, 1 + 172)
+    prob_b_best, _ = integrate.quad(lambda x: b.pdf(x) * a.cdf(x), 0, 1)
+    assert allocation["B"] == pytest.approx(prob_b_best, abs=0.02)
+
+
+def naive_ucb1(pulls, rewards, n):
+    """1件選ぶごとに試行数を仮算入する UCB1"""
+    pulls, choices = list(pulls), []
+    means = [r / p if p else 0.0 for r, p in zip(rewards, pulls)]
+    total = sum(pulls)
+    for i in range(n):
+        if 0 in pulls:
+            arm = pulls.index(0)
+        else:
+            index = [m + np.sqrt(2 * np.log(max(total + i, 1)) / p) for m, p in zip(means, pulls)]
+            arm = int(np.argmax(index))
+        choices.append(arm)
+        pulls[arm] += 1
+    return choices
+
+
+def test_ucb_batch_matches_sequential_ucb1():
+    allocator = BanditAllocator(["A", "B", "C", "D"], policy="ucb")
+    allocator.record_outcomes(["A"] * 50 + ["B"] * 30 + ["C"] * 5, [0.1] * 50 + [0.3] * 30 + [0.2] * 5)
+
+    choices = allocator.choose_batch(200)
+
+    expected = naive_ucb1(allocator.pulls, allocator.rewards, 200)
+    assert [allocator.arm_ids.index(c) for c in choices] == expected
+
+
+@pytest.mark.parametrize("policy", ["thompson", "ucb"])
+def test_converges_to_best_arm(policy):
+    rng = np.random.default_rng(0)
+    rates = {"A": 0.05, "B": 0.10, "C": 0.20}
+    allocator = BanditAllocator(list(rates), policy=policy, batch_size=32, seed=0)
+
+    for _ in range(6000):
+        arm = allocator.choose_variant()
+        allocator.record_outcome(arm, float(rng.random() < rates[arm]))
+
+    pulls = dict(zip(allocator.arm_ids, allocator.pulls))
+    assert pulls["C"] > pulls["B"] > pulls["A"]
+    assert pulls["C"] / 6000 > 0.6
+
+
+def test_record_outcomes_matches_single_records():
+    arms = ["A", "B", "C", "A", "C", "C"]
+    rewards = [1.0, 0.0, 0.5, 0.0, 1.0, 1.0]
+    batch = BanditAllocator(["A", "B", "C"])
+    single = BanditAllocator(["A", "B", "C"])
+
+    batch.record_outcomes(arms, rewards)
+    for arm, reward in zip(arms, rewards):
+        single.record_outcome(arm, reward)
+
+    assert np.array_equal(batch.pulls, single.pulls)
+    assert np.array_equal(batch.rewards, single.rewards)
+    with pytest.raises(KeyError):
+        batch.record_outcome("Z")
+
+
+def test_snapshot_restores_matching_arms(tmp_path):
+    path = str(tmp_path / "bandit.json")
+    allocator = BanditAllocator(["A", "B"], snapshot_path=path)
+    allocator.record_outcomes(["A", "A", "B"], [1.0, 0.0, 1.0])
+    allocator.save()
+
+    restored = BanditAllocator(["B", "C"], snapshot_path=path)
+
+    # 既存のアームだけ引き継ぎ、新しいアームは0から
+    assert restored.pulls.tolist() == [1.0, 0.0]
+    assert restored.rewards.tolist() == [1.0, 0.0]
@@ -0,0 +1,84 @@
+"""
+入札・予算配分最適化のテスト
+解がKKT条件（上下限に掛からないグループの限界価値が均等）を満たし、入札変更幅と支出が整合することを確認
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.bid_optimizer import (
+    BID_SPEND_ELASTICITY,
+    fit_response_curves,
+    simulate_ad_group_history,
+    solve_allocation,
+)
+
+
+@pytest.fixture(scope="module")
+def curves():
+    return fit_response_curves(simulate_ad_group_history(n_groups=300, days=28))
+
+
+def test_recovers_elasticity_from_noiseless_history():
+    rng = np.random.default_rng(0)
+    spend = rng.uniform(1000, 10000, (2, 20))
+    beta = np.array([[0.3], [0.7]])
+    conversions = 0.5 * spend ** beta
+    history = pd.DataFrame({
+        'group_id': np.repeat(['g1', 'g2'], 20),
+        'platform': 'Google Ads',
+        'spend': spend.ravel(),
+        'conversions': conversions.ravel() - 0.5,
+        'revenue': conversions.ravel() * 1000
+    })
+
+    fitted = fit_response_curves(history)
+
+    assert np.allclose(fitted.elasticity, [0.3, 0.7], atol=1e-6)
+
+
+@pytest.mark.parametrize("max_bid_adjustment", [None, 0.2, 0.5])
+def test_solution_satisfies_kkt(curves, max_bid_adjustment):
+    budget = float(curves.current_spend.sum())
+    plan = solve_allocation(curves, budget, max_bid_adjustment=max_bid_adjustment)
+    spend = plan.recommended_spend
+
+    # 予算を使い切る（上限に余裕がある場合）
+    assert spend.sum() == pytest.approx(budget, rel=1e-6)
+
+    lower, upper = curves.min_spend.copy(), curves.max_spend.copy()
+    if max_bid_adjustment is not None:
+        lower = np.maximum(lower, curves.current_spend * (1 - max_bid_adjustment) ** BID_SPEND_ELASTICITY)
+        upper = np.minimum(upper, curves.current_spend * (1 + max_bid_adjustment) ** BID_SPEND_ELASTICITY)
+    marginal = curves.marginal_roas(spend)
+    interior = (spend > lower * (1 + 1e-6)) & (spend < upper * (1 - 1e-6))
+    at_lower = spend <= lower * (1 + 1e-6)
+    at_upper = spend >= upper * (1 - 1e-6)
+
+    assert interior.any()
+    # 内点は限界価値 λ で均等、下限のグループは λ 以下、上限のグループは λ 以上
+    assert np.allclose(marginal[interior], plan.marginal_roas, rtol=1e-6)
+    assert (marginal[at_lower] <= plan.marginal_roas * (1 + 1e-6)).all()
+    assert (marginal[at_upper] >= plan.marginal_roas * (1 - 1e-6)).all()
+
+
+def test_spend_stays_reachable_by_capped_bids(curves):
+    plan = solve_allocation(curves, float(curves.current_spend.sum()) * 1.5, max_bid_adjustment=0.2)
+    frame = plan.to_frame()
+
+    assert frame['bid_multiplier'].between(0.8 - 1e-9, 1.2 + 1e-9).all()
+    # 支出比は入札倍率の弾力性乗に一致する
+    assert np.allclose(frame['recommended_spend'] / frame['current_spend'],
+                       frame['bid_multiplier'] ** BID_SPEND_ELASTICITY)
+
+
+def test_target_cpa_is_respected(curves):
+    unconstrained = solve_allocation(curves, float(curves.current_spend.sum()) * 2, max_bid_adjustment=None)
+    target = unconstrained.totals()['expected_cpa'] * 0.95
+
+    plan = solve_allocation(curves, float(curves.current_spend.sum()) * 2, target_cpa=target,
+                            max_bid_adjustment=None)
+
+    assert plan.binding == 'target_cpa'
+    assert plan.totals()['expected_cpa'] <= target * (1 + 1e-6)
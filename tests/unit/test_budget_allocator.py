@@ -0,0 +1,114 @@
+"""
+クロスプラットフォーム予算配分のテスト
+配分が上下限と予算合計を守り、候補配分の探索が解析解（限界価値の均等化）を上回らないことを確認
+"""
+
+import numpy as np
+import pytest
+
+from analytics.bid_optimizer import ResponseCurves
+from analytics.budget_allocator import (
+    BudgetConstraints,
+    evaluate_allocations,
+    fit_platform_curves,
+    optimize_budget,
+    project_to_budget,
+    simulate_platform_history,
+)
+
+
+def make_curves():
+    """凹の反応曲線（elasticity < 1）を持つ5プラットフォーム"""
+    current = np.array([30000.0, 20000.0, 15000.0, 10000.0, 5000.0])
+    return ResponseCurves(
+        group_ids=np.array(['A', 'B', 'C', 'D', 'E']),
+        platforms=np.array(['A', 'B', 'C', 'D', 'E']),
+        scale=np.array([0.05, 0.08, 0.02, 0.3, 0.01]),
+        elasticity=np.array([0.6, 0.5, 0.7, 0.3, 0.8]),
+        value_per_conversion=np.array([8000.0, 6000.0, 12000.0, 5000.0, 20000.0]),
+        current_spend=current,
+        min_spend=np.zeros(len(current)),
+        max_spend=np.full(len(current), np.inf)
+    )
+
+
+def test_bounds_combine_shares_pacing_and_platform_limits():
+    curves = make_curves()
+    constraints = BudgetConstraints(min_spend={'E': 6000.0}, max_spend={'A': 32000.0, 'D': 1000.0},
+                                    min_share=0.05, max_share=0.5, max_daily_change=0.3)
+
+    lower, upper = constraints.bounds(curves, 80000.0)
+
+    assert np.allclose(lower, [21000.0, 14000.0, 10500.0, 7000.0, 6000.0])
+    # 上限が下限を下回るプラットフォーム（D）は下限に揃える
+    assert np.allclose(upper, [32000.0, 26000.0, 19500.0, 7000.0, 6500.0])
+
+
+@pytest.mark.parametrize("objective", ['revenue', 'conversions'])
+@pytest.mark.parametrize("budget_ratio", [0.8, 1.0, 1.25])
+def test_allocation_respects_bounds_and_budget(objective, budget_ratio):
+    curves = make_curves()
+    budget = float(curves.current_spend.sum()) * budget_ratio
+    constraints = BudgetConstraints(min_spend={'D': 9000.0}, max_spend={'C': 16000.0}, max_daily_change=0.3)
+
+    allocation = optimize_budget(curves, budget, constraints, objective=objective, n_candidates=2000)
+    spend = allocation.recommended_spend
+
+    assert spend.sum() == pytest.approx(budget, rel=1e-6)
+    assert (spend >= allocation.lower * (1 - 1e-9)).all()
+    assert (spend <= allocation.upper * (1 + 1e-9)).all()
+    assert np.allclose(allocation.candidate_spend.sum(axis=1), budget, rtol=1e-6)
+    assert (allocation.candidate_spend >= allocation.lower * (1 - 1e-9)).all()
+    assert (allocation.candidate_spend <= allocation.upper * (1 + 1e-9)).all()
+
+
+@pytest.mark.parametrize("objective", ['revenue', 'conversions'])
+def test_candidate_search_does_not_beat_solver(objective):
+    curves = make_curves()
+    budget = float(curves.current_spend.sum())
+
+    allocation = optimize_budget(curves, budget, BudgetConstraints(max_daily_change=None),
+                                 objective=objective, n_candidates=5000, seed=1)
+    conversions, revenue = evaluate_allocations(curves, allocation.recommended_spend)
+    best = revenue[0] if objective == 'revenue' else conversions[0]
+    scores = allocation.candidate_revenue if objective == 'revenue' else allocation.candidate_conversions
+
+    assert allocation.binding != 'candidate_search'
+    assert scores.max() <= best * (1 + 1e-9)
+    assert allocation.totals()['candidate_percentile'] == 100.0
+
+    # 上下限に掛からないプラットフォームは限界価値が均等
+    weights = curves.value_per_conversion if objective == 'revenue' else np.ones(len(curves))
+    marginal = weights * curves.scale * curves.elasticity * allocation.recommended_spend ** (curves.elasticity - 1)
+    assert np.allclose(marginal, marginal.mean(), rtol=1e-5)
+
+
+def test_lower_bounds_above_budget_are_scaled_down():
+    curves = make_curves()
+    budget = float(curves.current_spend.sum()) * 0.5
+
+    allocation = optimize_budget(curves, budget, BudgetConstraints(max_daily_change=0.1), n_candidates=100)
+
+    assert allocation.lower.sum() == pytest.approx(budget)
+    assert allocation.recommended_spend.sum() == pytest.approx(budget, rel=1e-6)
+
+
+def test_projection_hits_budget_within_bounds():
+    rng = np.random.default_rng(0)
+    lower = np.array([0.0, 100.0, 200.0, 0.0])
+    upper = np.array([500.0, 400.0, 600.0, np.inf])
+
+    projected = project_to_budget(rng.uniform(0, 1000, (200, 4)), 1200.0, lower, upper)
+
+    assert np.allclose(projected.sum(axis=1), 1200.0, rtol=1e-9)
+    assert ((projected >= lower) & (projected <= upper)).all()
+
+
+def test_fitted_platform_curves_recover_simulated_elasticity():
+    history = simulate_platform_history(days=365, seed=0)
+
+    curves = fit_platform_curves(history)
+
+    expected = {'Google Ads': 0.55, 'Facebook Ads': 0.65, 'TikTok Ads': 0.70}
+    for platform, elasticity in expected.items():
+        assert curves.elasticity[list(curves.group_ids).index(platform)] == pytest.approx(elasticity, abs=0.1)
@@ -0,0 +1,113 @@
+"""
+実験エンジンのテスト
+mSPRTの尤度比・常時有効な信頼区間が定義どおりで、途中で何度結果を見ても第一種過誤がαに収まることを確認
+"""
+
+import numpy as np
+import pytest
+from scipy import integrate, stats
+
+from analytics.experiments import Experiment, msprt_statistics
+
+
+@pytest.mark.parametrize("diff,variance,mixing_sd", [(0.0, 1e-4, 0.01), (0.02, 4e-5, 0.01), (-0.05, 1e-3, 0.05)])
+def test_likelihood_ratio_matches_numeric_mixture(diff, variance, mixing_sd):
+    sd = np.sqrt(variance)
+    # Λ = ∫ N(diff; θ, v) N(θ; 0, τ²) dθ / N(diff; 0, v)
+    mixture, _ = integrate.quad(
+        lambda theta: stats.norm.pdf(diff, theta, sd) * stats.norm.pdf(theta, 0, mixing_sd),
+        -10 * mixing_sd, 10 * mixing_sd, points=[diff]
+    )
+    likelihood_ratio = mixture / stats.norm.pdf(diff, 0, sd)
+
+    result = msprt_statistics(np.array([diff]), np.array([variance]), mixing_sd, 0.05)
+
+    assert result["p_value"][0] == pytest.approx(min(1.0, 1 / likelihood_ratio), rel=1e-6)
+
+
+def test_interval_boundary_is_where_p_reaches_alpha():
+    variance = np.array([1e-4, 5e-5, 2e-3])
+    alpha = 0.05
+
+    half_width = msprt_statistics(np.zeros(3), variance, 0.01, alpha)["half_width"]
+
+    # 信頼区間の端では帰無仮説 θ = diff ± 半幅 の p 値がちょうど α
+    assert np.allclose(msprt_statistics(half_width, variance, 0.01, alpha)["p_value"], alpha)
+    assert np.allclose(msprt_statistics(-half_width, variance, 0.01, alpha)["p_value"], alpha)
+
+
+def test_type_one_error_holds_under_continuous_monitoring():
+    rng = np.random.default_rng(0)
+    n_experiments, n_looks, batch = 300, 40, 250
+    false_positives = 0
+    for _ in range(n_experiments):
+        experiment = Experiment("aa", ["A", "B"], alpha=0.05)
+        for _ in range(n_looks):
+            experiment.record_totals([batch, batch], rng.binomial(batch, 0.1, 2))
+            # 比較が1つなので常時有効p値がそのまま判定に使われる
+            if experiment.running_p[1] < experiment.alpha:
+                false_positives += 1
+                break
+
+    # 毎回結果を見て止めても偽陽性率は α 以下（モンテカルロ誤差分の余裕）
+    assert false_positives / n_experiments <= 0.05 + 2 * np.sqrt(0.05 * 0.95 / n_experiments)
+
+
+def test_detects_real_lift_and_p_never_increases():
+    rng = np.random.default_rng(1)
+    experiment = Experiment("ab", ["A", "B"], alpha=0.05)
+    p_values = []
+    for _ in range(60):
+        experiment.record_totals([500, 500], [rng.binomial(500, 0.10), rng.binomial(500, 0.13)])
+        p_values.append(experiment.sequential_test()[0]["p_value"])
+
+    assert np.all(np.diff(p_values) <= 0)
+    result = experiment.sequential_test()[0]
+    assert result["is_significant"]
+    low, high = result["confidence_interval"]
+    assert low < 3.0 < high
+
+
+def test_posterior_matches_beta_integral():
+    experiment = Experiment("bayes", ["A", "B"])
+    experiment.record_totals([1000, 1000], [100, 115])
+
+    posterior = experiment.posterior(draws=200000)
+
+    a, b = stats.beta(101, 901), stats.beta(116, 886)
+    prob_b_better, _ = integrate.quad(lambda x: b.pdf(x) * a.cdf(x), 0, 1)
+    assert posterior["prob_beat_control"][1] == pytest.approx(prob_b_better, abs=0.005)
+    assert posterior["prob_best"].sum() == pytest.approx(1.0)
+    assert posterior["mean"] == pytest.approx([101 / 1002, 116 / 1002])
+
+
+def test_record_matches_record_totals():
+    rng = np.random.default_rng(2)
+    variants = rng.choice(["A", "B", "C"], 5000)
+    converted = rng.random(5000) < 0.1
+    by_event = Experiment("events", ["A", "B", "C"])
+    by_event.record(variants, converted)
+
+    totals = Experiment("totals", ["A", "B", "C"])
+    totals.record_totals([(variants == v).sum() for v in "ABC"], [(converted & (variants == v)).sum() for v in "ABC"])
+
+    assert np.array_equal(by_event.visitors, totals.visitors)
+    assert np.array_equal(by_event.conversions, totals.conversions)
+    assert by_event.sequential_test() == totals.sequential_test()
+
+
+def test_single_events_do_not_pin_p_value_at_zero():
+    rng = np.random.default_rng(3)
+    experiment = Experiment("single", ["A", "B"], alpha=0.05)
+    # 1件ずつの記録では率が0と1になり、標本分散だけでは0になる
+    experiment.record(["A", "B"], [0, 1])
+    assert experiment.running_p[1] == 1.0
+
+    for _ in range(20):
+        experiment.record(rng.choice(["A", "B"], 1000), rng.random(1000) < 0.05)
+
+    result = experiment.sequential_test()[0]
+    low, high = result["confidence_interval"]
+    assert low < 0 < high
+    assert result["p_value"] > experiment.alpha
+    assert not result["is_significant"]
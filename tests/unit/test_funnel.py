@@ -0,0 +1,111 @@
+"""
+ファネル集計のテスト
+バッチ取り込みの遷移・滞在時間・コンバージョン率が、顧客ごとにイベントを順に辿った結果と一致することを確認
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from analytics.funnel import FUNNEL_STAGES, SECONDS_PER_DAY, FunnelState, StageEvents, acquisition_week
+
+
+def random_batches(n_customers=300, n_batches=4, seed=0):
+    """前進・後退・同じステージの重複・古い再送を含むステージイベントのバッチ"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 6, tzinfo=timezone.utc).timestamp()
+    batches = []
+    clock = start + rng.uniform(0, 60 * SECONDS_PER_DAY, n_customers)
+    for _ in range(n_batches):
+        rows = []
+        for c in range(n_customers):
+            for _ in range(rng.integers(0, 4)):
+                clock[c] += rng.exponential(5 * SECONDS_PER_DAY)
+                rows.append((f"c{c}", FUNNEL_STAGES[rng.integers(len(FUNNEL_STAGES))], clock[c]))
+            if rows and rng.random() < 0.1:
+                # 既に取り込んだ時刻より前のイベント
+                rows.append((f"c{c}", FUNNEL_STAGES[0], clock[c] - 90 * SECONDS_PER_DAY))
+        order = rng.permutation(len(rows))
+        batches.append([rows[i] for i in order])
+    return batches
+
+
+def per_customer_loop(batches):
+    """顧客ごとに時刻順でイベントを辿る素朴な集計"""
+    current, since, cohort = {}, {}, {}
+    entered, advanced, exits, dwell = (defaultdict(int), defaultdict(int), defaultdict(int), defaultdict(float))
+    transitions = defaultdict(int)
+    for batch in batches:
+        stored_since = dict(since)
+        for customer, stage, ts in sorted(batch, key=lambda row: (row[0], row[2])):
+            s = FUNNEL_STAGES.index(stage)
+            if customer in stored_since and ts < stored_since[customer]:
+                continue
+            if current.get(customer) == s:
+                continue
+            if customer not in cohort:
+                cohort[customer] = int(acquisition_week(ts))
+            week = cohort[customer]
+            entered[week, s] += 1
+            if customer in current:
+                prev = current[customer]
+                transitions[prev, s] += 1
+                exits[prev] += 1
+                advanced[week, prev] += s > prev
+                dwell[prev] += ts - since[customer]
+            current[customer], since[customer] = s, ts
+    return current, entered, advanced, exits, dwell, transitions
+
+
+@pytest.fixture(scope="module")
+def funnel_case():
+    batches = random_batches()
+    funnel = FunnelState()
+    for batch in batches:
+        customers, stages, timestamps = zip(*batch)
+        funnel.update(StageEvents.from_columns(customers, stages, np.array(timestamps)))
+    return funnel, per_customer_loop(batches)
+
+
+def test_metrics_match_per_customer_loop(funnel_case):
+    funnel, (current, entered, advanced, exits, dwell, transitions) = funnel_case
+
+    metrics = funnel.metrics(include_open=False)
+
+    for s, stage in enumerate(FUNNEL_STAGES):
+        result = metrics[stage]
+        stage_entered = sum(n for (_, t), n in entered.items() if t == s)
+        stage_advanced = sum(n for (_, t), n in advanced.items() if t == s)
+        assert result['count'] == sum(1 for code in current.values() if code == s)
+        assert result['entered'] == stage_entered
+        assert result['advanced'] == stage_advanced
+        assert result['conversion_rate'] == pytest.approx(stage_advanced / stage_entered)
+        assert result['avg_time_in_stage'] == pytest.approx(dwell[s] / exits[s] / SECONDS_PER_DAY)
+        assert result['transitions'] == {FUNNEL_STAGES[t]: n for (f, t), n in sorted(transitions.items()) if f == s}
+
+
+def test_cohort_conversion_matches_per_customer_loop(funnel_case):
+    funnel, (_, entered, advanced, _, _, _) = funnel_case
+
+    table = funnel.cohort_conversion()
+
+    weeks = sorted({week for week, _ in entered})
+    assert len(table) == len(weeks)
+    for row, week in zip(table.itertuples(index=False), weeks):
+        for s, rate in enumerate(row):
+            expected = advanced[week, s] / entered[week, s] if entered[week, s] else 0.0
+            assert rate == pytest.approx(expected)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "funnel.npz")
+    funnel = FunnelState(snapshot_path=path)
+    funnel.update(StageEvents.from_columns(["a", "a", "b"], ["Awareness", "Purchase", "Awareness"],
+                                           np.array([0.0, 86400.0, 10.0])))
+
+    restored = FunnelState(snapshot_path=path)
+
+    assert restored.customer_stages() == {"a": "Purchase", "b": "Awareness"}
+    assert restored.metrics(include_open=False) == funnel.metrics(include_open=False)
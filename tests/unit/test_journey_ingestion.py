@@ -0,0 +1,87 @@
+"""
+ジャーニー取り込みのテスト
+イベントログの取り込み → 顧客サマリー → 顧客セグメンテーションが通しで動くことを確認
+"""
+
+import numpy as np
+import pandas as pd
+
+from analytics.funnel import FUNNEL_STAGES, FunnelState
+from analytics.journey_ingestion import LOYALTY_PURCHASES, JourneyIngestor, JourneyStore
+from analytics.segmentation import SEGMENT_FEATURES, CustomerSegmenter
+
+
+def write_events(path, n_users: int = 200, seed: int = 0) -> None:
+    """ユーザーごとに数回の訪問と一部の購入を持つイベントログ"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-01-01").timestamp()
+    rows = []
+    for u in range(n_users):
+        t = start + rng.uniform(0, 60 * 86400)
+        for _ in range(rng.integers(1, 6)):
+            t += rng.uniform(0.5, 10) * 86400
+            rows.append((f"u{u}", t, rng.choice(["google", "facebook", "email", "direct"]), "visit", 0.0))
+            if rng.random() < 0.3:
+                rows.append((f"u{u}", t + 60, "direct", "purchase", float(rng.uniform(1000, 20000))))
+    frame = pd.DataFrame(rows, columns=["user_id", "timestamp", "source", "event", "value"])
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], unit="s")
+    frame.to_csv(path, index=False)
+
+
+def test_ingest_summary_segment(tmp_path):
+    events = tmp_path / "events.csv"
+    write_events(events)
+    store = JourneyStore(str(tmp_path / "store"))
+    JourneyIngestor(store=store, partitions=4, work_dir=str(tmp_path)).ingest([str(events)])
+
+    summary = JourneyStore(store.path).customer_summary()
+
+    assert len(summary) == 200
+    assert set(SEGMENT_FEATURES[:-1]) <= set(summary.columns)
+    assert summary['engagement_score'].between(0.1, 1.0).all()
+    assert summary['churn_probability'].between(0.05, 0.95).all()
+    # 最新イベントのユーザーは離脱確率が最も低い層に入る
+    assert summary.loc[summary['recency_days'].idxmin(), 'churn_probability'] == summary['churn_probability'].min()
+
+    segments = CustomerSegmenter().segment(summary)
+
+    assert sum(segment['size'] for segment in segments.values()) == len(summary)
+
+
+def test_empty_store_summary_has_segment_columns(tmp_path):
+    summary = JourneyStore(str(tmp_path / "empty")).customer_summary()
+
+    assert len(summary) == 0
+    assert set(SEGMENT_FEATURES[:-1]) <= set(summary.columns)
+
+
+def test_stage_events_follow_stored_touch_and_purchase_times(tmp_path):
+    events = tmp_path / "events.csv"
+    write_events(events)
+    store = JourneyStore(str(tmp_path / "store"))
+    JourneyIngestor(store=store, partitions=4, work_dir=str(tmp_path)).ingest([str(events)])
+
+    stage_events = store.stage_events()
+
+    expected = []
+    for arrays, journeys in store.iter_parts():
+        users = journeys["user_id"].to_numpy()[arrays.journey_id - journeys["journey_id"].iloc[0]]
+        for user in np.unique(users):
+            touches = np.sort(arrays.timestamp[users == user])
+            purchases = np.sort(journeys.loc[(journeys["user_id"] == user) & journeys["converted"], "end"].to_numpy())
+            expected.append((user, "Awareness", touches[0]))
+            if len(touches) > 1 and (len(purchases) == 0 or touches[1] < purchases[0]):
+                expected.append((user, "Consideration", touches[1]))
+            if len(purchases):
+                expected.append((user, "Purchase", purchases[0]))
+            if len(purchases) >= LOYALTY_PURCHASES:
+                expected.append((user, "Loyalty", purchases[LOYALTY_PURCHASES - 1]))
+    actual = [(c, FUNNEL_STAGES[s], t) for c, s, t in
+              zip(stage_events.customer_ids, stage_events.stage, stage_events.timestamp)]
+    assert sorted(actual) == sorted(expected)
+
+    # 滞在時間はルールの固定値ではなく実際の時刻差になる
+    funnel = FunnelState()
+    funnel.update(stage_events)
+    percentiles = funnel.metrics(include_open=False)['Awareness']['dwell_percentiles']
+    assert percentiles['p25'] < percentiles['p75']
@@ -0,0 +1,111 @@
+"""
+KPIロールアップのテスト
+任意期間の集計・前期間比較・日別推移が生データの走査と一致し、追記分の同期で取りこぼしがないことを確認
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.kpi_rollup import ALL_PROJECTS, KpiRollupStore
+
+
+@pytest.fixture(scope="module")
+def events():
+    rng = np.random.default_rng(0)
+    n = 20000
+    return pd.DataFrame({
+        'date': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 400, n), 'D')
+        + pd.to_timedelta(rng.integers(0, 86400, n), 's'),
+        'project': rng.choice(['A', 'B', 'C'], n),
+        'traffic': rng.lognormal(5, 1, n),
+        'bounce_rate': rng.normal(40, 5, n)
+    })
+
+
+@pytest.fixture(scope="module")
+def store(events):
+    store = KpiRollupStore()
+    # 2回に分けて取り込んでも1回で取り込んだのと同じ集計になる
+    half = len(events) // 2
+    store.ingest(events.iloc[:half], 'date', ['traffic', 'bounce_rate'], 'project')
+    store.ingest(events.iloc[half:], 'date', ['traffic', 'bounce_rate'], 'project')
+    return store
+
+
+def raw_scan(events, start, end, project=ALL_PROJECTS):
+    days = events['date'].dt.normalize()
+    rows = events[(days >= start) & (days <= end)]
+    return rows if project == ALL_PROJECTS else rows[rows['project'] == project]
+
+
+@pytest.mark.parametrize("start,end,project", [
+    ('2025-01-01', '2025-01-01', ALL_PROJECTS),
+    ('2025-02-13', '2026-01-20', 'A'),
+    ('2025-03-05', '2025-04-20', ALL_PROJECTS),
+    ('2025-06-02', '2025-06-29', 'C'),
+])
+def test_aggregate_matches_raw_scan(store, events, start, end, project):
+    result = store.aggregate('traffic', start, end, project)
+    raw = raw_scan(events, start, end, project)['traffic']
+
+    assert result.count == len(raw)
+    assert result.sum == pytest.approx(raw.sum())
+    assert result.min == raw.min()
+    assert result.max == raw.max()
+    # 分位点は前後の順位の観測値の間にスケッチの相対誤差の範囲で収まる
+    for q in (0.5, 0.9):
+        lower, upper = np.quantile(raw, q, method='lower'), np.quantile(raw, q, method='higher')
+        assert lower * 0.99 <= result.quantile(q) <= upper * 1.01
+
+
+def test_range_decomposes_into_coarse_periods(store):
+    pieces = store._decompose(*pd.to_datetime(['2025-02-13', '2026-01-21']).to_numpy(dtype='datetime64[D]')
+                               .astype(np.int64))
+
+    # 2/13(木)〜2/16 は日、2/17〜2/23 は週、3月をまたぐ週は日、3月〜12月は月、1/1(木)〜1/4 は日、1/5〜1/18 は週、残りは日
+    assert [grain for grain, _, _ in pieces] == ['day', 'week', 'day', 'month', 'day', 'week', 'day']
+    assert sum(last - first for _, first, last in pieces) == 4 + 1 + 5 + 10 + 4 + 2 + 2
+
+
+def test_compare_uses_preceding_window(store, events):
+    current, previous = store.compare('traffic', '2025-03-10', '2025-03-16', 'B')
+
+    assert (previous.start.isoformat(), previous.end.isoformat()) == ('2025-03-03', '2025-03-09')
+    assert previous.sum == pytest.approx(raw_scan(events, '2025-03-03', '2025-03-09', 'B')['traffic'].sum())
+    assert current.sum == pytest.approx(raw_scan(events, '2025-03-10', '2025-03-16', 'B')['traffic'].sum())
+
+
+def test_daily_frame_matches_groupby(store, events):
+    frame = store.frame(['traffic', 'bounce_rate'], '2025-01-01', '2025-01-31', aggs={'bounce_rate': 'mean'})
+    rows = raw_scan(events, '2025-01-01', '2025-01-31')
+    expected = rows.groupby(rows['date'].dt.normalize()).agg(traffic=('traffic', 'sum'),
+                                                              bounce_rate=('bounce_rate', 'mean'))
+
+    assert np.allclose(frame[['traffic', 'bounce_rate']].to_numpy(), expected.to_numpy())
+
+
+def test_sync_frame_picks_up_rows_landing_on_the_same_day():
+    store = KpiRollupStore()
+    day = pd.Timestamp('2025-05-01')
+    log = pd.DataFrame({'date': [day - pd.Timedelta(days=1), day + pd.Timedelta(hours=1)], 'traffic': [10.0, 1.0]})
+
+    assert store.sync_frame('feed', log, 'date', ['traffic']) == 2
+    # 同じデータの再同期では何も加算しない
+    assert store.sync_frame('feed', log, 'date', ['traffic']) == 0
+    # 同じ日の追記分だけを加算する
+    log = pd.concat([log, pd.DataFrame({'date': [day + pd.Timedelta(hours=5)], 'traffic': [2.0]})],
+                    ignore_index=True)
+    assert store.sync_frame('feed', log, 'date', ['traffic']) == 1
+    assert store.aggregate('traffic', day, day).sum == 3.0
+    assert store.aggregate('traffic', day - pd.Timedelta(days=1), day).sum == 13.0
+
+
+def test_failed_sync_does_not_advance_watermark():
+    store = KpiRollupStore()
+    log = pd.DataFrame({'date': pd.date_range('2025-05-01', periods=3), 'traffic': [1.0, 2.0, 3.0]})
+
+    with pytest.raises(KeyError):
+        store.sync_frame('feed', log, 'date', ['traffic', 'missing'])
+    assert store.sync_frame('feed', log, 'date', ['traffic']) == 3
+    assert store.aggregate('traffic', '2025-05-01', '2025-05-03').sum == 6.0
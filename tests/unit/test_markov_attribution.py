@@ -0,0 +1,70 @@
+"""
+マルコフ連鎖アトリビューションのテスト
+基本行列による一括計算の除去効果が、チャネルを1つずつ取り除いて解き直した結果と一致することを確認
+"""
+
+import numpy as np
+import pytest
+
+from analytics.markov_attribution import MarkovStates, markov_attribution, transition_counts
+
+
+def dense_counts(journeys, n_channels):
+    """パスを辿って遷移回数を数える（状態番号は MarkovStates と同じ）"""
+    states = MarkovStates(n_channels)
+    counts = np.zeros((states.size, states.size))
+    for journey in journeys:
+        path = [states.start] + [c + 1 for c in journey['channels']]
+        path.append(states.conversion if journey['converted'] else states.null)
+        for src, dst in zip(path[:-1], path[1:]):
+            counts[src, dst] += 1
+    return counts
+
+
+def conversion_probability(counts, n_channels, removed=None):
+    """開始状態からのコンバージョン確率（removed のチャネルへの遷移は離脱に付け替える）"""
+    states = MarkovStates(n_channels)
+    probs = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    if removed is not None:
+        probs = probs.copy()
+        probs[:, states.null] += probs[:, removed + 1]
+        probs[:, removed + 1] = 0.0
+    transient = n_channels + 1
+    q = probs[:transient, :transient]
+    r = probs[:transient, states.conversion]
+    return np.linalg.solve(np.eye(transient) - q, r)[states.start]
+
+
+def test_transition_counts_match_path_walk(make_touchpoints, split_journeys):
+    arrays = make_touchpoints()
+
+    counts = transition_counts(arrays).toarray()
+
+    assert np.array_equal(counts, dense_counts(split_journeys(arrays), len(arrays.channels)))
+
+
+@pytest.mark.parametrize("n_channels", [3, 8])
+def test_removal_effects_match_resolving_without_each_channel(make_touchpoints, split_journeys, n_channels):
+    arrays = make_touchpoints(n_journeys=500, n_channels=n_channels)
+    counts = dense_counts(split_journeys(arrays), n_channels)
+
+    result = markov_attribution(arrays)
+
+    p_conv = conversion_probability(counts, n_channels)
+    expected = np.array([
+        1 - conversion_probability(counts, n_channels, removed=c) / p_conv for c in range(n_channels)
+    ])
+    assert result.conversion_probability == pytest.approx(p_conv)
+    assert np.allclose(result.removal_effects, expected)
+    total_value = sum(j['value'] for j in split_journeys(arrays))
+    assert np.allclose(result.credits, expected / expected.sum() * total_value)
+
+
+def test_no_conversions_gives_zero_credit(make_touchpoints):
+    arrays = make_touchpoints(n_journeys=50)
+    arrays.converted = np.zeros(len(arrays), dtype=bool)
+
+    result = markov_attribution(arrays, total_value=0.0)
+
+    assert result.conversion_probability == 0.0
+    assert not result.credits.any()
@@ -0,0 +1,100 @@
+"""
+メディアチャンクアップロードのテスト
+ファイルがチャンクごとに欠けなく送られ、中断後は未送信セグメントだけを再送し、同じ内容の再アップロードを省くことを確認
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("requests")
+
+from api.media_upload import ChunkedMediaUploader, MediaUploadCache, file_sha256
+
+
+class FakeUploader(ChunkedMediaUploader):
+    """HTTPの代わりにコマンドを記録するアップローダー"""
+
+    def __init__(self, cache, chunk_size=4, append_concurrency=2, fail_segment=None):
+        super().__init__("https://upload.example/media", lambda: {}, cache=cache,
+                         chunk_size=chunk_size, append_concurrency=append_concurrency)
+        self.commands = []
+        self.chunks = {}
+        self.fail_segment = fail_segment
+
+    async def _request(self, method, **kwargs):
+        data = kwargs.get("data") or kwargs.get("params")
+        self.commands.append(data["command"])
+        if data["command"] == "INIT":
+            return {"media_id_string": "m1"}
+        if data["command"] == "APPEND":
+            if data["segment_index"] == self.fail_segment:
+                raise ConnectionError("append failed")
+            await asyncio.sleep(0.01)
+            self.chunks[data["segment_index"]] = kwargs["files"]["media"]
+        return {}
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(bytes(range(10)))
+    return str(path)
+
+
+def test_file_is_sent_in_chunks(media_file):
+    cache = MediaUploadCache(None)
+    uploader = FakeUploader(cache)
+
+    media_id = asyncio.run(uploader.upload(media_file))
+
+    assert media_id == "m1"
+    assert uploader.commands[0] == "INIT" and uploader.commands[-1] == "FINALIZE"
+    assert sorted(uploader.chunks) == [0, 1, 2]
+    assert b"".join(uploader.chunks[i] for i in range(3)) == bytes(range(10))
+    assert cache.get_media_id(file_sha256(media_file)) == "m1"
+
+
+def test_resume_sends_only_missing_segments(media_file):
+    cache = MediaUploadCache(None)
+    file_hash = file_sha256(media_file)
+    cache.start_session(file_hash, "m0", 10, 3600)
+    cache.mark_segment(file_hash, 0)
+    cache.mark_segment(file_hash, 2)
+    uploader = FakeUploader(cache)
+
+    media_id = asyncio.run(uploader.upload(media_file))
+
+    assert media_id == "m0"
+    assert "INIT" not in uploader.commands
+    assert uploader.chunks == {1: bytes(range(4, 8))}
+
+
+def test_same_content_reuses_media_id(media_file, tmp_path):
+    path = str(tmp_path / "cache.json")
+    asyncio.run(FakeUploader(MediaUploadCache(path)).upload(media_file))
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(bytes(range(10)))
+
+    # 再起動後も同じ内容のファイルは送らない
+    uploader = FakeUploader(MediaUploadCache(path))
+    assert asyncio.run(uploader.upload(str(copy))) == "m1"
+    assert uploader.commands == []
+
+
+def test_failed_append_stops_remaining_segments(media_file):
+    cache = MediaUploadCache(None)
+    uploader = FakeUploader(cache, chunk_size=2, append_concurrency=2, fail_segment=0)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await uploader.upload(media_file)
+        # 残りのタスクが後から送信を続けないこと
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    # 失敗時に送信中だったAPPENDも取り消され、待機中のセグメントは送られない
+    assert uploader.commands.count("APPEND") < 5
+    assert uploader.chunks == {}
+    assert cache.get_session(file_sha256(media_file), 10)["segments"] == []
@@ -0,0 +1,193 @@
+"""
+ページ計算キャッシュのテスト
+同時に来た同じ計算は1回だけ実行され、データ更新による無効化・TTL・上限で古い結果が返らないことを確認
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.page_cache import PageCache, fingerprint
+
+
+class SlowFunction:
+    """呼び出し回数を数え、release されるまで完了しない計算"""
+
+    def __init__(self, fail_first: bool = False):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+
+    def __call__(self, x):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        self.started.set()
+        self.release.wait(5)
+        if self.fail_first and call == 1:
+            raise RuntimeError("boom")
+        return x * 2
+
+
+def run_threads(target, n):
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_identical_calls_compute_once():
+    cache = PageCache()
+    fn = SlowFunction()
+
+    threads, results, errors = run_threads(lambda: cache.call(fn, 21), 8)
+    fn.started.wait(5)
+    time.sleep(0.05)
+    fn.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [42] * 8
+    assert fn.calls == 1
+    assert cache.summary()['misses'] == 1 and cache.summary()['hits'] == 7
+
+
+def test_waiters_recompute_when_inflight_call_fails():
+    cache = PageCache()
+    fn = SlowFunction(fail_first=True)
+
+    threads, results, errors = run_threads(lambda: cache.call(fn, 21), 4)
+    fn.started.wait(5)
+    time.sleep(0.05)
+    fn.release.set()
+    for thread in threads:
+        thread.join()
+
+    # 失敗した呼び出しだけが例外を受け取り、待っていた側は計算し直した結果を共有する
+    assert [type(e) for e in errors] == [RuntimeError]
+    assert results == [42] * 3
+    assert fn.calls == 2
+
+
+def test_invalidate_namespace_drops_dependent_entries():
+    cache = PageCache()
+    calls = []
+
+    def load(name):
+        calls.append(name)
+        return len(calls)
+
+    assert cache.call(load, 'a', depends_on=('journeys',)) == 1
+    assert cache.call(load, 'b') == 2
+    assert cache.call(load, 'a', depends_on=('journeys',)) == 1
+
+    cache.invalidate('journeys')
+
+    assert cache.call(load, 'a', depends_on=('journeys',)) == 3
+    assert cache.call(load, 'b') == 2
+    assert cache.summary()['entries'] == 2
+
+
+def test_result_computed_before_invalidation_is_not_stored():
+    cache = PageCache()
+    fn = SlowFunction()
+
+    threads, results, _ = run_threads(lambda: cache.call(fn, 1, depends_on=('journeys',)), 1)
+    fn.started.wait(5)
+    cache.invalidate('journeys')
+    fn.release.set()
+    threads[0].join()
+
+    assert results == [2]
+    assert cache.summary()['entries'] == 0
+    assert cache.call(fn, 1, depends_on=('journeys',)) == 2
+    assert fn.calls == 2
+
+
+def test_ttl_and_lru_limits():
+    cache = PageCache(max_entries=2)
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        return x
+
+    cache.call(compute, 1)
+    cache.call(compute, 2)
+    cache.call(compute, 1)
+    cache.call(compute, 3)
+
+    # 最も使われていない 2 が押し出される
+    cache.call(compute, 1)
+    cache.call(compute, 2)
+    assert calls == [1, 2, 3, 2]
+
+    cache.call(compute, 4, ttl=0.0)
+    cache.call(compute, 4, ttl=0.0)
+    assert calls[-2:] == [4, 4]
+
+
+def test_oversized_results_are_not_cached():
+    cache = PageCache(max_bytes=1000)
+    calls = []
+
+    def big():
+        calls.append(1)
+        return np.zeros(1000)
+
+    cache.call(big)
+    cache.call(big)
+
+    assert len(calls) == 2
+    assert cache.summary()['bytes'] == 0
+
+
+def test_fingerprint_follows_content():
+    frame = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+
+    assert fingerprint(frame) == fingerprint(frame.copy())
+    changed = frame.copy()
+    changed.loc[1, 'a'] = 5
+    assert fingerprint(frame) != fingerprint(changed)
+    assert fingerprint({'k': [1, 2]}, n=3) == fingerprint({'k': [1, 2]}, n=3)
+    assert fingerprint({'k': [1, 2]}, n=3) != fingerprint({'k': [1, 2]}, n=4)
+
+
+def test_copy_result_protects_cached_value():
+    cache = PageCache()
+
+    first = cache.call(lambda: {'rows': [1, 2]}, copy_result=True)
+    first['rows'].append(3)
+
+    assert cache.call(lambda: {'rows': [1, 2]}, copy_result=True) == {'rows': [1, 2]}
+
+
+@pytest.mark.parametrize("namespace", [None, 'journeys'])
+def test_cached_decorator_invalidation(namespace):
+    cache = PageCache()
+    calls = []
+
+    @cache.cached(depends_on=('journeys',))
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert load() == load() == 1
+    cache.invalidate(namespace)
+    assert load() == 2
+    load.invalidate()
+    assert load() == 3
@@ -0,0 +1,99 @@
+"""
+投稿履歴ストアのテスト
+追加した履歴が即時にファイルへ書かれ、再起動後も最新分・ページ・集計が復元されることを確認
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+
+from api.post_history import PostHistoryStore
+
+
+class Platform(Enum):
+    TWITTER = "twitter"
+    FACEBOOK = "facebook"
+
+
+class Status(Enum):
+    PUBLISHED = "published"
+    FAILED = "failed"
+
+
+@dataclass
+class Post:
+    id: str
+    platform: Platform
+    status: Status
+
+    def to_dict(self):
+        return {"id": self.id, "platform": self.platform.value, "status": self.status.value}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], Platform(data["platform"]), Status(data["status"]))
+
+
+def make_store(path, max_in_memory=5):
+    return PostHistoryStore(
+        history_path=str(path), max_in_memory=max_in_memory, serializer=Post.to_dict,
+        deserializer=Post.from_dict, statuses=[s.value for s in Status]
+    )
+
+
+def make_post(i):
+    return Post(f"p{i}", Platform.TWITTER if i % 2 else Platform.FACEBOOK,
+                Status.FAILED if i % 3 == 0 else Status.PUBLISHED)
+
+
+def test_recent_posts_survive_restart(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    for i in range(3):
+        store.append(make_post(i))
+
+    # 上限に達していない最新分もファイルに書かれている
+    restored = make_store(path)
+
+    assert [post.id for post in restored.recent_posts(10)] == ["p2", "p1", "p0"]
+    assert restored.get_counts() == store.get_counts()
+
+
+def test_pages_span_memory_and_file(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    for i in range(23):
+        store.append(make_post(i))
+    restored = make_store(path)
+
+    for history in (store, restored):
+        assert len(history) == 23
+        assert len(history.recent) == 5
+        ids = [record["id"] for page in range(1, 5) for record in history.page(page, 7)]
+        assert ids == [f"p{i}" for i in range(22, -1, -1)]
+
+
+def test_appends_after_restart_continue_the_file(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    for i in range(8):
+        store.append(make_post(i))
+    store.close()
+    # 書き込み途中で止まった行
+    with open(path, "ab") as f:
+        f.write(b'{"id": "broken"')
+
+    restored = make_store(path)
+    restored.append(make_post(8))
+
+    assert len(restored) == 9
+    assert [record["id"] for record in make_store(path).page(1, 20)] == [f"p{i}" for i in range(8, -1, -1)]
+
+
+def test_without_path_keeps_only_memory(tmp_path):
+    store = PostHistoryStore(history_path=None, max_in_memory=3, serializer=Post.to_dict)
+    for i in range(5):
+        store.append(make_post(i))
+
+    assert len(store) == 3
+    assert store.get_counts()["total"] == 5
+    assert [record["id"] for record in store.page(1, 10)] == ["p4", "p3", "p2"]
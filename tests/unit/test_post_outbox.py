@@ -0,0 +1,113 @@
+"""
+投稿アウトボックスのテスト
+同じ冪等キーの投稿が一度しか送信されず、送信中に停止した投稿が起動時に再送対象へ戻ることを確認
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from api.post_outbox import DEDUP_WINDOW_SECONDS, OutboxStatus, PostOutbox, make_idempotency_key
+
+
+def test_idempotency_key_dedups_within_window():
+    now = 100 * DEDUP_WINDOW_SECONDS
+    key = make_idempotency_key("twitter", "hello", ["b.png", "a.png"], now=now)
+
+    assert key == make_idempotency_key("twitter", "hello", ["a.png", "b.png"], now=now + DEDUP_WINDOW_SECONDS - 1)
+    assert key != make_idempotency_key("twitter", "hello", ["a.png", "b.png"], now=now + DEDUP_WINDOW_SECONDS)
+    assert key != make_idempotency_key("facebook", "hello", ["a.png", "b.png"], now=now)
+    # 予約投稿は予約時刻で区別する
+    scheduled = datetime(2025, 6, 1, 9, 0)
+    assert make_idempotency_key("twitter", "hello", scheduled_time=scheduled) != \
+        make_idempotency_key("twitter", "hello", scheduled_time=scheduled.replace(hour=10))
+    # 呼び出し側のキーは内容に依存しない
+    assert make_idempotency_key("twitter", "a", caller_key="k") == make_idempotency_key("twitter", "b", caller_key="k")
+
+
+def test_same_key_is_sent_once():
+    outbox = PostOutbox(None)
+
+    assert outbox.enqueue("k", "p1", "twitter", {"id": "p1"})
+    assert not outbox.enqueue("k", "p1", "twitter", {"id": "p1"})
+    assert outbox.claim("k")
+    # 送信中は他から送信権を取れない
+    assert not outbox.claim("k")
+
+    outbox.mark_delivered("k", "remote-1")
+
+    assert not outbox.claim("k", lease_seconds=-1)
+    assert outbox.get("k")["remote_id"] == "remote-1"
+    assert outbox.get("k")["attempts"] == 1
+
+
+def test_failed_and_released_rows_can_be_claimed_again():
+    outbox = PostOutbox(None)
+    outbox.enqueue("failed", "p1", "twitter", {})
+    outbox.enqueue("released", "p2", "twitter", {})
+    outbox.claim("failed")
+    outbox.claim("released")
+
+    outbox.mark_failed("failed", "timeout")
+    outbox.release("released", "http_429")
+
+    assert outbox.claim("failed")
+    assert outbox.claim("released")
+    assert outbox.get("failed")["attempts"] == 2
+
+
+def test_discard_only_removes_pending_rows():
+    outbox = PostOutbox(None)
+    outbox.enqueue("pending", "p1", "twitter", {})
+    outbox.enqueue("sending", "p2", "twitter", {})
+    outbox.claim("sending")
+
+    outbox.discard(["pending", "sending"])
+
+    assert outbox.get("pending") is None
+    assert outbox.get("sending")["status"] == OutboxStatus.SENDING
+
+
+def test_recover_resets_stale_sends_after_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = PostOutbox(path)
+    for key in ("pending", "stale", "delivered"):
+        outbox.enqueue(key, key, "twitter", {"id": key})
+    outbox.claim("stale")
+    outbox.claim("delivered")
+    outbox.mark_delivered("delivered")
+    outbox.close()
+
+    restarted = PostOutbox(path)
+
+    # リース期間内の送信中はまだ戻さない
+    assert [record["idempotency_key"] for record in restarted.recover()] == ["pending"]
+    recovered = restarted.recover(lease_seconds=-1)
+    assert [record["idempotency_key"] for record in recovered] == ["pending", "stale"]
+    assert recovered[1]["payload"] == {"id": "stale"}
+    assert restarted.get_statistics() == {OutboxStatus.PENDING: 2, OutboxStatus.DELIVERED: 1}
+
+
+def test_manager_requeues_undelivered_posts_on_start(tmp_path):
+    pytest.importorskip("requests")
+    from api.social_media_integrations import PlatformType, SocialMediaManager
+
+    paths = dict(queue_path=str(tmp_path / "queue.json"), outbox_path=str(tmp_path / "outbox.db"),
+                 history_path=str(tmp_path / "history.jsonl"))
+    manager = SocialMediaManager(**paths)
+    scheduled = datetime(2030, 1, 1, 9, 0)
+
+    asyncio.run(manager.create_post("hello", [PlatformType.TWITTER], scheduled_time=scheduled))
+    duplicates = asyncio.run(manager.create_post("hello", [PlatformType.TWITTER], scheduled_time=scheduled))
+
+    assert duplicates[0].metadata.get("duplicate")
+    assert len(manager.post_queue) == 1
+
+    # キューのファイルを失っても未配信の投稿はアウトボックスから戻る
+    manager.outbox.close()
+    for suffix in ("", ".journal"):
+        (tmp_path / f"queue.json{suffix}").unlink(missing_ok=True)
+    restarted = SocialMediaManager(**paths)
+
+    assert [post.scheduled_time for post in restarted.post_queue] == [scheduled]
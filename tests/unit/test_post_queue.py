@@ -0,0 +1,113 @@
+"""
+投稿キューのテスト
+変更がジャーナルへの追記で永続化され、スナップショットへの圧縮後も再起動でキューが復元されることを確認
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
+
+import pytest
+
+from api.post_queue import PostQueueFullError, ScheduledPostQueue
+
+BASE = datetime(2025, 6, 1, 12, 0)
+
+
+class Platform(Enum):
+    TWITTER = "twitter"
+    FACEBOOK = "facebook"
+
+
+@dataclass
+class Post:
+    id: str
+    platform: Platform
+    scheduled_time: Optional[datetime]
+
+    def to_dict(self):
+        return {"id": self.id, "platform": self.platform.value, "scheduled_time": self.scheduled_time.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], Platform(data["platform"]), datetime.fromisoformat(data["scheduled_time"]))
+
+
+def make_queue(path, **kwargs):
+    queue = ScheduledPostQueue(storage_path=str(path), serializer=Post.to_dict, deserializer=Post.from_dict, **kwargs)
+    queue.load()
+    return queue
+
+
+def make_post(i, platform=Platform.TWITTER):
+    return Post(f"p{i}", platform, BASE + timedelta(minutes=i))
+
+
+def queued_ids(queue):
+    return sorted(post.id for post in queue)
+
+
+def test_changes_are_journaled_without_rewriting_snapshot(tmp_path):
+    path = tmp_path / "queue.json"
+    queue = make_queue(path)
+    queue.push_many([make_post(i) for i in range(5)])
+    queue.push(make_post(5, Platform.FACEBOOK))
+    popped = queue.pop_ready("twitter", (BASE + timedelta(minutes=1)).timestamp())
+
+    assert [post.id for post in popped] == ["p0", "p1"]
+    # 個々の変更ではスナップショットを書かずジャーナルに追記するだけ
+    assert not path.exists()
+    assert len((tmp_path / "queue.json.journal").read_text().splitlines()) == 5 + 1 + 2
+
+    assert queued_ids(make_queue(path)) == ["p2", "p3", "p4", "p5"]
+
+
+def test_requeued_post_keeps_latest_state(tmp_path):
+    path = tmp_path / "queue.json"
+    queue = make_queue(path)
+    queue.push(make_post(0))
+    post = queue.pop_ready("twitter", BASE.timestamp())[0]
+    post.scheduled_time = BASE + timedelta(hours=1)
+    queue.requeue(post)
+
+    restored = make_queue(path)
+
+    assert [p.scheduled_time for p in restored] == [BASE + timedelta(hours=1)]
+
+
+def test_journal_is_compacted_into_snapshot(tmp_path):
+    path = tmp_path / "queue.json"
+    queue = make_queue(path, compact_min_entries=10)
+    for i in range(30):
+        queue.push(make_post(i))
+        queue.pop_ready("twitter", (BASE + timedelta(minutes=i - 3)).timestamp())
+
+    journal_lines = len((tmp_path / "queue.json.journal").read_text().splitlines())
+    assert path.exists()
+    assert journal_lines <= max(10, 2 * len(queue)) + 1
+    assert queued_ids(make_queue(path)) == queued_ids(queue)
+
+
+def test_truncated_journal_line_is_ignored(tmp_path):
+    path = tmp_path / "queue.json"
+    queue = make_queue(path)
+    queue.push_many([make_post(i) for i in range(3)])
+    with open(tmp_path / "queue.json.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "pop", "id"')
+
+    restored = make_queue(path)
+    restored.push(make_post(3))
+
+    assert queued_ids(make_queue(path)) == ["p0", "p1", "p2", "p3"]
+
+
+def test_full_queue_rejects_push(tmp_path):
+    queue = make_queue(tmp_path / "queue.json", max_size_per_platform=2)
+    queue.push_many([make_post(0), make_post(1)])
+
+    with pytest.raises(PostQueueFullError):
+        queue.push(make_post(2))
+    # 延期分は容量に関係なく戻せる
+    queue.requeue(make_post(2))
+    assert len(queue) == 3
@@ -0,0 +1,179 @@
+"""
+価格分析のテスト
+PSMの累積曲線と交点が回答の定義どおりの集計・細かい価格グリッド上の探索と一致し、ブートストラップ区間が真の交点を含むことを確認
+収益シミュレーションの顧客数が月ごとの漸化式と一致し、価格テストから需要・解約の弾力性を推定できることを確認
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.pricing import (
+    DEFAULT_CONVERSION_ELASTICITY,
+    MAX_MONTHLY_CHURN,
+    PSM_POINTS,
+    SIMULATED_PLAN_PROFILES,
+    demand_model_from_rates,
+    fit_demand_curves,
+    psm_analysis,
+    simulate_price_tests,
+    simulate_pricing,
+    simulate_psm_responses,
+)
+
+QUESTIONS = ['too_cheap', 'cheap', 'expensive', 'too_expensive']
+
+
+def brute_force_curves(answers, weights, prices):
+    """価格ごとに「その価格以上／以下と答えた回答の重みの割合」を数える"""
+    total = weights.sum()
+    at_or_above = lambda q: np.array([weights[answers[q] >= p].sum() / total for p in prices])
+    at_or_below = lambda q: np.array([weights[answers[q] <= p].sum() / total for p in prices])
+    return at_or_above('too_cheap'), at_or_above('cheap'), at_or_below('expensive'), at_or_below('too_expensive')
+
+
+def grid_crossings(prices, curves, points=20001):
+    """曲線を細かい価格グリッドで線形補間し、差が初めて0以下になる価格（0が続く場合はその区間の中点）を探す"""
+    grid = np.linspace(prices[0], prices[-1], points)
+    too_cheap, cheap, expensive, too_expensive = (np.interp(grid, prices, c) for c in curves)
+    diffs = {
+        'pmc': too_cheap - (1 - cheap),
+        'opp': too_cheap - too_expensive,
+        'ipp': cheap - expensive,
+        'pme': (1 - expensive) - too_expensive
+    }
+    points = {}
+    for name, diff in diffs.items():
+        start = end = int(np.argmax(diff <= 0))
+        while end + 1 < len(grid) and abs(diff[end + 1]) < 1e-12 and abs(diff[start]) < 1e-12:
+            end += 1
+        points[name] = (grid[start] + grid[end]) / 2
+    return points, grid[1] - grid[0]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_points_match_brute_force_grid(seed):
+    responses = simulate_psm_responses(n=400, seed=seed)
+    answers = {q: responses[q].to_numpy() for q in QUESTIONS}
+    weights = np.ones(len(responses))
+
+    result = psm_analysis(*(answers[q] for q in QUESTIONS))
+
+    curves = brute_force_curves(answers, weights, result.prices)
+    for actual, expected in zip((result.too_cheap, result.cheap, result.expensive, result.too_expensive), curves):
+        assert np.allclose(actual, expected)
+    expected_points, step = grid_crossings(result.prices, curves)
+    for name in PSM_POINTS:
+        assert result.points[name] == pytest.approx(expected_points[name], abs=step)
+    assert result.points['pmc'] <= result.points['pme']
+
+
+def test_integer_weights_match_repeated_respondents():
+    responses = simulate_psm_responses(n=300, seed=3)
+    weights = np.random.default_rng(0).integers(1, 5, len(responses))
+
+    weighted = psm_analysis(*(responses[q] for q in QUESTIONS), weights=weights)
+    repeated = psm_analysis(*(np.repeat(responses[q].to_numpy(), weights) for q in QUESTIONS))
+
+    assert weighted.total_weight == pytest.approx(weights.sum())
+    assert np.allclose(weighted.too_cheap, repeated.too_cheap)
+    assert np.allclose(weighted.too_expensive, repeated.too_expensive)
+    for name in PSM_POINTS:
+        assert weighted.points[name] == pytest.approx(repeated.points[name])
+
+    # 重みは単純な件数とは異なる交点を与える
+    unweighted = psm_analysis(*(responses[q] for q in QUESTIONS))
+    assert any(unweighted.points[name] != pytest.approx(weighted.points[name]) for name in PSM_POINTS)
+
+
+def test_inconsistent_and_missing_answers_are_dropped():
+    result = psm_analysis([100, 300, np.nan, 100], [200, 200, 200, 200], [300, 300, 300, 300],
+                          [400, 400, 400, 400])
+
+    assert result.respondents == 2
+    assert result.dropped == 2
+
+
+def test_bootstrap_intervals_cover_population_points():
+    # 大きな母集団の交点を真値とし、標本ごとの区間がそれを含む割合を数える
+    population = simulate_psm_responses(n=200000, seed=10)
+    truth = psm_analysis(*(population[q] for q in QUESTIONS)).points
+    rng = np.random.default_rng(11)
+
+    trials = 60
+    covered = {name: 0 for name in PSM_POINTS}
+    for trial in range(trials):
+        sample = population.iloc[rng.choice(len(population), 2000, replace=False)]
+        result = psm_analysis(*(sample[q] for q in QUESTIONS), n_bootstrap=300, confidence=0.9, seed=trial)
+        for name, (low, high) in result.intervals.items():
+            assert low <= result.points[name] <= high
+            covered[name] += low <= truth[name] <= high
+
+    # 90%区間の被覆率（OPPは裾の少数の回答で決まるため、パーセンタイル法ではやや下回る）
+    for name in PSM_POINTS:
+        assert covered[name] / trials >= 0.75
+
+
+def test_customer_recursion_matches_monthly_loop():
+    model = demand_model_from_rates(['Starter', 'Pro', 'Burst'], [1000.0, 3000.0, 500.0], [0.04, 0.02, 0.1],
+                                    [0.05, 0.03, 0.6], conversion_elasticity=(-1.2, 0.3), churn_elasticity=(0.8, 0.3))
+    rng = np.random.default_rng(0)
+    months = 24
+    # 月ごとに価格が変わるシナリオ（Burst は解約率が上限に掛かる）
+    prices = model.ref_price[None, :, None] * rng.uniform(0.5, 2.0, (4, len(model), months))
+    initial = np.array([500.0, 200.0, 50.0])
+
+    simulation = simulate_pricing(model, prices, visitors=[5000, 2000, 8000], initial_customers=initial,
+                                  unit_costs=[300, 800, 100], visitor_growth=0.02, n_samples=50, seed=7)
+
+    # シミュレーションと同じ順序で標本を引き直し、月ごとに C_t = C_{t-1}(1-r_t)+N_t を辿る
+    _, churn = model.sample(50, np.random.default_rng(7))
+    log_price = np.log(prices / model.ref_price[None, :, None])
+    churn_rate = np.minimum(np.exp(churn[:, None, :, 0, None] + churn[:, None, :, 1, None] * log_price),
+                            MAX_MONTHLY_CHURN)
+    assert (churn_rate == MAX_MONTHLY_CHURN).any()
+
+    previous = np.broadcast_to(initial[:, None], simulation.customers.shape[:-1] + (1,))[..., 0]
+    for t in range(months):
+        churned = previous * churn_rate[..., t]
+        current = previous - churned + simulation.new_customers[..., t]
+        assert np.allclose(simulation.churned[..., t], churned, rtol=1e-9)
+        assert np.allclose(simulation.customers[..., t], current, rtol=1e-9)
+        previous = current
+
+    assert np.allclose(simulation.mrr, simulation.customers * prices[None])
+    assert np.allclose(simulation.gross_profit[:, :, 1], simulation.customers[:, :, 1] * (prices[:, 1] - 800)[None])
+
+
+def test_fit_recovers_simulated_elasticities():
+    observations = simulate_price_tests(tests_per_plan=40, visitors=50000, seed=1)
+
+    model = fit_demand_curves(observations)
+    frame = model.to_frame().set_index('plan')
+
+    for plan, (_, _, conversion_elasticity, _, churn_elasticity, _) in SIMULATED_PLAN_PROFILES.items():
+        row = frame.loc[plan]
+        assert row['conversion_elasticity'] == pytest.approx(conversion_elasticity, abs=4 * row['conversion_elasticity_se'])
+        assert row['churn_elasticity'] == pytest.approx(churn_elasticity, abs=4 * row['churn_elasticity_se'])
+        assert row['conversion_elasticity_se'] < 0.1
+    # 想定の基準価格での率も想定値に近い
+    ref_prices = np.array([SIMULATED_PLAN_PROFILES[plan][0] for plan in model.plans])
+    assert np.allclose(model.conversion_rate(ref_prices), [SIMULATED_PLAN_PROFILES[p][1] for p in model.plans], rtol=0.05)
+    assert np.allclose(model.churn_rate(ref_prices), [SIMULATED_PLAN_PROFILES[p][3] for p in model.plans], rtol=0.15)
+
+def test_single_price_plan_falls_back_to_prior():
+    observations = pd.DataFrame({
+        'plan': ['Solo', 'Solo'],
+        'price': [1000.0, 1000.0],
+        'visitors': [5000, 6000],
+        'conversions': [200, 250]
+    })
+
+    model = fit_demand_curves(observations)
+
+    assert model.conversion_elasticity[0] == DEFAULT_CONVERSION_ELASTICITY[0]
+    assert model.conversion_cov[0, 1, 1] == pytest.approx(DEFAULT_CONVERSION_ELASTICITY[1] ** 2)
+    # 切片は行ごとの対数CV率の（CV数で重み付けした）平均
+    log_rates = np.log([200.5 / 5000, 250.5 / 6000])
+    expected = np.exp(np.average(log_rates, weights=[200.5, 250.5]))
+    assert model.conversion_rate(np.array([1000.0]))[0] == pytest.approx(expected)
@@ -0,0 +1,50 @@
+"""
+スケジューラーのイベントタスクのテスト
+他スレッドから受け付けたタスクがスケジューラー側で登録・実行され、完了後に破棄されることを確認
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("schedule")
+
+from automation.scheduler import MarketingScheduler, TaskPriority, TaskStatus
+
+
+def test_events_from_other_threads_are_registered_on_drain():
+    scheduler = MarketingScheduler()
+    threads = [
+        threading.Thread(target=scheduler.submit_event, args=(f"alert-{i}", "", "notify_kpi_alert"),
+                         kwargs={"kwargs": {"alert": {"alert_id": str(i)}}})
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 受け付けただけでは tasks を変更しない
+    assert scheduler.tasks == {}
+    scheduler._drain_events()
+    assert len(scheduler.tasks) == 20
+    assert all(task.priority == TaskPriority.HIGH for task in scheduler.tasks.values())
+
+
+def test_finished_event_tasks_are_discarded():
+    scheduler = MarketingScheduler()
+    scheduler.submit_event("alert", "", "notify_kpi_alert", kwargs={"alert": {"alert_id": "a"}})
+    regular_id = scheduler.add_task("report", "", "notify_kpi_alert", kwargs={"alert": {}})
+    scheduler._drain_events()
+    tasks = list(scheduler.tasks.values())
+
+    async def run():
+        await asyncio.gather(*[scheduler.execute_task(task) for task in tasks])
+
+    asyncio.run(run())
+    scheduler._discard_finished_events(tasks)
+
+    assert list(scheduler.tasks) == [regular_id]
+    assert scheduler.tasks[regular_id].status == TaskStatus.COMPLETED
+    assert list(scheduler.task_results) == [regular_id]
@@ -0,0 +1,92 @@
+"""
+顧客セグメンテーションのテスト
+オンライン標準化の合成が全件の統計量と一致し、再学習してもセグメント名が重心の対応で引き継がれることを確認
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics.segmentation import SEGMENT_FEATURES, CustomerSegmenter, RunningScaler
+
+NOW = datetime(2025, 6, 30)
+
+
+def make_customers(n=2000, seed=0, shift=0.0):
+    """特徴量の異なる5群からなる顧客"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([
+        [40000, 8, 9000, 0.9, 0.1, 300],
+        [8000, 3, 3000, 0.8, 0.2, 120],
+        [2000, 0, 0, 0.5, 0.4, 10],
+        [5000, 2, 2500, 0.2, 0.9, 200],
+        [35000, 6, 6000, 0.3, 0.8, 330]
+    ])
+    scale = np.array([3000, 1, 800, 0.05, 0.05, 10])
+    group = rng.integers(0, len(centers), n)
+    X = centers[group] + rng.normal(0, 1, (n, len(SEGMENT_FEATURES))) * scale * (1 + shift)
+    frame = pd.DataFrame(X[:, :-1], columns=SEGMENT_FEATURES[:-1])
+    frame['acquisition_date'] = [NOW - timedelta(days=float(d)) for d in X[:, -1]]
+    return frame
+
+
+def test_running_scaler_merges_batches():
+    rng = np.random.default_rng(1)
+    X = rng.normal(5, 3, (1000, 4)) * [1, 10, 100, 1000]
+    scaler = RunningScaler(4)
+
+    for batch in np.array_split(X, [10, 11, 400, 990]):
+        scaler.partial_fit(batch)
+
+    assert scaler.n == len(X)
+    assert np.allclose(scaler.mean, X.mean(axis=0))
+    assert np.allclose(scaler.scale, X.std(axis=0))
+    assert np.allclose(RunningScaler.from_dict(scaler.to_dict()).transform(X), scaler.transform(X))
+
+
+def test_names_are_kept_across_refits():
+    segmenter = CustomerSegmenter(model_path=None)
+    customers = make_customers()
+    first = segmenter.segment(customers, now=NOW, data_version="v1")
+    previous = dict(zip(segmenter.names, segmenter.centers.copy()))
+
+    # 分布が少し変わったデータで再学習しても、近い重心は同じ名前のまま
+    segmenter.segment(pd.concat([customers, make_customers(500, seed=2, shift=0.2)]), now=NOW, data_version="v2")
+
+    scale = segmenter.scaler.scale
+    for name, center in zip(segmenter.names, segmenter.centers):
+        nearest = min(previous, key=lambda other: (((previous[other] - center) / scale) ** 2).sum())
+        assert nearest == name
+    assert set(first) == set(segmenter.names)
+
+
+def test_segment_refits_only_when_data_version_changes(tmp_path):
+    path = str(tmp_path / "segments.json")
+    synthetic = make_customers(seed=3)
+    segmenter = CustomerSegmenter(model_path=path)
+    segmenter.segment(synthetic, now=NOW, data_version="synthetic")
+    centers = segmenter.centers.copy()
+
+    segmenter.segment(synthetic.iloc[:100], now=NOW, data_version="synthetic")
+    assert np.array_equal(segmenter.centers, centers)
+
+    # 取り込み後の実データでは合成データの重心を使い続けない
+    real = make_customers(seed=4, shift=0.5)
+    restored = CustomerSegmenter(model_path=path)
+    assert restored.data_version == "synthetic"
+    restored.segment(real, now=NOW, data_version="store:1")
+
+    assert restored.data_version == "store:1"
+    assert not np.allclose(restored.centers, centers)
+    assert CustomerSegmenter(model_path=path).data_version == "store:1"
+
+
+def test_segment_sizes_cover_all_customers():
+    customers = make_customers(seed=5)
+
+    segments = CustomerSegmenter(model_path=None).segment(customers, now=NOW)
+
+    assert sum(segment['size'] for segment in segments.values()) == len(customers)
+    assert segments['High-Value Champions']['avg_ltv'] == pytest.approx(40000, rel=0.1)
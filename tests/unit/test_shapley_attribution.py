@@ -0,0 +1,130 @@
+"""
+シャープレイ値アトリビューションのテスト
+厳密計算が全順列の列挙と一致し、順列サンプリングが標準誤差の範囲で厳密値に収まることを確認
+"""
+
+import importlib
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from analytics.shapley_attribution import (
+    DEFAULT_PERMUTATIONS,
+    CoalitionTable,
+    build_coalition_table,
+    exact_shapley,
+    sampled_shapley,
+    shapley_attribution,
+)
+
+# analytics パッケージが同名の関数を公開しているため、モジュールは import_module で取得する
+shapley_module = importlib.import_module("analytics.shapley_attribution")
+
+
+def brute_force_shapley(journeys, n_channels, characteristic):
+    """全順列で限界貢献を平均（v(S) は S に含まれるパスのみで計算）"""
+    def v(members):
+        inside = [j for j in journeys if set(j['channels']) <= members]
+        gain = sum(j['converted'] if characteristic == 'rate' else j['value'] for j in inside)
+        if characteristic == 'rate':
+            return gain / len(inside) if inside else 0.0
+        return gain
+
+    values = {}
+    shapley = np.zeros(n_channels)
+    for order in itertools.permutations(range(n_channels)):
+        members = frozenset()
+        for channel in order:
+            with_channel = members | {channel}
+            for coalition in (members, with_channel):
+                if coalition not in values:
+                    values[coalition] = v(coalition)
+            shapley[channel] += values[with_channel] - values[members]
+            members = with_channel
+    return shapley / math.factorial(n_channels)
+
+
+def test_coalition_table_counts_unique_channel_sets(make_touchpoints, split_journeys):
+    arrays = make_touchpoints()
+    table = build_coalition_table(arrays)
+
+    expected = {}
+    for journey in split_journeys(arrays):
+        key = tuple(sorted(set(journey['channels'])))
+        entry = expected.setdefault(key, [0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += journey['converted']
+        entry[2] += journey['value']
+
+    assert len(table) == len(expected)
+    for k in range(len(table)):
+        key = tuple(int(c) for c in table.channel_codes[table.members[table.indptr[k]:table.indptr[k + 1]]])
+        assert [table.paths[k], table.conversions[k]] == expected[key][:2]
+        assert table.value[k] == pytest.approx(expected[key][2])
+
+
+@pytest.mark.parametrize("characteristic", ["rate", "value"])
+def test_exact_matches_permutation_enumeration(make_touchpoints, split_journeys, characteristic):
+    arrays = make_touchpoints(n_channels=6)
+
+    exact = exact_shapley(build_coalition_table(arrays), characteristic)
+
+    assert np.allclose(exact, brute_force_shapley(split_journeys(arrays), 6, characteristic))
+
+
+def test_sampling_converges_to_exact(make_touchpoints):
+    table = build_coalition_table(make_touchpoints(n_journeys=2000, n_channels=10, max_length=4))
+    exact = exact_shapley(table, 'rate')
+
+    mean, std_error, used = sampled_shapley(table, 'rate', n_permutations=4000, workers=1, seed=0)
+
+    assert used == 4000
+    assert (np.abs(mean - exact) <= 5 * std_error + 1e-12).all()
+    # 効率性: 各順列の限界貢献の和は v(全チャネル) - v(空集合)
+    assert mean.sum() == pytest.approx(table.coalition_value(range(table.n_channels), 'rate'))
+
+
+def test_sampling_stops_early_with_tolerance(make_touchpoints):
+    table = build_coalition_table(make_touchpoints(n_journeys=2000, n_channels=10, max_length=4))
+
+    _, _, used = sampled_shapley(table, 'rate', n_permutations=50000, workers=1, seed=0, tolerance=0.05)
+
+    assert used < 50000
+
+
+def test_default_permutations_use_process_pool(make_touchpoints, monkeypatch):
+    table = build_coalition_table(make_touchpoints(n_journeys=500, n_channels=8, max_length=4))
+    started = []
+
+    class RecordingExecutor(shapley_module.ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            started.append(max_workers)
+            super().__init__(max_workers=max_workers)
+
+    monkeypatch.setattr(shapley_module, "ProcessPoolExecutor", RecordingExecutor)
+    mean, _, used = sampled_shapley(table, 'rate', workers=2, seed=0)
+
+    # デフォルトの順列数でも並列計算に回る
+    assert started == [2]
+    assert used == DEFAULT_PERMUTATIONS
+    assert mean.sum() == pytest.approx(table.coalition_value(range(table.n_channels), 'rate'))
+
+
+def test_incremental_table_matches_arrays(make_touchpoints):
+    arrays = make_touchpoints(n_channels=6)
+    table = build_coalition_table(arrays)
+    counts = {
+        tuple(int(c) for c in table.channel_codes[table.members[table.indptr[k]:table.indptr[k + 1]]]):
+            (table.paths[k], table.conversions[k], table.value[k])
+        for k in range(len(table))
+    }
+
+    from_counts = shapley_attribution(arrays, table=CoalitionTable.from_counts(counts))
+    direct = shapley_attribution(arrays)
+
+    assert direct.method == 'exact'
+    assert np.allclose(from_counts.credits, direct.credits)
+    # 貢献値の合計は総コンバージョン価値
+    assert direct.credits.sum() == pytest.approx(table.value.sum())